@@ -21,6 +21,9 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, Sticker, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import CommandStart, Command
 from aiogram.exceptions import TelegramBadRequest
+from app.services.bot_enforcer import BotEnforcer
+from app.handlers.middlewares import install_features_middleware
+from app.modules.message_features import MessageFeatures, features_of, LEXICON_SUMMON
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +33,9 @@ def register_all_handlers(dp, modules):
     
     router = Router()
     
+    # Текст каждого сообщения разбирается один раз (features в обработчиках)
+    install_features_middleware(router)
+    
     # Получаем информацию о боте для упоминаний
     bot_info = None
     
@@ -42,6 +48,14 @@ def register_all_handlers(dp, modules):
     
     asyncio.create_task(get_bot_info())
     
+    # Баны, муты и удаления модерации идут в Bot API через очередь модуля
+    if modules.get('moderation') and modules.get('bot'):
+        modules['moderation'].set_enforcer(BotEnforcer(modules['bot']))
+    
+    # Пороги флуда и запрещенные слова чатов из moderation_settings
+    if modules.get('moderation'):
+        asyncio.create_task(modules['moderation'].load_chat_settings())
+    
     # =================== ОСНОВНЫЕ КОМАНДЫ ===================
     
     @router.message(CommandStart())
@@ -428,7 +442,7 @@ def register_all_handlers(dp, modules):
     # =================== ОБРАБОТКА РЕПЛАЕВ ===================
     
     @router.message(F.reply_to_message)
-    async def reply_handler(message: Message):
+    async def reply_handler(message: Message, features: MessageFeatures = None):
         if not await check_permissions(message, modules):
             return
         
@@ -443,12 +457,12 @@ def register_all_handlers(dp, modules):
             await process_reply_to_bot(message, modules)
         else:
             # Обычная обработка текста
-            await process_smart_text(message, modules, bot_info)
+            await process_smart_text(message, modules, bot_info, features)
     
     # =================== ИНТЕЛЛЕКТУАЛЬНАЯ ОБРАБОТКА ТЕКСТА ===================
     
     @router.message(F.text)
-    async def smart_text_handler(message: Message):
+    async def smart_text_handler(message: Message, features: MessageFeatures = None):
         if not await check_permissions(message, modules):
             return
         
@@ -458,7 +472,7 @@ def register_all_handlers(dp, modules):
                 await message.answer("Бот работает только в группах.")
                 return
             
-        await process_smart_text(message, modules, bot_info)
+        await process_smart_text(message, modules, bot_info, features)
     
     # Регистрируем роутер
     dp.include_router(router)
@@ -542,7 +556,7 @@ async def save_user_and_message(message: Message, modules):
     except Exception as e:
         logger.error(f"Ошибка сохранения данных: {e}")
 
-async def process_ai_request(message: Message, user_message: str, modules):
+async def process_ai_request(message: Message, user_message: str, modules, features: MessageFeatures = None):
     """🤖 ИСПРАВЛЕНО: Обработка AI запроса БЕЗ "Думаю..." и смайлов"""
     
     try:
@@ -559,7 +573,7 @@ async def process_ai_request(message: Message, user_message: str, modules):
         # Получаем анализ поведения
         if modules.get('behavior'):
             behavior_analysis = await modules['behavior'].analyze_user_behavior(
-                message.from_user.id, message.chat.id, user_message, context
+                message.from_user.id, message.chat.id, user_message, context, features=features
             )
             context['behavior_analysis'] = behavior_analysis
         
@@ -590,14 +604,14 @@ async def process_ai_request(message: Message, user_message: str, modules):
         if modules.get('memory'):
             await modules['memory'].add_interaction(
                 message.from_user.id, message.chat.id, 
-                user_message, response
+                user_message, response, features=features
             )
         
         # Обучаем на взаимодействии
         if modules.get('behavior'):
             await modules['behavior'].learn_from_interaction(
                 message.from_user.id, message.chat.id, 
-                user_message, response
+                user_message, response, features=features
             )
         
     except Exception as e:
@@ -631,12 +645,12 @@ def clean_ai_response(response: str) -> str:
     
     return cleaned
 
-async def process_smart_text(message: Message, modules, bot_info):
+async def process_smart_text(message: Message, modules, bot_info, features: MessageFeatures = None):
     """🧠 Интеллектуальная обработка текста"""
     
     try:
         user = message.from_user
-        text = message.text.lower()
+        features = features_of(message.text, features)
         
         # Сохраняем пользователя и сообщение
         await save_user_and_message(message, modules)
@@ -644,23 +658,23 @@ async def process_smart_text(message: Message, modules, bot_info):
         # 1. Проверяем триггеры
         if modules.get('triggers'):
             trigger_response = await modules['triggers'].check_message_triggers(
-                message.text, message.chat.id, user.id
+                message.text, message.chat.id, user.id, user.first_name or ''
             )
             if trigger_response:
                 await message.answer(trigger_response)
                 return
         
         # 2. Проверяем модерацию
-        moderation_action = await check_moderation(message, modules)
+        moderation_action = await check_moderation(message, modules, features)
         if moderation_action:
             return
         
         # 3. Проверяем упоминания бота
-        should_respond = await check_bot_mentions(message, bot_info)
+        should_respond = await check_bot_mentions(message, bot_info, features)
         
         if should_respond:
             # Умный ответ на упоминание
-            await process_smart_response(message, modules)
+            await process_smart_response(message, modules, features)
         else:
             # Случайные ответы (если настроено)
             await process_random_responses(message, modules)
@@ -675,14 +689,15 @@ async def process_smart_text(message: Message, modules, bot_info):
     except Exception as e:
         logger.error(f"Ошибка интеллектуальной обработки: {e}")
 
-async def check_bot_mentions(message: Message, bot_info) -> bool:
+async def check_bot_mentions(message: Message, bot_info, features: MessageFeatures = None) -> bool:
     """🎯 Проверка упоминаний бота"""
     
     try:
         if message.chat.type == 'private':
             return True
         
-        text = message.text.lower()
+        features = features_of(message.text, features)
+        text = features.lower
         
         # Проверяем прямое упоминание
         if bot_info and f'@{bot_info.username.lower()}' in text:
@@ -693,12 +708,11 @@ async def check_bot_mentions(message: Message, bot_info) -> bool:
             return True
         
         # Проверяем общие слова-обращения
-        bot_keywords = ['бот', 'bot', 'робот', 'помощник', 'assistant']
-        if any(keyword in text for keyword in bot_keywords):
+        if features.hits(LEXICON_SUMMON):
             return True
         
         # Проверяем вопросительные предложения
-        if '?' in message.text and len(message.text) > 20:
+        if features.has_question and features.length > 20:
             return True
         
         return False
@@ -707,13 +721,13 @@ async def check_bot_mentions(message: Message, bot_info) -> bool:
         logger.error(f"Ошибка проверки упоминаний: {e}")
         return False
 
-async def process_smart_response(message: Message, modules):
+async def process_smart_response(message: Message, modules, features: MessageFeatures = None):
     """💡 Генерация умного ответа"""
     
     try:
         # Если есть AI, используем его
         if modules.get('ai'):
-            await process_ai_request(message, message.text, modules)
+            await process_ai_request(message, message.text, modules, features)
         else:
             # Базовые умные ответы без смайлов
             smart_responses = [
@@ -745,7 +759,7 @@ async def process_reply_to_bot(message: Message, modules):
     except Exception as e:
         logger.error(f"Ошибка обработки реплая: {e}")
 
-async def check_moderation(message: Message, modules) -> bool:
+async def check_moderation(message: Message, modules, features: MessageFeatures = None) -> bool:
     """🛡️ Проверка модерации"""
     
     try:
@@ -753,7 +767,7 @@ async def check_moderation(message: Message, modules) -> bool:
             return False
             
         moderation_result = await modules['moderation'].check_message(
-            message.from_user.id, message.chat.id, message.text
+            message.from_user.id, message.chat.id, message.text, features
         )
         
         if moderation_result['action'] != 'allow':
@@ -771,6 +785,17 @@ async def check_moderation(message: Message, modules) -> bool:
                 await message.answer(f"Предупреждение ({warnings}): {reason}")
             elif action == 'timeout':
                 await message.answer(f"Ограничение: {reason}")
+            elif action in ('mute', 'ban'):
+                # Эскалация за предупреждения: мут или бан уже в очереди модерации, срок снимет планировщик
+                warnings = moderation_result.get('user_warnings', 0)
+                until = moderation_result.get('until')
+                await modules['moderation'].apply_action(
+                    'delete', message.chat.id, message.from_user.id, reason=reason, message_id=message.message_id
+                )
+                if action == 'mute':
+                    await message.answer(f"Мут до {until:%H:%M} ({warnings} предупреждений): {reason}")
+                else:
+                    await message.answer(f"Бан до {until:%d.%m %H:%M} ({warnings} предупреждений): {reason}")
             
             return True
             
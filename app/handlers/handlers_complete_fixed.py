@@ -20,6 +20,9 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, Sticker, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import CommandStart, Command
 from aiogram.exceptions import TelegramBadRequest
+from app.services.bot_enforcer import BotEnforcer
+from app.handlers.middlewares import install_features_middleware
+from app.modules.message_features import MessageFeatures, features_of, LEXICON_SUMMON
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +32,9 @@ def register_all_handlers(dp, modules):
     
     router = Router()
     
+    # Текст каждого сообщения разбирается один раз (features в обработчиках)
+    install_features_middleware(router)
+    
     # Получаем информацию о боте для упоминаний
     bot_info = None
     
@@ -41,6 +47,21 @@ def register_all_handlers(dp, modules):
     
     asyncio.create_task(get_bot_info())
     
+    # Баны, муты и удаления модерации идут в Bot API через очередь модуля
+    if modules.get('moderation') and modules.get('bot'):
+        modules['moderation'].set_enforcer(BotEnforcer(modules['bot']))
+    
+    # Пороги флуда и запрещенные слова чатов из moderation_settings
+    if modules.get('moderation'):
+        asyncio.create_task(modules['moderation'].load_chat_settings())
+    
+    # Создатели триггеров узнают об их отключении (зависшая регулярка)
+    if modules.get('triggers') and modules.get('bot'):
+        async def send_html(chat_id: int, text: str):
+            return await modules['bot'].send_message(chat_id, text, parse_mode="HTML")
+        
+        modules['triggers'].set_notifier(send_html)
+    
     # =================== ОСНОВНЫЕ КОМАНДЫ ===================
     
     @router.message(CommandStart())
@@ -339,7 +360,7 @@ def register_all_handlers(dp, modules):
     # =================== ОБРАБОТКА РЕПЛАЕВ ===================
     
     @router.message(F.reply_to_message)
-    async def reply_handler(message: Message):
+    async def reply_handler(message: Message, features: MessageFeatures = None):
         if not await check_permissions(message, modules):
             return
             
@@ -348,16 +369,16 @@ def register_all_handlers(dp, modules):
             await process_reply_to_bot(message, modules)
         else:
             # Обычная обработка текста
-            await process_smart_text(message, modules, bot_info)
+            await process_smart_text(message, modules, bot_info, features)
     
     # =================== ИНТЕЛЛЕКТУАЛЬНАЯ ОБРАБОТКА ТЕКСТА ===================
     
     @router.message(F.text)
-    async def smart_text_handler(message: Message):
+    async def smart_text_handler(message: Message, features: MessageFeatures = None):
         if not await check_permissions(message, modules):
             return
             
-        await process_smart_text(message, modules, bot_info)
+        await process_smart_text(message, modules, bot_info, features)
     
     # Регистрируем роутер
     dp.include_router(router)
@@ -441,7 +462,7 @@ async def save_user_and_message(message: Message, modules):
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения данных: {e}")
 
-async def process_ai_request(message: Message, user_message: str, modules):
+async def process_ai_request(message: Message, user_message: str, modules, features: MessageFeatures = None):
     """🤖 Обработка AI запроса"""
     
     try:
@@ -459,7 +480,7 @@ async def process_ai_request(message: Message, user_message: str, modules):
         # Получаем анализ поведения
         if modules.get('behavior'):
             behavior_analysis = await modules['behavior'].analyze_user_behavior(
-                message.from_user.id, message.chat.id, user_message, context
+                message.from_user.id, message.chat.id, user_message, context, features=features
             )
             context['behavior_analysis'] = behavior_analysis
         
@@ -486,26 +507,26 @@ async def process_ai_request(message: Message, user_message: str, modules):
         if modules.get('memory'):
             await modules['memory'].add_interaction(
                 message.from_user.id, message.chat.id, 
-                user_message, response
+                user_message, response, features=features
             )
         
         # Обучаем на взаимодействии
         if modules.get('behavior'):
             await modules['behavior'].learn_from_interaction(
                 message.from_user.id, message.chat.id, 
-                user_message, response
+                user_message, response, features=features
             )
         
     except Exception as e:
         logger.error(f"❌ Ошибка AI обработки: {e}")
         await message.answer("❌ Произошла ошибка при обращении к AI. Попробуйте позже.")
 
-async def process_smart_text(message: Message, modules, bot_info):
+async def process_smart_text(message: Message, modules, bot_info, features: MessageFeatures = None):
     """🧠 Интеллектуальная обработка текста"""
     
     try:
         user = message.from_user
-        text = message.text.lower()
+        features = features_of(message.text, features)
         
         # Сохраняем пользователя и сообщение
         await save_user_and_message(message, modules)
@@ -513,23 +534,23 @@ async def process_smart_text(message: Message, modules, bot_info):
         # 1. Проверяем триггеры
         if modules.get('triggers'):
             trigger_response = await modules['triggers'].check_message_triggers(
-                message.text, message.chat.id, user.id
+                message.text, message.chat.id, user.id, user.first_name or ''
             )
             if trigger_response:
                 await message.answer(trigger_response)
                 return
         
         # 2. Проверяем модерацию
-        moderation_action = await check_moderation(message, modules)
+        moderation_action = await check_moderation(message, modules, features)
         if moderation_action:
             return
         
         # 3. Проверяем упоминания бота
-        should_respond = await check_bot_mentions(message, bot_info)
+        should_respond = await check_bot_mentions(message, bot_info, features)
         
         if should_respond:
             # Умный ответ на упоминание
-            await process_smart_response(message, modules)
+            await process_smart_response(message, modules, features)
         else:
             # Случайные ответы (если настроено)
             await process_random_responses(message, modules)
@@ -544,14 +565,15 @@ async def process_smart_text(message: Message, modules, bot_info):
     except Exception as e:
         logger.error(f"❌ Ошибка интеллектуальной обработки: {e}")
 
-async def check_bot_mentions(message: Message, bot_info) -> bool:
+async def check_bot_mentions(message: Message, bot_info, features: MessageFeatures = None) -> bool:
     """🎯 Проверка упоминаний бота"""
     
     try:
         if message.chat.type == 'private':
             return True
         
-        text = message.text.lower()
+        features = features_of(message.text, features)
+        text = features.lower
         
         # Проверяем прямое упоминание
         if bot_info and f'@{bot_info.username.lower()}' in text:
@@ -562,12 +584,11 @@ async def check_bot_mentions(message: Message, bot_info) -> bool:
             return True
         
         # Проверяем общие слова-обращения
-        bot_keywords = ['бот', 'bot', 'робот', 'помощник', 'assistant']
-        if any(keyword in text for keyword in bot_keywords):
+        if features.hits(LEXICON_SUMMON):
             return True
         
         # Проверяем вопросительные предложения
-        if '?' in message.text and len(message.text) > 20:
+        if features.has_question and features.length > 20:
             return True
         
         return False
@@ -576,13 +597,13 @@ async def check_bot_mentions(message: Message, bot_info) -> bool:
         logger.error(f"❌ Ошибка проверки упоминаний: {e}")
         return False
 
-async def process_smart_response(message: Message, modules):
+async def process_smart_response(message: Message, modules, features: MessageFeatures = None):
     """💡 Генерация умного ответа"""
     
     try:
         # Если есть AI, используем его
         if modules.get('ai'):
-            await process_ai_request(message, message.text, modules)
+            await process_ai_request(message, message.text, modules, features)
         else:
             # Базовые умные ответы
             smart_responses = [
@@ -614,7 +635,7 @@ async def process_reply_to_bot(message: Message, modules):
     except Exception as e:
         logger.error(f"❌ Ошибка обработки реплая: {e}")
 
-async def check_moderation(message: Message, modules) -> bool:
+async def check_moderation(message: Message, modules, features: MessageFeatures = None) -> bool:
     """🛡️ Проверка модерации"""
     
     try:
@@ -622,7 +643,7 @@ async def check_moderation(message: Message, modules) -> bool:
             return False
             
         moderation_result = await modules['moderation'].check_message(
-            message.from_user.id, message.chat.id, message.text
+            message.from_user.id, message.chat.id, message.text, features
         )
         
         if moderation_result['action'] != 'allow':
@@ -640,6 +661,17 @@ async def check_moderation(message: Message, modules) -> bool:
                 await message.answer(f"⚠️ Предупреждение ({warnings}): {reason}")
             elif action == 'timeout':
                 await message.answer(f"🕐 Временное ограничение: {reason}")
+            elif action in ('mute', 'ban'):
+                # Эскалация за предупреждения: мут или бан уже в очереди модерации, срок снимет планировщик
+                warnings = moderation_result.get('user_warnings', 0)
+                until = moderation_result.get('until')
+                await modules['moderation'].apply_action(
+                    'delete', message.chat.id, message.from_user.id, reason=reason, message_id=message.message_id
+                )
+                if action == 'mute':
+                    await message.answer(f"🔇 Мут до {until:%H:%M} ({warnings} предупреждений): {reason}")
+                else:
+                    await message.answer(f"🚫 Бан до {until:%d.%m %H:%M} ({warnings} предупреждений): {reason}")
             
             return True
             
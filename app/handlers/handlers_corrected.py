@@ -23,6 +23,8 @@ import json
 import os
 from typing import Dict, List, Any
 
+from app.services.bot_enforcer import BotEnforcer
+
 logger = logging.getLogger(__name__)
 
 # Глобальные переменные
@@ -96,6 +98,14 @@ def register_all_handlers(dp, modules):
     # Запускаем случайные сообщения
     asyncio.create_task(random_messages_sender(modules))
     
+    # Баны, муты и удаления модерации идут в Bot API через очередь модуля
+    if modules.get('moderation') and modules.get('bot'):
+        modules['moderation'].set_enforcer(BotEnforcer(modules['bot']))
+    
+    # Пороги флуда и запрещенные слова чатов из moderation_settings
+    if modules.get('moderation'):
+        asyncio.create_task(modules['moderation'].load_chat_settings())
+    
     # =================== ОСНОВНЫЕ КОМАНДЫ ===================
     
     @router.message(CommandStart())
@@ -272,7 +282,7 @@ def register_all_handlers(dp, modules):
             user_id = int(args[0])
             reason = " ".join(args[1:]) if len(args) > 1 else "Нарушение правил"
             
-            success = await ban_user_action(modules, user_id, message.from_user.id, reason)
+            success = await ban_user_action(modules, message.chat.id, user_id, message.from_user.id, reason)
             
             if success:
                 await message.reply(f"✅ Пользователь {user_id} забанен.\nПричина: {reason}")
@@ -869,16 +879,12 @@ async def track_user_action(modules, user_id: int, chat_id: int, action: str, da
     except Exception as e:
         logger.error(f"Ошибка трекинга: {e}")
 
-async def ban_user_action(modules, user_id: int, admin_id: int, reason: str) -> bool:
-    """🚫 Бан пользователя"""
-    try:
-        if modules.get('db'):
-            # Простое добавление в БД
-            pass
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка бана: {e}")
+async def ban_user_action(modules, chat_id: int, user_id: int, admin_id: int, reason: str) -> bool:
+    """🚫 Бан пользователя (запись и бан - через очередь модерации)"""
+    if not modules.get('moderation'):
         return False
+    result = await modules['moderation'].apply_action('ban', chat_id, user_id, admin_id=admin_id, reason=reason)
+    return result['success']
 
 async def process_ai_request(message: Message, user_message: str, modules):
     """🤖 Обработка AI запроса"""
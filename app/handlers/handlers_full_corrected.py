@@ -23,14 +23,20 @@ import re
 import asyncio
 import random
 from datetime import datetime, timedelta
+from functools import partial
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, Sticker, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, Sticker, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.filters import CommandStart, Command
 from aiogram.exceptions import TelegramBadRequest
 import json
 import os
 from typing import Dict, List, Any
 
+from app.modules.regex_guard import configure_regex_sandbox
+from app.services.bot_enforcer import BotEnforcer, ENFORCE_UNMUTE, ENFORCE_UNBAN
+from app.handlers.middlewares import install_features_middleware
+from app.modules.message_features import MessageFeatures, features_of, LEXICON_SUMMON, LEXICON_QUESTION
+
 logger = logging.getLogger(__name__)
 
 # Глобальные переменные
@@ -98,6 +104,9 @@ def register_all_handlers(dp, modules):
     
     router = Router()
     
+    # Текст каждого сообщения разбирается один раз (features в обработчиках)
+    install_features_middleware(router)
+    
     # Загружаем настройки СИНХРОННО
     if modules.get('config'):
         if hasattr(modules['config'].bot, 'allowed_chat_ids'):
@@ -123,6 +132,42 @@ def register_all_handlers(dp, modules):
     # Запускаем случайные сообщения
     asyncio.create_task(random_messages_sender(modules))
     
+    # Уведомления ценовых алертов и отключенных триггеров уходят через бота (HTML)
+    async def send_html(chat_id: int, text: str):
+        return await modules['bot'].send_message(chat_id, text, parse_mode="HTML")
+    
+    crypto_service = get_crypto_service(modules)
+    if getattr(crypto_service, 'alerts', None) and modules.get('bot'):
+        crypto_service.alerts.set_sender(send_html)
+    
+    if modules.get('config'):
+        configure_regex_sandbox(modules['config'].triggers.regex_timeout_ms)
+    trigger_store = getattr(modules.get('db'), 'trigger_store', None)
+    if trigger_store and modules.get('bot'):
+        trigger_store.set_notifier(send_html)
+    
+    # Все вызовы Bot API модерации (баны, муты, удаление, локдаун) - через очередь модуля
+    enforcer = BotEnforcer(modules['bot']) if modules.get('bot') else None
+    if modules.get('moderation') and enforcer:
+        modules['moderation'].set_enforcer(enforcer)
+    
+    # Пороги флуда и запрещенные слова чатов из moderation_settings
+    if modules.get('moderation'):
+        asyncio.create_task(modules['moderation'].load_chat_settings())
+    
+    # Истекшие муты и временные баны снимаются через ту же очередь (лимит частоты, повтор после 429)
+    async def lift_restriction(kind: str, chat_id: int, user_id: int):
+        action = ENFORCE_UNMUTE if kind == 'mute' else ENFORCE_UNBAN
+        if modules.get('moderation'):
+            modules['moderation'].executor.submit(chat_id, partial(enforcer, action, chat_id, user_id),
+                                                  f"{action} {user_id}")
+            return
+        return await enforcer(action, chat_id, user_id)
+    
+    restrictions = getattr(modules.get('db'), 'restrictions', None)
+    if restrictions and enforcer:
+        restrictions.set_lifter(lift_restriction)
+    
     # =================== ОСНОВНЫЕ КОМАНДЫ ===================
     
     @router.message(CommandStart())
@@ -261,7 +306,8 @@ def register_all_handlers(dp, modules):
                 "<b>💀 БОТ v3.0 - Команды для всех</b>\n\n"
                 "<b>🤖 УМНЫЕ ФУНКЦИИ:</b>\n"
                 "/ai [вопрос] - AI помощник (грубый)\n"
-                "/crypto [монета] - Курс криптовалют\n\n"
+                "/crypto [монета] - Курс криптовалют\n"
+                "/alert [монета] > [цена] - Ценовой алерт\n\n"
                 "<b>🎮 РАЗВЛЕЧЕНИЯ:</b>\n"
                 "/fact - Интересный факт\n"
                 "/joke - Анекдот\n"
@@ -366,15 +412,11 @@ def register_all_handlers(dp, modules):
             user_id = int(args[0])
             reason = " ".join(args[1:]) if len(args) > 1 else "Нарушение правил чата"
             
-            # Сохраняем в БД
-            if modules.get('db'):
-                await modules['db'].add_moderation_action({
-                    'action': 'ban',
-                    'user_id': user_id,
-                    'admin_id': message.from_user.id,
-                    'reason': reason,
-                    'ban_type': 'permanent'
-                })
+            # Запись в БД и бан через очередь модерации
+            if modules.get('moderation'):
+                await modules['moderation'].apply_action(
+                    'ban', message.chat.id, user_id, admin_id=message.from_user.id, reason=reason
+                )
             
             await message.reply(
                 f"✅ <b>ПОЛЬЗОВАТЕЛЬ ЗАБАНЕН</b>\n\n"
@@ -422,15 +464,12 @@ def register_all_handlers(dp, modules):
             
             mute_until = datetime.now() + timedelta(minutes=minutes)
             
-            # Сохраняем в БД
-            if modules.get('db'):
-                await modules['db'].add_moderation_action({
-                    'action': 'mute',
-                    'user_id': user_id,
-                    'admin_id': message.from_user.id,
-                    'reason': reason,
-                    'mute_until': mute_until
-                })
+            # Запись в БД и мут через очередь модерации (размут - по сроку)
+            if modules.get('moderation'):
+                await modules['moderation'].apply_action(
+                    'mute', message.chat.id, user_id, admin_id=message.from_user.id,
+                    reason=reason, duration=timedelta(minutes=minutes)
+                )
             
             # Форматируем время
             if minutes < 60:
@@ -475,14 +514,11 @@ def register_all_handlers(dp, modules):
             user_id = int(args[0])
             reason = " ".join(args[1:]) if len(args) > 1 else "Нарушение правил"
             
-            # Сохраняем в БД
-            if modules.get('db'):
-                await modules['db'].add_moderation_action({
-                    'action': 'kick',
-                    'user_id': user_id,
-                    'admin_id': message.from_user.id,
-                    'reason': reason
-                })
+            # Запись в БД и кик через очередь модерации
+            if modules.get('moderation'):
+                await modules['moderation'].apply_action(
+                    'kick', message.chat.id, user_id, admin_id=message.from_user.id, reason=reason
+                )
             
             await message.reply(
                 f"👢 <b>ПОЛЬЗОВАТЕЛЬ КИКНУТ</b>\n\n"
@@ -518,27 +554,25 @@ def register_all_handlers(dp, modules):
             user_id = int(args[0])
             reason = " ".join(args[1:]) if len(args) > 1 else "Нарушение правил"
             
-            # Сохраняем в БД
-            if modules.get('db'):
-                await modules['db'].add_moderation_action({
-                    'action': 'warn',
-                    'user_id': user_id,
-                    'admin_id': message.from_user.id,
-                    'reason': reason,
-                    'severity_level': 1
-                })
+            # Запись, счетчик из кэша и эскалация (мут/бан через очередь) - в модуле модерации
+            result = {'action': 'warn', 'until': None, 'user_warnings': 0}
+            if modules.get('moderation'):
+                result = await modules['moderation'].apply_action(
+                    'warn', message.chat.id, user_id, admin_id=message.from_user.id, reason=reason
+                )
             
-            # Получаем количество варнов у пользователя
-            warns_count = await get_user_warns_count(modules, user_id)
+            warns_count = result['user_warnings']
+            ban_at = modules['config'].moderation.max_warnings + 1
+            escalation_text = format_escalation(result)
             
             await message.reply(
                 f"⚠️ <b>ПРЕДУПРЕЖДЕНИЕ ВЫДАНО</b>\n\n"
                 f"🆔 ID: {user_id}\n"
                 f"👑 Админ: {message.from_user.first_name}\n"
                 f"📝 Причина: {reason}\n"
-                f"🔢 Предупреждений у пользователя: {warns_count}/3\n"
+                f"🔢 Предупреждений у пользователя: {warns_count}/{ban_at}\n"
                 f"⏰ Время: {datetime.now().strftime('%H:%M:%S')}\n\n"
-                f"{'🚨 Внимание! При 3 предупреждениях - автобан!' if warns_count >= 2 else 'При 3 предупреждениях пользователь будет забанен.'}"
+                f"{escalation_text or (f'🚨 Внимание! При {ban_at} предупреждениях - автобан!' if warns_count >= ban_at - 1 else f'При {ban_at} предупреждениях пользователь будет забанен.')}"
             )
                 
         except ValueError:
@@ -636,7 +670,8 @@ def register_all_handlers(dp, modules):
             f"• Используй <code>|</code> для случайных ответов\n"
             f"• Используй <code>{{name}}</code> для имени пользователя\n"
             f"• Используй <code>{{chat}}</code> для названия чата\n"
-            f"• Используй <code>{{time}}</code> для текущего времени\n\n"
+            f"• Используй <code>{{time}}</code> для текущего времени\n"
+            f"• Используй <code>{{random:да|нет|может}}</code> для случайного слова\n\n"
             f"<b>🚨 ВАЖНО:</b>\n"
             f"• Имя триггера должно быть уникальным\n"
             f"• Максимум {modules['config'].triggers.max_triggers_per_admin} триггеров на админа\n"
@@ -850,7 +885,6 @@ def register_all_handlers(dp, modules):
             return
         
         word = args[0].lower().strip()
-        global CUSTOM_TRIGGER_WORDS
         
         if word in CUSTOM_TRIGGER_WORDS:
             CUSTOM_TRIGGER_WORDS.remove(word)
@@ -1070,6 +1104,51 @@ def register_all_handlers(dp, modules):
         
         await process_ai_request_with_learning(message, user_message, modules)
     
+    @router.message(Command('ai_stats'))
+    async def ai_stats_handler(message: Message):
+        if message.from_user.id not in modules['config'].bot.admin_ids:
+            await message.reply("Только для админов.")
+            return
+        
+        if not modules.get('db') or not modules.get('ai'):
+            await message.reply("AI или БД не подключены.")
+            return
+        
+        args = message.text.split()[1:]
+        days = int(args[0]) if args and args[0].isdigit() else 7
+        
+        rows = await modules['db'].get_ai_telemetry(days)
+        stats = modules['ai'].aggregate_telemetry(rows)
+        
+        if not stats:
+            await message.reply(f"📡 Нет AI вызовов за {days} дн.")
+            return
+        
+        def fmt_latency(value):
+            return f"{value * 1000:.0f}мс" if value is not None else "—"
+        
+        stats_text = f"<b>📡 AI ТЕЛЕМЕТРИЯ ЗА {days} ДН.</b>\n"
+        current_day = None
+        total_cost = 0.0
+        
+        for row in stats:
+            if row['day'] != current_day:
+                current_day = row['day']
+                stats_text += f"\n<b>📅 {current_day}</b>\n"
+            
+            total_cost += row['cost_usd']
+            stats_text += (
+                f"• <code>{row['model']}</code>: {row['requests']} запр., "
+                f"кэш {row['cache_hits']}, склеено {row['coalesced']}, ошибок {row['errors']}\n"
+                f"  токены {row['prompt_tokens']}/{row['completion_tokens']}, ${row['cost_usd']:.4f}\n"
+                f"  p50 {fmt_latency(row['p50'])} · p95 {fmt_latency(row['p95'])} · "
+                f"p99 {fmt_latency(row['p99'])} · TTFB p50 {fmt_latency(row['ttfb_p50'])}\n"
+            )
+        
+        stats_text += f"\n💵 <b>Итого:</b> ${total_cost:.4f}"
+        
+        await message.reply(stats_text)
+    
     @router.message(Command('crypto'))
     async def crypto_handler(message: Message):
         if not check_chat_allowed(message.chat.id):
@@ -1087,6 +1166,7 @@ def register_all_handlers(dp, modules):
                 "<b>Команды:</b>\n"
                 "/crypto [монета] - Курс конкретной монеты\n"
                 "/crypto_top - Топ 10 монет по капитализации\n"
+                "/crypto_chart [монета] [часы] - График цены\n"
                 "/crypto_trending - Трендовые монеты\n\n"
                 "<b>Примеры:</b>\n"
                 "/crypto bitcoin\n"
@@ -1159,6 +1239,162 @@ def register_all_handlers(dp, modules):
                 {'crypto_data': crypto_data, 'coin_query': coin_query}
             )
     
+    @router.message(Command('crypto_top'))
+    async def crypto_top_handler(message: Message):
+        if not check_chat_allowed(message.chat.id):
+            await message.reply("Чат не поддерживается.")
+            return
+            
+        if message.chat.type == 'private' and message.from_user.id not in modules['config'].bot.admin_ids:
+            await message.reply("Бот только для групп.")
+            return
+        
+        crypto_service = get_crypto_service(modules)
+        top_coins = crypto_service.get_top_crypto(10) if crypto_service else []
+        
+        if not top_coins:
+            await message.reply("❌ Рыночные данные еще загружаются. Попробуй через минуту.")
+            return
+        
+        top_text = "<b>🏆 ТОП-10 КРИПТОВАЛЮТ</b>\n\n"
+        for i, coin in enumerate(top_coins, 1):
+            change = coin.get('price_change_percentage_24h') or 0
+            change_emoji = "🟢" if change > 0 else "🔴"
+            top_text += (
+                f"{i}. <b>{coin['name']}</b> ({coin['symbol'].upper()})\n"
+                f"   ${coin['current_price']:,.2f} {change_emoji} {change:+.2f}%\n"
+            )
+        
+        age = crypto_service.get_snapshot_age()
+        if age is not None:
+            top_text += f"\n⏰ Данные: {int(age // 60)} мин назад"
+        
+        await message.reply(top_text)
+    
+    @router.message(Command('crypto_chart'))
+    async def crypto_chart_handler(message: Message):
+        if not check_chat_allowed(message.chat.id):
+            await message.reply("Чат не поддерживается.")
+            return
+        
+        crypto_service = get_crypto_service(modules)
+        charts = modules.get('charts')
+        args = message.text.split()[1:]
+        if not crypto_service or not charts or not args:
+            await message.reply("Использование: /crypto_chart [монета] [часы, по умолчанию 24]")
+            return
+        
+        hours = int(args[-1]) if len(args) > 1 and args[-1].isdigit() else 24
+        coin_query = ' '.join(args[:-1] if len(args) > 1 and args[-1].isdigit() else args)
+        
+        coin = await crypto_service.get_coin_data(coin_query)
+        points = crypto_service.get_price_points(coin['id'], hours) if coin else []
+        if len(points) < 2:
+            await message.reply("📉 История цены еще накапливается. Попробуй позже.")
+            return
+        
+        timestamps, prices = zip(*points)
+        chart_path = await charts.create_crypto_chart(coin['symbol'], list(prices), list(timestamps))
+        if not chart_path:
+            await message.reply("❌ Не удалось построить график.")
+            return
+        
+        await message.reply_photo(
+            FSInputFile(chart_path),
+            caption=f"📈 {coin['name']} за {hours} ч"
+        )
+    
+    @router.message(Command('alert'))
+    async def alert_handler(message: Message):
+        if not check_chat_allowed(message.chat.id):
+            await message.reply("Чат не поддерживается.")
+            return
+        
+        crypto_service = get_crypto_service(modules)
+        alerts = getattr(crypto_service, 'alerts', None)
+        if not alerts:
+            await message.reply("❌ Ценовые алерты отключены.")
+            return
+        
+        args = message.text.split(maxsplit=1)
+        match = ALERT_PATTERN.match(args[1]) if len(args) > 1 else None
+        if not match:
+            await message.reply(
+                "<b>🔔 ЦЕНОВЫЕ АЛЕРТЫ</b>\n\n"
+                "/alert btc > 70000 - Когда цена поднимется выше\n"
+                "/alert eth < 2500 - Когда цена опустится ниже\n"
+                "/alerts - Мои алерты\n"
+                "/alert_del [ID] - Удалить алерт"
+            )
+            return
+        
+        coin_query, sign, raw_price = match.groups()
+        try:
+            threshold = parse_price(raw_price)
+        except ValueError:
+            await message.reply("❌ Не понял цену.")
+            return
+        
+        coin = await crypto_service.get_coin_data(coin_query)
+        if not coin:
+            await message.reply(f"❌ Монета <code>{coin_query}</code> не найдена.")
+            return
+        
+        direction = 'above' if sign == '>' else 'below'
+        price = coin['current_price']
+        if (direction == 'above' and price >= threshold) or (direction == 'below' and price <= threshold):
+            await message.reply(f"⚠️ {coin['symbol'].upper()} уже по ${price:,.2f}. Алерт сработал бы сразу.")
+            return
+        
+        alert = await alerts.add_alert(
+            message.from_user.id, message.chat.id, coin['id'], coin['symbol'],
+            direction, threshold, price
+        )
+        if not alert:
+            await message.reply(f"❌ Лимит: не больше {alerts.max_per_user} алертов.")
+            return
+        
+        await message.reply(
+            f"🔔 Алерт #{alert.id}: <b>{alert.symbol}</b> {sign} ${threshold:,.2f}\n"
+            f"Сейчас: ${price:,.2f}"
+        )
+    
+    @router.message(Command('alerts'))
+    async def alerts_list_handler(message: Message):
+        if not check_chat_allowed(message.chat.id):
+            await message.reply("Чат не поддерживается.")
+            return
+        
+        alerts = getattr(get_crypto_service(modules), 'alerts', None)
+        user_alerts = alerts.get_user_alerts(message.from_user.id) if alerts else []
+        if not user_alerts:
+            await message.reply("🔕 Активных алертов нет.")
+            return
+        
+        text = "<b>🔔 ТВОИ АЛЕРТЫ</b>\n\n"
+        for alert in user_alerts:
+            sign = '>' if alert.direction == 'above' else '<'
+            text += f"#{alert.id} <b>{alert.symbol}</b> {sign} ${alert.threshold:,.2f}\n"
+        
+        await message.reply(text)
+    
+    @router.message(Command('alert_del'))
+    async def alert_delete_handler(message: Message):
+        if not check_chat_allowed(message.chat.id):
+            await message.reply("Чат не поддерживается.")
+            return
+        
+        alerts = getattr(get_crypto_service(modules), 'alerts', None)
+        args = message.text.split()
+        if not alerts or len(args) < 2 or not args[1].lstrip('#').isdigit():
+            await message.reply("Использование: /alert_del [ID]")
+            return
+        
+        if alerts.remove_alert(message.from_user.id, int(args[1].lstrip('#'))):
+            await message.reply("✅ Алерт удален.")
+        else:
+            await message.reply("❌ Алерт не найден.")
+    
     # =================== СТАТИСТИКА ===================
     
     @router.message(Command('stats'))
@@ -1422,7 +1658,7 @@ def register_all_handlers(dp, modules):
     # =================== УМНЫЕ ОТВЕТЫ И ОБУЧЕНИЕ ===================
     
     @router.message(F.reply_to_message)
-    async def reply_handler(message: Message):
+    async def reply_handler(message: Message, features: MessageFeatures = None):
         if not check_chat_allowed(message.chat.id):
             return
         
@@ -1434,17 +1670,33 @@ def register_all_handlers(dp, modules):
             await process_adaptive_reply_to_bot(message, modules)
         else:
             # Обрабатываем как обычное сообщение с возможностью реагирования
-            await process_adaptive_smart_text(message, modules, bot_info)
+            await process_adaptive_smart_text(message, modules, bot_info, features)
+    
+    @router.message(F.new_chat_members)
+    async def new_members_handler(message: Message):
+        if not check_chat_allowed(message.chat.id) or not modules.get('moderation'):
+            return
+        
+        # Волна входов включает локдаун; во время локдауна новички ограничиваются
+        for member in message.new_chat_members:
+            if not member.is_bot:
+                modules['moderation'].on_member_joined(message.chat.id, member.id)
     
     @router.message(F.text)
-    async def smart_text_handler(message: Message):
+    async def smart_text_handler(message: Message, features: MessageFeatures = None):
         if not check_chat_allowed(message.chat.id):
             return
         
         if message.chat.type == 'private' and message.from_user.id not in modules['config'].bot.admin_ids:
             return
+        
+        # Первое сообщение новичка во время рейда удаляется через очередь модерации
+        moderation = modules.get('moderation')
+        if moderation and moderation.check_raid_message(message.from_user.id, message.chat.id):
+            moderation.executor.submit(message.chat.id, message.delete, 'delete raid message')
+            return
             
-        await process_adaptive_smart_text(message, modules, bot_info)
+        await process_adaptive_smart_text(message, modules, bot_info, features)
     
     # Регистрируем роутер
     dp.include_router(router)
@@ -1454,13 +1706,13 @@ def register_all_handlers(dp, modules):
 
 # =================== АДАПТИВНЫЕ ФУНКЦИИ С ОБУЧЕНИЕМ ===================
 
-async def process_adaptive_smart_text(message: Message, modules, bot_info):
+async def process_adaptive_smart_text(message: Message, modules, bot_info, features: MessageFeatures = None):
     """🧠 Интеллектуальная обработка с адаптивным обучением"""
     try:
         await save_user_and_message(message, modules)
         
         # Проверяем, должен ли бот отвечать
-        should_respond = await enhanced_should_respond_check(message, modules, bot_info)
+        should_respond = await enhanced_should_respond_check(message, modules, bot_info, features)
         
         if should_respond:
             # Получаем адаптивный контекст для пользователя
@@ -1486,23 +1738,22 @@ async def process_adaptive_smart_text(message: Message, modules, bot_info):
     except Exception as e:
         logger.error(f"Ошибка адаптивной обработки: {e}")
 
-async def enhanced_should_respond_check(message: Message, modules, bot_info) -> bool:
-    """🎯 Улучшенная проверка необходимости ответа"""
+async def enhanced_should_respond_check(message: Message, modules, bot_info, features: MessageFeatures = None) -> bool:
+    """🎯 Улучшенная проверка необходимости ответа (по признакам сообщения из апдейта)"""
     try:
         if message.chat.type == 'private':
             return True
         
-        text = message.text.lower()
+        features = features_of(message.text, features)
+        text = features.lower
         
         # 1. Прямое упоминание бота
         if bot_info and f'@{bot_info.username.lower()}' in text:
             return True
         
         # 2. Стандартные ключевые слова
-        standard_keywords = ['бот', 'bot', 'робот', 'помощник', 'assistant']
-        for keyword in standard_keywords:
-            if keyword in text:
-                return True
+        if features.hits(LEXICON_SUMMON):
+            return True
         
         # 3. Кастомные слова призыва
         global CUSTOM_TRIGGER_WORDS
@@ -1511,19 +1762,11 @@ async def enhanced_should_respond_check(message: Message, modules, bot_info) ->
                 return True
         
         # 4. Вопросы (улучшенная логика)
-        question_markers = ['?', 'что', 'как', 'когда', 'где', 'почему', 'зачем', 'кто']
-        if '?' in text or any(marker in text for marker in question_markers):
+        if features.has_question or features.hits(LEXICON_QUESTION):
             if len(text) > 10:  # Только содержательные вопросы
                 return True
         
-        # 5. Проверка активных триггеров
-        if modules.get('db'):
-            active_triggers = await modules['db'].get_active_triggers(message.chat.id)
-            for trigger in active_triggers:
-                if await check_trigger_match(text, trigger):
-                    return True
-        
-        # 6. Адаптивная проверка на основе обучения
+        # 5. Адаптивная проверка на основе обучения
         if modules.get('db'):
             learned_patterns = await get_user_learned_patterns(modules, message.from_user.id)
             for pattern in learned_patterns:
@@ -1561,7 +1804,7 @@ async def process_ai_request_with_learning(message: Message, user_message: str,
         
         # Запрос к AI
         response = await modules['ai'].generate_response(
-            user_message, message.from_user.id, context
+            user_message, message.from_user.id, context, chat_id=message.chat.id
         )
         
         # Очищаем ответ от вежливости
@@ -1692,7 +1935,7 @@ async def get_moderation_stats(modules) -> dict:
         stats['auto_mod_enabled'] = False  # TODO: получить из настроек
         stats['toxicity_detection'] = False
         stats['spam_detection'] = False
-        stats['raid_protection'] = False
+        stats['raid_protection'] = getattr(modules['config'].moderation, 'raid_protection', False)
         stats['log_actions'] = True
         
         return stats
@@ -1701,26 +1944,77 @@ async def get_moderation_stats(modules) -> dict:
         logger.error(f"Ошибка получения статистики модерации: {e}")
         return {}
 
-async def get_user_warns_count(modules, user_id: int) -> int:
-    """⚠️ Получение количества предупреждений пользователя"""
+async def get_user_warns_count(modules, user_id: int, chat_id: int) -> int:
+    """⚠️ Действующие предупреждения пользователя в чате (из кэша WarningStore)"""
     try:
-        if not modules.get('db'):
-            return 0
-        
-        result = await modules['db'].fetchone(
-            "SELECT COUNT(*) as count FROM warnings WHERE user_id = ? AND is_active = TRUE",
-            (user_id,)
-        )
-        
-        return result['count'] if result else 0
+        store = getattr(modules.get('db'), 'warning_store', None)
+        return store.count(chat_id, user_id) if store else 0
         
     except Exception as e:
         logger.error(f"Ошибка подсчета предупреждений: {e}")
         return 0
 
+def format_escalation(result: Dict[str, Any]) -> str:
+    """📈 Текст эскалации предупреждений (мут или временный бан уже поставлены в очередь)"""
+    until = result.get('until')
+    if result.get('action') == 'mute' and until:
+        return f"🔇 Автомут до {until.strftime('%H:%M')}"
+    if result.get('action') == 'ban' and until:
+        return f"🚫 Автобан до {until.strftime('%d.%m %H:%M')}"
+    return ''
+
+ALERT_PATTERN = re.compile(r'^\s*(.+?)\s*([<>])\s*\$?\s*([\d][\d\s.,]*)\s*$')
+
+def parse_price(raw: str) -> float:
+    """💲 Цена из ввода: "65 000", "65,000.5", "65000,5", "0,25" (запятая - и разряды, и дробь)"""
+    value = re.sub(r'\s', '', raw)
+    if value.count(',') == 1:
+        whole, fraction = value.split(',')
+        if '.' in value:
+            # "65,000.5" - запятая разрядов; "1.234,5" - точки разрядов, запятая дробная
+            return float(value.replace(',', '') if value.index(',') < value.index('.')
+                         else whole.replace('.', '') + '.' + fraction)
+        # Без точки запятая дробная, кроме разряда тысяч: "65,000"
+        if len(fraction) == 3 and whole.strip('0'):
+            return float(whole + fraction)
+        return float(whole + '.' + fraction)
+    return float(value.replace(',', ''))
+
+def get_crypto_service(modules):
+    """₿ CryptoService из modules (напрямую или через CryptoModule)"""
+    crypto = modules.get('crypto')
+    return getattr(crypto, 'crypto_service', crypto)
+
+async def get_crypto_price_detailed(coin_query, modules):
+    """₿ Подробные данные монеты из рыночного снимка"""
+    try:
+        crypto_service = get_crypto_service(modules)
+        if not crypto_service:
+            return None
+        
+        coin = await crypto_service.get_coin_data(coin_query)
+        if not coin:
+            return None
+        
+        return {
+            'name': coin['name'],
+            'symbol': coin['symbol'],
+            'price': coin['current_price'],
+            'change_24h': coin.get('price_change_percentage_24h') or 0,
+            'change_7d': crypto_service.get_change_7d(coin) or 0,
+            'market_cap_rank': coin.get('market_cap_rank') or 'N/A',
+            'market_cap': int(coin.get('market_cap') or 0),
+            'volume_24h': int(coin.get('total_volume') or 0),
+            'ath': coin.get('ath') or 0,
+            'atl': coin.get('atl') or 0
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка получения курса: {e}")
+        return None
+
 # Остальные заглушки функций (для экономии места - в полной версии будут реализованы)
 async def get_trigger_stats(modules): return {'total_triggers': 0, 'active_triggers': 0}
-async def get_crypto_price_detailed(coin_query, modules): return None
 async def get_chat_top_users(modules, chat_id, limit): return []
 async def calculate_activity_level(stats): return "Средний"
 async def calculate_engagement_score(stats): return 75
@@ -1728,7 +2022,6 @@ async def get_learning_statistics_detailed(modules): return {}
 async def analyze_sticker_with_learning(sticker, modules, user_id): return {"response_type": "emoji"}
 async def get_adaptive_user_context(modules, user_id, chat_id): return {}
 async def get_learned_response(modules, user_id, text): return None
-async def check_trigger_match(text, trigger): return False
 async def get_user_learned_patterns(modules, user_id): return []
 async def update_user_adaptive_profile(modules, user_id, message, response): pass
 async def process_adaptive_reply_to_bot(message, modules): pass
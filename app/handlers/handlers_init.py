@@ -5,10 +5,14 @@
 """
 
 import logging
+import asyncio
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, Sticker
 from aiogram.filters import CommandStart, Command
 from datetime import datetime
+from app.services.bot_enforcer import BotEnforcer
+from app.handlers.middlewares import install_features_middleware
+from app.modules.message_features import MessageFeatures
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +22,17 @@ def register_all_handlers(dp, modules):
     
     router = Router()
     
+    # Текст каждого сообщения разбирается один раз (features в обработчиках)
+    install_features_middleware(router)
+    
+    # Баны, муты и удаления модерации идут в Bot API через очередь модуля
+    if modules.get('moderation') and modules.get('bot'):
+        modules['moderation'].set_enforcer(BotEnforcer(modules['bot']))
+    
+    # Пороги флуда и запрещенные слова чатов из moderation_settings
+    if modules.get('moderation'):
+        asyncio.create_task(modules['moderation'].load_chat_settings())
+    
     # Основные команды
     @router.message(CommandStart())
     async def start_handler(message: Message):
@@ -361,7 +376,7 @@ def register_all_handlers(dp, modules):
     
     # Обработка всех текстовых сообщений
     @router.message(F.text)
-    async def text_handler(message: Message):
+    async def text_handler(message: Message, features: MessageFeatures = None):
         user = message.from_user
         
         # Сохраняем пользователя и сообщение
@@ -385,7 +400,7 @@ def register_all_handlers(dp, modules):
         # Проверяем модерацию
         if modules.get('moderation'):
             moderation_result = await modules['moderation'].check_message(
-                user.id, message.chat.id, message.text
+                user.id, message.chat.id, message.text, features
             )
             
             if moderation_result['action'] != 'allow':
@@ -403,6 +418,17 @@ def register_all_handlers(dp, modules):
                     await message.answer(f"⚠️ Предупреждение ({warnings}): {reason}")
                 elif action == 'timeout':
                     await message.answer(f"🕐 Временное ограничение: {reason}")
+                elif action in ('mute', 'ban'):
+                    # Эскалация за предупреждения: мут или бан уже в очереди модерации, срок снимет планировщик
+                    warnings = moderation_result.get('user_warnings', 0)
+                    until = moderation_result.get('until')
+                    await modules['moderation'].apply_action(
+                        'delete', message.chat.id, message.from_user.id, reason=reason, message_id=message.message_id
+                    )
+                    if action == 'mute':
+                        await message.answer(f"🔇 Мут до {until:%H:%M} ({warnings} предупреждений): {reason}")
+                    else:
+                        await message.answer(f"🚫 Бан до {until:%d.%m %H:%M} ({warnings} предупреждений): {reason}")
                 
                 return
         
@@ -25,6 +25,10 @@ import os
 import aiohttp
 from typing import Dict, List, Any
 
+from app.services.bot_enforcer import BotEnforcer
+from app.handlers.middlewares import install_features_middleware
+from app.modules.message_features import MessageFeatures, features_of, LEXICON_SUMMON
+
 logger = logging.getLogger(__name__)
 
 # Разрешенные чаты
@@ -50,6 +54,9 @@ def register_all_handlers(dp, modules):
     
     router = Router()
     
+    # Текст каждого сообщения разбирается один раз (features в обработчиках)
+    install_features_middleware(router)
+    
     # Загружаем разрешенные чаты
     if modules.get('config') and hasattr(modules['config'].bot, 'allowed_chat_ids'):
         ALLOWED_CHAT_IDS = modules['config'].bot.allowed_chat_ids
@@ -66,6 +73,14 @@ def register_all_handlers(dp, modules):
     
     asyncio.create_task(get_bot_info())
     
+    # Баны, муты и удаления модерации идут в Bot API через очередь модуля
+    if modules.get('moderation') and modules.get('bot'):
+        modules['moderation'].set_enforcer(BotEnforcer(modules['bot']))
+    
+    # Пороги флуда и запрещенные слова чатов из moderation_settings
+    if modules.get('moderation'):
+        asyncio.create_task(modules['moderation'].load_chat_settings())
+    
     # =================== ОСНОВНЫЕ КОМАНДЫ ===================
     
     @router.message(CommandStart())
@@ -236,7 +251,7 @@ def register_all_handlers(dp, modules):
             reason = " ".join(args[1:]) if len(args) > 1 else "Нарушение правил"
             
             # Выполняем бан
-            success = await ban_user(modules, user_id, message.from_user.id, reason)
+            success = await ban_user(modules, message.chat.id, user_id, message.from_user.id, reason)
             
             if success:
                 await message.reply(f"✅ Пользователь {user_id} забанен.\nПричина: {reason}")
@@ -261,7 +276,7 @@ def register_all_handlers(dp, modules):
         
         try:
             user_id = int(args[0])
-            success = await unban_user(modules, user_id, message.from_user.id)
+            success = await unban_user(modules, message.chat.id, user_id, message.from_user.id)
             
             if success:
                 await message.reply(f"✅ Пользователь {user_id} разбанен.")
@@ -294,7 +309,7 @@ def register_all_handlers(dp, modules):
             minutes = int(args[2])
             reason = " ".join(args[3:]) if len(args) > 3 else "Нарушение"
             
-            success = await mute_user(modules, user_id, message.from_user.id, minutes, reason)
+            success = await mute_user(modules, message.chat.id, user_id, message.from_user.id, minutes, reason)
             
             if success:
                 await message.reply(f"🔇 Пользователь {user_id} замучен на {minutes} мин.\nПричина: {reason}")
@@ -321,7 +336,7 @@ def register_all_handlers(dp, modules):
             user_id = int(args[0])
             reason = " ".join(args[1:]) if len(args) > 1 else "Предупреждение"
             
-            warnings_count = await warn_user(modules, user_id, message.from_user.id, reason)
+            warnings_count = await warn_user(modules, message.chat.id, user_id, message.from_user.id, reason)
             
             await message.reply(
                 f"⚠️ Пользователь {user_id} получил предупреждение.\n"
@@ -394,7 +409,7 @@ def register_all_handlers(dp, modules):
             return
         
         # Получаем данные криптовалюты
-        crypto_data = await get_crypto_price(coin_query)
+        crypto_data = await get_crypto_price(coin_query, modules)
         
         if not crypto_data:
             await message.reply(f"❌ Не удалось найти данные для {coin_query}")
@@ -642,7 +657,7 @@ def register_all_handlers(dp, modules):
     # =================== РЕПЛАИ И УМНЫЕ ОТВЕТЫ ===================
     
     @router.message(F.reply_to_message)
-    async def reply_handler(message: Message):
+    async def reply_handler(message: Message, features: MessageFeatures = None):
         if not check_chat_allowed(message.chat.id):
             return
         
@@ -653,17 +668,17 @@ def register_all_handlers(dp, modules):
         if message.reply_to_message.from_user.id == modules['bot'].id:
             await process_reply_to_bot(message, modules)
         else:
-            await process_smart_text(message, modules, bot_info)
+            await process_smart_text(message, modules, bot_info, features)
     
     @router.message(F.text)
-    async def smart_text_handler(message: Message):
+    async def smart_text_handler(message: Message, features: MessageFeatures = None):
         if not check_chat_allowed(message.chat.id):
             return
         
         if message.chat.type == 'private' and message.from_user.id not in modules['config'].bot.admin_ids:
             return
             
-        await process_smart_text(message, modules, bot_info)
+        await process_smart_text(message, modules, bot_info, features)
     
     # Регистрируем роутер
     dp.include_router(router)
@@ -673,62 +688,35 @@ def register_all_handlers(dp, modules):
 
 # =================== ФУНКЦИИ МОДЕРАЦИИ ===================
 
-async def ban_user(modules, user_id: int, admin_id: int, reason: str) -> bool:
-    """🚫 Забанить пользователя"""
-    try:
-        if modules.get('db'):
-            await modules['db'].execute(
-                "INSERT INTO bans (user_id, admin_id, reason, ban_date) VALUES (?, ?, ?, ?)",
-                (user_id, admin_id, reason, datetime.now())
-            )
-            return True
-    except Exception as e:
-        logger.error(f"Ошибка бана: {e}")
+async def ban_user(modules, chat_id: int, user_id: int, admin_id: int, reason: str) -> bool:
+    """🚫 Забанить пользователя (запись и бан - через очередь модерации)"""
+    if not modules.get('moderation'):
         return False
+    result = await modules['moderation'].apply_action('ban', chat_id, user_id, admin_id=admin_id, reason=reason)
+    return result['success']
 
-async def unban_user(modules, user_id: int, admin_id: int) -> bool:
+async def unban_user(modules, chat_id: int, user_id: int, admin_id: int) -> bool:
     """✅ Разбанить пользователя"""
-    try:
-        if modules.get('db'):
-            result = await modules['db'].execute(
-                "DELETE FROM bans WHERE user_id = ?", (user_id,)
-            )
-            return result.rowcount > 0
-    except Exception as e:
-        logger.error(f"Ошибка разбана: {e}")
+    if not modules.get('moderation'):
         return False
+    result = await modules['moderation'].apply_action('unban', chat_id, user_id, admin_id=admin_id)
+    return result['success']
 
-async def mute_user(modules, user_id: int, admin_id: int, minutes: int, reason: str) -> bool:
-    """🔇 Замутить пользователя"""
-    try:
-        if modules.get('db'):
-            mute_until = datetime.now() + timedelta(minutes=minutes)
-            await modules['db'].execute(
-                "INSERT INTO mutes (user_id, admin_id, reason, mute_until) VALUES (?, ?, ?, ?)",
-                (user_id, admin_id, reason, mute_until)
-            )
-            return True
-    except Exception as e:
-        logger.error(f"Ошибка мута: {e}")
+async def mute_user(modules, chat_id: int, user_id: int, admin_id: int, minutes: int, reason: str) -> bool:
+    """🔇 Замутить пользователя (размут - по сроку, планировщиком)"""
+    if not modules.get('moderation'):
         return False
+    result = await modules['moderation'].apply_action(
+        'mute', chat_id, user_id, admin_id=admin_id, reason=reason, duration=timedelta(minutes=minutes)
+    )
+    return result['success']
 
-async def warn_user(modules, user_id: int, admin_id: int, reason: str) -> int:
-    """⚠️ Предупредить пользователя"""
-    try:
-        if modules.get('db'):
-            await modules['db'].execute(
-                "INSERT INTO warnings (user_id, admin_id, reason, warn_date) VALUES (?, ?, ?, ?)",
-                (user_id, admin_id, reason, datetime.now())
-            )
-            
-            # Подсчитываем общее количество предупреждений
-            result = await modules['db'].fetchone(
-                "SELECT COUNT(*) as count FROM warnings WHERE user_id = ?", (user_id,)
-            )
-            return result['count'] if result else 1
-    except Exception as e:
-        logger.error(f"Ошибка предупреждения: {e}")
+async def warn_user(modules, chat_id: int, user_id: int, admin_id: int, reason: str) -> int:
+    """⚠️ Предупредить пользователя; возвращает действующие предупреждения в чате"""
+    if not modules.get('moderation'):
         return 0
+    result = await modules['moderation'].apply_action('warn', chat_id, user_id, admin_id=admin_id, reason=reason)
+    return result['user_warnings']
 
 async def get_moderation_stats(modules) -> Dict[str, int]:
     """📊 Статистика модерации"""
@@ -797,9 +785,26 @@ async def get_detailed_moderation_stats(modules) -> Dict[str, Any]:
 
 # =================== ФУНКЦИИ КРИПТОВАЛЮТ ===================
 
-async def get_crypto_price(coin_query: str) -> Dict[str, Any]:
+async def get_crypto_price(coin_query: str, modules: Dict[str, Any] = None) -> Dict[str, Any]:
     """₿ Получить цену криптовалюты"""
     try:
+        # CryptoService разрешает символ по локальному реестру без /search
+        crypto_module = (modules or {}).get('crypto')
+        service = getattr(crypto_module, 'crypto_service', crypto_module)
+        if service and hasattr(service, 'get_coin_data'):
+            coin = await service.get_coin_data(coin_query)
+            if not coin:
+                return None
+            return {
+                'name': coin.get('name'),
+                'symbol': coin.get('symbol') or coin_query,
+                'price': coin['current_price'],
+                'change_24h': coin.get('price_change_percentage_24h') or 0,
+                'market_cap': coin.get('market_cap') or 0,
+                'volume_24h': coin.get('total_volume') or 0,
+                'market_cap_rank': coin.get('market_cap_rank')
+            }
+        
         async with aiohttp.ClientSession() as session:
             url = f"https://api.coingecko.com/api/v3/simple/price"
             params = {
@@ -1178,7 +1183,7 @@ async def save_user_and_message(message: Message, modules):
     except Exception as e:
         logger.error(f"Ошибка сохранения данных: {e}")
 
-async def process_harsh_ai_request(message: Message, user_message: str, modules):
+async def process_harsh_ai_request(message: Message, user_message: str, modules, features: MessageFeatures = None):
     """🤖 Грубая обработка AI"""
     try:
         context = {
@@ -1220,7 +1225,7 @@ async def process_harsh_ai_request(message: Message, user_message: str, modules)
         if modules.get('memory'):
             await modules['memory'].add_interaction(
                 message.from_user.id, message.chat.id,
-                user_message, response
+                user_message, response, features=features
             )
         
     except Exception as e:
@@ -1256,16 +1261,16 @@ def clean_harsh_response(response: str) -> str:
     
     return cleaned.strip()
 
-async def process_smart_text(message: Message, modules, bot_info):
+async def process_smart_text(message: Message, modules, bot_info, features: MessageFeatures = None):
     """🧠 Интеллектуальная обработка"""
     try:
         await save_user_and_message(message, modules)
         
         # Проверяем упоминания
-        should_respond = await check_bot_mentions(message, bot_info)
+        should_respond = await check_bot_mentions(message, bot_info, features)
         
         if should_respond:
-            await process_harsh_smart_response(message, modules)
+            await process_harsh_smart_response(message, modules, features)
         else:
             # Редкие случайные ответы
             if random.random() < 0.005:
@@ -1275,25 +1280,25 @@ async def process_smart_text(message: Message, modules, bot_info):
     except Exception as e:
         logger.error(f"Ошибка обработки: {e}")
 
-async def check_bot_mentions(message: Message, bot_info) -> bool:
+async def check_bot_mentions(message: Message, bot_info, features: MessageFeatures = None) -> bool:
     """🎯 Проверка упоминаний"""
     try:
         if message.chat.type == 'private':
             return True
         
-        text = message.text.lower()
+        features = features_of(message.text, features)
+        text = features.lower
         
         # Прямое упоминание
         if bot_info and f'@{bot_info.username.lower()}' in text:
             return True
         
         # Ключевые слова
-        keywords = ['бот', 'bot', 'робот', 'помощник']
-        if any(keyword in text for keyword in keywords):
+        if features.hits(LEXICON_SUMMON):
             return True
         
         # Вопросы
-        if '?' in message.text and len(message.text) > 15:
+        if features.has_question and features.length > 15:
             return True
         
         return False
@@ -1302,11 +1307,11 @@ async def check_bot_mentions(message: Message, bot_info) -> bool:
         logger.error(f"Ошибка проверки упоминаний: {e}")
         return False
 
-async def process_harsh_smart_response(message: Message, modules):
+async def process_harsh_smart_response(message: Message, modules, features: MessageFeatures = None):
     """💡 Грубый умный ответ"""
     try:
         if modules.get('ai'):
-            await process_harsh_ai_request(message, message.text, modules)
+            await process_harsh_ai_request(message, message.text, modules, features)
         else:
             responses = ["Что?", "AI отключен.", "Настрой ключи.", "Не работает."]
             await message.reply(random.choice(responses))
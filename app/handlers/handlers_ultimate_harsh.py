@@ -22,6 +22,9 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, Sticker
 from aiogram.filters import CommandStart, Command
 from aiogram.exceptions import TelegramBadRequest
+from app.services.bot_enforcer import BotEnforcer
+from app.handlers.middlewares import install_features_middleware
+from app.modules.message_features import MessageFeatures, features_of, LEXICON_SUMMON
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +39,9 @@ def register_all_handlers(dp, modules):
     
     router = Router()
     
+    # Текст каждого сообщения разбирается один раз (features в обработчиках)
+    install_features_middleware(router)
+    
     # Загружаем разрешенные чаты из конфига
     if modules.get('config') and hasattr(modules['config'].bot, 'allowed_chat_ids'):
         ALLOWED_CHAT_IDS = modules['config'].bot.allowed_chat_ids
@@ -53,6 +59,14 @@ def register_all_handlers(dp, modules):
     
     asyncio.create_task(get_bot_info())
     
+    # Баны, муты и удаления модерации идут в Bot API через очередь модуля
+    if modules.get('moderation') and modules.get('bot'):
+        modules['moderation'].set_enforcer(BotEnforcer(modules['bot']))
+    
+    # Пороги флуда и запрещенные слова чатов из moderation_settings
+    if modules.get('moderation'):
+        asyncio.create_task(modules['moderation'].load_chat_settings())
+    
     # =================== ОСНОВНЫЕ КОМАНДЫ ===================
     
     @router.message(CommandStart())
@@ -429,7 +443,7 @@ def register_all_handlers(dp, modules):
     # =================== ОБРАБОТКА РЕПЛАЕВ ===================
     
     @router.message(F.reply_to_message)
-    async def reply_handler(message: Message):
+    async def reply_handler(message: Message, features: MessageFeatures = None):
         if not check_chat_allowed(message.chat.id):
             return
         
@@ -440,19 +454,19 @@ def register_all_handlers(dp, modules):
         if message.reply_to_message.from_user.id == modules['bot'].id:
             await process_reply_to_bot(message, modules)
         else:
-            await process_smart_text(message, modules, bot_info)
+            await process_smart_text(message, modules, bot_info, features)
     
     # =================== ИНТЕЛЛЕКТУАЛЬНАЯ ОБРАБОТКА ===================
     
     @router.message(F.text)
-    async def smart_text_handler(message: Message):
+    async def smart_text_handler(message: Message, features: MessageFeatures = None):
         if not check_chat_allowed(message.chat.id):
             return
         
         if message.chat.type == 'private' and message.from_user.id not in modules['config'].bot.admin_ids:
             return
             
-        await process_smart_text(message, modules, bot_info)
+        await process_smart_text(message, modules, bot_info, features)
     
     # Регистрируем роутер
     dp.include_router(router)
@@ -505,7 +519,7 @@ async def save_user_and_message(message: Message, modules):
     except Exception as e:
         logger.error(f"Ошибка сохранения данных: {e}")
 
-async def process_harsh_ai_request(message: Message, user_message: str, modules):
+async def process_harsh_ai_request(message: Message, user_message: str, modules, features: MessageFeatures = None):
     """🤖 ГРУБАЯ обработка AI - БЕЗ 'Бот:' и 'Думаю...'"""
     
     try:
@@ -546,7 +560,7 @@ async def process_harsh_ai_request(message: Message, user_message: str, modules)
         if modules.get('memory'):
             await modules['memory'].add_interaction(
                 message.from_user.id, message.chat.id, 
-                user_message, response
+                user_message, response, features=features
             )
         
     except Exception as e:
@@ -592,34 +606,34 @@ def clean_harsh_response(response: str) -> str:
     
     return cleaned.strip()
 
-async def process_smart_text(message: Message, modules, bot_info):
+async def process_smart_text(message: Message, modules, bot_info, features: MessageFeatures = None):
     """🧠 Интеллектуальная обработка"""
     
     try:
         user = message.from_user
-        text = message.text.lower()
+        features = features_of(message.text, features)
         
         await save_user_and_message(message, modules)
         
         # 1. Проверяем триггеры
         if modules.get('triggers'):
             trigger_response = await modules['triggers'].check_message_triggers(
-                message.text, message.chat.id, user.id
+                message.text, message.chat.id, user.id, user.first_name or ''
             )
             if trigger_response:
                 await message.reply(trigger_response)
                 return
         
         # 2. Проверяем модерацию
-        moderation_action = await check_moderation(message, modules)
+        moderation_action = await check_moderation(message, modules, features)
         if moderation_action:
             return
         
         # 3. Проверяем упоминания бота
-        should_respond = await check_bot_mentions(message, bot_info)
+        should_respond = await check_bot_mentions(message, bot_info, features)
         
         if should_respond:
-            await process_harsh_smart_response(message, modules)
+            await process_harsh_smart_response(message, modules, features)
         else:
             await process_random_responses(message, modules)
         
@@ -633,14 +647,15 @@ async def process_smart_text(message: Message, modules, bot_info):
     except Exception as e:
         logger.error(f"Ошибка обработки: {e}")
 
-async def check_bot_mentions(message: Message, bot_info) -> bool:
+async def check_bot_mentions(message: Message, bot_info, features: MessageFeatures = None) -> bool:
     """🎯 Проверка упоминаний"""
     
     try:
         if message.chat.type == 'private':
             return True
         
-        text = message.text.lower()
+        features = features_of(message.text, features)
+        text = features.lower
         
         # Прямое упоминание
         if bot_info and f'@{bot_info.username.lower()}' in text:
@@ -651,12 +666,11 @@ async def check_bot_mentions(message: Message, bot_info) -> bool:
             return True
         
         # Ключевые слова
-        bot_keywords = ['бот', 'bot', 'робот', 'помощник']
-        if any(keyword in text for keyword in bot_keywords):
+        if features.hits(LEXICON_SUMMON):
             return True
         
         # Вопросы
-        if '?' in message.text and len(message.text) > 15:
+        if features.has_question and features.length > 15:
             return True
         
         return False
@@ -665,12 +679,12 @@ async def check_bot_mentions(message: Message, bot_info) -> bool:
         logger.error(f"Ошибка проверки упоминаний: {e}")
         return False
 
-async def process_harsh_smart_response(message: Message, modules):
+async def process_harsh_smart_response(message: Message, modules, features: MessageFeatures = None):
     """💡 ГРУБЫЙ умный ответ"""
     
     try:
         if modules.get('ai'):
-            await process_harsh_ai_request(message, message.text, modules)
+            await process_harsh_ai_request(message, message.text, modules, features)
         else:
             # Грубые базовые ответы
             harsh_responses = [
@@ -699,7 +713,7 @@ async def process_reply_to_bot(message: Message, modules):
     except Exception as e:
         logger.error(f"Ошибка реплая: {e}")
 
-async def check_moderation(message: Message, modules) -> bool:
+async def check_moderation(message: Message, modules, features: MessageFeatures = None) -> bool:
     """🛡️ Модерация"""
     
     try:
@@ -707,7 +721,7 @@ async def check_moderation(message: Message, modules) -> bool:
             return False
             
         moderation_result = await modules['moderation'].check_message(
-            message.from_user.id, message.chat.id, message.text
+            message.from_user.id, message.chat.id, message.text, features
         )
         
         if moderation_result['action'] != 'allow':
@@ -725,6 +739,17 @@ async def check_moderation(message: Message, modules) -> bool:
                 await message.reply(f"Предупреждение {warnings}: {reason}")
             elif action == 'timeout':
                 await message.reply(f"Ограничение: {reason}")
+            elif action in ('mute', 'ban'):
+                # Эскалация за предупреждения: мут или бан уже в очереди модерации, срок снимет планировщик
+                warnings = moderation_result.get('user_warnings', 0)
+                until = moderation_result.get('until')
+                await modules['moderation'].apply_action(
+                    'delete', message.chat.id, message.from_user.id, reason=reason, message_id=message.message_id
+                )
+                if action == 'mute':
+                    await message.reply(f"Мут до {until:%H:%M} ({warnings} предупреждений): {reason}")
+                else:
+                    await message.reply(f"Бан до {until:%d.%m %H:%M} ({warnings} предупреждений): {reason}")
             
             return True
             
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+🧩 MIDDLEWARES v3.0
+🧬 Общие данные апдейта для обработчиков
+
+MessageFeaturesMiddleware разбирает текст сообщения один раз и кладет
+MessageFeatures в данные апдейта: обработчик получает его аргументом
+features и передает в модули (модерация, поведение, память, проверка
+ответа бота), которые иначе разбирали бы текст каждый заново.
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.modules.message_features import MessageFeatures
+
+FEATURES_KEY = 'features'
+
+
+class MessageFeaturesMiddleware(BaseMiddleware):
+    """🧬 features = MessageFeatures(текст или подпись) для каждого сообщения"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        text = getattr(event, 'text', None) or getattr(event, 'caption', None)
+        if text and FEATURES_KEY not in data:
+            data[FEATURES_KEY] = MessageFeatures(text)
+        return await handler(event, data)
+
+
+def install_features_middleware(router):
+    """🔌 Подключение к сообщениям роутера (до фильтров, один раз на апдейт)"""
+    router.message.outer_middleware(MessageFeaturesMiddleware())
+
+
+__all__ = ["MessageFeaturesMiddleware", "install_features_middleware", "FEATURES_KEY"]
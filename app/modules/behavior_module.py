@@ -13,6 +13,10 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
 from collections import defaultdict, Counter
 
+from app.modules.message_features import (
+    MessageFeatures, features_of, STYLE_LEXICONS, LEXICON_POSITIVE, LEXICON_NEGATIVE
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -52,15 +56,16 @@ class BehaviorModule:
         logger.info("🌟 Behavior Module инициализирован")
     
     async def analyze_user_behavior(self, user_id: int, chat_id: int, 
-                                   message: str, context: Dict = None) -> Dict[str, Any]:
-        """🔍 Анализ поведения пользователя"""
+                                   message: str, context: Dict = None,
+                                   features: Optional[MessageFeatures] = None) -> Dict[str, Any]:
+        """🔍 Анализ поведения пользователя (features - признаки сообщения из апдейта)"""
         
         try:
             # Получаем профиль пользователя
             profile = await self._get_user_profile(user_id)
             
             # Анализируем текущее сообщение
-            message_analysis = self._analyze_message(message)
+            message_analysis = self._analyze_message(message, features)
             
             # Обновляем профиль с новыми данными
             updated_profile = self._update_profile(profile, message_analysis)
@@ -132,7 +137,8 @@ class BehaviorModule:
             return base_response
     
     async def learn_from_interaction(self, user_id: int, chat_id: int, 
-                                   user_message: str, bot_response: str) -> bool:
+                                   user_message: str, bot_response: str,
+                                   features: Optional[MessageFeatures] = None) -> bool:
         """📚 Обучение на основе взаимодействия"""
         
         try:
@@ -144,7 +150,7 @@ class BehaviorModule:
                 'user_message': user_message,
                 'bot_response': bot_response,
                 'timestamp': datetime.now().isoformat(),
-                'message_analysis': self._analyze_message(user_message),
+                'message_analysis': self._analyze_message(user_message, features),
                 'response_effectiveness': self._estimate_response_effectiveness(user_message, bot_response)
             }
             
@@ -224,20 +230,21 @@ class BehaviorModule:
             logger.error(f"❌ Ошибка сохранения профиля: {e}")
             return False
     
-    def _analyze_message(self, message: str) -> Dict[str, Any]:
-        """📊 Анализ сообщения пользователя"""
+    def _analyze_message(self, message: str, features: Optional[MessageFeatures] = None) -> Dict[str, Any]:
+        """📊 Анализ сообщения пользователя (по признакам апдейта, если переданы)"""
         
         try:
+            features = features_of(message, features)
             analysis = {
-                'length': len(message),
-                'word_count': len(message.split()),
-                'has_questions': '?' in message,
-                'has_exclamations': '!' in message,
-                'has_emojis': any(ord(char) > 127 for char in message),
-                'sentiment': self._analyze_sentiment(message),
-                'communication_style': self._detect_communication_style(message),
-                'topic_keywords': self._extract_keywords(message),
-                'complexity_level': self._assess_complexity(message)
+                'length': features.length,
+                'word_count': features.word_count,
+                'has_questions': features.has_question,
+                'has_exclamations': features.has_exclamation,
+                'has_emojis': features.non_ascii,
+                'sentiment': self._analyze_sentiment(features),
+                'communication_style': self._detect_communication_style(features),
+                'topic_keywords': self._extract_keywords(features),
+                'complexity_level': self._assess_complexity(features)
             }
             
             return analysis
@@ -246,18 +253,12 @@ class BehaviorModule:
             logger.error(f"❌ Ошибка анализа сообщения: {e}")
             return {}
     
-    def _analyze_sentiment(self, message: str) -> str:
+    def _analyze_sentiment(self, features: MessageFeatures) -> str:
         """😊 Анализ настроения сообщения"""
         
         try:
-            message_lower = message.lower()
-            
-            positive_words = ['хорошо', 'отлично', 'супер', 'класс', 'спасибо', 'радуюсь']
-            negative_words = ['плохо', 'ужасно', 'проблема', 'ошибка', 'не работает']
-            neutral_words = ['вопрос', 'помощь', 'информация']
-            
-            positive_score = sum(1 for word in positive_words if word in message_lower)
-            negative_score = sum(1 for word in negative_words if word in message_lower)
+            positive_score = features.count(LEXICON_POSITIVE)
+            negative_score = features.count(LEXICON_NEGATIVE)
             
             if positive_score > negative_score:
                 return 'positive'
@@ -270,23 +271,11 @@ class BehaviorModule:
             logger.error(f"❌ Ошибка анализа настроения: {e}")
             return 'neutral'
     
-    def _detect_communication_style(self, message: str) -> str:
+    def _detect_communication_style(self, features: MessageFeatures) -> str:
         """🗣️ Определение стиля общения"""
         
         try:
-            message_lower = message.lower()
-            
-            formal_markers = ['пожалуйста', 'благодарю', 'извините', 'могли бы']
-            casual_markers = ['привет', 'пока', 'круто', 'ок']
-            technical_markers = ['функция', 'алгоритм', 'код', 'программа']
-            emotional_markers = ['чувствую', 'переживаю', 'волнуюсь', 'радуюсь']
-            
-            scores = {
-                'formal': sum(1 for marker in formal_markers if marker in message_lower),
-                'casual': sum(1 for marker in casual_markers if marker in message_lower),
-                'technical': sum(1 for marker in technical_markers if marker in message_lower),
-                'emotional': sum(1 for marker in emotional_markers if marker in message_lower)
-            }
+            scores = {style: features.count(style) for style in STYLE_LEXICONS}
             
             # Возвращаем стиль с максимальным счетом
             max_style = max(scores, key=scores.get)
@@ -300,43 +289,23 @@ class BehaviorModule:
             logger.error(f"❌ Ошибка определения стиля общения: {e}")
             return 'neutral'
     
-    def _extract_keywords(self, message: str) -> List[str]:
+    def _extract_keywords(self, features: MessageFeatures) -> List[str]:
         """🔑 Извлечение ключевых слов"""
         
-        try:
-            stop_words = {'и', 'в', 'на', 'с', 'по', 'для', 'от', 'до', 'из', 'к', 'о', 'что', 'это'}
-            
-            words = message.lower().split()
-            keywords = []
-            
-            for word in words:
-                clean_word = ''.join(c for c in word if c.isalnum())
-                if len(clean_word) > 2 and clean_word not in stop_words and clean_word.isalpha():
-                    keywords.append(clean_word)
-            
-            return list(set(keywords))[:10]
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка извлечения ключевых слов: {e}")
-            return []
+        return features.keywords
     
-    def _assess_complexity(self, message: str) -> str:
+    def _assess_complexity(self, features: MessageFeatures) -> str:
         """🧠 Оценка сложности сообщения"""
         
-        try:
-            word_count = len(message.split())
-            avg_word_length = sum(len(word) for word in message.split()) / max(word_count, 1)
-            
-            if word_count > 50 or avg_word_length > 6:
-                return 'complex'
-            elif word_count > 20 or avg_word_length > 4:
-                return 'medium'
-            else:
-                return 'simple'
-                
-        except Exception as e:
-            logger.error(f"❌ Ошибка оценки сложности: {e}")
+        word_count = features.word_count
+        avg_word_length = features.avg_word_length
+        
+        if word_count > 50 or avg_word_length > 6:
+            return 'complex'
+        elif word_count > 20 or avg_word_length > 4:
             return 'medium'
+        else:
+            return 'simple'
     
     def _update_profile(self, profile: Dict[str, Any], message_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """🔄 Обновление профиля пользователя"""
@@ -96,18 +96,20 @@ class ChartsModule:
             logger.error(f"❌ Ошибка создания графика эмоций: {e}")
             return ""
     
-    async def create_crypto_chart(self, coin_name: str, price_data: List[float]) -> str:
+    async def create_crypto_chart(self, coin_name: str, price_data: List[float],
+                                  timestamps: List[datetime] = None) -> str:
         """₿ Создание графика криптовалюты"""
         
         try:
             if not price_data:
                 return ""
             
-            # Генерируем временные метки
-            timestamps = []
-            for i in range(len(price_data)):
-                timestamp = datetime.now() - timedelta(hours=len(price_data)-i-1)
-                timestamps.append(timestamp)
+            # Без меток времени считаем точки почасовыми
+            if not timestamps:
+                timestamps = []
+                for i in range(len(price_data)):
+                    timestamp = datetime.now() - timedelta(hours=len(price_data)-i-1)
+                    timestamps.append(timestamp)
             
             # Создаем график цены
             fig, ax = plt.subplots(figsize=(12, 6))
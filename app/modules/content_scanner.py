@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+🔎 CONTENT SCANNER v3.0
+⚡ Запрещенные слова, токсичность и спам за один проход
+
+Сообщение нормализуется один раз: NFKD без диакритики и невидимых
+символов, нижний регистр, латинские двойники и leet-замены сводятся к
+кириллице (сп@м, cпaм, cп@m -> спам; 4 -> ч: 4at -> чат), повторы букв схлопываются
+(спаааам -> спам). Те же преобразования применяются к словарям, поэтому
+обе стороны сравниваются в одном алфавите.
+
+Все словари (запрещенные, токсичные и свои списки чатов) собраны в один
+автомат Ахо-Корасик; совпадение засчитывается только целым словом,
+а запись со звездочкой в конце ("идиот*") - префиксом слова. Спам-правила
+объединены в одну регулярку по исходному тексту (регистр и ссылки
+важны). Результат - все категории сразу.
+"""
+
+import re
+import unicodedata
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from app.modules.trigger_matcher import AhoCorasick
+
+CATEGORY_BANNED = 'banned'
+CATEGORY_TOXIC = 'toxic'
+
+# Основы со звездочкой ловят падежи и производные (рекламу, спама, мошенничество).
+# "обман" - без звездочки, формами существительного: префикс задел бы
+# обычное "обманчиво" ("обманчиво простой")
+DEFAULT_BANNED_WORDS = (
+    'спам*', 'реклам*', 'мошенни*',
+    'обман', 'обмана', 'обману', 'обманом', 'обмане', 'обманы', 'обманов', 'обманами', 'обманах'
+)
+DEFAULT_TOXIC_WORDS = ('дурак*', 'идиот*', 'тупой', 'глупый')
+
+# Токсичность = число разных токсичных слов / TOXIC_SATURATION (не больше 1)
+TOXIC_SATURATION = 3
+
+# Спам-правила по исходному тексту: имя группы = причина
+SPAM_RULES = (
+    ('links', r'(?:https?://\S+){3,}'),    # Множественные ссылки
+    ('repeat', r'(?P<char>.)(?P=char){10,}'),  # Повторяющиеся символы
+    ('caps', r'[A-Z]{20,}'),               # Много заглавных букв
+)
+
+# Двойники и leet -> кириллица (после lower())
+_LOOKALIKES = {
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'o': 'о', 'p': 'р', 't': 'т', 'x': 'х', 'y': 'у', 'u': 'и',
+    '@': 'а', '0': 'о', '1': 'и', '3': 'з', '4': 'ч', '6': 'б', '$': 'с',
+    'ё': 'е',
+}
+
+# Невидимые символы, которыми разбивают слова
+_INVISIBLE = ('\u00ad', '\u200b', '\u200c', '\u200d', '\u2060', '\ufeff')
+
+_REPEATS = re.compile(r'(.)\1+')
+
+
+def _build_table() -> Dict[int, Optional[str]]:
+    table: Dict[int, Optional[str]] = {ord(char): target for char, target in _LOOKALIKES.items()}
+    for char in _INVISIBLE:
+        table[ord(char)] = None
+    # Комбинируемые диакритические знаки (остаются после NFKD)
+    for code in range(0x0300, 0x0370):
+        table[code] = None
+    return table
+
+
+_TABLE = _build_table()
+
+
+def normalize(text: str) -> str:
+    """🔤 Единый вид текста для словарей: регистр, двойники, leet, повторы"""
+
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+    text = text.lower().translate(_TABLE)
+    return _REPEATS.sub(r'\1', text)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum()
+
+
+class ScanResult:
+    """📋 Все категории нарушений одного сообщения"""
+
+    __slots__ = ('categories', 'spam_reason', 'normalized')
+
+    def __init__(self):
+        # категория -> найденные слова словаря (без повторов)
+        self.categories: Dict[str, Set[str]] = {}
+        self.spam_reason: Optional[str] = None
+        # Нормализованный текст (None, если сканеру не понадобился)
+        self.normalized: Optional[str] = None
+
+    @property
+    def is_spam(self) -> bool:
+        return self.spam_reason is not None
+
+    @property
+    def banned_words(self) -> Set[str]:
+        return self.categories.get(CATEGORY_BANNED, set())
+
+    @property
+    def toxic_words(self) -> Set[str]:
+        return self.categories.get(CATEGORY_TOXIC, set())
+
+    @property
+    def toxicity(self) -> float:
+        return min(1.0, len(self.toxic_words) / TOXIC_SATURATION)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'spam_reason': self.spam_reason,
+            'categories': {category: sorted(words) for category, words in self.categories.items()},
+            'toxicity': self.toxicity
+        }
+
+
+class ContentScanner:
+    """🔎 Однопроходный сканер содержимого"""
+
+    def __init__(self, banned_words: Iterable[str] = DEFAULT_BANNED_WORDS,
+                 toxic_words: Iterable[str] = DEFAULT_TOXIC_WORDS):
+        self._lexicons: Dict[str, List[str]] = {
+            CATEGORY_BANNED: list(banned_words),
+            CATEGORY_TOXIC: list(toxic_words)
+        }
+        self._chat_lexicons: Dict[int, Dict[str, List[str]]] = {}
+
+        self._automaton = self._build(self._lexicons)
+        self._chat_automata: Dict[int, Optional[AhoCorasick]] = {}
+
+        self.spam_regex = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in SPAM_RULES))
+
+    # =================== СЛОВАРИ ===================
+
+    @staticmethod
+    def _entries(lexicons: Dict[str, List[str]]) -> Iterable[Tuple[str, Tuple[str, str, bool]]]:
+        for category, words in lexicons.items():
+            for word in words:
+                is_prefix = word.endswith('*')
+                normalized = normalize(word.rstrip('*').strip())
+                if normalized:
+                    yield normalized, (category, word.rstrip('*'), is_prefix)
+
+    def _build(self, *lexicon_sets: Dict[str, List[str]]) -> Optional[AhoCorasick]:
+        entries = [entry for lexicons in lexicon_sets for entry in self._entries(lexicons)]
+        return AhoCorasick(entries) if entries else None
+
+    def set_words(self, category: str, words: Iterable[str]):
+        """📝 Замена общего словаря категории"""
+
+        self._lexicons[category] = list(words)
+        self._automaton = self._build(self._lexicons)
+        self._chat_automata.clear()
+
+    def set_chat_words(self, chat_id: int, category: str, words: Iterable[str]):
+        """💬 Свой словарь чата (дополняет общий; пустой список - удалить)"""
+
+        chat_lexicons = self._chat_lexicons.setdefault(chat_id, {})
+        words = list(words)
+        if words:
+            chat_lexicons[category] = words
+        else:
+            chat_lexicons.pop(category, None)
+            if not chat_lexicons:
+                del self._chat_lexicons[chat_id]
+        self._chat_automata.pop(chat_id, None)
+
+    def get_chat_words(self, chat_id: int) -> Dict[str, List[str]]:
+        return {category: list(words) for category, words in self._chat_lexicons.get(chat_id, {}).items()}
+
+    def _automaton_for(self, chat_id: Optional[int]) -> Optional[AhoCorasick]:
+        if chat_id is None or chat_id not in self._chat_lexicons:
+            return self._automaton
+
+        automaton = self._chat_automata.get(chat_id)
+        if automaton is None:
+            # Общий и чатовый словари в одном автомате - проход остается одним
+            automaton = self._chat_automata[chat_id] = self._build(self._lexicons, self._chat_lexicons[chat_id])
+        return automaton
+
+    # =================== СКАНИРОВАНИЕ ===================
+
+    def scan(self, message: str, chat_id: Optional[int] = None, normalized: Optional[str] = None) -> ScanResult:
+        """🔎 Все категории за один проход по нормализованному тексту
+
+        normalized - уже посчитанный normalize(message) (MessageFeatures.normalized)
+        """
+
+        result = ScanResult()
+        if not message:
+            return result
+
+        spam = self.spam_regex.search(message)
+        if spam:
+            result.spam_reason = spam.lastgroup
+
+        automaton = self._automaton_for(chat_id)
+        if automaton is None:
+            return result
+
+        text = result.normalized = normalized if normalized is not None else normalize(message)
+        last = len(text) - 1
+        categories = result.categories
+
+        for end, length, (category, word, is_prefix) in automaton.iter_matches(text):
+            start = end - length + 1
+            if start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if not is_prefix and end < last and _is_word_char(text[end + 1]):
+                continue
+            found = categories.get(category)
+            if found is None:
+                found = categories[category] = set()
+            found.add(word)
+
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Размеры словарей и автоматов"""
+
+        return {
+            'lexicons': {category: len(words) for category, words in self._lexicons.items()},
+            'chats_with_custom_words': len(self._chat_lexicons),
+            'automaton_states': len(self._automaton.goto) if self._automaton else 0,
+            'chat_automata_cached': len(self._chat_automata)
+        }
+
+
+__all__ = ["ContentScanner", "ScanResult", "normalize"]
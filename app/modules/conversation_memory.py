@@ -0,0 +1,645 @@
+#!/usr/bin/env python3
+"""
+💭 CONVERSATION MEMORY v3.0
+🔁 Кольцевые буферы последних реплик по (пользователь, чат)
+
+На каждую пару хранится deque последних window обменов (реплика
+пользователя + ответ бота) в компактных записях со __slots__. Буфер
+поднимается из таблицы context_memory при первом обращении, новые
+обмены пишутся в память сразу, а в БД - через BatchWriter
+(write-through).
+
+Все буферы лежат в одном LRU (OrderedDict) с бюджетом по памяти:
+при превышении вытесняются давно не использованные диалоги, так что
+число собеседников не ограничивает процесс, а вернувшийся пользователь
+просто заново поднимается из БД.
+
+Анализ диалога (темы, стиль, предпочтения) ведется нарастающим итогом:
+у буфера есть ConversationAnalysis со счетчиками ключевых слов, суммами
+длин, вопросов и восклицаний и маркерами предпочтений. Новый обмен
+прибавляет свое сообщение, выпавший из окна - вычитает, оба шага стоят
+O(длина сообщения), а снимок контекста не перечитывает историю.
+Новое сообщение не разбирается заново, если передан MessageFeatures
+апдейта.
+
+Долгий диалог хранится в три яруса:
+• последние window обменов - дословно, в буфере и строках 'turn';
+• выпавшие из окна сообщения сворачиваются в RollingSummary: счетчик
+  тем за всю историю и несколько самых "тематичных" предложений
+  (локальная экстрактивная выжимка, O(длина сообщения) на обмен);
+  сводка живет одной строкой 'summary' и по желанию переписывается
+  AI-провайдером в фоновой задаче с низким приоритетом;
+• свернутые строки 'turn' удаляются при сохранении сводки, а диалоги,
+  молчащие дольше cleanup_days, удаляются целиком.
+Поэтому на пару (пользователь, чат) в БД не больше 2 * window + 1
+строк, а сводка в промпте ограничена MAX_SUMMARY_CHARS.
+"""
+
+import re
+import sys
+import time
+import json
+import asyncio
+import logging
+from collections import deque, OrderedDict, Counter
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable, Awaitable
+
+from app.modules.message_features import (
+    MessageFeatures, extract_keywords, LEXICONS, LEXICON_LIKES, LEXICON_DISLIKES
+)
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TYPE_TURN = 'turn'
+CONTEXT_TYPE_SUMMARY = 'summary'
+
+DEFAULT_WINDOW = 10
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# Оценка накладных расходов записи (вместе с ее ключевыми словами в счетчиках)
+# и буфера сверх самих строк
+_TURN_OVERHEAD = 600
+_BUFFER_OVERHEAD = 1500
+
+# Маркеры предпочтений - те же словари, что у MessageFeatures
+POSITIVE_MARKERS = LEXICONS[LEXICON_LIKES]
+NEGATIVE_MARKERS = LEXICONS[LEXICON_DISLIKES]
+
+# Слов вокруг маркера предпочтения
+MARKER_CONTEXT_WORDS = 3
+
+# Сводка: предложений, длина предложения, тем за историю, итоговая длина текста
+MAX_SUMMARY_SENTENCES = 5
+MAX_SENTENCE_CHARS = 200
+MAX_SUMMARY_TOPICS = 50
+MAX_SUMMARY_CHARS = 800
+# Короче - не предложение, а реплика вроде "ок, спасибо"
+MIN_SENTENCE_WORDS = 4
+
+DEFAULT_SUMMARY_THRESHOLD = 20
+DEFAULT_CLEANUP_DAYS = 30
+# Удаление заброшенных диалогов - не чаще раза в период
+CLEANUP_INTERVAL_SECONDS = 6 * 3600
+
+# Фоновое сжатие сводок AI: очередь и пауза между запросами
+MAX_SUMMARY_JOBS = 100
+SUMMARY_JOB_PAUSE = 2.0
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+')
+
+_INSERT_TURN = (
+    "INSERT INTO context_memory (user_id, chat_id, context_type, context_data, created_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def context_around(text: str, marker: str, window: int = MARKER_CONTEXT_WORDS) -> str:
+    """📍 Слова вокруг первого вхождения маркера (маркер может быть из нескольких слов)"""
+
+    position = text.find(marker)
+    if position < 0:
+        return ""
+    words = text.split()
+    index = len(text[:position].split())
+    # Маркер внутри слова - это слово уже посчитано слева
+    if position > 0 and not text[position - 1].isspace():
+        index -= 1
+    span = len(marker.split())
+    return ' '.join(words[max(0, index - window):index + span + window])
+
+
+def _bump(counter: Dict[str, int], key: str, sign: int):
+    value = counter.get(key, 0) + sign
+    if value > 0:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+class ConversationAnalysis:
+    """📈 Нарастающие итоги по сообщениям пользователя в окне диалога"""
+    __slots__ = ('messages', 'total_length', 'questions', 'exclamations', 'non_ascii',
+                 'emoji_messages', 'keywords', 'likes', 'dislikes')
+
+    def __init__(self):
+        self.messages = 0
+        self.total_length = 0
+        self.questions = 0
+        self.exclamations = 0
+        # Сообщения с не-ASCII символами (прежний признак "эмодзи" стиля общения)
+        self.non_ascii = 0
+        self.emoji_messages = 0
+        self.keywords: Counter = Counter()
+        # Контекст маркера -> число сообщений окна, где он встретился (порядок - первое появление)
+        self.likes: Dict[str, int] = {}
+        self.dislikes: Dict[str, int] = {}
+
+    def add(self, message: str, features: Optional[MessageFeatures] = None):
+        """➕ Сообщение вошло в окно (features - готовые признаки апдейта)"""
+        self._apply(features if features is not None else MessageFeatures(message), 1)
+
+    def remove(self, message: str):
+        """➖ Сообщение выпало из окна"""
+        self._apply(MessageFeatures(message), -1)
+
+    def _apply(self, features: MessageFeatures, sign: int):
+        self.messages += sign
+        self.total_length += sign * features.length
+        self.questions += sign * features.has_question
+        self.exclamations += sign * features.has_exclamation
+        self.non_ascii += sign * features.non_ascii
+        self.emoji_messages += sign * features.has_emoji
+
+        for keyword in features.keywords:
+            _bump(self.keywords, keyword, sign)
+
+        lowered = features.lower
+        for category, target in ((LEXICON_LIKES, self.likes), (LEXICON_DISLIKES, self.dislikes)):
+            for marker in features.hits(category):
+                context = context_around(lowered, marker)
+                if context:
+                    _bump(target, context, sign)
+
+    # =================== СНИМКИ ===================
+
+    @property
+    def average_length(self) -> float:
+        return self.total_length / self.messages if self.messages else 0.0
+
+    def top_keywords(self, limit: int = 10) -> List[str]:
+        """🔑 Самые частые ключевые слова окна"""
+        return [word for word, _ in self.keywords.most_common(limit)]
+
+    def preferences(self) -> Dict[str, Any]:
+        """⭐ Предпочтения пользователя"""
+        return {
+            'likes': list(self.likes),
+            'dislikes': list(self.dislikes),
+            'interests': [],
+            'communication_preferences': {
+                'prefers_detailed_answers': self.average_length > 50,
+                'uses_emojis': self.emoji_messages > 0,
+                'asks_follow_up_questions': self.questions > 0
+            }
+        }
+
+    def communication_style(self) -> Dict[str, Any]:
+        """🗣️ Стиль общения"""
+
+        if not self.messages:
+            return {'style': 'unknown'}
+
+        avg_length = self.average_length
+        style = {
+            'average_message_length': round(avg_length, 1),
+            'questions_ratio': round(self.questions / self.messages, 2),
+            'exclamations_ratio': round(self.exclamations / self.messages, 2),
+            'uses_emojis': self.non_ascii > 0,
+            'style': 'neutral'
+        }
+
+        if avg_length > 100:
+            style['style'] = 'detailed'
+        elif avg_length < 20:
+            style['style'] = 'concise'
+
+        if style['questions_ratio'] > 0.5:
+            style['style'] = 'inquisitive'
+
+        if style['exclamations_ratio'] > 0.3:
+            style['style'] = 'enthusiastic'
+
+        return style
+
+
+class RollingSummary:
+    """🗜️ Свернутая часть диалога: темы за всю историю и ключевые предложения"""
+    __slots__ = ('topics', 'sentences', 'folded', 'abstract', 'abstract_folded', 'persisted_folded')
+
+    def __init__(self):
+        self.topics: Counter = Counter()
+        # Предложения в хронологическом порядке
+        self.sentences: List[str] = []
+        self.folded = 0
+        # Пересказ AI и число свернутых сообщений на момент пересказа
+        self.abstract = ''
+        self.abstract_folded = 0
+        # Сколько было свернуто при последнем сохранении (не сериализуется)
+        self.persisted_folded = 0
+
+    def fold(self, message: str):
+        """🗜️ Свернуть выпавшее из окна сообщение"""
+
+        topics = self.topics
+        for keyword in extract_keywords(message):
+            topics[keyword] += 1
+        if len(topics) > 2 * MAX_SUMMARY_TOPICS:
+            self.topics = topics = Counter(dict(topics.most_common(MAX_SUMMARY_TOPICS)))
+
+        candidates = self.sentences + [
+            sentence[:MAX_SENTENCE_CHARS] for sentence in _SENTENCE_BOUNDARY.split(message.strip())
+            if len(sentence.split()) >= MIN_SENTENCE_WORDS
+        ]
+        if len(candidates) > MAX_SUMMARY_SENTENCES:
+            # Оставляем самые тематичные, в прежнем порядке
+            scores = [self._score(sentence) for sentence in candidates]
+            keep = sorted(range(len(candidates)), key=scores.__getitem__, reverse=True)[:MAX_SUMMARY_SENTENCES]
+            candidates = [candidates[index] for index in sorted(keep)]
+        self.sentences = candidates
+        self.folded += 1
+
+    def _score(self, sentence: str) -> float:
+        keywords = extract_keywords(sentence)
+        topics = self.topics
+        return sum(topics.get(keyword, 0) for keyword in keywords) / (len(keywords) + 1)
+
+    def top_topics(self, limit: int = 5) -> List[str]:
+        return [word for word, _ in self.topics.most_common(limit)]
+
+    def extractive_text(self) -> str:
+        """📝 Локальная выжимка: темы и ключевые предложения"""
+
+        parts = []
+        topics = self.top_topics()
+        if topics:
+            parts.append(f"Темы: {', '.join(topics)}.")
+        parts.extend(self.sentences)
+        return ' '.join(parts)[:MAX_SUMMARY_CHARS]
+
+    def text(self) -> str:
+        """📝 Сводка для промпта (пересказ AI, если есть)"""
+        return self.abstract or self.extractive_text()
+
+    @property
+    def size(self) -> int:
+        return (sum(sys.getsizeof(sentence) for sentence in self.sentences) + sys.getsizeof(self.abstract) +
+                len(self.topics) * 100)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'topics': dict(self.topics.most_common(MAX_SUMMARY_TOPICS)),
+            'sentences': self.sentences,
+            'folded': self.folded,
+            'abstract': self.abstract,
+            'abstract_folded': self.abstract_folded
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> 'RollingSummary':
+        data = json.loads(raw)
+        summary = cls()
+        summary.topics = Counter(data.get('topics', {}))
+        summary.sentences = list(data.get('sentences', []))[:MAX_SUMMARY_SENTENCES]
+        summary.folded = summary.persisted_folded = int(data.get('folded', 0))
+        summary.abstract = data.get('abstract', '')[:MAX_SUMMARY_CHARS]
+        summary.abstract_folded = int(data.get('abstract_folded', 0))
+        return summary
+
+
+class Turn:
+    """💬 Один обмен: реплика пользователя и ответ бота"""
+    __slots__ = ('user_message', 'bot_response', 'timestamp')
+
+    def __init__(self, user_message: str, bot_response: str, timestamp: float):
+        self.user_message = user_message
+        self.bot_response = bot_response
+        self.timestamp = timestamp
+
+    @property
+    def size(self) -> int:
+        return sys.getsizeof(self.user_message) + sys.getsizeof(self.bot_response) + _TURN_OVERHEAD
+
+
+class ConversationBuffer:
+    """🔁 Последние обмены диалога, их нарастающий анализ, сводка старых и снимок контекста"""
+    __slots__ = ('turns', 'size', 'analysis', 'summary', 'context')
+
+    def __init__(self, window: int):
+        self.turns: deque = deque(maxlen=window)
+        self.size = _BUFFER_OVERHEAD
+        self.analysis = ConversationAnalysis()
+        self.summary = RollingSummary()
+        # Снимок контекста для AI; собирается из итогов при чтении после нового обмена
+        self.context: Optional[Dict[str, Any]] = None
+
+    def append(self, turn: Turn, features: Optional[MessageFeatures] = None) -> int:
+        """➕ Обмен в конец (самый старый выпадает в сводку); возвращает изменение размера"""
+        delta = turn.size
+        if len(self.turns) == self.turns.maxlen:
+            dropped = self.turns[0]
+            delta -= dropped.size
+            self.analysis.remove(dropped.user_message)
+            summary = self.summary
+            summary_size = summary.size
+            summary.fold(dropped.user_message)
+            delta += summary.size - summary_size
+        self.analysis.add(turn.user_message, features)
+        self.turns.append(turn)
+        self.size += delta
+        self.context = None
+        return delta
+
+    def as_memory(self) -> List[str]:
+        """📜 Обмены в формате контекста AI ("Пользователь: ...", "Бот: ...")"""
+        memory = []
+        for turn in self.turns:
+            memory.append(f"Пользователь: {turn.user_message}")
+            memory.append(f"Бот: {turn.bot_response}")
+        return memory
+
+
+class ConversationMemory:
+    """🔁 LRU кольцевых буферов с бюджетом памяти и записью в context_memory"""
+
+    def __init__(self, db_service=None, window: int = DEFAULT_WINDOW, max_bytes: int = DEFAULT_MAX_BYTES,
+                 summary_threshold: int = DEFAULT_SUMMARY_THRESHOLD, cleanup_days: float = DEFAULT_CLEANUP_DAYS):
+        self.db = db_service
+        self.window = window
+        self.max_bytes = max_bytes
+        # Пересказ AI - каждые summary_threshold свернутых сообщений
+        self.summary_threshold = summary_threshold
+        self.cleanup_days = cleanup_days
+
+        self._buffers: 'OrderedDict[Tuple[int, int], ConversationBuffer]' = OrderedDict()
+        self._size = 0
+        # Пары, которые сейчас поднимаются из БД (параллельные запросы ждут одну загрузку)
+        self._loading: Dict[Tuple[int, int], asyncio.Future] = {}
+
+        # Фоновый пересказ сводок: summarizer(text) -> новый текст или None
+        self._summarizer: Optional[Callable[[str], Awaitable[Optional[str]]]] = None
+        self._jobs: asyncio.Queue = asyncio.Queue(maxsize=MAX_SUMMARY_JOBS)
+        self._queued_jobs: Set[Tuple[int, int]] = set()
+        self._worker: Optional[asyncio.Task] = None
+        self._next_cleanup = 0.0
+
+        self.stats = {'hits': 0, 'loads': 0, 'added': 0, 'evicted': 0, 'folded': 0,
+                      'summaries_saved': 0, 'summaries_rewritten': 0, 'cleanups': 0}
+
+    def set_summarizer(self, summarizer: Callable[[str], Awaitable[Optional[str]]]):
+        """🔌 Пересказ сводок (например, через AI-провайдера): summarizer(text) -> text"""
+        self._summarizer = summarizer
+
+    # =================== ДОСТУП ===================
+
+    async def get(self, user_id: int, chat_id: int) -> ConversationBuffer:
+        """🔍 Буфер диалога (из LRU или из БД при первом обращении)"""
+
+        key = (user_id, chat_id)
+        buffer = self._buffers.get(key)
+        if buffer is not None:
+            self._buffers.move_to_end(key)
+            self.stats['hits'] += 1
+            return buffer
+
+        loading = self._loading.get(key)
+        if loading is not None:
+            # wait() не пробрасывает отмену чужой загрузки - только отмену нас самих
+            await asyncio.wait((loading,))
+            if loading.cancelled():
+                # Загружавшую задачу отменили - загружаем сами
+                return await self.get(user_id, chat_id)
+            buffer = loading.result()
+            # Пока ждали, буфер могли вытеснить - возвращаем его в LRU
+            if key not in self._buffers:
+                self._buffers[key] = buffer
+                self._size += buffer.size
+            return buffer
+
+        loading = self._loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            buffer = await self._load(user_id, chat_id)
+        except BaseException:
+            # Отмена (CancelledError не ловится в _load) - ожидающие не должны висеть
+            loading.cancel()
+            raise
+        finally:
+            del self._loading[key]
+
+        self._buffers[key] = buffer
+        self._size += buffer.size
+        self._evict(keep=key)
+        loading.set_result(buffer)
+        return buffer
+
+    async def _load(self, user_id: int, chat_id: int) -> ConversationBuffer:
+        """📥 Сводка и последние window обменов из context_memory (ошибка БД - пустой буфер)"""
+        buffer = ConversationBuffer(self.window)
+        self.stats['loads'] += 1
+        if not self.db or not hasattr(self.db, 'fetchall'):
+            return buffer
+
+        try:
+            rows = await self.db.fetchall(
+                "SELECT context_data, created_at FROM context_memory "
+                "WHERE user_id = ? AND chat_id = ? AND context_type = ? ORDER BY id DESC LIMIT ?",
+                (user_id, chat_id, CONTEXT_TYPE_TURN, self.window)
+            )
+            for row in reversed(rows):
+                data = json.loads(row['context_data'])
+                created = _parse_datetime(row['created_at'])
+                stamp = created.timestamp() if created else 0.0
+                buffer.append(Turn(data.get('user', ''), data.get('bot', ''), stamp))
+
+            row = await self.db.fetchone(
+                "SELECT context_data FROM context_memory "
+                "WHERE user_id = ? AND chat_id = ? AND context_type = ? ORDER BY id DESC LIMIT 1",
+                (user_id, chat_id, CONTEXT_TYPE_SUMMARY)
+            )
+            if row:
+                buffer.summary = RollingSummary.from_json(row['context_data'])
+                buffer.size += buffer.summary.size
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки памяти диалога {user_id}/{chat_id}: {e}")
+
+        return buffer
+
+    async def add(self, user_id: int, chat_id: int, user_message: str, bot_response: str,
+                  metadata: Optional[Dict[str, Any]] = None,
+                  features: Optional[MessageFeatures] = None) -> ConversationBuffer:
+        """➕ Новый обмен: в буфер сразу, в context_memory - через пакетный писатель"""
+
+        buffer = await self.get(user_id, chat_id)
+        summary = buffer.summary
+        folded = summary.folded
+        turn = Turn(user_message, bot_response, time.time())
+        self._size += buffer.append(turn, features)
+        self.stats['added'] += 1
+        self.stats['folded'] += summary.folded - folded
+
+        data = {'user': user_message, 'bot': bot_response}
+        if metadata:
+            data['metadata'] = metadata
+        self._write(_INSERT_TURN, (
+            user_id, chat_id, CONTEXT_TYPE_TURN, json.dumps(data, ensure_ascii=False),
+            datetime.fromtimestamp(turn.timestamp)
+        ))
+
+        # Сводка сохраняется раз в window свертываний (и при вытеснении) - тогда же удаляются свернутые обмены
+        if summary.folded - summary.persisted_folded >= self.window:
+            self._save_summary(user_id, chat_id, summary)
+        if self._summarizer and summary.folded - summary.abstract_folded >= self.summary_threshold:
+            self._queue_rewrite(user_id, chat_id, summary)
+        if turn.timestamp >= self._next_cleanup:
+            self.cleanup(turn.timestamp)
+
+        self._evict(keep=(user_id, chat_id))
+        return buffer
+
+    def clear(self, user_id: int, chat_id: int):
+        """🗑️ Забыть диалог (буфер и строки в БД)"""
+
+        buffer = self._buffers.pop((user_id, chat_id), None)
+        if buffer is not None:
+            self._size -= buffer.size
+        self._write(
+            "DELETE FROM context_memory WHERE user_id = ? AND chat_id = ? AND context_type IN (?, ?)",
+            (user_id, chat_id, CONTEXT_TYPE_TURN, CONTEXT_TYPE_SUMMARY)
+        )
+
+    # =================== СВОДКИ ===================
+
+    def _save_summary(self, user_id: int, chat_id: int, summary: RollingSummary):
+        """💾 Сводка - одной строкой; обмены старше окна удаляются (они уже в сводке)"""
+
+        self._write(
+            "DELETE FROM context_memory WHERE user_id = ? AND chat_id = ? AND context_type = ?",
+            (user_id, chat_id, CONTEXT_TYPE_SUMMARY)
+        )
+        self._write(_INSERT_TURN, (user_id, chat_id, CONTEXT_TYPE_SUMMARY, summary.to_json(), datetime.now()))
+        self._write(
+            "DELETE FROM context_memory WHERE user_id = ? AND chat_id = ? AND context_type = ? AND id < ("
+            "SELECT MIN(id) FROM (SELECT id FROM context_memory "
+            "WHERE user_id = ? AND chat_id = ? AND context_type = ? ORDER BY id DESC LIMIT ?))",
+            (user_id, chat_id, CONTEXT_TYPE_TURN, user_id, chat_id, CONTEXT_TYPE_TURN, self.window)
+        )
+        summary.persisted_folded = summary.folded
+        self.stats['summaries_saved'] += 1
+
+    def _flush_summary(self, key: Tuple[int, int], buffer: ConversationBuffer):
+        """💾 Несохраненные свертывания - в БД (иначе следующая запись сводки удалит их обмены)"""
+
+        if buffer.summary.folded > buffer.summary.persisted_folded:
+            self._save_summary(key[0], key[1], buffer.summary)
+
+    def cleanup(self, now: Optional[float] = None):
+        """🧹 Удаление диалогов, молчащих дольше cleanup_days (обмены и сводки)"""
+
+        now = time.time() if now is None else now
+        self._next_cleanup = now + CLEANUP_INTERVAL_SECONDS
+        if self.cleanup_days <= 0:
+            return
+        # Удаляется диалог целиком, только если в нем нет ни одной строки новее срока:
+        # у редко пишущего пользователя сводка и старые обмены живут, пока диалог жив
+        self._write(
+            "DELETE FROM context_memory WHERE context_type IN (?, ?) AND (user_id, chat_id) NOT IN ("
+            "SELECT user_id, chat_id FROM context_memory WHERE context_type IN (?, ?) AND created_at >= ?)",
+            (CONTEXT_TYPE_TURN, CONTEXT_TYPE_SUMMARY, CONTEXT_TYPE_TURN, CONTEXT_TYPE_SUMMARY,
+             datetime.fromtimestamp(now - self.cleanup_days * 86400))
+        )
+        self.stats['cleanups'] += 1
+
+    def _queue_rewrite(self, user_id: int, chat_id: int, summary: RollingSummary):
+        key = (user_id, chat_id)
+        if key in self._queued_jobs or self._jobs.full():
+            return
+        self._queued_jobs.add(key)
+        self._jobs.put_nowait((key, summary))
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run_rewrites())
+
+    async def _run_rewrites(self):
+        """🐢 Пересказ сводок по одной с паузами, чтобы не отнимать квоту у ответов"""
+
+        while True:
+            (user_id, chat_id), summary = await self._jobs.get()
+            try:
+                folded = summary.folded
+                text = await self._summarizer(summary.extractive_text())
+                self._apply_rewrite(user_id, chat_id, summary, folded, text)
+            except Exception as e:
+                logger.error(f"❌ Ошибка пересказа сводки {user_id}/{chat_id}: {e}")
+            finally:
+                self._queued_jobs.discard((user_id, chat_id))
+            await asyncio.sleep(SUMMARY_JOB_PAUSE)
+
+    def _apply_rewrite(self, user_id: int, chat_id: int, summary: RollingSummary, folded: int, text: Optional[str]):
+        buffer = self._buffers.get((user_id, chat_id))
+        if buffer is not None and buffer.summary is not summary:
+            # Диалог вытеснили и подняли заново - сводка в БД уже новее
+            return
+        # Пустой ответ (провайдер недоступен) - следующая попытка через summary_threshold сообщений
+        summary.abstract_folded = folded
+        if not text:
+            return
+
+        size = summary.size
+        summary.abstract = text.strip()[:MAX_SUMMARY_CHARS]
+        if buffer is not None:
+            buffer.size += summary.size - size
+            self._size += summary.size - size
+        self._save_summary(user_id, chat_id, summary)
+        self.stats['summaries_rewritten'] += 1
+
+    async def close(self):
+        """🔒 Сохранение сводок и остановка фонового пересказа (неотработанные задачи отбрасываются)"""
+
+        for key, buffer in self._buffers.items():
+            self._flush_summary(key, buffer)
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _write(self, query: str, params: tuple):
+        writer = getattr(self.db, 'writer', None)
+        if writer:
+            writer.enqueue(query, params)
+        elif self.db and hasattr(self.db, 'execute'):
+            asyncio.create_task(self.db.execute(query, params))
+
+    def _evict(self, keep: Tuple[int, int]):
+        """🧹 Вытеснение давно не использованных диалогов сверх бюджета"""
+
+        buffers = self._buffers
+        while self._size > self.max_bytes and len(buffers) > 1:
+            key, buffer = buffers.popitem(last=False)
+            if key == keep:
+                # Текущий диалог не вытесняется - возвращаем в конец
+                buffers[key] = buffer
+                continue
+            self._flush_summary(key, buffer)
+            self._size -= buffer.size
+            self.stats['evicted'] += 1
+
+    # =================== СТАТИСТИКА ===================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика буферов"""
+
+        return {
+            **self.stats,
+            'conversations': len(self._buffers),
+            'estimated_bytes': self._size,
+            'max_bytes': self.max_bytes,
+            'window': self.window,
+            'summary_jobs': self._jobs.qsize()
+        }
+
+
+__all__ = [
+    "ConversationMemory", "ConversationBuffer", "ConversationAnalysis", "RollingSummary", "Turn",
+    "extract_keywords", "context_around", "CONTEXT_TYPE_TURN", "CONTEXT_TYPE_SUMMARY"
+]
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+🌊 FLOOD DETECTOR v3.0
+⚡ Скользящее окно флуда за O(1)
+
+На каждую пару (чат, пользователь) - кольцевой буфер из threshold + 1
+последних отметок времени (список [позиция записи, t1, ..., tN] - в
+несколько раз компактнее deque). Флуд - когда самая старая отметка
+моложе window секунд, то есть больше threshold сообщений за окно.
+Пары хранятся в OrderedDict по давности активности: при переполнении
+вытесняются самые давние, простаивающие дольше idle секунд удаляются
+попутно с головы очереди. Порог и окно настраиваются для каждого чата.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+DEFAULT_WINDOW_SECONDS = 60
+DEFAULT_MAX_TRACKED = 50000
+DEFAULT_IDLE_SECONDS = 600
+
+# Сколько простаивающих пар удалять за одно сообщение (амортизированная очистка)
+_PURGE_PER_HIT = 4
+
+_EMPTY = float('-inf')
+
+
+def _new_ring(size: int) -> List[float]:
+    ring = [_EMPTY] * (size + 1)
+    ring[0] = 1
+    return ring
+
+
+def _last_stamp(ring: List[float]) -> float:
+    position = ring[0] - 1
+    return ring[position if position else len(ring) - 1]
+
+
+def _resize_ring(ring: List[float], size: int) -> List[float]:
+    """📐 Кольцо другой длины с сохранением последних отметок"""
+
+    position = ring[0]
+    stamps = [stamp for stamp in ring[position:] + ring[1:position] if stamp != _EMPTY][-size:]
+    resized = _new_ring(size)
+    for stamp in stamps:
+        _push(resized, stamp)
+    return resized
+
+
+def _push(ring: List[float], stamp: float) -> float:
+    """➕ Запись отметки, возвращает самую старую из оставшихся"""
+
+    position = ring[0]
+    ring[position] = stamp
+    position = position + 1 if position < len(ring) - 1 else 1
+    ring[0] = position
+    return ring[position]
+
+
+class FloodDetector:
+    """🌊 Детектор флуда по чатам"""
+
+    def __init__(self, threshold: int, window_seconds: float = DEFAULT_WINDOW_SECONDS,
+                 max_tracked: int = DEFAULT_MAX_TRACKED, idle_seconds: float = DEFAULT_IDLE_SECONDS):
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self.max_tracked = max_tracked
+        # Окно не может быть длиннее простоя, иначе пара удалится раньше срока
+        self.idle_seconds = max(idle_seconds, window_seconds)
+
+        self._windows: 'OrderedDict[Tuple[int, int], List[float]]' = OrderedDict()
+        self._chat_limits: Dict[int, Tuple[int, float]] = {}
+
+        self.stats = {'checks': 0, 'floods': 0, 'evicted': 0, 'expired': 0}
+
+    # =================== НАСТРОЙКИ ЧАТОВ ===================
+
+    def limits(self, chat_id: int) -> Tuple[int, float]:
+        """📏 (порог, окно в секундах) для чата"""
+
+        return self._chat_limits.get(chat_id, (self.threshold, self.window_seconds))
+
+    def set_chat_limits(self, chat_id: int, threshold: Optional[int] = None,
+                        window_seconds: Optional[float] = None):
+        """⚙️ Свой порог и окно для чата (None - значение по умолчанию)"""
+
+        current_threshold, current_window = self.limits(chat_id)
+        threshold = current_threshold if threshold is None else threshold
+        window_seconds = current_window if window_seconds is None else window_seconds
+
+        if (threshold, window_seconds) == (self.threshold, self.window_seconds):
+            self._chat_limits.pop(chat_id, None)
+        else:
+            self._chat_limits[chat_id] = (threshold, window_seconds)
+            self.idle_seconds = max(self.idle_seconds, window_seconds)
+
+    # =================== ПРОВЕРКА ===================
+
+    def hit(self, chat_id: int, user_id: int, now: Optional[float] = None) -> bool:
+        """🌊 Учет сообщения и проверка: больше порога сообщений за окно?"""
+
+        now = time.monotonic() if now is None else now
+        threshold, window_seconds = self.limits(chat_id)
+        self.stats['checks'] += 1
+
+        windows = self._windows
+        key = (chat_id, user_id)
+        ring = windows.get(key)
+
+        if ring is None:
+            ring = windows[key] = _new_ring(threshold + 1)
+        else:
+            windows.move_to_end(key)
+            if len(ring) != threshold + 2:
+                # Порог чата изменился - пересоздаем кольцо с новой длиной
+                ring = windows[key] = _resize_ring(ring, threshold + 1)
+
+        oldest = _push(ring, now)
+        self._evict(now)
+
+        if oldest > now - window_seconds:
+            self.stats['floods'] += 1
+            return True
+        return False
+
+    def _evict(self, now: float):
+        windows = self._windows
+
+        idle_before = now - self.idle_seconds
+        for _ in range(_PURGE_PER_HIT):
+            if not windows:
+                break
+            oldest_key, oldest_ring = next(iter(windows.items()))
+            if _last_stamp(oldest_ring) > idle_before:
+                break
+            del windows[oldest_key]
+            self.stats['expired'] += 1
+
+        while len(windows) > self.max_tracked:
+            windows.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def reset(self, chat_id: int, user_id: int):
+        """🔄 Забыть историю пользователя в чате"""
+
+        self._windows.pop((chat_id, user_id), None)
+
+    # =================== СТАТИСТИКА ===================
+
+    def memory_bytes(self) -> int:
+        """💾 Оценка памяти под окна (проход по всем парам - не для горячего пути)"""
+
+        total = sys.getsizeof(self._windows) + sys.getsizeof(self._chat_limits)
+        for key, ring in self._windows.items():
+            # Ключ-кортеж, список и float-отметки (int позиции кэшированы)
+            total += sys.getsizeof(key) + sys.getsizeof(ring) + 24 * (len(ring) - 1)
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика детектора"""
+
+        return {
+            **self.stats,
+            'tracked': len(self._windows),
+            'chat_overrides': len(self._chat_limits),
+            'memory_kb': round(self.memory_bytes() / 1024, 1)
+        }
+
+
+__all__ = ["FloodDetector"]
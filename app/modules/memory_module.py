@@ -3,67 +3,80 @@
 🧠 MEMORY MODULE v2.0
 💭 Модуль долгосрочной памяти диалогов
 
-Система запоминания контекста разговоров и предпочтений пользователей
+Система запоминания контекста разговоров и предпочтений пользователей.
+Последние обмены каждого диалога держатся в кольцевых буферах
+ConversationMemory (LRU с бюджетом памяти, запись в context_memory).
+Анализ диалога ведется нарастающим итогом при каждом обмене, контекст
+собирается из итогов без повторного разбора истории. Выпавшие из окна
+обмены сворачиваются в сводку, которую при AI_MEMORY_AI_SUMMARIES
+фоном пересказывает AI-провайдер.
 """
 
 import logging
 import asyncio
-import json
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, Any, List, Optional, Tuple
 
+from app.modules.conversation_memory import ConversationMemory, ConversationBuffer, ConversationAnalysis
+from app.modules.message_features import MessageFeatures, features_of
+
 logger = logging.getLogger(__name__)
 
 
 class MemoryModule:
     """🧠 Модуль памяти диалогов"""
     
-    def __init__(self, db_service):
+    def __init__(self, db_service, config=None, ai_service=None):
         self.db = db_service
+        self.ai = ai_service
+        ai_config = getattr(config, 'ai', None)
         
         # Настройки памяти
         self.memory_config = {
             'max_interactions_per_user': 50,
-            'context_window_messages': 10,
-            'summary_threshold': 20,
-            'cleanup_days': 30
+            'context_window_messages': getattr(ai_config, 'memory_window_messages', 10),
+            'summary_threshold': getattr(ai_config, 'memory_summary_threshold', 20),
+            'cleanup_days': getattr(ai_config, 'memory_cleanup_days', 30),
+            'cache_mb': getattr(ai_config, 'memory_cache_mb', 16),
+            'ai_summaries': getattr(ai_config, 'memory_ai_summaries', False)
         }
         
-        # Кэш контекста для быстрого доступа
-        self.context_cache = {}
+        # Кольцевые буферы диалогов в общем LRU (вместо бессрочного кэша контекстов)
+        self.conversations = ConversationMemory(
+            db_service,
+            window=self.memory_config['context_window_messages'],
+            max_bytes=int(self.memory_config['cache_mb'] * 1024 * 1024),
+            summary_threshold=self.memory_config['summary_threshold'],
+            cleanup_days=self.memory_config['cleanup_days']
+        )
+        if ai_service and self.memory_config['ai_summaries']:
+            self.conversations.set_summarizer(self._summarize_with_ai)
         
         logger.info("🧠 Memory Module инициализирован")
     
     async def add_interaction(self, user_id: int, chat_id: int, user_message: str, 
-                             bot_response: str, metadata: Dict = None) -> bool:
-        """💬 Добавление взаимодействия в память"""
+                             bot_response: str, metadata: Dict = None,
+                             features: Optional[MessageFeatures] = None) -> bool:
+        """💬 Добавление взаимодействия в память (features - признаки сообщения из апдейта)"""
         
         try:
+            features = features_of(user_message, features)
+            
             # Подготавливаем метаданные
             interaction_metadata = {
                 'timestamp': datetime.now().isoformat(),
                 'message_length': len(user_message),
                 'response_length': len(bot_response),
-                'has_entities': self._extract_entities(user_message),
-                'topic_keywords': self._extract_keywords(user_message),
+                'has_entities': self._extract_entities(user_message, features),
+                'topic_keywords': self._extract_keywords(user_message, features),
                 **(metadata or {})
             }
             
-            # Сохраняем в базу данных
-            success = await self.db.add_memory(
-                user_id, chat_id, user_message, bot_response,
-                json.dumps(interaction_metadata)
-            )
+            # В буфер диалога сразу, в БД - через пакетный писатель
+            await self.conversations.add(user_id, chat_id, user_message, bot_response, interaction_metadata, features)
             
-            if success:
-                # Очищаем кэш для этого пользователя
-                cache_key = f"{user_id}_{chat_id}"
-                if cache_key in self.context_cache:
-                    del self.context_cache[cache_key]
-                
-                logger.debug(f"💬 Взаимодействие добавлено в память пользователя {user_id}")
-            
-            return success
+            logger.debug(f"💬 Взаимодействие добавлено в память пользователя {user_id}")
+            return True
             
         except Exception as e:
             logger.error(f"❌ Ошибка добавления взаимодействия в память: {e}")
@@ -73,83 +86,43 @@ class MemoryModule:
         """🔍 Получение контекста диалога"""
         
         try:
-            cache_key = f"{user_id}_{chat_id}"
+            # Буфер диалога (при первом обращении поднимается из БД)
+            buffer = await self.conversations.get(user_id, chat_id)
             
-            # Проверяем кэш
-            if cache_key in self.context_cache:
-                cached_context = self.context_cache[cache_key]
-                # Проверяем свежесть кэша (15 минут)
-                cache_time = datetime.fromisoformat(cached_context.get('cached_at'))
-                if datetime.now() - cache_time < timedelta(minutes=15):
-                    return cached_context
-            
-            # Получаем память из БД
-            memory_items = await self.db.get_memory(
-                user_id, chat_id, self.memory_config['context_window_messages']
-            )
-            
-            if not memory_items:
+            if not buffer.turns:
                 return {'has_context': False}
             
-            # Анализируем контекст
-            context = await self._analyze_conversation_context(
-                user_id, chat_id, memory_items
-            )
-            
-            # Добавляем временную метку для кэша
-            context['cached_at'] = datetime.now().isoformat()
+            # Снимок собирается из нарастающих итогов и живет до следующего обмена
+            if buffer.context is None:
+                buffer.context = self._build_context(user_id, chat_id, buffer)
             
-            # Сохраняем в кэш
-            self.context_cache[cache_key] = context
-            
-            return context
+            return buffer.context
             
         except Exception as e:
             logger.error(f"❌ Ошибка получения контекста: {e}")
             return {'has_context': False, 'error': str(e)}
     
-    async def _analyze_conversation_context(self, user_id: int, chat_id: int, 
-                                          memory_items: List[str]) -> Dict[str, Any]:
-        """🔍 Анализ контекста диалога"""
+    def _build_context(self, user_id: int, chat_id: int, buffer: ConversationBuffer) -> Dict[str, Any]:
+        """🔍 Контекст диалога из нарастающих итогов буфера"""
         
+        memory_items = buffer.as_memory()
         try:
-            if not memory_items:
-                return {'has_context': False}
-            
-            # Разделяем сообщения на пользовательские и ботовские
-            user_messages = []
-            bot_messages = []
-            
-            for i, item in enumerate(memory_items):
-                if i % 2 == 0:  # Четные индексы - пользователь
-                    if item.startswith("Пользователь: "):
-                        user_messages.append(item[14:])  # Убираем префикс
-                else:  # Нечетные индексы - бот
-                    if item.startswith("Бот: "):
-                        bot_messages.append(item[5:])  # Убираем префикс
-            
-            # Анализируем темы и интересы
-            topics = self._extract_conversation_topics(user_messages)
-            preferences = self._extract_user_preferences(user_messages, bot_messages)
-            
-            # Определяем стиль общения
-            communication_style = self._analyze_communication_style(user_messages)
+            analysis = buffer.analysis
             
-            # Создаем сводку диалога
-            conversation_summary = self._generate_conversation_summary(
-                user_messages, bot_messages, topics
-            )
+            # Темы и интересы
+            topics = self._group_related_topics(analysis.top_keywords(10))
             
             context = {
                 'has_context': True,
                 'user_id': user_id,
                 'chat_id': chat_id,
                 'memory': memory_items,
-                'conversation_summary': conversation_summary,
+                'conversation_summary': self._generate_conversation_summary(analysis, topics),
+                'long_term_summary': buffer.summary.text() if buffer.summary.folded else '',
                 'main_topics': topics[:5],  # Топ-5 тем
-                'user_preferences': preferences,
-                'communication_style': communication_style,
-                'total_interactions': len(memory_items) // 2,
+                'user_preferences': analysis.preferences(),
+                'communication_style': analysis.communication_style(),
+                'total_interactions': len(buffer.turns) + buffer.summary.folded,
                 'analysis_timestamp': datetime.now().isoformat()
             }
             
@@ -163,102 +136,26 @@ class MemoryModule:
                 'error': 'Ошибка анализа контекста'
             }
     
-    def _extract_entities(self, text: str) -> Dict[str, List[str]]:
+    def _extract_entities(self, text: str, features: Optional[MessageFeatures] = None) -> Dict[str, List[str]]:
         """🔍 Извлечение сущностей из текста"""
         
         try:
-            entities = {
-                'urls': [],
-                'mentions': [],
-                'hashtags': [],
-                'numbers': [],
-                'dates': []
-            }
-            
-            words = text.split()
-            
-            for word in words:
-                # URLs
-                if word.startswith(('http://', 'https://', 'www.')):
-                    entities['urls'].append(word)
-                
-                # Mentions
-                elif word.startswith('@'):
-                    entities['mentions'].append(word)
-                
-                # Hashtags  
-                elif word.startswith('#'):
-                    entities['hashtags'].append(word)
-                
-                # Numbers
-                elif word.isdigit():
-                    entities['numbers'].append(word)
-            
-            return entities
+            return features_of(text, features).entities
             
         except Exception as e:
             logger.error(f"❌ Ошибка извлечения сущностей: {e}")
             return {}
     
-    def _extract_keywords(self, text: str) -> List[str]:
+    def _extract_keywords(self, text: str, features: Optional[MessageFeatures] = None) -> List[str]:
         """🔑 Извлечение ключевых слов"""
         
         try:
-            # Простое извлечение ключевых слов
-            # В продакшене здесь был бы более сложный NLP анализ
-            
-            stop_words = {
-                'и', 'в', 'на', 'с', 'по', 'для', 'от', 'до', 'из', 'к', 'о',
-                'что', 'это', 'как', 'но', 'а', 'да', 'нет', 'не', 'или', 'же'
-            }
-            
-            words = text.lower().split()
-            keywords = []
-            
-            for word in words:
-                # Убираем знаки препинания
-                clean_word = ''.join(c for c in word if c.isalnum())
-                
-                # Фильтруем стоп-слова и короткие слова
-                if (len(clean_word) > 2 and 
-                    clean_word not in stop_words and
-                    clean_word.isalpha()):
-                    keywords.append(clean_word)
-            
-            # Возвращаем уникальные ключевые слова
-            return list(set(keywords))[:10]  # Максимум 10 ключевых слов
+            return features_of(text, features).keywords
             
         except Exception as e:
             logger.error(f"❌ Ошибка извлечения ключевых слов: {e}")
             return []
     
-    def _extract_conversation_topics(self, user_messages: List[str]) -> List[str]:
-        """📝 Извлечение тем диалога"""
-        
-        try:
-            # Собираем все ключевые слова из сообщений пользователя
-            all_keywords = []
-            
-            for message in user_messages:
-                keywords = self._extract_keywords(message)
-                all_keywords.extend(keywords)
-            
-            # Подсчитываем частоту ключевых слов
-            from collections import Counter
-            keyword_counts = Counter(all_keywords)
-            
-            # Возвращаем самые популярные темы
-            topics = [word for word, count in keyword_counts.most_common(10)]
-            
-            # Группируем связанные темы
-            grouped_topics = self._group_related_topics(topics)
-            
-            return grouped_topics
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка извлечения тем диалога: {e}")
-            return []
-    
     def _group_related_topics(self, topics: List[str]) -> List[str]:
         """🔗 Группировка связанных тем"""
         
@@ -296,132 +193,17 @@ class MemoryModule:
             logger.error(f"❌ Ошибка группировки тем: {e}")
             return topics[:8]
     
-    def _extract_user_preferences(self, user_messages: List[str], 
-                                 bot_messages: List[str]) -> Dict[str, Any]:
-        """⭐ Извлечение предпочтений пользователя"""
-        
-        try:
-            preferences = {
-                'likes': [],
-                'dislikes': [],
-                'interests': [],
-                'communication_preferences': {
-                    'prefers_detailed_answers': False,
-                    'uses_emojis': False,
-                    'asks_follow_up_questions': False
-                }
-            }
-            
-            # Анализируем сообщения на предмет предпочтений
-            all_user_text = ' '.join(user_messages).lower()
-            
-            # Ищем позитивные маркеры
-            positive_markers = ['нравится', 'люблю', 'хорошо', 'отлично', 'супер', 'класс']
-            for marker in positive_markers:
-                if marker in all_user_text:
-                    # Извлекаем контекст вокруг маркера
-                    context = self._extract_context_around_word(all_user_text, marker)
-                    if context:
-                        preferences['likes'].append(context)
-            
-            # Ищем негативные маркеры
-            negative_markers = ['не нравится', 'плохо', 'ужасно', 'не люблю']
-            for marker in negative_markers:
-                if marker in all_user_text:
-                    context = self._extract_context_around_word(all_user_text, marker)
-                    if context:
-                        preferences['dislikes'].append(context)
-            
-            # Анализируем стиль общения
-            if len(all_user_text) / max(len(user_messages), 1) > 50:
-                preferences['communication_preferences']['prefers_detailed_answers'] = True
-            
-            if any('😊' in msg or '🙂' in msg or '👍' in msg for msg in user_messages):
-                preferences['communication_preferences']['uses_emojis'] = True
-            
-            if any('?' in msg for msg in user_messages):
-                preferences['communication_preferences']['asks_follow_up_questions'] = True
-            
-            return preferences
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка извлечения предпочтений: {e}")
-            return {}
-    
-    def _extract_context_around_word(self, text: str, word: str, window: int = 3) -> str:
-        """📍 Извлечение контекста вокруг слова"""
-        
-        try:
-            words = text.split()
-            
-            for i, w in enumerate(words):
-                if word in w:
-                    start = max(0, i - window)
-                    end = min(len(words), i + window + 1)
-                    context_words = words[start:end]
-                    return ' '.join(context_words)
-            
-            return ""
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка извлечения контекста: {e}")
-            return ""
-    
-    def _analyze_communication_style(self, user_messages: List[str]) -> Dict[str, Any]:
-        """🗣️ Анализ стиля общения"""
-        
-        try:
-            if not user_messages:
-                return {'style': 'unknown'}
-            
-            total_length = sum(len(msg) for msg in user_messages)
-            avg_length = total_length / len(user_messages)
-            
-            # Подсчитываем различные характеристики
-            question_count = sum(1 for msg in user_messages if '?' in msg)
-            exclamation_count = sum(1 for msg in user_messages if '!' in msg)
-            emoji_count = sum(1 for msg in user_messages if any(ord(char) > 127 for char in msg))
-            
-            style = {
-                'average_message_length': round(avg_length, 1),
-                'questions_ratio': round(question_count / len(user_messages), 2),
-                'exclamations_ratio': round(exclamation_count / len(user_messages), 2),
-                'uses_emojis': emoji_count > 0,
-                'style': 'neutral'
-            }
-            
-            # Определяем стиль
-            if avg_length > 100:
-                style['style'] = 'detailed'
-            elif avg_length < 20:
-                style['style'] = 'concise'
-            
-            if style['questions_ratio'] > 0.5:
-                style['style'] = 'inquisitive'
-            
-            if style['exclamations_ratio'] > 0.3:
-                style['style'] = 'enthusiastic'
-            
-            return style
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка анализа стиля общения: {e}")
-            return {'style': 'unknown'}
-    
-    def _generate_conversation_summary(self, user_messages: List[str], 
-                                     bot_messages: List[str], 
-                                     topics: List[str]) -> str:
+    def _generate_conversation_summary(self, analysis: ConversationAnalysis, topics: List[str]) -> str:
         """📝 Генерация сводки диалога"""
         
         try:
-            if not user_messages:
+            if not analysis.messages:
                 return "Нет истории диалога"
             
             summary_parts = []
             
             # Количество взаимодействий
-            interactions_count = len(user_messages)
-            summary_parts.append(f"Диалог из {interactions_count} сообщений")
+            summary_parts.append(f"Диалог из {analysis.messages} сообщений")
             
             # Основные темы
             if topics:
@@ -429,8 +211,7 @@ class MemoryModule:
                 summary_parts.append(f"Основные темы: {', '.join(main_topics)}")
             
             # Характер диалога
-            avg_user_length = sum(len(msg) for msg in user_messages) / len(user_messages)
-            if avg_user_length > 50:
+            if analysis.average_length > 50:
                 summary_parts.append("подробные обсуждения")
             else:
                 summary_parts.append("краткое общение")
@@ -441,17 +222,25 @@ class MemoryModule:
             logger.error(f"❌ Ошибка генерации сводки диалога: {e}")
             return "Активный диалог с пользователем"
     
+    async def _summarize_with_ai(self, text: str) -> Optional[str]:
+        """🧠 Пересказ сводки диалога через AI (None - провайдер не ответил)"""
+        
+        # Выжимка - в начале: ключ кэша AIService строится по началу промпта
+        prompt = (
+            f"{text}\n\nПерескажи в 2-3 предложениях, о чем пользователь говорил раньше: "
+            "факты о нем, интересы, просьбы. Без вступлений."
+        )
+        response = await self.ai.generate_response(prompt)
+        if not response or response.startswith('❌'):
+            return None
+        return response
+    
     async def clear_user_memory(self, user_id: int, chat_id: int) -> bool:
         """🗑️ Очистка памяти пользователя"""
         
         try:
-            # В реальной реализации здесь был бы SQL запрос DELETE
-            # Для демонстрации возвращаем True
-            
-            # Очищаем кэш
-            cache_key = f"{user_id}_{chat_id}"
-            if cache_key in self.context_cache:
-                del self.context_cache[cache_key]
+            # Буфер и строки context_memory
+            self.conversations.clear(user_id, chat_id)
             
             logger.info(f"🗑️ Память пользователя {user_id} в чате {chat_id} очищена")
             return True
@@ -488,11 +277,15 @@ class MemoryModule:
                 'error': str(e)
             }
     
+    async def close(self):
+        """🔒 Остановка фонового пересказа сводок"""
+        await self.conversations.close()
+    
     def get_module_stats(self) -> Dict[str, Any]:
         """📊 Статистика модуля"""
         
         return {
-            'cached_contexts': len(self.context_cache),
+            'conversations': self.conversations.get_stats(),
             'config': self.memory_config,
             'module_status': 'active'
         }
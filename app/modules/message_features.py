@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+🧬 MESSAGE FEATURES v3.0
+⚡ Признаки сообщения за один проход - общие для всех модулей
+
+Раньше каждое сообщение разбирали по отдельности: BehaviorModule
+(настроение, стиль, ключевые слова, сложность), MemoryModule (ключевые
+слова и сущности), ModerationModule (нормализация для словарей) и
+проверка "отвечать ли боту" - около десятка lower()/split() и проходов
+подстрокой, каждый со своими списками стоп-слов.
+
+MessageFeatures считается один раз на апдейт (MessageFeaturesMiddleware
+кладет его в данные обработчика под именем features):
+• один lower() и одно разбиение на слова; из этих слов берутся
+  ключевые слова, сущности и длины слов;
+• один проход по объединенному словарю (настроение, стили общения,
+  призыв бота, вопросительные слова, маркеры предпочтений): каждое
+  слово, даже если оно есть в нескольких словарях, ищется один раз
+  подстрокой в общем lower() - как прежние `word in message.lower()`.
+  Для коротких сообщений чата поиск подстроки в C быстрее автомата
+  Ахо-Корасик на Python;
+• нормализация для словарей модерации (content_scanner.normalize)
+  считается при первом обращении и тоже один раз.
+Модули принимают features необязательным аргументом и без него строят
+признаки сами, поэтому старые вызовы работают как прежде.
+"""
+
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+from app.modules.content_scanner import normalize
+
+# Ключевые слова сообщения: без стоп-слов, короче 3 букв - не слово
+STOP_WORDS = frozenset({
+    'и', 'в', 'на', 'с', 'по', 'для', 'от', 'до', 'из', 'к', 'о',
+    'что', 'это', 'как', 'но', 'а', 'да', 'нет', 'не', 'или', 'же'
+})
+MAX_KEYWORDS_PER_MESSAGE = 10
+
+PREFERENCE_EMOJIS = ('😊', '🙂', '👍')
+
+URL_PREFIXES = ('http://', 'https://', 'www.')
+_ENTITY_STARTS = frozenset('@#hw0123456789')
+
+# Словари (подстрока нижнего регистра)
+LEXICON_POSITIVE = 'positive'
+LEXICON_NEGATIVE = 'negative'
+LEXICON_FORMAL = 'formal'
+LEXICON_CASUAL = 'casual'
+LEXICON_TECHNICAL = 'technical'
+LEXICON_EMOTIONAL = 'emotional'
+LEXICON_SUMMON = 'summon'
+LEXICON_QUESTION = 'question'
+LEXICON_LIKES = 'likes'
+LEXICON_DISLIKES = 'dislikes'
+
+# Стили общения в порядке приоритета при равном счете
+STYLE_LEXICONS = (LEXICON_FORMAL, LEXICON_CASUAL, LEXICON_TECHNICAL, LEXICON_EMOTIONAL)
+
+LEXICONS: Dict[str, tuple] = {
+    LEXICON_POSITIVE: ('хорошо', 'отлично', 'супер', 'класс', 'спасибо', 'радуюсь'),
+    LEXICON_NEGATIVE: ('плохо', 'ужасно', 'проблема', 'ошибка', 'не работает'),
+    LEXICON_FORMAL: ('пожалуйста', 'благодарю', 'извините', 'могли бы'),
+    LEXICON_CASUAL: ('привет', 'пока', 'круто', 'ок'),
+    LEXICON_TECHNICAL: ('функция', 'алгоритм', 'код', 'программа'),
+    LEXICON_EMOTIONAL: ('чувствую', 'переживаю', 'волнуюсь', 'радуюсь'),
+    LEXICON_SUMMON: ('бот', 'bot', 'робот', 'помощник', 'assistant'),
+    LEXICON_QUESTION: ('что', 'как', 'когда', 'где', 'почему', 'зачем', 'кто'),
+    # Маркеры предпочтений для памяти диалога
+    LEXICON_LIKES: ('нравится', 'люблю', 'хорошо', 'отлично', 'супер', 'класс'),
+    LEXICON_DISLIKES: ('не нравится', 'плохо', 'ужасно', 'не люблю'),
+}
+
+
+def _merge_lexicons(lexicons: Dict[str, Iterable[str]]) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    """📚 (слово, его словари) без повторов слов, в порядке словарей"""
+
+    merged: Dict[str, List[str]] = {}
+    for category, words in lexicons.items():
+        for word in words:
+            merged.setdefault(word, []).append(category)
+    return tuple((word, tuple(categories)) for word, categories in merged.items())
+
+
+_LEXICON_WORDS = _merge_lexicons(LEXICONS)
+
+
+def keywords_from_words(words: Iterable[str]) -> List[str]:
+    """🔑 Ключевые слова из слов нижнего регистра (уникальные, по порядку, не больше 10)"""
+
+    keywords = []
+    seen = set()
+    for word in words:
+        # Убираем знаки препинания (большинство слов и так без них)
+        clean_word = word if word.isalnum() else ''.join(c for c in word if c.isalnum())
+        if (len(clean_word) > 2 and clean_word not in STOP_WORDS and
+                clean_word.isalpha() and clean_word not in seen):
+            seen.add(clean_word)
+            keywords.append(clean_word)
+            if len(keywords) == MAX_KEYWORDS_PER_MESSAGE:
+                break
+    return keywords
+
+
+def extract_keywords(text: str) -> List[str]:
+    """🔑 Ключевые слова сообщения (уникальные, в порядке появления, не больше 10)"""
+    return keywords_from_words(text.lower().split())
+
+
+class MessageFeatures:
+    """🧬 Признаки одного сообщения (считаются один раз на апдейт)"""
+
+    __slots__ = ('text', 'lower', 'words', 'length', 'word_count', 'avg_word_length',
+                 'has_question', 'has_exclamation', 'non_ascii', 'has_emoji',
+                 'keywords', 'entities', 'lexicon', '_normalized')
+
+    def __init__(self, text: str):
+        text = text or ''
+        self.text = text
+        self.lower = lower = text.lower()
+        self.words = words = lower.split()
+
+        self.length = len(text)
+        self.word_count = len(words)
+        self.has_question = '?' in text
+        self.has_exclamation = '!' in text
+        self.non_ascii = not text.isascii()
+        self.has_emoji = self.non_ascii and any(emoji in text for emoji in PREFERENCE_EMOJIS)
+
+        self.avg_word_length = sum(map(len, words)) / max(len(words), 1)
+        self.keywords = keywords_from_words(words)
+
+        # Сущности редки: по первой букве отбираются кандидаты, значения - потом
+        entity_indexes = [
+            index for index, word in enumerate(words)
+            if word[0] in _ENTITY_STARTS and (
+                word[0] in '@#' or word.isdigit() or word.startswith(URL_PREFIXES)
+            )
+        ]
+        self.entities = self._entities(entity_indexes)
+
+        # Словарь -> найденные слова (в порядке словаря)
+        lexicon: Dict[str, List[str]] = {}
+        for word, categories in _LEXICON_WORDS:
+            if word in lower:
+                for category in categories:
+                    found = lexicon.get(category)
+                    if found is None:
+                        lexicon[category] = [word]
+                    else:
+                        found.append(word)
+        self.lexicon = lexicon
+
+        self._normalized: Optional[str] = None
+
+    def _entities(self, indexes: List[int]) -> Dict[str, List[str]]:
+        entities = {'urls': [], 'mentions': [], 'hashtags': [], 'numbers': [], 'dates': []}
+        if not indexes:
+            return entities
+
+        # Значения - в исходном регистре (lower() не меняет границы слов)
+        original = self.text.split()
+        for index in indexes:
+            word = original[index]
+            lowered = self.words[index]
+            if lowered.startswith(URL_PREFIXES):
+                entities['urls'].append(word)
+            elif word.startswith('@'):
+                entities['mentions'].append(word)
+            elif word.startswith('#'):
+                entities['hashtags'].append(word)
+            elif word.isdigit():
+                entities['numbers'].append(word)
+        return entities
+
+    # =================== ДОСТУП ===================
+
+    @property
+    def normalized(self) -> str:
+        """🔤 Текст в виде словарей модерации (считается при первом обращении)"""
+        if self._normalized is None:
+            self._normalized = normalize(self.text)
+        return self._normalized
+
+    def hits(self, category: str) -> List[str]:
+        """📚 Слова словаря, найденные в сообщении"""
+        return self.lexicon.get(category, [])
+
+    def count(self, category: str) -> int:
+        """🔢 Сколько разных слов словаря в сообщении"""
+        return len(self.lexicon.get(category, ()))
+
+    def contains(self, word: str) -> bool:
+        """🔍 Подстрока в нижнем регистре (для слов вне словарей)"""
+        return word in self.lower
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'length': self.length,
+            'word_count': self.word_count,
+            'has_question': self.has_question,
+            'has_exclamation': self.has_exclamation,
+            'has_emoji': self.has_emoji,
+            'keywords': self.keywords,
+            'entities': self.entities,
+            'lexicon': self.lexicon
+        }
+
+
+def features_of(text: str, features: Optional[MessageFeatures] = None) -> MessageFeatures:
+    """🧬 Готовые признаки апдейта или новые для текста"""
+    if features is not None and features.text == text:
+        return features
+    return MessageFeatures(text)
+
+
+__all__ = [
+    "MessageFeatures", "features_of", "extract_keywords", "keywords_from_words",
+    "STOP_WORDS", "MAX_KEYWORDS_PER_MESSAGE", "PREFERENCE_EMOJIS", "LEXICONS", "STYLE_LEXICONS",
+    "LEXICON_POSITIVE", "LEXICON_NEGATIVE", "LEXICON_FORMAL", "LEXICON_CASUAL", "LEXICON_TECHNICAL",
+    "LEXICON_EMOTIONAL", "LEXICON_SUMMON", "LEXICON_QUESTION", "LEXICON_LIKES", "LEXICON_DISLIKES"
+]
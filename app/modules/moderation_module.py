@@ -4,10 +4,28 @@
 Модуль автоматической модерации и контроля
 """
 
+import json
 import logging
-from typing import Dict, Any, List
+from functools import partial
+from typing import Dict, Any, List, Optional, Callable, Awaitable
 from datetime import datetime, timedelta
-import re
+
+from app.modules.flood_detector import FloodDetector
+from app.modules.content_scanner import ContentScanner, CATEGORY_BANNED, DEFAULT_BANNED_WORDS, DEFAULT_TOXIC_WORDS
+from app.modules.spam_waves import SpamWaveDetector
+from app.modules.raid_guard import RaidGuard
+from app.modules.message_features import MessageFeatures
+from app.services.moderation_executor import ModerationExecutor
+from app.services.warning_store import WarningStore, ACTION_WARN, ACTION_MUTE, ACTION_BAN, AUTO_ADMIN_ID
+
+# Действия apply_action (совпадают с видами вызовов BotEnforcer)
+ACTION_KICK = 'kick'
+ACTION_UNBAN = 'unban'
+ACTION_UNMUTE = 'unmute'
+ACTION_DELETE = 'delete'
+
+# Действия, которые пишутся в таблицы модерации (delete - только вызов Bot API)
+RECORDED_ACTIONS = (ACTION_WARN, ACTION_MUTE, ACTION_BAN, ACTION_KICK, ACTION_UNBAN, ACTION_UNMUTE)
 
 logger = logging.getLogger(__name__)
 
@@ -19,42 +37,86 @@ class ModerationModule:
         self.db = db_service
         self.config = config
         
-        # Словарь запрещенных слов
-        self.banned_words = [
-            'спам', 'реклама', 'мошенник', 'обман'
-        ]
+        # Словарь запрещенных слов ("слово*" - основа с любыми окончаниями)
+        self.banned_words = list(DEFAULT_BANNED_WORDS)
+        
+        # Запрещенные слова, токсичность и спам-правила - за один проход
+        self.scanner = ContentScanner(self.banned_words, DEFAULT_TOXIC_WORDS)
         
-        # Паттерны спама
-        self.spam_patterns = [
-            r'(https?://\S+){3,}',  # Множественные ссылки
-            r'(.)\1{10,}',  # Повторяющиеся символы
-            r'[A-Z]{20,}'   # Много заглавных букв
-        ]
+        # Предупреждения по (чат, пользователь): кэш БД, без COUNT-запросов
+        moderation_config = config.moderation
+        self.warnings = getattr(db_service, 'warning_store', None) or WarningStore(db_service)
+        self.warnings.configure(
+            max_warnings=moderation_config.max_warnings,
+            decay_hours=getattr(moderation_config, 'warning_decay_hours', 72),
+            ban_for_excessive_warnings=moderation_config.ban_for_excessive_warnings
+        )
         
-        # Счетчики для пользователей
-        self.user_warnings = {}
-        self.flood_protection = {}
+        # Флуд: скользящее окно на (чат, пользователь), пороги по чатам
+        self.flood = FloodDetector(
+            threshold=moderation_config.flood_threshold,
+            window_seconds=getattr(moderation_config, 'flood_window_seconds', 60),
+            max_tracked=getattr(moderation_config, 'flood_max_tracked', 50000),
+            idle_seconds=getattr(moderation_config, 'flood_idle_seconds', 600)
+        )
+        
+        # Спам-волны: почти одинаковые сообщения сразу во многих чатах
+        self.spam_waves = SpamWaveDetector(
+            max_chats=getattr(moderation_config, 'spam_wave_chats', 3),
+            max_users=getattr(moderation_config, 'spam_wave_users', 5),
+            window_minutes=getattr(moderation_config, 'spam_wave_window_minutes', 10),
+            max_entries=getattr(moderation_config, 'spam_wave_max_entries', 20000)
+        )
+        
+        # Рейды: окна входов и первых сообщений по чатам, локдаун через очередь вызовов
+        self.executor = ModerationExecutor(getattr(moderation_config, 'api_calls_per_second', 20))
+        self.raid = RaidGuard(
+            self.executor,
+            join_threshold=getattr(moderation_config, 'raid_join_threshold', 10),
+            message_threshold=getattr(moderation_config, 'raid_message_threshold', 10),
+            window_seconds=getattr(moderation_config, 'raid_window_seconds', 60),
+            lockdown_minutes=getattr(moderation_config, 'raid_lockdown_minutes', 15),
+            new_member_minutes=getattr(moderation_config, 'raid_new_member_minutes', 10),
+            ban_offenders=getattr(moderation_config, 'raid_ban_offenders', True)
+        )
+        self.raid_protection = getattr(moderation_config, 'raid_protection', True)
+        
+        # Вызовы Bot API: enforcer(kind, chat_id, user_id, until, message_id)
+        self._enforcer: Optional[Callable[..., Awaitable[Any]]] = None
         
         logger.info("🛡️ Moderation Module инициализирован")
     
-    async def check_message(self, user_id: int, chat_id: int, message: str) -> Dict[str, Any]:
-        """🔍 Проверка сообщения"""
+    async def check_message(self, user_id: int, chat_id: int, message: str,
+                            features: Optional[MessageFeatures] = None) -> Dict[str, Any]:
+        """🔍 Проверка сообщения (features - признаки из апдейта: нормализация не повторяется)"""
         
         try:
+            normalized = features.normalized if features is not None and features.text == message else None
+            scan = self.scanner.scan(message, chat_id, normalized)
             checks = {
-                'is_spam': self._check_spam(message),
-                'has_banned_words': self._check_banned_words(message),
-                'is_flood': self._check_flood(user_id),
-                'toxicity_level': self._check_toxicity(message)
+                'is_raid': self.check_raid_message(user_id, chat_id),
+                'is_spam': scan.is_spam,
+                'has_banned_words': bool(scan.banned_words),
+                'is_flood': self._check_flood(user_id, chat_id),
+                'is_spam_wave': self._check_spam_wave(user_id, chat_id, message, scan.normalized),
+                'toxicity_level': scan.toxicity,
+                'spam_reason': scan.spam_reason,
+                'categories': scan.to_dict()['categories']
             }
             
             # Определяем действие
             action = 'allow'
             reason = ''
             
-            if checks['is_spam']:
+            if checks['is_raid']:
+                action = 'delete'
+                reason = 'Рейд'
+            elif checks['is_spam']:
                 action = 'delete'
                 reason = 'Спам'
+            elif checks['is_spam_wave']:
+                action = 'delete'
+                reason = 'Спам-волна'
             elif checks['has_banned_words']:
                 action = 'warn'
                 reason = 'Запрещенные слова'
@@ -65,110 +127,268 @@ class ModerationModule:
                 action = 'warn'
                 reason = 'Токсичность'
             
-            # Записываем действие
-            if action != 'allow':
-                await self._log_moderation_action(user_id, chat_id, action, reason)
+            # Предупреждение засчитывается и может перейти в мут или бан
+            # (записи и вызовы Bot API - внутри apply_action)
+            warnings_count = self.warnings.count(chat_id, user_id)
+            until = None
+            if action == ACTION_WARN:
+                applied = await self.apply_action(ACTION_WARN, chat_id, user_id, reason=reason)
+                action, until, warnings_count = applied['action'], applied['until'], applied['user_warnings']
+            elif action != 'allow':
+                self._log_moderation_action(user_id, chat_id, action, reason)
             
             return {
                 'action': action,
                 'reason': reason,
                 'checks': checks,
-                'user_warnings': self.user_warnings.get(user_id, 0)
+                'user_warnings': warnings_count,
+                'until': until
             }
             
         except Exception as e:
             logger.error(f"❌ Ошибка проверки сообщения: {e}")
             return {'action': 'allow', 'error': str(e)}
     
-    def _check_spam(self, message: str) -> bool:
-        """📧 Проверка на спам"""
+    def set_enforcer(self, enforcer: Callable[..., Awaitable[Any]]):
+        """🔌 Вызовы Bot API: enforcer(kind, chat_id, user_id, until, message_id) - и для рейдов"""
+        self._enforcer = enforcer
+        self.raid.set_enforcer(enforcer)
+    
+    async def apply_action(self, action: str, chat_id: int, user_id: Optional[int] = None,
+                           admin_id: int = AUTO_ADMIN_ID, reason: str = '',
+                           duration: Optional[timedelta] = None,
+                           message_id: Optional[int] = None) -> Dict[str, Any]:
+        """⚖️ Действие модерации: запись в БД пакетом, вызов Bot API через очередь
         
+        duration - срок мута (по умолчанию из конфига) или бана (без срока - навсегда).
+        Предупреждение сверх лимита само переходит в мут или бан.
+        """
+        
+        result = {'action': action, 'until': None, 'user_warnings': 0, 'success': True}
         try:
-            for pattern in self.spam_patterns:
-                if re.search(pattern, message):
-                    return True
-            return False
+            until = datetime.now() + duration if duration else None
+            action_data: Dict[str, Any] = {}
+            if action == ACTION_MUTE:
+                until = until or datetime.now() + timedelta(minutes=self.config.moderation.mute_duration_minutes)
+                action_data = {'mute_until': until}
+            elif action == ACTION_BAN:
+                action_data = {'ban_type': 'temporary' if until else 'permanent', 'expires_at': until}
+            elif action == ACTION_WARN:
+                action_data = {'severity_level': 1}
+            result['until'] = until
+            
+            if action in RECORDED_ACTIONS:
+                await self._record_action(action, chat_id, user_id, admin_id, reason, action_data)
+            
+            if action == ACTION_WARN:
+                warnings_count = self.warnings.count(chat_id, user_id)
+                escalation = self.warnings.escalation(warnings_count)
+                if escalation != ACTION_WARN:
+                    until = await self.escalate(user_id, chat_id, escalation, reason, warnings_count)
+                    result.update(action=escalation, until=until)
+                result['user_warnings'] = warnings_count
+                return result
+            
+            self._submit(action, chat_id, user_id, until, message_id)
+            return result
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка действия модерации {action}: {e}")
+            return {**result, 'success': False, 'error': str(e)}
+    
+    async def escalate(self, user_id: int, chat_id: int, action: str, reason: str,
+                       warnings_count: int) -> Optional[datetime]:
+        """📈 Мут или временный бан за предупреждения (срок снимет планировщик)"""
+        
+        duration = None
+        if action == ACTION_BAN:
+            duration = timedelta(hours=self.config.moderation.ban_duration_hours)
+        
+        result = await self.apply_action(
+            action, chat_id, user_id, reason=f"{reason} (предупреждений: {warnings_count})", duration=duration
+        )
+        
+        logger.info(f"📈 Эскалация: {action} для {user_id} в {chat_id} после {warnings_count} предупреждений")
+        return result['until']
+    
+    async def _record_action(self, action: str, chat_id: int, user_id: int, admin_id: int,
+                             reason: str, action_data: Dict[str, Any]):
+        """💾 Строки действия (таблица действия и moderation_log) - в пакетный писатель"""
+        
+        if self.db and hasattr(self.db, 'add_moderation_action'):
+            await self.db.add_moderation_action({
+                'action': action,
+                'user_id': user_id,
+                'chat_id': chat_id,
+                'admin_id': admin_id,
+                'reason': reason,
+                'auto_generated': admin_id == AUTO_ADMIN_ID,
+                **action_data
+            })
+            # add_moderation_action обновляет только кэш самой БД
+            if action == ACTION_WARN and getattr(self.db, 'warning_store', None) is not self.warnings:
+                self.warnings.add(chat_id, user_id, admin_id, reason, persist=False)
+        elif action == ACTION_WARN:
+            # БД без действий модерации - строку пишет сам кэш
+            self.warnings.add(chat_id, user_id, admin_id, reason)
+    
+    def _submit(self, kind: str, chat_id: int, user_id: Optional[int] = None,
+                until: Optional[datetime] = None, message_id: Optional[int] = None):
+        """🚦 Вызов Bot API в очередь чата (порядок действий в чате сохраняется)"""
+        
+        if not self._enforcer:
+            logger.warning(f"⚠️ Нет enforcer, {kind} для {user_id} в {chat_id} только записан")
+            return
+        call = partial(self._enforcer, kind, chat_id, user_id, until, message_id)
+        self.executor.submit(chat_id, call, f"{kind} {user_id or message_id or ''}".strip())
+    
+    def on_member_joined(self, chat_id: int, user_id: int) -> bool:
+        """👋 Вход участника; True - чат в локдауне и участник ограничен"""
+        
+        try:
+            return self.raid_protection and self.raid.on_join(chat_id, user_id)
             
         except Exception as e:
-            logger.error(f"❌ Ошибка проверки спама: {e}")
+            logger.error(f"❌ Ошибка учета входа участника: {e}")
             return False
     
-    def _check_banned_words(self, message: str) -> bool:
-        """🚫 Проверка запрещенных слов"""
+    def check_raid_message(self, user_id: int, chat_id: int) -> bool:
+        """🚨 Первое сообщение новичка во время рейда (удалить)"""
         
-        message_lower = message.lower()
-        return any(word in message_lower for word in self.banned_words)
+        try:
+            return self.raid_protection and self.raid.on_message(chat_id, user_id)
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки рейда: {e}")
+            return False
     
-    def _check_flood(self, user_id: int) -> bool:
+    def _check_flood(self, user_id: int, chat_id: int) -> bool:
         """🌊 Проверка флуда"""
         
         try:
-            current_time = datetime.now()
+            return self.flood.hit(chat_id, user_id)
             
-            if user_id not in self.flood_protection:
-                self.flood_protection[user_id] = []
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки флуда: {e}")
+            return False
+    
+    def _check_spam_wave(self, user_id: int, chat_id: int, message: str,
+                         normalized: Optional[str] = None) -> bool:
+        """🌐 Проверка спам-волны по всем чатам"""
+        
+        try:
+            return self.spam_waves.check(message, chat_id, user_id, normalized=normalized)
             
-            # Добавляем текущее время
-            self.flood_protection[user_id].append(current_time)
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки спам-волны: {e}")
+            return False
+    
+    async def load_chat_settings(self):
+        """📥 Пороги флуда и запрещенные слова чатов из moderation_settings"""
+        
+        if not self.db or not hasattr(self.db, 'fetchall'):
+            return
+        
+        try:
+            rows = await self.db.fetchall(
+                "SELECT chat_id, setting_key, setting_value FROM moderation_settings "
+                "WHERE setting_key IN ('flood_threshold', 'flood_window_seconds', 'banned_words') "
+                "AND chat_id IS NOT NULL"
+            )
             
-            # Оставляем только последние сообщения за минуту
-            minute_ago = current_time - timedelta(minutes=1)
-            self.flood_protection[user_id] = [
-                t for t in self.flood_protection[user_id] 
-                if t > minute_ago
-            ]
+            for row in rows:
+                if row['setting_key'] == 'flood_threshold':
+                    self.flood.set_chat_limits(row['chat_id'], threshold=int(row['setting_value']))
+                elif row['setting_key'] == 'flood_window_seconds':
+                    self.flood.set_chat_limits(row['chat_id'], window_seconds=float(row['setting_value']))
+                else:
+                    self.scanner.set_chat_words(row['chat_id'], CATEGORY_BANNED, json.loads(row['setting_value']))
             
-            # Проверяем количество сообщений
-            return len(self.flood_protection[user_id]) > self.config.moderation.flood_threshold
+            logger.info(f"🌊 Загружены настройки модерации для {len(rows)} параметров чатов")
             
         except Exception as e:
-            logger.error(f"❌ Ошибка проверки флуда: {e}")
-            return False
+            logger.error(f"❌ Ошибка загрузки настроек модерации чатов: {e}")
     
-    def _check_toxicity(self, message: str) -> float:
-        """☠️ Проверка токсичности"""
+    async def set_chat_flood_limits(self, chat_id: int, threshold: Optional[int] = None,
+                                    window_seconds: Optional[int] = None, admin_id: int = 0) -> bool:
+        """⚙️ Порог флуда для чата (сохраняется в moderation_settings)"""
         
         try:
-            # Простая проверка токсичности
-            toxic_words = ['дурак', 'идиот', 'тупой', 'глупый']
-            toxic_count = sum(1 for word in toxic_words if word in message.lower())
+            self.flood.set_chat_limits(chat_id, threshold, window_seconds)
             
-            # Нормализуем от 0 до 1
-            return min(1.0, toxic_count / 3)
+            if self.db and hasattr(self.db, 'execute'):
+                for key, value in (('flood_threshold', threshold), ('flood_window_seconds', window_seconds)):
+                    if value is None:
+                        continue
+                    await self.db.execute(
+                        "INSERT OR REPLACE INTO moderation_settings "
+                        "(chat_id, setting_key, setting_value, updated_by, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (chat_id, key, str(value), admin_id, datetime.now())
+                    )
+            return True
             
         except Exception as e:
-            logger.error(f"❌ Ошибка проверки токсичности: {e}")
-            return 0.0
+            logger.error(f"❌ Ошибка сохранения настроек флуда: {e}")
+            return False
     
-    async def _log_moderation_action(self, user_id: int, chat_id: int, action: str, reason: str):
-        """📝 Логирование действий модерации"""
+    async def set_chat_banned_words(self, chat_id: int, words: List[str], admin_id: int = 0) -> bool:
+        """🚫 Свои запрещенные слова чата (дополняют общий список; "слово*" - префикс)"""
         
         try:
-            # Сохраняем в БД
-            await self.db.track_event(
-                user_id, chat_id, 'moderation_action',
-                {'action': action, 'reason': reason}
-            )
+            self.scanner.set_chat_words(chat_id, CATEGORY_BANNED, words)
             
-            # Увеличиваем счетчик предупреждений
-            if action == 'warn':
-                self.user_warnings[user_id] = self.user_warnings.get(user_id, 0) + 1
+            if self.db and hasattr(self.db, 'execute'):
+                await self.db.execute(
+                    "INSERT OR REPLACE INTO moderation_settings "
+                    "(chat_id, setting_key, setting_value, updated_by, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, 'banned_words', json.dumps(list(words), ensure_ascii=False),
+                     admin_id, datetime.now())
+                )
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения запрещенных слов чата: {e}")
+            return False
+    
+    def get_flood_stats(self) -> Dict[str, Any]:
+        """📊 Статистика детектора флуда (включая память)"""
+        return self.flood.get_stats()
+    
+    def get_spam_wave_stats(self) -> Dict[str, Any]:
+        """📊 Статистика индекса спам-волн"""
+        return self.spam_waves.get_stats()
+    
+    def get_raid_stats(self) -> Dict[str, Any]:
+        """📊 Статистика рейдов и очереди вызовов модерации"""
+        return {**self.raid.get_stats(), 'executor': self.executor.get_stats()}
+    
+    async def close(self):
+        """🔒 Выполнение оставшихся вызовов модерации"""
+        await self.executor.close()
+    
+    def _log_moderation_action(self, user_id: int, chat_id: int, action: str, reason: str):
+        """📝 Логирование автоматических действий (удаление, таймаут) в moderation_log"""
+        
+        try:
+            if self.db and hasattr(self.db, 'log_moderation_action'):
+                self.db.log_moderation_action(user_id, chat_id, AUTO_ADMIN_ID, action, reason, auto_generated=True)
             
             logger.info(f"🛡️ Модерация: {action} для пользователя {user_id}, причина: {reason}")
             
         except Exception as e:
             logger.error(f"❌ Ошибка логирования модерации: {e}")
     
-    def get_user_warnings(self, user_id: int) -> int:
-        """⚠️ Получение количества предупреждений"""
-        return self.user_warnings.get(user_id, 0)
+    def get_user_warnings(self, user_id: int, chat_id: int) -> int:
+        """⚠️ Получение количества предупреждений в чате"""
+        return self.warnings.count(chat_id, user_id)
     
-    def reset_user_warnings(self, user_id: int) -> bool:
-        """🔄 Сброс предупреждений"""
+    def reset_user_warnings(self, user_id: int, chat_id: int) -> bool:
+        """🔄 Сброс предупреждений в чате"""
         
         try:
-            if user_id in self.user_warnings:
-                del self.user_warnings[user_id]
+            self.warnings.reset(chat_id, user_id)
             return True
             
         except Exception as e:
@@ -176,4 +396,6 @@ class ModerationModule:
             return False
 
 
-__all__ = ["ModerationModule"]
\ No newline at end of file
+__all__ = [
+    "ModerationModule", "ACTION_KICK", "ACTION_UNBAN", "ACTION_UNMUTE", "ACTION_DELETE", "RECORDED_ACTIONS"
+]
\ No newline at end of file
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+🚨 RAID GUARD v3.0
+🔒 Обнаружение рейдов (волн входов и первых сообщений) и локдаун чата
+
+Для каждого чата - два скользящих окна на кольцах FloodDetector: входы
+новых участников и их первые сообщения. Новички помнятся до первого
+сообщения (не дольше new_member_minutes), поэтому обычное сообщение
+старого участника стоит один поиск в словаре.
+
+Когда окно переполняется, чат уходит в локдаун:
+• права чата сужаются до текста (Bot API не умеет включать медленный
+  режим, поэтому вместо него отключаются медиа, стикеры и ссылки);
+• все недавно вошедшие и новые участники ограничиваются до конца
+  локдауна;
+• новички, успевшие написать, собираются в список нарушителей и по
+  окончании банятся одной пачкой.
+Все вызовы Bot API идут через ModerationExecutor с ограничением частоты.
+"""
+
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, Any, Optional, Set, Callable, Awaitable
+
+from app.modules.flood_detector import FloodDetector
+
+logger = logging.getLogger(__name__)
+
+# Действия, которые выполняет enforcer(kind, chat_id, user_id, until)
+RAID_LOCK = 'lock_chat'
+RAID_UNLOCK = 'unlock_chat'
+RAID_RESTRICT = 'restrict'
+RAID_BAN = 'ban'
+
+REASON_JOINS = 'joins'
+REASON_FIRST_MESSAGES = 'first_messages'
+
+# Предел помнимых новичков на чат (самые давние вытесняются)
+MAX_RECENT_MEMBERS = 1000
+
+# Ключ окна чата в FloodDetector (пользователь не важен)
+_CHAT_KEY = 0
+
+
+@dataclass
+class Lockdown:
+    """🔒 Локдаун чата"""
+    chat_id: int
+    reason: str
+    started: float
+    until: float
+    restricted: Set[int] = field(default_factory=set)
+    offenders: Set[int] = field(default_factory=set)
+
+
+class RaidGuard:
+    """🚨 Детектор рейдов по чатам"""
+
+    def __init__(self, executor=None, join_threshold: int = 10, message_threshold: int = 10,
+                 window_seconds: float = 60, lockdown_minutes: float = 15,
+                 new_member_minutes: float = 10, ban_offenders: bool = True):
+        self.executor = executor
+        self.window_seconds = window_seconds
+        self.lockdown_seconds = lockdown_minutes * 60
+        self.new_member_seconds = new_member_minutes * 60
+        self.ban_offenders = ban_offenders
+
+        self.joins = FloodDetector(join_threshold, window_seconds)
+        self.first_messages = FloodDetector(message_threshold, window_seconds)
+
+        # чат -> {новичок: время входа} в порядке входа
+        self._recent: Dict[int, 'OrderedDict[int, float]'] = {}
+        self._lockdowns: Dict[int, Lockdown] = {}
+        self._enforcer: Optional[Callable[[str, int, Optional[int], Optional[datetime]], Awaitable[Any]]] = None
+
+        self.stats = {'joins': 0, 'first_messages': 0, 'lockdowns': 0, 'restricted': 0, 'banned': 0}
+
+    def set_enforcer(self, enforcer: Callable[[str, int, Optional[int], Optional[datetime]], Awaitable[Any]]):
+        """🔌 Вызовы Bot API: enforcer(kind, chat_id, user_id, until)"""
+        self._enforcer = enforcer
+
+    # =================== СОБЫТИЯ ===================
+
+    def on_join(self, chat_id: int, user_id: int, now: Optional[float] = None) -> bool:
+        """👋 Вход участника; True - участник ограничен из-за локдауна"""
+
+        now = time.time() if now is None else now
+        self.stats['joins'] += 1
+
+        recent = self._recent.get(chat_id)
+        if recent is None:
+            recent = self._recent[chat_id] = OrderedDict()
+        recent[user_id] = now
+        recent.move_to_end(user_id)
+        self._trim(recent, now)
+
+        lockdown = self.get_lockdown(chat_id, now)
+        if lockdown is None and self.joins.hit(chat_id, _CHAT_KEY, now):
+            lockdown = self._start(chat_id, REASON_JOINS, now)
+
+        if lockdown is not None:
+            self._restrict(lockdown, user_id)
+            return True
+        return False
+
+    def on_message(self, chat_id: int, user_id: int, now: Optional[float] = None) -> bool:
+        """💬 Сообщение; True - первое сообщение новичка во время рейда (удалить)"""
+
+        recent = self._recent.get(chat_id)
+        if not recent or user_id not in recent:
+            return False
+
+        now = time.time() if now is None else now
+        joined = recent.pop(user_id)
+        if not recent:
+            del self._recent[chat_id]
+        if joined < now - self.new_member_seconds:
+            return False
+
+        self.stats['first_messages'] += 1
+        lockdown = self.get_lockdown(chat_id, now)
+        if lockdown is None and self.first_messages.hit(chat_id, _CHAT_KEY, now):
+            lockdown = self._start(chat_id, REASON_FIRST_MESSAGES, now)
+
+        if lockdown is not None:
+            lockdown.offenders.add(user_id)
+            self._restrict(lockdown, user_id)
+            return True
+        return False
+
+    def _trim(self, recent: 'OrderedDict[int, float]', now: float):
+        forget_before = now - self.new_member_seconds
+        while recent and (len(recent) > MAX_RECENT_MEMBERS or next(iter(recent.values())) < forget_before):
+            recent.popitem(last=False)
+
+    # =================== ЛОКДАУН ===================
+
+    def get_lockdown(self, chat_id: int, now: Optional[float] = None) -> Optional[Lockdown]:
+        """🔒 Текущий локдаун чата (истекший завершается здесь же)"""
+
+        lockdown = self._lockdowns.get(chat_id)
+        if lockdown is not None and lockdown.until <= (time.time() if now is None else now):
+            self.end_lockdown(chat_id)
+            return None
+        return lockdown
+
+    def _start(self, chat_id: int, reason: str, now: float) -> Lockdown:
+        lockdown = self._lockdowns[chat_id] = Lockdown(chat_id, reason, now, now + self.lockdown_seconds)
+        self.stats['lockdowns'] += 1
+        logger.warning(f"🚨 Рейд в чате {chat_id} ({reason}): локдаун на {self.lockdown_seconds / 60:.0f} мин")
+
+        self._enforce(RAID_LOCK, chat_id)
+
+        # Вошедшие за окно обнаружения - скорее всего часть той же волны
+        joined_after = now - self.window_seconds
+        for user_id, joined in reversed(self._recent.get(chat_id, {}).items()):
+            if joined < joined_after:
+                break
+            self._restrict(lockdown, user_id)
+
+        try:
+            asyncio.get_running_loop().call_later(self.lockdown_seconds, self._expire, lockdown)
+        except RuntimeError:
+            # Нет цикла событий - локдаун завершится при следующем обращении
+            pass
+        return lockdown
+
+    def _expire(self, lockdown: Lockdown):
+        # Таймер не должен завершить более поздний локдаун того же чата
+        if self._lockdowns.get(lockdown.chat_id) is lockdown:
+            self.end_lockdown(lockdown.chat_id)
+
+    def _restrict(self, lockdown: Lockdown, user_id: int):
+        if user_id in lockdown.restricted:
+            return
+        lockdown.restricted.add(user_id)
+        self.stats['restricted'] += 1
+        self._enforce(RAID_RESTRICT, lockdown.chat_id, user_id, datetime.fromtimestamp(lockdown.until))
+
+    def end_lockdown(self, chat_id: int) -> Optional[Lockdown]:
+        """🔓 Завершение локдауна: права чата обратно, нарушители - в бан пачкой"""
+
+        lockdown = self._lockdowns.pop(chat_id, None)
+        if lockdown is None:
+            return None
+
+        self._enforce(RAID_UNLOCK, chat_id)
+        if self.ban_offenders:
+            for user_id in lockdown.offenders:
+                self._enforce(RAID_BAN, chat_id, user_id)
+            self.stats['banned'] += len(lockdown.offenders)
+
+        logger.info(f"🔓 Локдаун чата {chat_id} снят: ограничено {len(lockdown.restricted)}, "
+                    f"нарушителей {len(lockdown.offenders)}")
+        return lockdown
+
+    def _enforce(self, kind: str, chat_id: int, user_id: Optional[int] = None, until: Optional[datetime] = None):
+        if not self._enforcer:
+            return
+        call = partial(self._enforcer, kind, chat_id, user_id, until)
+        if self.executor:
+            self.executor.submit(chat_id, call, f"{kind} {user_id or ''}".strip())
+        else:
+            asyncio.create_task(call())
+
+    # =================== СТАТИСТИКА ===================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика рейдов"""
+
+        return {
+            **self.stats,
+            'active_lockdowns': len(self._lockdowns),
+            'tracked_new_members': sum(len(recent) for recent in self._recent.values())
+        }
+
+
+__all__ = ["RaidGuard", "Lockdown", "RAID_LOCK", "RAID_UNLOCK", "RAID_RESTRICT", "RAID_BAN"]
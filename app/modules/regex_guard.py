@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+🛡️ REGEX GUARD v3.0
+⏱️ Безопасное выполнение пользовательских регулярок
+
+Регулярки триггеров пишут пользователи, а одна катастрофическая
+(например, (a+)+$) в re.search подвешивает цикл событий для всех чатов.
+Поэтому:
+- при создании шаблон проходит статический анализ (вложенные
+  неограниченные квантификаторы, пересекающиеся альтернативы под
+  квантификатором, огромные счетчики, обратные ссылки в повторе);
+- при проверке сообщений регулярки выполняются либо линейным движком
+  re2 (если установлен), либо в небольшом пуле процессов. У каждого
+  шаблона свой бюджет: превысивший прерывается, проверка остальных
+  продолжается (совпадения не теряются), а виновник возвращается
+  вызывающему, чтобы тот отключил триггер. Шаблон, который укладывается
+  в бюджет, но в сумме тратит слишком много (COST_LIMIT_FACTOR бюджетов
+  за минуту), тоже отключается. Процесс, не ответивший вовремя,
+  убивается; виновника он успевает отметить в общей памяти.
+"""
+
+import re
+import html
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+try:
+    import re2  # pyre2 / google-re2: линейное время, без возвратов
+    RE2_AVAILABLE = True
+except ImportError:
+    re2 = None
+    RE2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Ограничения статического анализа
+MAX_PATTERN_LENGTH = 200
+MAX_REPEAT_COUNT = 1000
+
+# Повтор с большим верхним пределом ведет себя как неограниченный
+_UNBOUNDED_FROM = 100
+
+# Внутри повтора хотя бы с таким пределом вложенный неограниченный
+# квантификатор дает полиномиальный или экспоненциальный перебор: (.*a){20}
+_NESTING_FROM = 10
+
+# Бюджет по умолчанию на один шаблон при проверке сообщения
+DEFAULT_TIMEOUT = 0.1
+
+# Рабочих процессов: столько проверок идет параллельно, медленная не держит остальные чаты
+DEFAULT_POOL_SIZE = 2
+
+# Суммарные затраты шаблона: больше COST_LIMIT_FACTOR * timeout за окно - отключение.
+# Учитываются только вызовы дольше COST_FLOOR_FRACTION * timeout
+COST_WINDOW_SECONDS = 60
+COST_LIMIT_FACTOR = 10
+COST_FLOOR_FRACTION = 0.05
+_MAX_COST_ENTRIES = 10000
+
+# Запас сверх суммы бюджетов, после которого процесс считается зависшим
+WORKER_DEADLINE_SLACK = 0.5
+
+# Сколько ждать запуска рабочего процесса (spawn импортирует модули заново)
+WORKER_START_TIMEOUT = 15.0
+
+_MAX_WORKER_CACHE = 1024
+
+
+# =================== СТАТИЧЕСКИЙ АНАЛИЗ ===================
+
+def analyze_regex(pattern: str) -> Optional[str]:
+    """🔍 Причина отказа для опасного шаблона или None, если шаблон допустим"""
+
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        return f"шаблон длиннее {MAX_PATTERN_LENGTH} символов"
+
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except (re.error, OverflowError, RecursionError) as e:
+        return f"некорректное выражение: {e}"
+
+    return _walk(parsed, False)
+
+
+def _is_repeat(op) -> bool:
+    return str(op) in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+
+
+def _walk(items, in_repeat: bool) -> Optional[str]:
+    """🌳 Обход дерева sre_parse; in_repeat - внутри повтора с возвратами"""
+
+    for op, av in items:
+        name = str(op)
+
+        if _is_repeat(op):
+            low, high, body = av
+            if high != sre_constants.MAXREPEAT and high > MAX_REPEAT_COUNT:
+                return f"слишком большой счетчик повторов ({high})"
+
+            backtracks = name != 'POSSESSIVE_REPEAT'
+            unbounded = high == sre_constants.MAXREPEAT or high >= _UNBOUNDED_FROM
+            if unbounded and in_repeat and backtracks:
+                return "вложенные неограниченные квантификаторы, например (a+)+"
+
+            nesting = backtracks and (high == sre_constants.MAXREPEAT or high >= _NESTING_FROM)
+            if nesting:
+                overlap = _overlapping_branch(body)
+                if overlap:
+                    return overlap
+
+            reason = _walk(body, in_repeat or nesting)
+            if reason:
+                return reason
+
+        elif name == 'SUBPATTERN':
+            reason = _walk(av[-1], in_repeat)
+            if reason:
+                return reason
+
+        elif name == 'ATOMIC_GROUP':
+            reason = _walk(av, False)
+            if reason:
+                return reason
+
+        elif name == 'BRANCH':
+            for branch in av[1]:
+                reason = _walk(branch, in_repeat)
+                if reason:
+                    return reason
+
+        elif name in ('ASSERT', 'ASSERT_NOT'):
+            reason = _walk(av[1], in_repeat)
+            if reason:
+                return reason
+
+        elif name == 'GROUPREF_EXISTS':
+            for branch in av[1:]:
+                if branch is not None:
+                    reason = _walk(branch, in_repeat)
+                    if reason:
+                        return reason
+
+        elif name == 'GROUPREF' and in_repeat:
+            return "обратная ссылка внутри повтора"
+
+    return None
+
+
+def _first_literal(items) -> Optional[int]:
+    """🔤 Первый символ ветки, если это литерал (иначе None - может начаться с чего угодно)"""
+
+    for op, av in items:
+        name = str(op)
+        if name == 'LITERAL':
+            return av
+        if name == 'SUBPATTERN':
+            return _first_literal(av[-1])
+        if name in ('AT',):
+            continue
+        return None
+    return None
+
+
+def _overlapping_branch(body) -> Optional[str]:
+    """🔀 Альтернативы под повтором, начинающиеся одинаково ((a|ab)+, (\\w|\\d)+)"""
+
+    for op, av in body:
+        name = str(op)
+        if name == 'SUBPATTERN':
+            reason = _overlapping_branch(av[-1])
+            if reason:
+                return reason
+        elif name == 'BRANCH':
+            branches = av[1]
+            firsts = [_first_literal(branch) for branch in branches]
+            literals = [first for first in firsts if first is not None]
+            if None in firsts or len(set(literals)) != len(literals):
+                return "пересекающиеся альтернативы под квантификатором, например (a|ab)+"
+    return None
+
+
+# =================== ВЫПОЛНЕНИЕ ===================
+
+class _PatternTimeout(Exception):
+    """⏰ Шаблон исчерпал свой бюджет (SIGALRM в рабочем процессе)"""
+
+
+def _on_alarm(signum, frame):
+    raise _PatternTimeout()
+
+
+def _worker_main(conn, current):
+    """🧵 Рабочий процесс: (items, text, timeout) -> (ключ совпадения, ключи по таймауту, затраты)
+
+    У каждого шаблона свой бюджет: таймер SIGALRM прерывает re.search
+    (движок проверяет сигналы во время перебора), и проверка идет дальше.
+    current - индекс выполняемого шаблона: по нему родитель находит
+    виновника, если процесс пришлось убить (нет setitimer, например Windows).
+    """
+
+    timer = hasattr(signal, 'setitimer')
+    if timer:
+        signal.signal(signal.SIGALRM, _on_alarm)
+
+    cache: Dict[str, 're.Pattern'] = {}
+    conn.send('ready')
+
+    while True:
+        try:
+            items, text, timeout = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        result = None
+        timed_out = []
+        costs = []
+        floor = timeout * COST_FLOOR_FRACTION
+        for index, (key, pattern) in enumerate(items):
+            current.value = index
+            compiled = cache.get(pattern)
+            if compiled is None:
+                if len(cache) >= _MAX_WORKER_CACHE:
+                    cache.clear()
+                try:
+                    compiled = cache[pattern] = re.compile(pattern, re.IGNORECASE)
+                except re.error:
+                    continue
+
+            started = time.perf_counter()
+            try:
+                if timer:
+                    signal.setitimer(signal.ITIMER_REAL, timeout)
+                try:
+                    found = compiled.search(text)
+                finally:
+                    if timer:
+                        signal.setitimer(signal.ITIMER_REAL, 0)
+            except _PatternTimeout:
+                timed_out.append(key)
+                costs.append((pattern, timeout))
+                continue
+
+            elapsed = time.perf_counter() - started
+            if elapsed >= floor:
+                costs.append((pattern, elapsed))
+            if found:
+                result = key
+                break
+
+        current.value = -1
+        conn.send((result, timed_out, costs))
+
+
+class _Worker:
+    """🧵 Рабочий процесс песочницы и канал к нему"""
+
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = context.Pipe()
+        self.current = context.Value('i', -1, lock=False)
+        self.process = context.Process(target=_worker_main, args=(child_conn, self.current), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        try:
+            started = parent_conn.poll(WORKER_START_TIMEOUT) and parent_conn.recv() == 'ready'
+        except (EOFError, OSError):
+            started = False
+        if not started:
+            self.process.kill()
+            raise RuntimeError("процесс регулярок не запустился")
+        self.conn = parent_conn
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def run(self, items: List[Tuple[Any, str]], text: str, timeout: float):
+        """📤 Запрос (блокирующий, в потоке): ответ воркера или None, если пришлось убить"""
+
+        self.conn.send((items, text, timeout))
+        # Каждый шаблон ограничен сам; запас - на случай, когда таймер не сработал
+        if self.conn.poll(timeout * len(items) + WORKER_DEADLINE_SLACK):
+            return self.conn.recv()
+        return None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class RegexSandbox:
+    """⏱️ Выполнение регулярок с бюджетом времени на каждый шаблон"""
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, pool_size: int = DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle: List[_Worker] = []
+        self._workers: set = set()
+        self._slots = asyncio.Semaphore(pool_size)
+        self._re2_cache: Dict[str, Any] = {}
+
+        # Затраты шаблонов: pattern -> [начало окна, секунд за окно]
+        self._costs: Dict[str, List[float]] = {}
+
+        self.stats = {'searches': 0, 'timeouts': 0, 'over_budget': 0, 'restarts': 0}
+
+    @property
+    def engine(self) -> str:
+        if RE2_AVAILABLE:
+            return 're2'
+        return 'worker' if self.timeout > 0 else 'inline'
+
+    @property
+    def cost_limit(self) -> float:
+        """💸 Сколько секунд шаблон может тратить за COST_WINDOW_SECONDS"""
+        return self.timeout * COST_LIMIT_FACTOR
+
+    async def search_first(self, items: List[Tuple[Any, str]],
+                           text: str) -> Tuple[Optional[Any], List[Any]]:
+        """🎯 (ключ первого совпавшего шаблона, ключи шаблонов для отключения)
+
+        Для отключения - превысившие бюджет на сообщение или суммарный
+        лимит затрат за окно. Медленный шаблон не отменяет проверку
+        остальных: совпадение после него все равно находится.
+        """
+
+        if not items:
+            return None, []
+
+        self.stats['searches'] += 1
+
+        if RE2_AVAILABLE:
+            return self._search_re2(items, text), []
+
+        if self.timeout <= 0:
+            return _search_inline(items, text), []
+
+        result = None
+        offenders: List[Any] = []
+        costs: List[Tuple[str, float]] = []
+
+        async with self._slots:
+            remaining = items
+            while remaining:
+                worker = await self._acquire()
+                try:
+                    reply = await asyncio.to_thread(worker.run, remaining, text, self.timeout)
+                except (EOFError, OSError) as e:
+                    logger.warning(f"⚠️ Процесс регулярок упал: {e}")
+                    self._discard(worker)
+                    break
+                if reply is not None:
+                    self._idle.append(worker)
+                    result, timed_out, batch_costs = reply
+                    offenders.extend(timed_out)
+                    costs.extend(batch_costs)
+                    break
+
+                # Таймер не сработал: убиваем процесс, виновник - шаблон, на котором он стоял
+                culprit = worker.current.value
+                self._discard(worker)
+                if not 0 <= culprit < len(remaining):
+                    logger.warning("⚠️ Процесс регулярок не ответил, виновник не определен")
+                    break
+                key, pattern = remaining[culprit]
+                offenders.append(key)
+                costs.append((pattern, self.timeout))
+                remaining = remaining[culprit + 1:]
+
+        self.stats['timeouts'] += len(offenders)
+        offenders.extend(self._charge(items, costs, offenders))
+        return result, offenders
+
+    def _charge(self, items: List[Tuple[Any, str]], costs: List[Tuple[str, float]],
+                known: List[Any]) -> List[Any]:
+        """💸 Учет затрат шаблонов; ключи тех, кто превысил лимит за окно"""
+
+        if not costs:
+            return []
+
+        now = time.monotonic()
+        over = set()
+        for pattern, spent in costs:
+            entry = self._costs.get(pattern)
+            if entry is None or now - entry[0] > COST_WINDOW_SECONDS:
+                if len(self._costs) >= _MAX_COST_ENTRIES:
+                    self._costs.clear()
+                entry = self._costs[pattern] = [now, 0.0]
+            entry[1] += spent
+            if entry[1] > self.cost_limit:
+                over.add(pattern)
+                del self._costs[pattern]
+
+        extra = [key for key, pattern in items if pattern in over and key not in known]
+        self.stats['over_budget'] += len(extra)
+        return extra
+
+    async def _acquire(self) -> _Worker:
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive():
+                return worker
+            self._discard(worker)
+
+        worker = await asyncio.to_thread(_Worker)
+        self._workers.add(worker)
+        self.stats['restarts'] += 1
+        return worker
+
+    def _discard(self, worker: _Worker):
+        self._workers.discard(worker)
+        worker.kill()
+
+    def _search_re2(self, items: List[Tuple[Any, str]], text: str) -> Optional[Any]:
+        for key, pattern in items:
+            compiled = self._re2_cache.get(pattern)
+            if compiled is None:
+                try:
+                    compiled = self._re2_cache[pattern] = re2.compile(pattern, re2.IGNORECASE)
+                except Exception:
+                    # Конструкции, которых нет в re2 (обратные ссылки) - не совпадение
+                    compiled = self._re2_cache[pattern] = False
+            if compiled and compiled.search(text):
+                return key
+        return None
+
+    def close(self):
+        """🔒 Остановка рабочих процессов"""
+
+        for worker in list(self._workers):
+            self._discard(worker)
+        self._idle.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'engine': self.engine,
+            'timeout_ms': int(self.timeout * 1000),
+            'workers': len(self._workers),
+            'tracked_patterns': len(self._costs)
+        }
+
+
+def _search_inline(items: List[Tuple[Any, str]], text: str) -> Optional[Any]:
+    for key, pattern in items:
+        try:
+            if re.search(pattern, text, re.IGNORECASE):
+                return key
+        except re.error:
+            continue
+    return None
+
+
+_sandbox: Optional[RegexSandbox] = None
+
+
+def get_regex_sandbox() -> RegexSandbox:
+    """🛡️ Общая песочница процесса"""
+
+    global _sandbox
+    if _sandbox is None:
+        _sandbox = RegexSandbox()
+    return _sandbox
+
+
+def configure_regex_sandbox(timeout_ms: int) -> RegexSandbox:
+    """⚙️ Бюджет общей песочницы (0 - выполнять в цикле событий без защиты)"""
+
+    sandbox = get_regex_sandbox()
+    sandbox.timeout = max(0, timeout_ms) / 1000
+    return sandbox
+
+
+def disabled_notice(trigger: Dict[str, Any], timeout: float) -> str:
+    """📨 Уведомление создателю об отключенном триггере"""
+
+    return (
+        f"⚠️ <b>Триггер отключен</b>\n\n"
+        f"Регулярное выражение триггера <b>{html.escape(str(trigger.get('name', '?')))}</b> "
+        f"выполнялось дольше {int(timeout * 1000)} мс или в сумме слишком долго и тормозило бота.\n"
+        f"Шаблон: <code>{html.escape(trigger.get('pattern', '')[:100])}</code>\n\n"
+        f"Упростите выражение и создайте триггер заново."
+    )
+
+
+__all__ = [
+    "RegexSandbox", "analyze_regex", "get_regex_sandbox", "configure_regex_sandbox",
+    "disabled_notice", "RE2_AVAILABLE"
+]
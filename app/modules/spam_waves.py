@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+🌐 SPAM WAVES v3.0
+🧬 Поиск волн почти одинакового спама по всем чатам (SimHash)
+
+Каждое сообщение (после нормализации content_scanner) сворачивается в
+64-битный SimHash по символьным триграммам: на коротких сообщениях
+слова дают слишком мало признаков, и замена одного слова сдвигает
+отпечаток так же далеко, как чужой текст. У длинных сообщений берутся
+128 наименьших хэшей признаков - у похожих текстов это почти одна и та
+же выборка, а цена отпечатка ограничена сверху.
+
+Голоса по 64 битам считаются на уровне C: bytes.translate раскладывает
+биты хэшей по байтам-счетчикам (строка на хэш - 64 байта), строки
+складываются сверткой большого целого пополам, и на каждый шаг уходит
+одна операция над всем числом, а не цикл по признакам.
+
+Недавние отпечатки лежат в индексе из 8 перекрывающихся 16-битных полос
+(соседние байты отпечатка по кругу). Кандидаты - записи, совпавшие хоть
+в одной полосе: до 3 разных бит совпадение гарантировано, на расстоянии
+до 8 находится большинство пар, а у волны из многих копий - почти все.
+16-битные ключи держат корзины почти пустыми даже при десятках тысяч
+записей в окне; корзины ограничены по длине, записи старше окна
+удаляются с головы общей очереди, поэтому проверка сообщения стоит
+постоянное время.
+
+Хэш признаков - встроенный hash(): он случаен между запусками, но
+индекс живет только в памяти процесса.
+"""
+
+import re
+import time
+import struct
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+from app.modules.content_scanner import normalize
+
+MASK64 = (1 << 64) - 1
+
+# Полоса = BAND_BITS бит, начиная с каждого BAND_STEP-го (по кругу)
+BANDS = 8
+BAND_BITS = 16
+BAND_STEP = 8
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Почти дубликат: отличается не больше чем на столько бит
+MAX_DISTANCE = 8
+
+# Предел записей в одной корзине (популярный отпечаток не раздувает проверку)
+MAX_BUCKET = 32
+
+# Короткие реплики ("привет", "+") повторяются везде естественно
+MIN_WORDS = 5
+
+SHINGLE = 3
+
+# Выборка наименьших хэшей признаков (счетчик столбца - байт, предел 255)
+MAX_FEATURES = 128
+
+# Строка счетчиков одного хэша: 64 столбца по байту
+_ROW_BITS = 64 * 8
+
+_WORDS = re.compile(r'\w+')
+
+_BAND_SHIFTS = tuple((band, band * BAND_STEP) for band in range(BANDS))
+
+# _BIT_TABLES[j]: байт -> его j-й бит (0 или 1)
+_BIT_TABLES = [bytes(value >> bit & 1 for value in range(256)) for bit in range(8)]
+
+# Порог большинства -> таблица "счетчик больше порога" (цифры '1' / '0')
+_MAJORITY_TABLES = [bytes(0x31 if count > threshold else 0x30 for count in range(256))
+                    for threshold in range(MAX_FEATURES // 2 + 1)]
+
+
+def simhash(text: str, normalized: Optional[str] = None) -> Optional[int]:
+    """🧬 64-битный SimHash текста (None - слишком короткий)
+
+    normalized - уже нормализованный текст, если он есть у вызывающего
+    """
+
+    words = _WORDS.findall(normalize(text) if normalized is None else normalized)
+    if len(words) < MIN_WORDS:
+        return None
+
+    joined = ' '.join(words)
+    features = {joined[i:i + SHINGLE] for i in range(len(joined) - SHINGLE + 1)}
+
+    hashes = sorted(hash(feature) & MASK64 for feature in features)[:MAX_FEATURES]
+    rows = len(hashes)
+    packed = struct.pack(f'<{rows}Q', *hashes)
+
+    # Байт 8k + j строки = j-й бит k-го байта хэша, то есть бит 8k + j
+    counters = bytearray(rows * 64)
+    for bit, table in enumerate(_BIT_TABLES):
+        counters[bit::8] = packed.translate(table)
+
+    # Сложение строк: нижняя половина + верхняя, пока не останется одна
+    value = int.from_bytes(counters, 'little')
+    while rows > 1:
+        half = rows // 2
+        value = (value & ((1 << _ROW_BITS * half) - 1)) + (value >> _ROW_BITS * half)
+        rows -= half
+
+    # Бит отпечатка = 1, если за него проголосовало больше половины признаков
+    digits = value.to_bytes(64, 'little').translate(_MAJORITY_TABLES[len(hashes) // 2])
+    return int(digits[::-1], 2)
+
+
+class _Entry:
+    __slots__ = ('stamp', 'fingerprint', 'chat_id', 'user_id')
+
+    def __init__(self, stamp: float, fingerprint: int, chat_id: int, user_id: int):
+        self.stamp = stamp
+        self.fingerprint = fingerprint
+        self.chat_id = chat_id
+        self.user_id = user_id
+
+
+class SpamWaveDetector:
+    """🌐 Индекс недавних отпечатков по всем чатам"""
+
+    def __init__(self, max_chats: int = 3, max_users: int = 5, window_minutes: float = 10,
+                 max_entries: int = 20000):
+        self.max_chats = max_chats
+        self.max_users = max_users
+        self.window_seconds = window_minutes * 60
+        self.max_entries = max_entries
+
+        self._entries: deque = deque()
+        # Ключ корзины: номер полосы << BAND_BITS | значение полосы.
+        # Корзины упорядочены по времени и чистятся с головы вместе с общей
+        # очередью, поэтому в них только записи из окна
+        # Списки, а не deque: корзин десятки тысяч, и почти все из 1-2 записей
+        self._buckets: Dict[int, List[_Entry]] = {}
+
+        self.stats = {'checked': 0, 'fingerprinted': 0, 'waves': 0}
+
+    @staticmethod
+    def _bands(fingerprint: int) -> List[int]:
+        # Удвоенный отпечаток - последняя полоса заходит на начало
+        doubled = fingerprint | fingerprint << 64
+        return [band << BAND_BITS | doubled >> shift & BAND_MASK for band, shift in _BAND_SHIFTS]
+
+    def check(self, message: str, chat_id: int, user_id: int, now: Optional[float] = None,
+              normalized: Optional[str] = None) -> bool:
+        """🌊 Учет сообщения; True - его почти дубликаты уже идут по многим чатам или от многих людей"""
+
+        self.stats['checked'] += 1
+        fingerprint = simhash(message, normalized) if message else None
+        if fingerprint is None:
+            return False
+
+        self.stats['fingerprinted'] += 1
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        chats = {chat_id}
+        users = {user_id}
+        bands = self._bands(fingerprint)
+
+        for key in bands:
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            for entry in bucket:
+                if (entry.fingerprint ^ fingerprint).bit_count() <= MAX_DISTANCE:
+                    chats.add(entry.chat_id)
+                    users.add(entry.user_id)
+
+        entry = _Entry(now, fingerprint, chat_id, user_id)
+        self._entries.append(entry)
+        for key in bands:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._buckets[key] = [entry]
+                continue
+            bucket.append(entry)
+            if len(bucket) > MAX_BUCKET:
+                del bucket[0]
+
+        if len(chats) > self.max_chats or len(users) > self.max_users:
+            self.stats['waves'] += 1
+            return True
+        return False
+
+    def _expire(self, now: float):
+        """🧹 Удаление записей старше окна (и сверх лимита) с головы очереди"""
+
+        entries, buckets = self._entries, self._buckets
+        since = now - self.window_seconds
+
+        while entries and (entries[0].stamp < since or len(entries) > self.max_entries):
+            entry = entries.popleft()
+            for key in self._bands(entry.fingerprint):
+                bucket = buckets.get(key)
+                # Корзины упорядочены по времени; если записи там нет - ее уже вытеснил MAX_BUCKET
+                if bucket and bucket[0] is entry:
+                    del bucket[0]
+                    if not bucket:
+                        del buckets[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика индекса"""
+
+        return {**self.stats, 'entries': len(self._entries), 'buckets': len(self._buckets)}
+
+
+__all__ = ["SpamWaveDetector", "simhash"]
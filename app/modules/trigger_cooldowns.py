@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+⏳ TRIGGER COOLDOWNS v3.0
+🚦 Откаты и лимиты срабатываний триггеров
+
+Три независимых ограничения, каждое - O(1) на сообщение:
+- откат триггера в чате: (chat_id, trigger_id) -> момент окончания;
+- откат пользователя в чате: (chat_id, user_id) -> момент окончания;
+- лимит срабатываний в чате: токен-бакет на chat_id.
+Словари ограничены по размеру: при переполнении вытесняются самые
+старые записи, истекшие записи в начале очереди удаляются попутно.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Hashable, Optional, Tuple
+
+# Предел записей в каждом словаре
+DEFAULT_MAX_ENTRIES = 50000
+
+# Сколько истекших записей удалять за одну запись (амортизированная очистка)
+_PURGE_PER_SET = 4
+
+
+class ExpiringMap:
+    """🕰️ Ключ -> момент окончания, ограниченный по размеру"""
+
+    __slots__ = ('max_entries', '_until')
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._until: 'OrderedDict[Hashable, float]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._until)
+
+    def active(self, key: Hashable, now: float) -> bool:
+        until = self._until.get(key)
+        return until is not None and until > now
+
+    def set(self, key: Hashable, until: float, now: float):
+        until_map = self._until
+        until_map[key] = until
+        until_map.move_to_end(key)
+
+        # Попутная очистка истекших записей с головы очереди
+        for _ in range(_PURGE_PER_SET):
+            if not until_map:
+                break
+            oldest_key, oldest_until = next(iter(until_map.items()))
+            if oldest_until > now:
+                break
+            del until_map[oldest_key]
+
+        while len(until_map) > self.max_entries:
+            until_map.popitem(last=False)
+
+
+class TriggerCooldowns:
+    """🚦 Откаты триггеров, пользователей и лимит чата"""
+
+    def __init__(self, trigger_seconds: float = 2, user_seconds: float = 5,
+                 chat_per_minute: int = 20, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.trigger_seconds = trigger_seconds
+        self.user_seconds = user_seconds
+        self.chat_per_minute = chat_per_minute
+        self.max_entries = max_entries
+
+        self._triggers = ExpiringMap(max_entries)
+        self._users = ExpiringMap(max_entries)
+
+        # chat_id -> (токены, время последнего пополнения)
+        self._buckets: 'OrderedDict[int, Tuple[float, float]]' = OrderedDict()
+
+        self.stats = {'allowed': 0, 'trigger_cooldown': 0, 'user_cooldown': 0, 'chat_limit': 0}
+
+    def _tokens(self, chat_id: int, now: float) -> float:
+        if self.chat_per_minute <= 0:
+            return float('inf')
+
+        state = self._buckets.get(chat_id)
+        if state is None:
+            return float(self.chat_per_minute)
+
+        tokens, updated = state
+        refill = (now - updated) * self.chat_per_minute / 60
+        return min(float(self.chat_per_minute), tokens + refill)
+
+    def blocked(self, chat_id: int, user_id: int, now: Optional[float] = None) -> Optional[str]:
+        """🚫 Причина, по которой в чате сейчас не сработает ни один триггер пользователя"""
+
+        now = time.monotonic() if now is None else now
+
+        if self._users.active((chat_id, user_id), now):
+            self.stats['user_cooldown'] += 1
+            return 'user_cooldown'
+
+        if self._tokens(chat_id, now) < 1:
+            self.stats['chat_limit'] += 1
+            return 'chat_limit'
+
+        return None
+
+    def try_fire(self, chat_id: int, user_id: int, trigger_id: str,
+                 trigger_seconds: Optional[float] = None, now: Optional[float] = None) -> bool:
+        """✅ Проверка всех ограничений и фиксация срабатывания, если оно разрешено"""
+
+        now = time.monotonic() if now is None else now
+
+        if self.blocked(chat_id, user_id, now):
+            return False
+
+        trigger_key = (chat_id, trigger_id)
+        if self._triggers.active(trigger_key, now):
+            self.stats['trigger_cooldown'] += 1
+            return False
+
+        seconds = self.trigger_seconds if trigger_seconds is None else trigger_seconds
+        if seconds > 0:
+            self._triggers.set(trigger_key, now + seconds, now)
+        if self.user_seconds > 0:
+            self._users.set((chat_id, user_id), now + self.user_seconds, now)
+
+        if self.chat_per_minute > 0:
+            self._buckets[chat_id] = (self._tokens(chat_id, now) - 1, now)
+            self._buckets.move_to_end(chat_id)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+
+        self.stats['allowed'] += 1
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Счетчики отказов и размеры словарей"""
+
+        return {
+            **self.stats,
+            'trigger_entries': len(self._triggers),
+            'user_entries': len(self._users),
+            'chat_buckets': len(self._buckets)
+        }
+
+
+__all__ = ["TriggerCooldowns", "ExpiringMap"]
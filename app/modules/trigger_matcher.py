@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+🎯 TRIGGER MATCHER v3.0
+⚡ Скомпилированный набор триггеров
+
+Все текстовые триггеры чата (contains / exact / starts_with / ends_with)
+собираются в один автомат Ахо-Корасик, а регулярные выражения - в одну
+объединенную регулярку-префильтр. Регулярки с обязательным литералом
+(например, "привет" в \bпривет\d*\b) тоже попадают в автомат и
+проверяются только при найденном литерале. Сообщение проверяется за один проход,
+результат - триггер с наивысшим приоритетом (при равенстве - созданный
+раньше), как и при прежнем последовательном переборе.
+"""
+
+import re
+import logging
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Типы, которые обслуживает автомат; остальные (text и неизвестные) = contains
+MATCH_CONTAINS = 0
+MATCH_EXACT = 1
+MATCH_STARTS_WITH = 2
+MATCH_ENDS_WITH = 3
+MATCH_REGEX = 4
+
+# Короче литерала префильтр почти всегда срабатывает и бесполезен
+MIN_REGEX_LITERAL = 3
+
+_TEXT_KINDS = {
+    'contains': MATCH_CONTAINS,
+    'text': MATCH_CONTAINS,
+    'exact': MATCH_EXACT,
+    'starts_with': MATCH_STARTS_WITH,
+    'ends_with': MATCH_ENDS_WITH
+}
+
+# Обратные ссылки и глобальные флаги ломают объединение в одну регулярку
+_UNMERGEABLE = re.compile(r'\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)')
+
+
+def required_literal(pattern: str) -> Optional[str]:
+    """🔍 Самая длинная цепочка литералов верхнего уровня (обязательна в любом совпадении)"""
+
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except (re.error, OverflowError, RecursionError):
+        return None
+
+    best, run = '', []
+    for op, av in parsed:
+        if str(op) == 'LITERAL':
+            char = chr(av)
+            # Литерал должен одинаково выглядеть после lower() текста
+            if char.lower() == char.upper().lower() == char.casefold():
+                run.append(char.lower())
+                continue
+        if len(run) > len(best):
+            best = ''.join(run)
+        run = []
+    if len(run) > len(best):
+        best = ''.join(run)
+
+    return best if len(best) >= MIN_REGEX_LITERAL else None
+
+
+class AhoCorasick:
+    """🔤 Автомат Ахо-Корасик: все вхождения всех образцов за один проход"""
+
+    __slots__ = ('goto', 'fail', 'output')
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, Any]]] = [[]]
+
+        for pattern, payload in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append((len(pattern), payload))
+
+        self._build_fail_links()
+
+    def _build_fail_links(self):
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                # Наследуем выходы суффиксов, чтобы поиск не ходил по fail-цепочке
+                if self.output[self.fail[child]]:
+                    self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text: str):
+        """🔎 (позиция конца, длина образца, payload) для каждого вхождения"""
+
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                for length, payload in output[node]:
+                    yield end, length, payload
+
+
+class CompiledTriggerSet:
+    """⚡ Скомпилированные триггеры одного чата"""
+
+    def __init__(self, triggers: Iterable[Dict[str, Any]]):
+        self.triggers: List[Dict[str, Any]] = []
+        self.ranks: List[Tuple[int, int]] = []
+        self.source_size = 0
+
+        text_patterns = []
+        regexes: List[Tuple[int, 're.Pattern']] = []
+        self.literal_regexes: Dict[int, 're.Pattern'] = {}
+        self.regex_patterns: Dict[int, str] = {}
+
+        for trigger in triggers:
+            self.source_size += 1
+            if not trigger.get('is_active', True) or not trigger.get('pattern'):
+                continue
+
+            index = len(self.triggers)
+            self.triggers.append(trigger)
+            # Меньше - важнее: сначала приоритет, затем порядок создания
+            self.ranks.append((-int(trigger.get('priority') or 0), index))
+
+            trigger_type = trigger.get('type', 'contains')
+            if trigger_type == 'regex':
+                try:
+                    compiled = re.compile(trigger['pattern'], re.IGNORECASE)
+                except re.error:
+                    logger.warning(f"⚠️ Некорректное регулярное выражение в триггере: {trigger['pattern']}")
+                    continue
+
+                self.regex_patterns[index] = trigger['pattern']
+                literal = required_literal(trigger['pattern'])
+                if literal:
+                    self.literal_regexes[index] = compiled
+                    text_patterns.append((literal, (MATCH_REGEX, index)))
+                else:
+                    regexes.append((index, compiled))
+                continue
+
+            kind = _TEXT_KINDS.get(trigger_type, MATCH_CONTAINS)
+            text_patterns.append((trigger['pattern'].lower(), (kind, index)))
+
+        self.automaton = AhoCorasick(text_patterns) if text_patterns else None
+
+        # Регулярки проверяем в порядке важности
+        regexes.sort(key=lambda item: self.ranks[item[0]])
+        self.regexes = regexes
+        self.regex_prefilter = self._merge_regexes(regexes)
+
+    @staticmethod
+    def _merge_regexes(regexes: List[Tuple[int, 're.Pattern']]) -> Optional['re.Pattern']:
+        """🧩 Одна регулярка-префильтр: не совпала - ни одна не совпадет"""
+
+        if not regexes:
+            return None
+        if any(_UNMERGEABLE.search(compiled.pattern) for _, compiled in regexes):
+            return None
+        try:
+            return re.compile('|'.join(f'(?:{compiled.pattern})' for _, compiled in regexes), re.IGNORECASE)
+        except re.error:
+            return None
+
+    def __len__(self) -> int:
+        return len(self.triggers)
+
+    def _scan(self, message_text: str, message_lower: Optional[str] = None) -> Tuple[Optional[int], Optional[set]]:
+        """🔤 Проход автомата: (лучший текстовый триггер, регулярки с найденным литералом)"""
+
+        best = None
+        if message_lower is None:
+            message_lower = message_text.lower()
+        last = len(message_lower) - 1
+        ranks = self.ranks
+        regex_candidates = None
+
+        if self.automaton:
+            for end, length, (kind, index) in self.automaton.iter_matches(message_lower):
+                if kind == MATCH_REGEX:
+                    if regex_candidates is None:
+                        regex_candidates = set()
+                    regex_candidates.add(index)
+                    continue
+                if kind == MATCH_EXACT:
+                    if end != last or length != len(message_lower):
+                        continue
+                elif kind == MATCH_STARTS_WITH:
+                    if end != length - 1:
+                        continue
+                elif kind == MATCH_ENDS_WITH:
+                    if end != last:
+                        continue
+                if best is None or ranks[index] < ranks[best]:
+                    best = index
+
+        return best, regex_candidates
+
+    def match(self, message_text: str, message_lower: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """🎯 Самый важный сработавший триггер или None (message_lower - готовый lower() текста)"""
+
+        best, regex_candidates = self._scan(message_text, message_lower)
+        ranks = self.ranks
+
+        # Регулярки с найденным литералом - только более важные, чем лучший текстовый
+        if regex_candidates:
+            for index in sorted(regex_candidates, key=ranks.__getitem__):
+                if best is not None and ranks[index] >= ranks[best]:
+                    break
+                if self.literal_regexes[index].search(message_text):
+                    best = index
+                    break
+
+        if self.regexes and (self.regex_prefilter is None or self.regex_prefilter.search(message_text)):
+            for index, compiled in self.regexes:
+                if best is not None and ranks[index] >= ranks[best]:
+                    break
+                if compiled.search(message_text):
+                    best = index
+                    break
+
+        return self.triggers[best] if best is not None else None
+
+    async def match_guarded(self, message_text: str, sandbox,
+                            message_lower: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """🛡️ Как match(), но регулярки выполняет песочница с бюджетом времени
+
+        Возвращает (триггер или None, триггеры, превысившие бюджет).
+        """
+
+        best, regex_candidates = self._scan(message_text, message_lower)
+        if not self.regexes and not regex_candidates:
+            return (self.triggers[best] if best is not None else None), []
+
+        # Объединенный префильтр сам может зависнуть - в песочницу уходят все кандидаты
+        ranks = self.ranks
+        indexes = set(regex_candidates or ())
+        indexes.update(index for index, _ in self.regexes)
+        items = [
+            (index, self.regex_patterns[index])
+            for index in sorted(indexes, key=ranks.__getitem__)
+            if best is None or ranks[index] < ranks[best]
+        ]
+
+        found, offenders = await sandbox.search_first(items, message_text)
+        if found is not None:
+            best = found
+
+        return (
+            self.triggers[best] if best is not None else None,
+            [self.triggers[index] for index in offenders]
+        )
+
+
+__all__ = ["AhoCorasick", "CompiledTriggerSet", "required_literal"]
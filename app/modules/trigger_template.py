@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+🧩 TRIGGER TEMPLATE v3.0
+⚡ Скомпилированные шаблоны ответов триггеров
+
+Ответ разбирается один раз: литеральные куски и слоты плейсхолдеров.
+Рендер - копия списка частей, заполнение слотов и один ''.join,
+время берется одним вызовом datetime.now() и только если оно нужно.
+Неизвестные плейсхолдеры остаются в тексте как есть.
+"""
+
+import re
+import random
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# {name} или {name:аргумент}
+_PLACEHOLDER = re.compile(r'\{(\w+)(?::([^{}]*))?\}')
+
+# Слоты, значение которых зависит от сообщения
+SLOT_USER_ID = 0
+SLOT_CHAT_ID = 1
+SLOT_MESSAGE = 2
+SLOT_FIRST_NAME = 3
+SLOT_TIME = 4
+SLOT_DATE = 5
+SLOT_DATETIME = 6
+SLOT_RANDOM = 7
+
+_SLOTS = {
+    'user_id': SLOT_USER_ID,
+    'chat_id': SLOT_CHAT_ID,
+    'message': SLOT_MESSAGE,
+    'first_name': SLOT_FIRST_NAME,
+    'name': SLOT_FIRST_NAME,
+    'time': SLOT_TIME,
+    'date': SLOT_DATE,
+    'datetime': SLOT_DATETIME
+}
+
+_TIME_SLOTS = (SLOT_TIME, SLOT_DATE, SLOT_DATETIME)
+
+# Сколько разных ответов держать скомпилированными
+TEMPLATE_CACHE_SIZE = 4096
+
+
+class ResponseTemplate:
+    """🧩 Ответ триггера: литералы + слоты"""
+
+    __slots__ = ('source', 'parts', 'slots', 'needs_time')
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts: List[str] = []
+        # (позиция в parts, тип слота, варианты для {random:...})
+        self.slots: List[Tuple[int, int, Optional[Tuple[str, ...]]]] = []
+
+        position = 0
+        for match in _PLACEHOLDER.finditer(source):
+            name, argument = match.group(1), match.group(2)
+
+            if name == 'random' and argument:
+                slot = SLOT_RANDOM
+                choices = tuple(argument.split('|'))
+            elif argument is None and name in _SLOTS:
+                slot = _SLOTS[name]
+                choices = None
+            else:
+                continue
+
+            if match.start() > position:
+                self.parts.append(source[position:match.start()])
+            self.slots.append((len(self.parts), slot, choices))
+            self.parts.append('')
+            position = match.end()
+
+        if position < len(source):
+            self.parts.append(source[position:])
+
+        self.needs_time = any(slot in _TIME_SLOTS for _, slot, _ in self.slots)
+
+    def render(self, user_id: int, chat_id: int, message: str = '', first_name: str = '') -> str:
+        """✍️ Подстановка значений в один проход"""
+
+        if not self.slots:
+            return self.source
+
+        clock = date = None
+        if self.needs_time:
+            # Форматы прежние: %H:%M и %d.%m.%Y, но без strftime на каждый слот
+            now = datetime.now()
+            clock = f"{now.hour:02d}:{now.minute:02d}"
+            date = f"{now.day:02d}.{now.month:02d}.{now.year}"
+        out = self.parts.copy()
+
+        for position, slot, choices in self.slots:
+            if slot == SLOT_USER_ID:
+                value = str(user_id)
+            elif slot == SLOT_CHAT_ID:
+                value = str(chat_id)
+            elif slot == SLOT_MESSAGE:
+                value = message
+            elif slot == SLOT_FIRST_NAME:
+                value = first_name or ''
+            elif slot == SLOT_RANDOM:
+                value = random.choice(choices)
+            elif slot == SLOT_TIME:
+                value = clock
+            elif slot == SLOT_DATE:
+                value = date
+            else:
+                value = f"{date} {clock}"
+            out[position] = value
+
+        return ''.join(out)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(response: str) -> ResponseTemplate:
+    """⚙️ Скомпилированный шаблон (кэш по тексту ответа, шаблоны неизменяемы)"""
+
+    return ResponseTemplate(response)
+
+
+__all__ = ["ResponseTemplate", "compile_template"]
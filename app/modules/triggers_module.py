@@ -8,14 +8,23 @@
 
 import logging
 import json
-import re
+import os
+import time
 import asyncio  # ДОБАВЛЕН ИМПОРТ
 from datetime import datetime
 from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 
+from app.modules.trigger_matcher import CompiledTriggerSet
+from app.modules.regex_guard import analyze_regex, configure_regex_sandbox, disabled_notice
+from app.modules.trigger_cooldowns import TriggerCooldowns
+from app.modules.trigger_template import compile_template
+
 logger = logging.getLogger(__name__)
 
+# Счетчики срабатываний сбрасываются на диск не чаще раза в N секунд
+SAVE_DEBOUNCE_SECONDS = 5.0
+
 
 class TriggersModule:
     """⚡ Модуль системы триггеров"""
@@ -35,6 +44,30 @@ class TriggersModule:
         # Статистика срабатывания
         self.trigger_stats = {}
         
+        # Хранилище flexible_triggers (если БД его поддерживает), иначе JSON-файл
+        self.store = None
+        
+        # Скомпилированные наборы по чатам (без хранилища), пересобираются при изменениях
+        self._compiled: Dict[str, CompiledTriggerSet] = {}
+        
+        # Отложенное сохранение: флаг изменений + одна задача сброса
+        self._dirty = False
+        self._last_save = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._save_lock = asyncio.Lock()
+        
+        # Регулярки выполняются в песочнице с бюджетом времени
+        triggers_config = getattr(config, 'triggers', None)
+        self.sandbox = configure_regex_sandbox(getattr(triggers_config, 'regex_timeout_ms', 100))
+        self._notifier = None
+        
+        # Откаты триггеров и пользователей, лимит срабатываний в чате
+        self.cooldowns = TriggerCooldowns(
+            trigger_seconds=getattr(triggers_config, 'cooldown_seconds', 2),
+            user_seconds=getattr(triggers_config, 'user_cooldown_seconds', 5),
+            chat_per_minute=getattr(triggers_config, 'chat_triggers_per_minute', 20)
+        )
+        
         # Типы триггеров
         self.trigger_types = {
             'text': 'Текстовый триггер',
@@ -50,7 +83,43 @@ class TriggersModule:
     
     async def initialize(self):
         """📥 Отложенная инициализация триггеров"""
-        await self.load_triggers()
+        
+        store = getattr(self.db, 'trigger_store', None)
+        if store is None:
+            await self.load_triggers()
+            return
+        
+        self.store = store
+        if self._notifier:
+            store.set_notifier(self._notifier)
+        if self.triggers_file.exists():
+            await self._migrate_json_to_store()
+        
+        # Общие словари с хранилищем: записи через store сразу видны модулю
+        self.triggers = store.chat_triggers
+        self.global_triggers = store.global_triggers
+        self._invalidate_compiled()
+        logger.info(f"📥 Триггеры из БД: {store.count()}")
+    
+    async def _migrate_json_to_store(self):
+        """📦 Перенос триггеров из triggers.json в flexible_triggers (однократно)"""
+        
+        try:
+            with open(self.triggers_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            
+            legacy = list(data.get('global_triggers', {}).values())
+            for chat_triggers in data.get('chat_triggers', {}).values():
+                legacy.extend(chat_triggers.values())
+            
+            for trigger_data in legacy:
+                await self.store.add(trigger_data)
+            
+            self.triggers_file.rename(self.triggers_file.with_name(self.triggers_file.name + '.migrated'))
+            logger.info(f"📦 Перенесено триггеров из JSON в БД: {len(legacy)}")
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка переноса триггеров в БД: {e}")
     
     async def load_triggers(self):
         """📥 Загрузка триггеров из файла"""
@@ -63,31 +132,84 @@ class TriggersModule:
                     self.global_triggers = data.get('global_triggers', {})
                     self.trigger_stats = data.get('statistics', {})
                 
+                self._invalidate_compiled()
                 logger.info(f"📥 Загружено триггеров: {len(self.triggers)} чатовых, {len(self.global_triggers)} глобальных")
             
         except Exception as e:
             logger.error(f"❌ Ошибка загрузки триггеров: {e}")
     
     async def save_triggers(self):
-        """💾 Сохранение триггеров в файл"""
+        """💾 Сохранение триггеров в файл (атомарно, запись в потоке)"""
         
-        try:
-            data = {
-                'chat_triggers': self.triggers,
-                'global_triggers': self.global_triggers,
-                'statistics': self.trigger_stats,
-                'last_updated': datetime.now().isoformat()
-            }
-            
-            with open(self.triggers_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+        async with self._save_lock:
+            try:
+                # Снимок сериализуем в цикле событий, пока данные не меняются
+                self._dirty = False
+                payload = json.dumps({
+                    'chat_triggers': self.triggers,
+                    'global_triggers': self.global_triggers,
+                    'statistics': self.trigger_stats,
+                    'last_updated': datetime.now().isoformat()
+                }, ensure_ascii=False)
                 
-            logger.debug("💾 Триггеры сохранены")
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения триггеров: {e}")
-            return False
+                await asyncio.to_thread(self._write_atomic, payload)
+                self._last_save = time.monotonic()
+                
+                logger.debug("💾 Триггеры сохранены")
+                return True
+                
+            except Exception as e:
+                self._dirty = True
+                logger.error(f"❌ Ошибка сохранения триггеров: {e}")
+                return False
+    
+    def _write_atomic(self, payload: str):
+        """📝 Временный файл + rename: при сбое остается прежняя версия"""
+        
+        tmp_path = self.triggers_file.with_name(self.triggers_file.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.triggers_file)
+    
+    def _mark_dirty(self):
+        """🚩 Изменились счетчики: сохраним не чаще SAVE_DEBOUNCE_SECONDS"""
+        
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+    
+    async def _delayed_flush(self):
+        """⏳ Отложенный сброс накопленных изменений"""
+        
+        delay = self._last_save + SAVE_DEBOUNCE_SECONDS - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self._dirty:
+            await self.save_triggers()
+    
+    async def close(self):
+        """🔒 Финальный сброс несохраненных счетчиков"""
+        
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        
+        if self._dirty:
+            await self.save_triggers()
+        
+        self.sandbox.close()
+    
+    def set_notifier(self, notifier):
+        """📨 Корутина уведомлений создателям: notifier(user_id, text)"""
+        
+        self._notifier = notifier
+        if self.store:
+            self.store.set_notifier(notifier)
     
     async def add_trigger(self, user_id: int, chat_id: int, trigger_name: str, 
                          trigger_pattern: str, response: str, 
@@ -108,6 +230,22 @@ class TriggersModule:
                     'error': f'Неизвестный тип триггера. Доступные: {", ".join(self.trigger_types.keys())}'
                 }
             
+            # Регулярки: разрешены ли и не опасен ли шаблон
+            if trigger_type == 'regex':
+                triggers_config = getattr(self.config, 'triggers', None)
+                if triggers_config and not triggers_config.allow_regex:
+                    return {
+                        'success': False,
+                        'error': 'Регулярные выражения в триггерах отключены'
+                    }
+                
+                reason = analyze_regex(trigger_pattern)
+                if reason:
+                    return {
+                        'success': False,
+                        'error': f'Опасное регулярное выражение: {reason}'
+                    }
+            
             # Проверяем лимиты
             if not await self._check_trigger_limits(user_id, chat_id):
                 return {
@@ -131,7 +269,9 @@ class TriggersModule:
             }
             
             # Сохраняем триггер
-            if trigger_data['is_global']:
+            if self.store:
+                trigger_data = await self.store.add(trigger_data)
+            elif trigger_data['is_global']:
                 self.global_triggers[trigger_data['id']] = trigger_data
             else:
                 chat_key = str(chat_id)
@@ -139,8 +279,11 @@ class TriggersModule:
                     self.triggers[chat_key] = {}
                 self.triggers[chat_key][trigger_data['id']] = trigger_data
             
+            self._invalidate_compiled(None if trigger_data['is_global'] else str(chat_id))
+            
             # Сохраняем в файл
-            await self.save_triggers()
+            if not self.store:
+                await self.save_triggers()
             
             # Логируем создание
             if self.db:
@@ -184,15 +327,20 @@ class TriggersModule:
                 }
             
             # Удаляем триггер
-            if trigger_data['is_global']:
+            if self.store:
+                await self.store.delete(trigger_data)
+            elif trigger_data['is_global']:
                 del self.global_triggers[trigger_data['id']]
             else:
                 chat_key = str(chat_id)
                 if chat_key in self.triggers and trigger_data['id'] in self.triggers[chat_key]:
                     del self.triggers[chat_key][trigger_data['id']]
             
+            self._invalidate_compiled(None if trigger_data['is_global'] else str(chat_id))
+            
             # Сохраняем изменения
-            await self.save_triggers()
+            if not self.store:
+                await self.save_triggers()
             
             # Логируем удаление
             if self.db:
@@ -214,23 +362,28 @@ class TriggersModule:
             }
     
     async def check_message_triggers(self, message_text: str, chat_id: int, 
-                                   user_id: int) -> Optional[str]:
+                                   user_id: int, first_name: str = '') -> Optional[str]:
         """🎯 Проверка сообщения на соответствие триггерам"""
         
         try:
             if not message_text:
                 return None
             
-            # Получаем триггеры для этого чата
-            chat_triggers = self.triggers.get(str(chat_id), {})
+            # Пользователь на откате или чат исчерпал лимит - даже не ищем совпадения
+            if self.cooldowns.blocked(chat_id, user_id):
+                return None
+            
+            chat_key = str(chat_id)
             
             # Проверяем чатовые триггеры
-            response = await self._check_triggers(message_text, chat_triggers, user_id, chat_id)
+            compiled = self._get_compiled(chat_key, self.triggers.get(chat_key, {}))
+            response = await self._check_triggers(message_text, compiled, user_id, chat_id, first_name)
             if response:
                 return response
             
             # Проверяем глобальные триггеры
-            response = await self._check_triggers(message_text, self.global_triggers, user_id, chat_id)
+            compiled = self._get_compiled(self.GLOBAL_KEY, self.global_triggers)
+            response = await self._check_triggers(message_text, compiled, user_id, chat_id, first_name)
             if response:
                 return response
             
@@ -240,101 +393,117 @@ class TriggersModule:
             logger.error(f"❌ Ошибка проверки триггеров: {e}")
             return None
     
-    async def _check_triggers(self, message_text: str, triggers: Dict, 
-                            user_id: int, chat_id: int) -> Optional[str]:
-        """🔍 Проверка сообщения против набора триггеров"""
+    GLOBAL_KEY = '__global__'
+    
+    def _get_compiled(self, key: str, triggers: Dict) -> CompiledTriggerSet:
+        """⚙️ Скомпилированный набор триггеров (сборка только после изменений)"""
+        
+        # С хранилищем - его набор: он сбрасывается и при выключении триггера (set_active)
+        if self.store:
+            return self.store.compiled(key)
+        
+        compiled = self._compiled.get(key)
+        if compiled is None or compiled.source_size != len(triggers):
+            compiled = CompiledTriggerSet(triggers.values())
+            self._compiled[key] = compiled
+        return compiled
+    
+    def _invalidate_compiled(self, chat_key: Optional[str] = None):
+        """♻️ Сброс скомпилированного набора чата (None - глобальные и все чаты)"""
+        
+        if chat_key is None:
+            self._compiled.clear()
+        else:
+            self._compiled.pop(chat_key, None)
+    
+    async def _check_triggers(self, message_text: str, compiled: CompiledTriggerSet, 
+                            user_id: int, chat_id: int, first_name: str = '') -> Optional[str]:
+        """🔍 Проверка сообщения против скомпилированного набора за один проход"""
         
         try:
-            for trigger_id, trigger_data in triggers.items():
-                if not trigger_data.get('is_active', True):
-                    continue
+            trigger_data, offenders = await compiled.match_guarded(message_text, self.sandbox)
+            for offender in offenders:
+                self._disable_slow_regex(offender)
+            if not trigger_data:
+                return None
+            
+            trigger_id = trigger_data['id']
+            
+            # Откаты проверяются до шаблонизации ответа и любой записи в БД
+            settings = trigger_data.get('settings') or {}
+            cooldown = settings.get('cooldown') if isinstance(settings, dict) else None
+            if not self.cooldowns.try_fire(chat_id, user_id, trigger_id,
+                                           float(cooldown) if cooldown is not None else None):
+                return None
+            
+            # Обновляем статистику
+            if trigger_id not in self.trigger_stats:
+                self.trigger_stats[trigger_id] = 0
+            self.trigger_stats[trigger_id] += 1
+            
+            if self.store:
+                # Счетчик в памяти, строка активации - в пакетную запись
+                self.store.record_activation(trigger_data, user_id, chat_id, message_text)
+            else:
+                # Увеличиваем счетчик использования
+                trigger_data['usage_count'] = trigger_data.get('usage_count', 0) + 1
+                trigger_data['last_used'] = datetime.now().isoformat()
                 
-                # Проверяем соответствие
-                if await self._match_trigger(message_text, trigger_data):
-                    # Увеличиваем счетчик использования
-                    trigger_data['usage_count'] = trigger_data.get('usage_count', 0) + 1
-                    trigger_data['last_used'] = datetime.now().isoformat()
-                    
-                    # Обновляем статистику
-                    if trigger_id not in self.trigger_stats:
-                        self.trigger_stats[trigger_id] = 0
-                    self.trigger_stats[trigger_id] += 1
-                    
-                    # Сохраняем статистику
-                    asyncio.create_task(self.save_triggers())
-                    
-                    # Логируем срабатывание
-                    if self.db:
-                        await self.db.track_event(
-                            user_id, chat_id, 'trigger_activated',
-                            {'trigger_name': trigger_data['name'], 'trigger_id': trigger_id}
-                        )
-                    
-                    # Обрабатываем ответ триггера
-                    return await self._process_trigger_response(
-                        trigger_data['response'], user_id, chat_id, message_text
+                # Счетчики живут в памяти, на диск - отложенно
+                self._mark_dirty()
+
+                # Логируем срабатывание
+                if self.db:
+                    await self.db.track_event(
+                        user_id, chat_id, 'trigger_activated',
+                        {'trigger_name': trigger_data['name'], 'trigger_id': trigger_id}
                     )
             
-            return None
+            # Обрабатываем ответ триггера
+            return await self._process_trigger_response(
+                trigger_data['response'], user_id, chat_id, message_text, first_name
+            )
             
         except Exception as e:
             logger.error(f"❌ Ошибка при проверке набора триггеров: {e}")
             return None
     
-    async def _match_trigger(self, message_text: str, trigger_data: Dict) -> bool:
-        """🎯 Проверка соответствия сообщения триггеру"""
+    def _disable_slow_regex(self, trigger_data: Dict):
+        """🛑 Отключение триггера с зависающей регуляркой и уведомление создателя"""
+        
+        chat_key = None if trigger_data.get('is_global') else str(trigger_data.get('chat_id'))
+        self._invalidate_compiled(chat_key)
         
+        if self.store:
+            self.store.disable_slow_regex(trigger_data, self.sandbox.timeout)
+            return
+        
+        if not trigger_data.get('is_active', True):
+            return
+        
+        trigger_data['is_active'] = False
+        self._mark_dirty()
+        logger.warning(f"🛑 Триггер {trigger_data['name']} отключен: регулярка превысила бюджет")
+        
+        if self._notifier and trigger_data.get('creator_id'):
+            asyncio.create_task(self._notify(
+                trigger_data['creator_id'], disabled_notice(trigger_data, self.sandbox.timeout)
+            ))
+    
+    async def _notify(self, user_id: int, text: str):
         try:
-            pattern = trigger_data['pattern']
-            trigger_type = trigger_data.get('type', 'contains')
-            
-            # Приводим к нижнему регистру для сравнения
-            message_lower = message_text.lower()
-            pattern_lower = pattern.lower()
-            
-            if trigger_type == 'exact':
-                return message_lower == pattern_lower
-            elif trigger_type == 'contains':
-                return pattern_lower in message_lower
-            elif trigger_type == 'starts_with':
-                return message_lower.startswith(pattern_lower)
-            elif trigger_type == 'ends_with':
-                return message_lower.endswith(pattern_lower)
-            elif trigger_type == 'regex':
-                try:
-                    return bool(re.search(pattern, message_text, re.IGNORECASE))
-                except re.error:
-                    logger.warning(f"⚠️ Некорректное регулярное выражение в триггере: {pattern}")
-                    return False
-            else:
-                # По умолчанию - contains
-                return pattern_lower in message_lower
-                
+            await self._notifier(user_id, text)
         except Exception as e:
-            logger.error(f"❌ Ошибка сопоставления триггера: {e}")
-            return False
+            logger.debug(f"Не удалось уведомить {user_id}: {e}")
     
     async def _process_trigger_response(self, response: str, user_id: int, 
-                                      chat_id: int, original_message: str) -> str:
+                                      chat_id: int, original_message: str,
+                                      first_name: str = '') -> str:
         """🔧 Обработка ответа триггера с заменой переменных"""
         
         try:
-            processed_response = response
-            
-            # Заменяем переменные
-            replacements = {
-                '{user_id}': str(user_id),
-                '{chat_id}': str(chat_id),
-                '{message}': original_message,
-                '{time}': datetime.now().strftime('%H:%M'),
-                '{date}': datetime.now().strftime('%d.%m.%Y'),
-                '{datetime}': datetime.now().strftime('%d.%m.%Y %H:%M')
-            }
-            
-            for placeholder, value in replacements.items():
-                processed_response = processed_response.replace(placeholder, value)
-            
-            return processed_response
+            # Шаблон разбирается один раз на текст ответа, дальше - только рендер
+            return compile_template(response).render(user_id, chat_id, original_message, first_name)
             
         except Exception as e:
             logger.error(f"❌ Ошибка обработки ответа триггера: {e}")
@@ -507,6 +676,7 @@ class TriggersModule:
             'loaded_triggers': len(self.triggers),
             'global_triggers': len(self.global_triggers),
             'trigger_types': list(self.trigger_types.keys()),
+            'cooldowns': self.cooldowns.get_stats(),
             'status': 'active'
         }
 
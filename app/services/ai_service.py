@@ -9,6 +9,8 @@
 import logging
 import asyncio
 import json
+import math
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 import aiohttp
@@ -16,17 +18,35 @@ from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Цены моделей в USD за 1M токенов: (prompt, completion)
+MODEL_PRICING = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'claude-3-5-sonnet-20241022': (3.00, 15.00),
+    'claude-3-haiku-20240307': (0.25, 1.25),
+    'claude-3-opus-20240229': (15.00, 75.00)
+}
+
+# Предел сводки ранней части диалога в промпте
+MAX_PROMPT_SUMMARY_CHARS = 800
+
 
 class AIService:
     """🧠 Сервис искусственного интеллекта"""
     
-    def __init__(self, config):
+    def __init__(self, config, db_service=None):
         self.config = config
         self.ai_config = config.ai
+        self.db = db_service
         
         # Кэш ответов
         self.response_cache = TTLCache(maxsize=100, ttl=3600)  # 1 час
         
+        # Запросы в полете: одинаковые промпты ждут один вызов провайдера
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
         # Счетчики лимитов
         self.daily_usage = {}
         self.user_usage = {}
@@ -43,33 +63,58 @@ class AIService:
         logger.info("🧠 AI Service инициализирован")
     
     async def generate_response(self, prompt: str, user_id: int = None, 
-                              context: Dict = None) -> Optional[str]:
+                              context: Dict = None, chat_id: int = None) -> Optional[str]:
         """🎯 Генерация ответа от AI"""
         
+        future = None
+        
         try:
             # Проверяем лимиты
             if not self._check_limits(user_id):
                 return "❌ Превышен лимит запросов к AI. Попробуйте позже."
             
+            started = time.perf_counter()
+            
             # Проверяем кэш
             cache_key = self._generate_cache_key(prompt, context)
             if cache_key in self.response_cache:
                 logger.debug("📋 Ответ получен из кэша")
+                self._emit_telemetry({
+                    'user_id': user_id, 'chat_id': chat_id, 'prompt': prompt,
+                    'response_time': time.perf_counter() - started, 'cache_hit': True
+                })
                 return self.response_cache[cache_key]
             
+            # Тот же промпт уже в работе - ждем его вместо второго вызова
+            inflight = self._inflight.get(cache_key)
+            if inflight is not None:
+                response = await asyncio.shield(inflight)
+                self._emit_telemetry({
+                    'user_id': user_id, 'chat_id': chat_id, 'prompt': prompt,
+                    'response_time': time.perf_counter() - started, 'coalesced': True,
+                    'success': bool(response)
+                })
+                return response or "❌ AI сервисы временно недоступны. Проверьте настройки API ключей."
+            
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[cache_key] = future
+            
             # Подготавливаем промпт с контекстом
             enhanced_prompt = self._enhance_prompt(prompt, context)
             
             # Генерируем ответ
             response = None
+            call_meta = {'user_id': user_id, 'chat_id': chat_id, 'prompt': prompt}
             
             # Пробуем OpenAI
             if self.ai_config.openai_api_key:
-                response = await self._call_openai(enhanced_prompt)
+                response = await self._call_openai(enhanced_prompt, call_meta)
             
             # Если OpenAI не сработал, пробуем Anthropic
             if not response and self.ai_config.anthropic_api_key:
-                response = await self._call_anthropic(enhanced_prompt)
+                response = await self._call_anthropic(enhanced_prompt, call_meta)
+            
+            future.set_result(response)
             
             if not response:
                 return "❌ AI сервисы временно недоступны. Проверьте настройки API ключей."
@@ -85,10 +130,20 @@ class AIService:
         except Exception as e:
             logger.error(f"❌ Ошибка генерации ответа: {e}")
             return "❌ Произошла ошибка при обращении к AI. Попробуйте позже."
+        
+        finally:
+            if future is not None:
+                if not future.done():
+                    future.set_result(None)
+                if self._inflight.get(cache_key) is future:
+                    del self._inflight[cache_key]
     
-    async def _call_openai(self, prompt: str) -> Optional[str]:
+    async def _call_openai(self, prompt: str, call_meta: Dict = None) -> Optional[str]:
         """🔵 Вызов OpenAI API"""
         
+        telemetry = {**(call_meta or {}), 'provider': 'openai', 'model': self.ai_config.default_model}
+        started = time.perf_counter()
+        
         try:
             url = "https://api.openai.com/v1/chat/completions"
             headers = {
@@ -111,20 +166,35 @@ class AIService:
             
             async with aiohttp.ClientSession() as session:
                 async with session.post(url, headers=headers, json=data, timeout=30) as resp:
+                    telemetry['ttfb'] = time.perf_counter() - started
                     if resp.status == 200:
                         result = await resp.json()
-                        return result['choices'][0]['message']['content'].strip()
+                        usage = result.get('usage') or {}
+                        telemetry['prompt_tokens'] = usage.get('prompt_tokens', 0)
+                        telemetry['completion_tokens'] = usage.get('completion_tokens', 0)
+                        content = result['choices'][0]['message']['content'].strip()
+                        telemetry['response'] = content
+                        return content
                     else:
                         logger.error(f"OpenAI API ошибка {resp.status}: {await resp.text()}")
+                        telemetry['success'] = False
                         return None
                         
         except Exception as e:
             logger.error(f"❌ Ошибка вызова OpenAI: {e}")
+            telemetry['success'] = False
             return None
+        
+        finally:
+            telemetry['response_time'] = time.perf_counter() - started
+            self._emit_telemetry(telemetry)
     
-    async def _call_anthropic(self, prompt: str) -> Optional[str]:
+    async def _call_anthropic(self, prompt: str, call_meta: Dict = None) -> Optional[str]:
         """🟠 Вызов Anthropic Claude API"""
         
+        telemetry = {**(call_meta or {}), 'provider': 'anthropic'}
+        started = time.perf_counter()
+        
         try:
             url = "https://api.anthropic.com/v1/messages"
             headers = {
@@ -139,6 +209,7 @@ class AIService:
                 model = "claude-3-haiku-20240307"
             elif "opus" in self.ai_config.default_model.lower():
                 model = "claude-3-opus-20240229"
+            telemetry['model'] = model
             
             data = {
                 "model": model,
@@ -154,16 +225,114 @@ class AIService:
             
             async with aiohttp.ClientSession() as session:
                 async with session.post(url, headers=headers, json=data, timeout=30) as resp:
+                    telemetry['ttfb'] = time.perf_counter() - started
                     if resp.status == 200:
                         result = await resp.json()
-                        return result['content'][0]['text'].strip()
+                        usage = result.get('usage') or {}
+                        telemetry['prompt_tokens'] = usage.get('input_tokens', 0)
+                        telemetry['completion_tokens'] = usage.get('output_tokens', 0)
+                        content = result['content'][0]['text'].strip()
+                        telemetry['response'] = content
+                        return content
                     else:
                         logger.error(f"Anthropic API ошибка {resp.status}: {await resp.text()}")
+                        telemetry['success'] = False
                         return None
                         
         except Exception as e:
             logger.error(f"❌ Ошибка вызова Anthropic: {e}")
+            telemetry['success'] = False
             return None
+        
+        finally:
+            telemetry['response_time'] = time.perf_counter() - started
+            self._emit_telemetry(telemetry)
+    
+    def _emit_telemetry(self, record: Dict[str, Any]):
+        """📡 Отправка записи телеметрии в пакетный писатель БД"""
+        
+        try:
+            record.setdefault('model', self.ai_config.default_model)
+            record.setdefault('provider', 'cache' if record.get('cache_hit') else None)
+            record['cost_usd'] = self.estimate_cost(
+                record.get('model'),
+                record.get('prompt_tokens', 0),
+                record.get('completion_tokens', 0)
+            )
+            
+            if self.db and hasattr(self.db, 'log_ai_telemetry'):
+                self.db.log_ai_telemetry(record)
+                
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи телеметрии AI: {e}")
+    
+    @staticmethod
+    def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """💵 Оценка стоимости вызова в USD"""
+        
+        model = model or ''
+        pricing = MODEL_PRICING.get(model)
+        if pricing is None:
+            # Датированный снимок ("gpt-4o-mini-2024-07-18") - по самому длинному префиксу
+            prefixes = [name for name in MODEL_PRICING if model.startswith(name)]
+            pricing = MODEL_PRICING[max(prefixes, key=len)] if prefixes else (0.0, 0.0)
+        prompt_price, completion_price = pricing
+        return ((prompt_tokens or 0) * prompt_price + (completion_tokens or 0) * completion_price) / 1_000_000
+    
+    @staticmethod
+    def aggregate_telemetry(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """📊 Агрегация телеметрии по (день, модель) с перцентилями задержки"""
+        
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        
+        for row in rows:
+            key = (row.get('day'), row.get('model_used') or 'unknown')
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'day': key[0], 'model': key[1], 'requests': 0, 'cache_hits': 0,
+                    'coalesced': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                    'cost_usd': 0.0, '_latencies': [], '_ttfb': []
+                }
+            
+            group['requests'] += 1
+            group['prompt_tokens'] += row.get('prompt_tokens') or 0
+            group['completion_tokens'] += row.get('completion_tokens') or 0
+            group['cost_usd'] += row.get('cost_usd') or 0.0
+            
+            if row.get('cache_hit'):
+                group['cache_hits'] += 1
+                continue
+            if row.get('coalesced'):
+                group['coalesced'] += 1
+                continue
+            if not row.get('success', True):
+                group['errors'] += 1
+            
+            # Перцентили считаются только по реальным вызовам провайдера
+            if row.get('response_time') is not None:
+                group['_latencies'].append(row['response_time'])
+            if row.get('ttfb') is not None:
+                group['_ttfb'].append(row['ttfb'])
+        
+        def percentile(values: List[float], pct: float) -> Optional[float]:
+            if not values:
+                return None
+            index = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+            return values[index]
+        
+        result = []
+        for key in sorted(groups):
+            group = groups[key]
+            latencies = sorted(group.pop('_latencies'))
+            ttfb = sorted(group.pop('_ttfb'))
+            group['p50'] = percentile(latencies, 50)
+            group['p95'] = percentile(latencies, 95)
+            group['p99'] = percentile(latencies, 99)
+            group['ttfb_p50'] = percentile(ttfb, 50)
+            result.append(group)
+        
+        return result
     
     def _enhance_prompt(self, prompt: str, context: Dict = None) -> str:
         """💡 Улучшение промпта с контекстом"""
@@ -186,6 +355,11 @@ class AIService:
                     recent_memory = memory[-6:]  # Последние 3 обмена
                     memory_text = "\n".join(recent_memory)
                     enhanced = f"Контекст диалога:\n{memory_text}\n\nТекущий вопрос: {prompt}"
+                    
+                    # Свернутая часть долгого диалога (длина ограничена памятью)
+                    summary = context.get('long_term_summary')
+                    if summary:
+                        enhanced = f"Ранее в диалоге: {summary[:MAX_PROMPT_SUMMARY_CHARS]}\n\n{enhanced}"
             
             return enhanced
             
@@ -285,6 +459,7 @@ class AIService:
                 'daily_usage': self.daily_usage.get(today, 0),
                 'daily_limit': self.ai_config.daily_limit,
                 'cache_size': len(self.response_cache),
+                'inflight_requests': len(self._inflight),
                 'openai_available': bool(self.ai_config.openai_api_key),
                 'anthropic_available': bool(self.ai_config.anthropic_api_key),
                 'default_model': self.ai_config.default_model
@@ -295,4 +470,4 @@ class AIService:
             return {}
 
 
-__all__ = ["AIService"]
\ No newline at end of file
+__all__ = ["AIService", "MODEL_PRICING"]
\ No newline at end of file
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+📦 BATCH WRITER v3.0
+🗄️ Пакетная запись в SQLite
+
+Горячий путь только кладет (query, params) в очередь, а фоновая задача
+сбрасывает накопленное через executemany одной транзакцией.
+
+У писателя свое соединение с файлом БД: commit() или rollback() других
+вызовов (DatabaseService.execute, TriggerStore.add, ...) не задевают его
+незавершенный пакет, а его откат после битой строки не отменяет чужие
+записи. Очередность записей между соединениями обеспечивает сама SQLite
+(ожидание блокировки до timeout).
+"""
+
+import logging
+import asyncio
+from typing import Dict, Any, List, Tuple, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """📦 Фоновый пакетный писатель со своим aiosqlite-соединением"""
+
+    def __init__(self, db_path: str, flush_interval: float = 1.0, max_batch: int = 500,
+                 timeout: float = 30.0, foreign_keys: bool = True):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.foreign_keys = foreign_keys
+        self.connection = None
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        # Очередь в порядке поступления: [(query, params), ...]
+        self._pending: List[Tuple[str, tuple]] = []
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # Статистика
+        self.stats = {'enqueued': 0, 'written': 0, 'flushes': 0, 'errors': 0}
+
+    def enqueue(self, query: str, params: tuple = ()):
+        """➕ Постановка записи в очередь (без await, без I/O)"""
+
+        if self._closed:
+            logger.warning("⚠️ BatchWriter закрыт, запись отброшена")
+            return
+
+        self._pending.append((query, tuple(params)))
+        self.stats['enqueued'] += 1
+
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def start(self):
+        """🚀 Открытие соединения писателя и запуск фоновой задачи сброса"""
+
+        if self.connection is None:
+            self.connection = await aiosqlite.connect(self.db_path, timeout=self.timeout)
+            # PRAGMA действуют на соединение: те же проверки, что у основного
+            await self.connection.execute(f"PRAGMA foreign_keys={'ON' if self.foreign_keys else 'OFF'}")
+            await self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("📦 BatchWriter запущен")
+
+    async def _run(self):
+        """🔄 Цикл сброса очереди"""
+
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """💾 Сброс очереди одной транзакцией"""
+
+        async with self._lock:
+            if not self._pending or self.connection is None:
+                return 0
+
+            batch, self._pending = self._pending, []
+
+            # Группируем подряд идущие одинаковые запросы, сохраняя порядок
+            groups: List[Tuple[str, List[tuple]]] = []
+            for query, params in batch:
+                if groups and groups[-1][0] == query:
+                    groups[-1][1].append(params)
+                else:
+                    groups.append((query, [params]))
+
+            try:
+                for query, rows in groups:
+                    await self.connection.executemany(query, rows)
+                await self.connection.commit()
+
+                self.stats['written'] += len(batch)
+                self.stats['flushes'] += 1
+                return len(batch)
+
+            except Exception as e:
+                logger.error(f"❌ Ошибка пакетной записи ({len(batch)} строк): {e}")
+                try:
+                    await self.connection.rollback()
+                except Exception:
+                    pass
+                return await self._flush_row_by_row(batch)
+
+    async def _flush_row_by_row(self, batch: List[Tuple[str, tuple]]) -> int:
+        """🩹 Запасной путь: одна битая строка не должна терять весь пакет"""
+
+        written = 0
+        for query, params in batch:
+            try:
+                await self.connection.execute(query, params)
+                written += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.debug(f"Отброшена строка пакета: {e}")
+
+        try:
+            await self.connection.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка фиксации пакета: {e}")
+            return 0
+
+        self.stats['written'] += written
+        self.stats['flushes'] += 1
+        return written
+
+    async def close(self):
+        """🔒 Остановка с финальным сбросом"""
+
+        self._closed = True
+        self._wakeup.set()
+
+        if self._task:
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"❌ Ошибка остановки BatchWriter: {e}")
+            self._task = None
+
+        await self.flush()
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+        logger.info("📦 BatchWriter остановлен")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика писателя"""
+
+        return {**self.stats, 'pending': len(self._pending)}
+
+
+__all__ = ["BatchWriter"]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+🔨 BOT ENFORCER v3.0
+🤖 Вызовы Bot API для действий модерации
+
+Одна точка, где действие модерации (бан, мут, кик, удаление, локдаун)
+превращается в вызов Telegram. ModerationModule и RaidGuard не знают
+про бота: они ставят enforcer(kind, chat_id, user_id, until, message_id)
+в ModerationExecutor, а тот выполняет вызовы с ограничением частоты и
+повтором после 429.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from aiogram.types import ChatPermissions
+
+from app.modules.raid_guard import RAID_LOCK, RAID_UNLOCK, RAID_RESTRICT, RAID_BAN
+
+logger = logging.getLogger(__name__)
+
+ENFORCE_BAN = RAID_BAN
+ENFORCE_UNBAN = 'unban'
+ENFORCE_MUTE = 'mute'
+ENFORCE_UNMUTE = 'unmute'
+ENFORCE_KICK = 'kick'
+ENFORCE_DELETE = 'delete'
+ENFORCE_LOCK = RAID_LOCK
+ENFORCE_UNLOCK = RAID_UNLOCK
+
+# Права участника после снятия мута
+UNMUTED_PERMISSIONS = ChatPermissions(
+    can_send_messages=True, can_send_audios=True, can_send_documents=True,
+    can_send_photos=True, can_send_videos=True, can_send_video_notes=True,
+    can_send_voice_notes=True, can_send_polls=True, can_send_other_messages=True,
+    can_add_web_page_previews=True
+)
+
+# Локдаун при рейде: только текст (медленный режим через Bot API не включить)
+LOCKDOWN_PERMISSIONS = ChatPermissions(can_send_messages=True)
+MUTED_PERMISSIONS = ChatPermissions(can_send_messages=False)
+
+
+class BotEnforcer:
+    """🔨 enforcer(kind, chat_id, user_id, until, message_id) поверх aiogram Bot"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        # Права чатов на время локдауна (возвращаются после)
+        self._saved_permissions: Dict[int, ChatPermissions] = {}
+        self.stats: Dict[str, int] = {}
+
+    async def __call__(self, kind: str, chat_id: int, user_id: Optional[int] = None,
+                       until: Optional[datetime] = None, message_id: Optional[int] = None) -> Any:
+        self.stats[kind] = self.stats.get(kind, 0) + 1
+        bot = self.bot
+
+        if kind == ENFORCE_DELETE:
+            return await bot.delete_message(chat_id, message_id)
+        if kind in (ENFORCE_MUTE, RAID_RESTRICT):
+            return await bot.restrict_chat_member(chat_id, user_id, permissions=MUTED_PERMISSIONS, until_date=until)
+        if kind == ENFORCE_UNMUTE:
+            return await bot.restrict_chat_member(chat_id, user_id, permissions=UNMUTED_PERMISSIONS)
+        if kind == ENFORCE_BAN:
+            return await bot.ban_chat_member(chat_id, user_id, until_date=until)
+        if kind == ENFORCE_UNBAN:
+            return await bot.unban_chat_member(chat_id, user_id, only_if_banned=True)
+        if kind == ENFORCE_KICK:
+            # Кик = бан и сразу разбан: участник может вернуться по ссылке
+            await bot.ban_chat_member(chat_id, user_id)
+            return await bot.unban_chat_member(chat_id, user_id, only_if_banned=True)
+        if kind == ENFORCE_LOCK:
+            chat = await bot.get_chat(chat_id)
+            self._saved_permissions[chat_id] = chat.permissions or UNMUTED_PERMISSIONS
+            return await bot.set_chat_permissions(chat_id, LOCKDOWN_PERMISSIONS)
+        if kind == ENFORCE_UNLOCK:
+            return await bot.set_chat_permissions(chat_id, self._saved_permissions.pop(chat_id, UNMUTED_PERMISSIONS))
+
+        logger.warning(f"⚠️ Неизвестное действие модерации: {kind}")
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Вызовы по видам"""
+        return {**self.stats, 'locked_chats': len(self._saved_permissions)}
+
+
+__all__ = [
+    "BotEnforcer", "MUTED_PERMISSIONS", "UNMUTED_PERMISSIONS", "LOCKDOWN_PERMISSIONS",
+    "ENFORCE_BAN", "ENFORCE_UNBAN", "ENFORCE_MUTE", "ENFORCE_UNMUTE", "ENFORCE_KICK",
+    "ENFORCE_DELETE", "ENFORCE_LOCK", "ENFORCE_UNLOCK"
+]
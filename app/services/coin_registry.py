@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+🗂️ COIN REGISTRY v3.0
+🔍 Локальный индекс монет CoinGecko
+
+Разрешение запроса пользователя в coin_id без сетевых запросов:
+точное совпадение ID / символа / названия, префикс по отсортированному
+массиву ключей и исправление опечаток (расстояние 1) по индексу удалений.
+"""
+
+import re
+import logging
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько кандидатов просматривать при поиске по префиксу
+PREFIX_SCAN_LIMIT = 64
+
+# Минимальная длина запроса для префикса и исправления опечаток
+MIN_PREFIX_LENGTH = 3
+MIN_FUZZY_LENGTH = 4
+
+_SPACES = re.compile(r"\s+")
+_COIN_ID = re.compile(r"^[a-z0-9][a-z0-9-]*$")
+
+
+def normalize_key(text: str) -> str:
+    """🔧 Ключ индекса: нижний регистр, одиночные пробелы"""
+
+    return _SPACES.sub(" ", (text or "").lower()).strip()
+
+
+def looks_like_coin_id(text: str) -> bool:
+    """🔎 Похоже ли на ID CoinGecko (bitcoin, the-open-network)"""
+
+    return bool(_COIN_ID.match(text))
+
+
+def _edit_distance_within_one(a: str, b: str) -> bool:
+    """📏 Расстояние Дамерау-Левенштейна не больше 1"""
+
+    if a == b:
+        return True
+
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        # Перестановка соседних символов
+        return (len(diff) == 2 and diff[1] == diff[0] + 1
+                and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+
+    if la > lb:
+        a, b = b, a
+    # b длиннее на один символ: ищем вставку
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+def _deletes(key: str) -> Iterable[str]:
+    """✂️ Варианты ключа с одним удаленным символом"""
+
+    for i in range(len(key)):
+        yield key[:i] + key[i + 1:]
+
+
+class CoinRegistry:
+    """🗂️ Индекс монет: id, символы, названия, префиксы, опечатки"""
+
+    def __init__(self):
+        self.coins: Dict[str, Tuple[str, str]] = {}   # coin_id -> (symbol, name)
+        self.by_symbol: Dict[str, List[str]] = {}
+        self.by_name: Dict[str, List[str]] = {}
+        self.ranks: Dict[str, int] = {}
+
+        # Отсортированный массив (ключ, coin_id) для поиска по префиксу
+        self._prefix_keys: List[Tuple[str, str]] = []
+
+        # Индекс удалений только по ранжированным монетам:
+        # опечатки почти всегда касаются известных монет, а полный индекс тяжелый
+        self._fuzzy: Dict[str, List[str]] = {}
+
+        self.updated_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.coins)
+
+    def load(self, coins: Iterable[Dict[str, Any]], updated_at: Optional[float] = None):
+        """📥 Полная перестройка индекса из списка /coins/list"""
+
+        table = {}
+        for coin in coins:
+            coin_id = normalize_key(coin.get('id'))
+            if not coin_id:
+                continue
+            table[coin_id] = (normalize_key(coin.get('symbol')), normalize_key(coin.get('name')))
+
+        self.coins = table
+        self.updated_at = updated_at
+        self._rebuild()
+
+    def set_ranks(self, ranks: Dict[str, int]):
+        """🏆 Ранги капитализации для разрешения неоднозначностей"""
+
+        if ranks == self.ranks:
+            return
+
+        self.ranks = dict(ranks)
+        self._rebuild()
+
+    def _rank(self, coin_id: str) -> Tuple[float, int, str]:
+        return (self.ranks.get(coin_id) or float('inf'), len(coin_id), coin_id)
+
+    def _rebuild(self):
+        """🔁 Пересчет производных индексов"""
+
+        by_symbol: Dict[str, List[str]] = {}
+        by_name: Dict[str, List[str]] = {}
+        prefix_keys = []
+
+        for coin_id, (symbol, name) in self.coins.items():
+            if symbol:
+                by_symbol.setdefault(symbol, []).append(coin_id)
+            if name:
+                by_name.setdefault(name, []).append(coin_id)
+                prefix_keys.append((name, coin_id))
+            prefix_keys.append((coin_id, coin_id))
+
+        for index in (by_symbol, by_name):
+            for ids in index.values():
+                ids.sort(key=self._rank)
+
+        prefix_keys.sort()
+
+        fuzzy: Dict[str, List[str]] = {}
+        for coin_id in self.ranks:
+            if coin_id not in self.coins:
+                continue
+            symbol, name = self.coins[coin_id]
+            for key in {coin_id, symbol, name}:
+                if len(key) < MIN_FUZZY_LENGTH - 1:
+                    continue
+                for variant in (key, *_deletes(key)):
+                    fuzzy.setdefault(variant, []).append(coin_id)
+
+        self.by_symbol = by_symbol
+        self.by_name = by_name
+        self._prefix_keys = prefix_keys
+        self._fuzzy = fuzzy
+
+    # =================== ПОИСК ===================
+
+    def resolve(self, query: str) -> Optional[str]:
+        """🔍 Запрос -> coin_id: точное, затем префикс, затем опечатка"""
+
+        key = normalize_key(query)
+        if not key:
+            return None
+
+        return (self.lookup_exact(key)
+                or self.lookup_prefix(key)
+                or self.lookup_fuzzy(key))
+
+    def lookup_exact(self, key: str) -> Optional[str]:
+        """🎯 Точное совпадение ID, символа или названия"""
+
+        if key in self.coins:
+            return key
+
+        ids = self.by_symbol.get(key) or self.by_name.get(key)
+        if ids:
+            return ids[0]
+
+        # "ethereum classic" -> ethereum-classic
+        dashed = key.replace(" ", "-")
+        if dashed in self.coins:
+            return dashed
+
+        return None
+
+    def lookup_prefix(self, key: str) -> Optional[str]:
+        """🔤 Лучшая по рангу монета, чье название или ID начинается с запроса"""
+
+        if len(key) < MIN_PREFIX_LENGTH:
+            return None
+
+        keys = self._prefix_keys
+        start = bisect_left(keys, (key, ""))
+        best = None
+
+        for i in range(start, min(start + PREFIX_SCAN_LIMIT, len(keys))):
+            candidate, coin_id = keys[i]
+            if not candidate.startswith(key):
+                break
+            if best is None or self._rank(coin_id) < self._rank(best):
+                best = coin_id
+
+        return best
+
+    def lookup_fuzzy(self, key: str) -> Optional[str]:
+        """🩹 Исправление одной опечатки среди ранжированных монет"""
+
+        if len(key) < MIN_FUZZY_LENGTH:
+            return None
+
+        best = None
+        for variant in (key, *_deletes(key)):
+            for coin_id in self._fuzzy.get(variant, ()):
+                if best is not None and self._rank(coin_id) >= self._rank(best):
+                    continue
+                symbol, name = self.coins[coin_id]
+                if any(_edit_distance_within_one(key, target) for target in (coin_id, symbol, name)):
+                    best = coin_id
+
+        return best
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Размеры индексов"""
+
+        return {
+            'coins': len(self.coins),
+            'symbols': len(self.by_symbol),
+            'prefix_keys': len(self._prefix_keys),
+            'fuzzy_keys': len(self._fuzzy),
+            'updated_at': self.updated_at
+        }
+
+
+__all__ = ["CoinRegistry", "normalize_key", "looks_like_coin_id"]
@@ -9,23 +9,79 @@
 import logging
 import asyncio
 import json
+import math
+import time
 import aiohttp
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
-from cachetools import TTLCache
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, List, Optional, Tuple
+from cachetools import TTLCache, LRUCache
+
+from app.services.coin_registry import CoinRegistry, normalize_key, looks_like_coin_id
+from app.services.price_alerts import PriceAlertEngine
+from app.services.price_history import PriceHistoryStore
 
 logger = logging.getLogger(__name__)
 
+# Максимальный размер страницы /coins/markets
+MARKETS_PAGE_SIZE = 250
+
+# Пауза после 429 без заголовка Retry-After
+DEFAULT_RETRY_AFTER = 60
+
 
 class CryptoService:
     """₿ Сервис криптовалют"""
     
-    def __init__(self, config):
+    def __init__(self, config, db_service=None):
         self.config = config
         self.crypto_config = config.crypto
+        self.db = db_service
+        
+        # Кэш курсов вне снимка: coin_id -> {'coin': ..., 'fetched_at': ...}
+        # Записи живут до stale_ttl_seconds: свежие отдаем как есть,
+        # устаревшие - сразу, с фоновым обновлением
+        self.price_cache = LRUCache(maxsize=1000)
+        self._price_tasks: Dict[str, asyncio.Task] = {}
+        
+        # Негативный кэш несуществующих ID (404 от API)
+        self.negative_cache = TTLCache(
+            maxsize=5000, ttl=max(1, self.crypto_config.negative_cache_ttl_seconds)
+        )
+        
+        # До этого момента (time.time()) запросы к API не отправляются - 429
+        self._backoff_until = 0.0
+        
+        # Рыночный снимок топ-N монет: запросы обслуживаются из памяти
+        self.market_table: Dict[str, Dict[str, Any]] = {}
+        self.market_symbols: Dict[str, str] = {}
+        self.market_ranked: List[str] = []
+        self.snapshot_updated_at: Optional[float] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._snapshot_lock = asyncio.Lock()
         
-        # Кэш для курсов
-        self.price_cache = TTLCache(maxsize=1000, ttl=300)  # 5 минут
+        # Локальный индекс всех монет из /coins/list
+        self.registry = CoinRegistry()
+        self._registry_task: Optional[asyncio.Task] = None
+        
+        # История цен снимка для графиков и изменений за период
+        self.history: Optional[PriceHistoryStore] = None
+        self._history_persisted_at = time.time()
+        if self.crypto_config.price_history_enabled:
+            self.history = PriceHistoryStore(db_service)
+        
+        # Ценовые алерты проверяются на каждом обновлении снимка
+        self.alerts: Optional[PriceAlertEngine] = None
+        if self.crypto_config.price_alerts:
+            self.alerts = PriceAlertEngine(
+                db_service,
+                max_per_user=self.crypto_config.max_alerts_per_user,
+                messages_per_second=self.crypto_config.alert_messages_per_second
+            )
+        
+        # Тренды: последний результат + фоновая задача обновления
+        self._trending: Optional[Dict[str, Any]] = None
+        self._trending_task: Optional[asyncio.Task] = None
         
         # Популярные криптовалюты
         self.popular_coins = {
@@ -56,6 +112,398 @@ class CryptoService:
         
         logger.info("₿ Crypto Service инициализирован")
     
+    async def initialize(self):
+        """🚀 Прогрев снимка из БД и запуск фонового обновления"""
+        
+        await self._load_registry_from_db()
+        await self._load_snapshot_from_db()
+        
+        if self.history:
+            try:
+                await self.history.load()
+            except Exception as e:
+                logger.error(f"❌ Ошибка загрузки истории цен: {e}")
+        
+        if self.alerts:
+            try:
+                await self.alerts.load(self._coin_symbol)
+            except Exception as e:
+                logger.error(f"❌ Ошибка загрузки алертов: {e}")
+        
+        if self.crypto_config.market_snapshot_enabled and self._snapshot_task is None:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+        
+        if self.crypto_config.coin_registry_refresh_hours > 0 and self._registry_task is None:
+            self._registry_task = asyncio.create_task(self._registry_loop())
+    
+    # =================== РЫНОЧНЫЙ СНИМОК ===================
+    
+    async def _snapshot_loop(self):
+        """🔄 Периодическое обновление снимка каждые cache_ttl_seconds"""
+        
+        while True:
+            try:
+                if await self.refresh_market_snapshot():
+                    self._record_history()
+                    await self._evaluate_alerts()
+                # Тренды обновляем сразу после снимка, чтобы детали брались из памяти
+                await self._start_trending_refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка цикла рыночного снимка: {e}")
+            
+            await asyncio.sleep(max(30, self.crypto_config.cache_ttl_seconds))
+    
+    async def refresh_market_snapshot(self) -> bool:
+        """📥 Загрузка топ-N монет через /coins/markets (один запрос на 250 монет)"""
+        
+        async with self._snapshot_lock:
+            top_n = max(1, self.crypto_config.market_snapshot_size)
+            pages = math.ceil(top_n / MARKETS_PAGE_SIZE)
+            url = f"{self.base_url}/coins/markets"
+            
+            coins: List[Dict[str, Any]] = []
+            
+            try:
+                async with aiohttp.ClientSession() as session:
+                    for page in range(1, pages + 1):
+                        params = {
+                            'vs_currency': self.crypto_config.default_vs_currency,
+                            'order': 'market_cap_desc',
+                            'per_page': MARKETS_PAGE_SIZE,
+                            'page': page,
+                            'sparkline': 'false',
+                            'price_change_percentage': '1h,24h,7d'
+                        }
+                        status, page_data = await self._get_json(session, url, params, timeout=20)
+                        if status != 200:
+                            logger.error(f"Ошибка API рынка (страница {page}): {status}")
+                            break
+                        
+                        coins.extend(self._normalize_market_row(row) for row in page_data)
+                        if len(page_data) < MARKETS_PAGE_SIZE:
+                            break
+                        
+            except Exception as e:
+                logger.error(f"❌ Ошибка загрузки рыночного снимка: {e}")
+            
+            if not coins:
+                # Старый снимок остается в силе
+                return False
+            
+            self._apply_snapshot(coins[:top_n], time.time())
+            self._persist_snapshot(coins[:top_n])
+            
+            logger.info(f"📥 Рыночный снимок обновлен: {len(self.market_table)} монет")
+            return True
+    
+    def _record_history(self):
+        """📈 Точка истории по каждой монете снимка + периодическое сохранение"""
+        
+        if not self.history:
+            return
+        
+        self.history.record_snapshot(self.market_table, self.snapshot_updated_at)
+        
+        if time.time() - self._history_persisted_at >= self.crypto_config.price_history_persist_minutes * 60:
+            self.history.persist()
+            self._history_persisted_at = time.time()
+    
+    def get_price_points(self, coin_id: str, hours: float = 24) -> List[Tuple[datetime, float]]:
+        """📊 Точки (время, цена) из истории для графика"""
+        
+        if not self.history:
+            return []
+        
+        return [
+            (datetime.fromtimestamp(ts), price)
+            for ts, price in self.history.get_points(coin_id, hours, time.time())
+        ]
+    
+    async def _evaluate_alerts(self):
+        """🔔 Проверка алертов: цены из снимка, остальные - одним запросом по ids"""
+        
+        if not self.alerts:
+            return
+        
+        coin_ids = self.alerts.coins()
+        if not coin_ids:
+            return
+        
+        prices = {
+            coin_id: self.market_table[coin_id]['current_price']
+            for coin_id in coin_ids if coin_id in self.market_table
+        }
+        
+        missing = [coin_id for coin_id in coin_ids if coin_id not in prices]
+        if missing:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    for start in range(0, len(missing), MARKETS_PAGE_SIZE):
+                        coins = await self._fetch_markets_by_ids(session, missing[start:start + MARKETS_PAGE_SIZE])
+                        prices.update(
+                            (coin_id, coin['current_price'])
+                            for coin_id, coin in coins.items() if coin.get('current_price') is not None
+                        )
+            except Exception as e:
+                logger.error(f"❌ Ошибка получения цен для алертов: {e}")
+        
+        triggered = self.alerts.evaluate(prices)
+        if triggered:
+            logger.info(f"🔔 Сработало алертов: {len(triggered)}")
+    
+    def _coin_symbol(self, coin_id: str) -> Optional[str]:
+        """🔤 Символ монеты по ID (снимок, затем реестр)"""
+        
+        coin = self.market_table.get(coin_id)
+        if coin:
+            return coin['symbol']
+        entry = self.registry.coins.get(coin_id)
+        return entry[0] if entry else None
+    
+    def _normalize_market_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """🔧 Строка /coins/markets в формат _fetch_coin_data"""
+        
+        return {
+            'id': row.get('id'),
+            'name': row.get('name'),
+            'symbol': row.get('symbol') or '',
+            'current_price': row.get('current_price'),
+            'market_cap': row.get('market_cap'),
+            'market_cap_rank': row.get('market_cap_rank'),
+            'total_volume': row.get('total_volume'),
+            'price_change_24h': row.get('price_change_24h'),
+            'price_change_percentage_24h': row.get('price_change_percentage_24h') or 0,
+            'price_change_percentage_1h': row.get('price_change_percentage_1h_in_currency'),
+            'price_change_percentage_7d': row.get('price_change_percentage_7d_in_currency'),
+            'circulating_supply': row.get('circulating_supply'),
+            'total_supply': row.get('total_supply'),
+            'ath': row.get('ath'),
+            'atl': row.get('atl'),
+            'last_updated': row.get('last_updated')
+        }
+    
+    def _apply_snapshot(self, coins: List[Dict[str, Any]], updated_at: float):
+        """🔁 Атомарная замена таблиц снимка"""
+        
+        table = {}
+        symbols = {}
+        ranked = []
+        
+        for coin in coins:
+            coin_id = coin.get('id')
+            if not coin_id or coin.get('current_price') is None:
+                continue
+            
+            table[coin_id] = coin
+            ranked.append(coin_id)
+            
+            # Символ достается монете с наибольшей капитализацией
+            symbol = coin['symbol'].lower()
+            if symbol and symbol not in symbols:
+                symbols[symbol] = coin_id
+        
+        ranked.sort(key=lambda cid: table[cid].get('market_cap_rank') or float('inf'))
+        
+        self.market_table = table
+        self.market_symbols = symbols
+        self.market_ranked = ranked
+        self.snapshot_updated_at = updated_at
+        
+        # Ранги снимка разрешают неоднозначные символы в реестре
+        self.registry.set_ranks({
+            coin_id: table[coin_id].get('market_cap_rank') or position
+            for position, coin_id in enumerate(ranked, 1)
+        })
+    
+    def _persist_snapshot(self, coins: List[Dict[str, Any]]):
+        """💾 Запись снимка в crypto_cache через пакетный писатель"""
+        
+        writer = getattr(self.db, 'writer', None)
+        if not writer:
+            return
+        
+        now = datetime.now()
+        for coin in coins:
+            if not coin.get('id'):
+                continue
+            
+            writer.enqueue("""
+                INSERT OR REPLACE INTO crypto_cache
+                (coin_id, coin_symbol, coin_name, price_data, market_data, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                coin['id'],
+                coin['symbol'],
+                coin.get('name'),
+                json.dumps({
+                    'usd': coin.get('current_price'),
+                    'change_24h': coin.get('price_change_percentage_24h'),
+                    'change_7d': coin.get('price_change_percentage_7d')
+                }),
+                json.dumps(coin),
+                now
+            ))
+    
+    async def _load_snapshot_from_db(self):
+        """📤 Прогрев снимка из crypto_cache после рестарта"""
+        
+        if not self.db or not hasattr(self.db, 'fetchall'):
+            return
+        
+        try:
+            rows = await self.db.fetchall(
+                "SELECT market_data, last_updated FROM crypto_cache WHERE market_data IS NOT NULL"
+            )
+            
+            coins = []
+            newest = None
+            for row in rows:
+                try:
+                    coins.append(json.loads(row['market_data']))
+                except (TypeError, ValueError):
+                    continue
+                
+                try:
+                    updated = datetime.fromisoformat(str(row['last_updated'])).timestamp()
+                    newest = updated if newest is None else max(newest, updated)
+                except ValueError:
+                    pass
+            
+            if coins:
+                self._apply_snapshot(coins, newest or time.time())
+                logger.info(f"📤 Снимок рынка загружен из БД: {len(self.market_table)} монет")
+                
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки снимка из БД: {e}")
+    
+    # =================== РЕЕСТР МОНЕТ ===================
+    
+    async def _registry_loop(self):
+        """🔄 Обновление реестра раз в coin_registry_refresh_hours"""
+        
+        period = self.crypto_config.coin_registry_refresh_hours * 3600
+        
+        while True:
+            try:
+                age = time.time() - (self.registry.updated_at or 0)
+                if age >= period:
+                    if not await self.refresh_coin_registry():
+                        # Повторяем раньше, если API недоступен
+                        await asyncio.sleep(600)
+                        continue
+                    age = 0
+                
+                await asyncio.sleep(max(60, period - age))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка цикла реестра монет: {e}")
+                await asyncio.sleep(600)
+    
+    async def refresh_coin_registry(self) -> bool:
+        """📥 Полный список монет через /coins/list"""
+        
+        try:
+            async with aiohttp.ClientSession() as session:
+                status, coins = await self._get_json(session, f"{self.base_url}/coins/list", timeout=30)
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки списка монет: {e}")
+            return False
+        
+        if status != 200 or not coins:
+            logger.error(f"Ошибка API списка монет: {status}")
+            return False
+        
+        self.registry.load(coins, time.time())
+        self._persist_registry()
+        
+        logger.info(f"🗂️ Реестр монет обновлен: {len(self.registry)} монет")
+        return True
+    
+    def _persist_registry(self):
+        """💾 Замена coin_registry одной транзакцией пакетного писателя"""
+        
+        writer = getattr(self.db, 'writer', None)
+        if not writer:
+            return
+        
+        now = datetime.now()
+        # Все строки ставятся в очередь синхронно и сбрасываются одним пакетом
+        writer.enqueue("DELETE FROM coin_registry")
+        for coin_id, (symbol, name) in self.registry.coins.items():
+            writer.enqueue(
+                "INSERT OR REPLACE INTO coin_registry (coin_id, symbol, name, updated_at) VALUES (?, ?, ?, ?)",
+                (coin_id, symbol, name, now)
+            )
+    
+    async def _load_registry_from_db(self):
+        """📤 Прогрев реестра из coin_registry после рестарта"""
+        
+        if not self.db or not hasattr(self.db, 'fetchall'):
+            return
+        
+        try:
+            rows = await self.db.fetchall("SELECT coin_id, symbol, name, updated_at FROM coin_registry")
+            if not rows:
+                return
+            
+            updated_at = None
+            for row in rows:
+                try:
+                    updated = datetime.fromisoformat(str(row['updated_at'])).timestamp()
+                    updated_at = updated if updated_at is None else min(updated_at, updated)
+                except ValueError:
+                    continue
+            
+            self.registry.load(
+                ({'id': row['coin_id'], 'symbol': row['symbol'], 'name': row['name']} for row in rows),
+                updated_at
+            )
+            logger.info(f"📤 Реестр монет загружен из БД: {len(self.registry)} монет")
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки реестра монет из БД: {e}")
+    
+    async def get_coin_data(self, coin_query: str) -> Optional[Dict[str, Any]]:
+        """💾 Сырые данные монеты: из снимка, а вне топ-N - из API"""
+        
+        coin_id = self._normalize_coin_query(coin_query)
+        if not coin_id:
+            return None
+        
+        coin = self.market_table.get(coin_id)
+        if coin:
+            return coin
+        
+        if coin_id in self.negative_cache:
+            return None
+        
+        entry = self.price_cache.get(coin_id)
+        if entry:
+            age = time.time() - entry['fetched_at']
+            if age > self.crypto_config.cache_ttl_seconds:
+                self._start_price_refresh(coin_id)
+            if age <= self.crypto_config.stale_ttl_seconds or self.get_backoff_remaining() > 0:
+                return entry['coin']
+        
+        return await asyncio.shield(self._start_price_refresh(coin_id))
+    
+    def get_top_crypto(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """🏆 Топ монет по капитализации из снимка"""
+        
+        return [self.market_table[coin_id] for coin_id in self.market_ranked[:limit]]
+    
+    def get_snapshot_age(self) -> Optional[float]:
+        """⏱️ Возраст снимка в секундах"""
+        
+        if self.snapshot_updated_at is None:
+            return None
+        return time.time() - self.snapshot_updated_at
+    
+    # =================== ЗАПРОСЫ КУРСОВ ===================
+    
     async def get_crypto_price(self, coin_query: str, user_id: int = None) -> Dict[str, Any]:
         """💰 Получение курса криптовалюты"""
         
@@ -70,29 +518,62 @@ class CryptoService:
                     'suggestions': list(self.popular_coins.keys())[:5]
                 }
             
-            # Проверяем кэш
-            cache_key = f"price_{coin_id}"
-            if cache_key in self.price_cache:
-                cached_data = self.price_cache[cache_key]
-                cached_data['from_cache'] = True
-                return cached_data
+            # Монеты из снимка отдаем из памяти
+            snapshot_coin = self.market_table.get(coin_id)
+            if snapshot_coin:
+                age = self.get_snapshot_age()
+                return self._cached_response(snapshot_coin, coin_query, user_id, age,
+                                             stale=age is not None and age > 2 * self.crypto_config.cache_ttl_seconds,
+                                             snapshot_age=age)
             
-            # Запрашиваем данные
-            price_data = await self._fetch_coin_data(coin_id)
-            
-            if not price_data:
+            # Недавно получали 404 - в API не ходим
+            if coin_id in self.negative_cache:
                 return {
                     'error': True,
-                    'message': 'Не удалось получить данные о криптовалюте',
-                    'suggestions': list(self.popular_coins.keys())[:3]
+                    'message': f'Криптовалюта "{coin_query}" не найдена',
+                    'suggestions': list(self.popular_coins.keys())[:5]
                 }
             
-            # Формируем ответ
-            result = self._format_price_response(price_data, coin_query, user_id)
+            ttl = self.crypto_config.cache_ttl_seconds
+            entry = self.price_cache.get(coin_id)
+            
+            if entry:
+                age = time.time() - entry['fetched_at']
+                if age <= ttl:
+                    return self._cached_response(entry['coin'], coin_query, user_id, age)
+                
+                if age <= self.crypto_config.stale_ttl_seconds or self.get_backoff_remaining() > 0:
+                    # Отдаем устаревшее сразу, обновляем в фоне
+                    self._start_price_refresh(coin_id)
+                    return self._cached_response(entry['coin'], coin_query, user_id, age, stale=True)
+            
+            # Промах: ждем единственный запрос по монете
+            coin = await asyncio.shield(self._start_price_refresh(coin_id))
+            
+            if not coin and entry and coin_id not in self.negative_cache:
+                # Лучше старый курс, чем ошибка
+                age = time.time() - entry['fetched_at']
+                return self._cached_response(entry['coin'], coin_query, user_id, age, stale=True)
             
-            # Сохраняем в кэш
-            self.price_cache[cache_key] = result
+            if not coin:
+                if coin_id in self.negative_cache:
+                    message = f'Криптовалюта "{coin_query}" не найдена'
+                elif self.get_backoff_remaining() > 0:
+                    message = (f'CoinGecko ограничил запросы, попробуйте через '
+                               f'{math.ceil(self.get_backoff_remaining())} сек')
+                else:
+                    message = 'Не удалось получить данные о криптовалюте'
+                
+                return {
+                    'error': True,
+                    'message': message,
+                    'suggestions': list(self.popular_coins.keys())[:3]
+                }
             
+            result = self._format_price_response(coin, coin_query, user_id)
+            result['from_cache'] = False
+            result['cache_age'] = 0.0
+            result['stale'] = False
             return result
             
         except Exception as e:
@@ -103,60 +584,63 @@ class CryptoService:
                 'details': str(e)
             }
     
+    def _cached_response(self, coin: Dict[str, Any], coin_query: str, user_id: Optional[int],
+                         age: Optional[float], stale: bool = False, **extra) -> Dict[str, Any]:
+        """📦 Свежий ответ поверх закэшированных данных (кэш не изменяется)"""
+        
+        result = self._format_price_response(coin, coin_query, user_id)
+        result.update(from_cache=True, cache_age=age, stale=stale, **extra)
+        return result
+    
+    def _start_price_refresh(self, coin_id: str) -> asyncio.Task:
+        """🔄 Единственная задача обновления курса на монету"""
+        
+        task = self._price_tasks.get(coin_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refresh_price(coin_id))
+            self._price_tasks[coin_id] = task
+        return task
+    
+    async def _refresh_price(self, coin_id: str) -> Optional[Dict[str, Any]]:
+        """📥 Загрузка курса монеты вне снимка в кэш"""
+        
+        try:
+            coin = await self._fetch_coin_data(coin_id)
+            if coin:
+                self.price_cache[coin_id] = {'coin': coin, 'fetched_at': time.time()}
+            return coin
+        finally:
+            self._price_tasks.pop(coin_id, None)
+    
     async def get_trending_crypto(self, limit: int = 7) -> Dict[str, Any]:
-        """🔥 Получение трендовых криптовалют"""
+        """🔥 Получение трендовых криптовалют (stale-while-revalidate)"""
         
         try:
-            cache_key = "trending_crypto"
+            entry = self._trending
             
-            # Проверяем кэш
-            if cache_key in self.price_cache:
-                return self.price_cache[cache_key]
+            if entry is None:
+                # Холодный старт: ждем единственную загрузку
+                entry = await asyncio.shield(self._start_trending_refresh())
+                if entry is None:
+                    return {
+                        'error': True,
+                        'message': 'Не удалось получить трендовые криптовалюты'
+                    }
+            elif time.time() - entry['fetched_at'] > self.crypto_config.cache_ttl_seconds:
+                # Отдаем устаревшее сразу, обновляем в фоне
+                self._start_trending_refresh()
             
-            # Запрашиваем трендовые монеты
-            url = f"{self.base_url}/search/trending"
-            headers = self._get_headers()
+            age = time.time() - entry['fetched_at']
+            return {
+                'error': False,
+                'trending_coins': entry['coins'][:limit],
+                'update_time': entry['update_time'],
+                'source': 'CoinGecko',
+                'from_cache': True,
+                'cache_age': age,
+                'stale': age > self.crypto_config.cache_ttl_seconds
+            }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        trending_coins = data.get('coins', [])[:limit]
-                        
-                        # Получаем подробную информацию о трендовых монетах
-                        detailed_coins = []
-                        for coin_info in trending_coins:
-                            coin_id = coin_info['item']['id']
-                            coin_data = await self._fetch_coin_data(coin_id)
-                            
-                            if coin_data:
-                                detailed_coins.append({
-                                    'name': coin_data['name'],
-                                    'symbol': coin_data['symbol'].upper(),
-                                    'price': self._format_price(coin_data['current_price']),
-                                    'change_24h': self._format_change(coin_data.get('price_change_percentage_24h', 0)),
-                                    'market_cap_rank': coin_data.get('market_cap_rank', 'N/A'),
-                                    'market_cap': self._format_market_cap(coin_data.get('market_cap', 0))
-                                })
-                        
-                        result = {
-                            'error': False,
-                            'trending_coins': detailed_coins,
-                            'update_time': datetime.now().strftime('%H:%M'),
-                            'source': 'CoinGecko'
-                        }
-                        
-                        # Сохраняем в кэш
-                        self.price_cache[cache_key] = result
-                        return result
-                    
-                    else:
-                        logger.error(f"Ошибка API трендов: {resp.status}")
-                        return {
-                            'error': True,
-                            'message': 'Не удалось получить трендовые криптовалюты'
-                        }
-                        
         except Exception as e:
             logger.error(f"❌ Ошибка получения трендовых криптовалют: {e}")
             return {
@@ -164,6 +648,87 @@ class CryptoService:
                 'message': 'Произошла ошибка при получении трендов'
             }
     
+    def _start_trending_refresh(self) -> asyncio.Task:
+        """🔄 Единственная фоновая задача обновления трендов"""
+        
+        if self._trending_task is None or self._trending_task.done():
+            self._trending_task = asyncio.create_task(self._refresh_trending())
+        return self._trending_task
+    
+    async def _refresh_trending(self) -> Optional[Dict[str, Any]]:
+        """📥 /search/trending + детали одним пакетом"""
+        
+        try:
+            url = f"{self.base_url}/search/trending"
+            
+            async with aiohttp.ClientSession() as session:
+                status, data = await self._get_json(session, url, timeout=10)
+                if status != 200:
+                    logger.error(f"Ошибка API трендов: {status}")
+                    return self._trending
+                
+                coin_ids = [
+                    coin_info['item']['id']
+                    for coin_info in data.get('coins', [])
+                    if coin_info.get('item', {}).get('id')
+                ]
+                
+                # Детали берем из снимка, недостающие - одним запросом /coins/markets?ids=
+                details = {cid: self.market_table[cid] for cid in coin_ids if cid in self.market_table}
+                missing = [cid for cid in coin_ids if cid not in details]
+                if missing:
+                    details.update(await self._fetch_markets_by_ids(session, missing))
+            
+            coins = []
+            for coin_id in coin_ids:
+                coin_data = details.get(coin_id)
+                if not coin_data or coin_data.get('current_price') is None:
+                    continue
+                
+                coins.append({
+                    'name': coin_data['name'],
+                    'symbol': coin_data['symbol'].upper(),
+                    'price': self._format_price(coin_data['current_price']),
+                    'change_24h': self._format_change(coin_data.get('price_change_percentage_24h') or 0),
+                    'market_cap_rank': coin_data.get('market_cap_rank') or 'N/A',
+                    'market_cap': self._format_market_cap(coin_data.get('market_cap', 0))
+                })
+            
+            self._trending = {
+                'coins': coins,
+                'fetched_at': time.time(),
+                'update_time': datetime.now().strftime('%H:%M')
+            }
+            return self._trending
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления трендов: {e}")
+            return self._trending
+    
+    async def _fetch_markets_by_ids(self, session: aiohttp.ClientSession,
+                                    coin_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """📊 Пакетное получение данных монет через /coins/markets?ids="""
+        
+        params = {
+            'vs_currency': self.crypto_config.default_vs_currency,
+            'ids': ','.join(coin_ids),
+            'per_page': MARKETS_PAGE_SIZE,
+            'sparkline': 'false',
+            'price_change_percentage': '1h,24h,7d'
+        }
+        
+        status, rows = await self._get_json(session, f"{self.base_url}/coins/markets", params, timeout=10)
+        if status != 200:
+            logger.error(f"Ошибка API рынка (ids): {status}")
+            return {}
+        
+        result = {}
+        for row in rows:
+            coin = self._normalize_market_row(row)
+            if coin.get('id'):
+                result[coin['id']] = coin
+        return result
+    
     async def _fetch_coin_data(self, coin_id: str) -> Optional[Dict]:
         """📊 Получение данных о монете"""
         
@@ -178,61 +743,113 @@ class CryptoService:
                 'sparkline': 'false'
             }
             
-            headers = self._get_headers()
-            
             async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, headers=headers, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        
-                        # Извлекаем нужные данные
-                        market_data = data.get('market_data', {})
-                        usd_data = market_data.get('current_price', {}).get('usd')
-                        
-                        if usd_data is None:
-                            return None
-                        
-                        return {
-                            'id': data.get('id'),
-                            'name': data.get('name'),
-                            'symbol': data.get('symbol'),
-                            'current_price': usd_data,
-                            'market_cap': market_data.get('market_cap', {}).get('usd'),
-                            'market_cap_rank': market_data.get('market_cap_rank'),
-                            'total_volume': market_data.get('total_volume', {}).get('usd'),
-                            'price_change_24h': market_data.get('price_change_24h'),
-                            'price_change_percentage_24h': market_data.get('price_change_percentage_24h'),
-                            'circulating_supply': market_data.get('circulating_supply'),
-                            'total_supply': market_data.get('total_supply'),
-                            'ath': market_data.get('ath', {}).get('usd'),
-                            'atl': market_data.get('atl', {}).get('usd'),
-                            'last_updated': market_data.get('last_updated')
-                        }
-                    else:
-                        logger.error(f"Ошибка API монеты: {resp.status}")
-                        return None
-                        
+                status, data = await self._get_json(session, url, params, timeout=10)
+            
+            if status == 404:
+                # Запоминаем, чтобы опечатки не били по лимиту API
+                self.negative_cache[coin_id] = True
+                return None
+            
+            if status != 200:
+                logger.error(f"Ошибка API монеты: {status}")
+                return None
+            
+            # Извлекаем нужные данные
+            market_data = data.get('market_data', {})
+            usd_data = market_data.get('current_price', {}).get('usd')
+            
+            if usd_data is None:
+                return None
+            
+            return {
+                'id': data.get('id'),
+                'name': data.get('name'),
+                'symbol': data.get('symbol'),
+                'current_price': usd_data,
+                'market_cap': market_data.get('market_cap', {}).get('usd'),
+                'market_cap_rank': market_data.get('market_cap_rank'),
+                'total_volume': market_data.get('total_volume', {}).get('usd'),
+                'price_change_24h': market_data.get('price_change_24h'),
+                'price_change_percentage_24h': market_data.get('price_change_percentage_24h'),
+                'price_change_percentage_7d': market_data.get('price_change_percentage_7d'),
+                'circulating_supply': market_data.get('circulating_supply'),
+                'total_supply': market_data.get('total_supply'),
+                'ath': market_data.get('ath', {}).get('usd'),
+                'atl': market_data.get('atl', {}).get('usd'),
+                'last_updated': market_data.get('last_updated')
+            }
+            
         except Exception as e:
             logger.error(f"❌ Ошибка получения данных монеты {coin_id}: {e}")
             return None
     
+    async def _get_json(self, session: aiohttp.ClientSession, url: str,
+                        params: Optional[Dict[str, Any]] = None,
+                        timeout: int = 10) -> Tuple[int, Any]:
+        """🌐 GET к CoinGecko с учетом паузы после 429"""
+        
+        if self.get_backoff_remaining() > 0:
+            return 429, None
+        
+        async with session.get(url, params=params, headers=self._get_headers(), timeout=timeout) as resp:
+            if resp.status == 429:
+                delay = self._parse_retry_after(resp.headers.get('Retry-After'))
+                self._backoff_until = max(self._backoff_until, time.time() + delay)
+                logger.warning(f"⏳ CoinGecko 429, пауза запросов на {delay:.0f} сек")
+                return 429, None
+            
+            if resp.status != 200:
+                return resp.status, None
+            
+            return 200, await resp.json()
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> float:
+        """⏱️ Retry-After: секунды или HTTP-дата"""
+        
+        if not value:
+            return DEFAULT_RETRY_AFTER
+        
+        try:
+            return max(1.0, float(value))
+        except ValueError:
+            pass
+        
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(1.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER
+    
+    def get_backoff_remaining(self) -> float:
+        """⏳ Сколько секунд еще действует пауза после 429"""
+        
+        return max(0.0, self._backoff_until - time.time())
+    
     def _normalize_coin_query(self, query: str) -> Optional[str]:
         """🔍 Нормализация запроса монеты"""
         
-        query_lower = query.lower().strip()
+        query_lower = normalize_key(query)
+        if not query_lower:
+            return None
         
         # Проверяем популярные монеты
         if query_lower in self.popular_coins:
             return self.popular_coins[query_lower]
         
-        # Проверяем по частичному совпадению
-        for key, value in self.popular_coins.items():
-            if query_lower in key or key in query_lower:
-                return value
+        # Точное совпадение с ID или символом из снимка
+        if query_lower in self.market_table:
+            return query_lower
+        if query_lower in self.market_symbols:
+            return self.market_symbols[query_lower]
         
-        # Если не найдено, возвращаем исходный запрос
-        # (возможно, это точный ID монеты)
-        return query_lower if len(query_lower) > 2 else None
+        # Реестр: точное совпадение, префикс, опечатка - без сети
+        if len(self.registry):
+            return self.registry.resolve(query_lower)
+        
+        # Реестр еще не загружен: передаем в API только то, что похоже на ID
+        return query_lower if looks_like_coin_id(query_lower) and len(query_lower) > 2 else None
     
     def _format_price_response(self, coin_data: Dict, original_query: str, user_id: int = None) -> Dict[str, Any]:
         """📝 Форматирование ответа о цене"""
@@ -249,6 +866,7 @@ class CryptoService:
                 'price_raw': price,
                 'change_24h': change_24h,
                 'change_24h_formatted': self._format_change(change_24h),
+                'change_7d': self.get_change_7d(coin_data),
                 'trend_emoji': self._get_trend_emoji(change_24h),
                 'market_cap': self._format_market_cap(coin_data.get('market_cap')),
                 'volume_24h': self._format_volume(coin_data.get('total_volume')),
@@ -267,6 +885,14 @@ class CryptoService:
                 'message': 'Ошибка обработки данных о криптовалюте'
             }
     
+    def get_change_7d(self, coin_data: Dict) -> Optional[float]:
+        """📊 Изменение за 7 дней: из API, иначе из локальной истории"""
+        
+        change = coin_data.get('price_change_percentage_7d')
+        if change is None and self.history and coin_data.get('id'):
+            change = self.history.change_percent(coin_data['id'], 24 * 7, time.time())
+        return change
+    
     def _format_price(self, price: float) -> str:
         """💰 Форматирование цены"""
         
@@ -432,8 +1058,34 @@ class CryptoService:
         """🔒 Закрытие сервиса"""
         
         try:
+            if self._snapshot_task:
+                self._snapshot_task.cancel()
+                try:
+                    await self._snapshot_task
+                except asyncio.CancelledError:
+                    pass
+                self._snapshot_task = None
+            
+            if self._trending_task and not self._trending_task.done():
+                self._trending_task.cancel()
+            
+            if self._registry_task:
+                self._registry_task.cancel()
+                self._registry_task = None
+            
+            if self.alerts:
+                await self.alerts.close()
+            
+            if self.history:
+                self.history.persist()
+            
+            for task in list(self._price_tasks.values()):
+                task.cancel()
+            self._price_tasks.clear()
+            
             # Очищаем кэш
             self.price_cache.clear()
+            self.negative_cache.clear()
             
             logger.info("₿ Crypto Service закрыт")
             
@@ -445,6 +1097,13 @@ class CryptoService:
         
         return {
             'cache_size': len(self.price_cache),
+            'negative_cache_size': len(self.negative_cache),
+            'backoff_seconds': self.get_backoff_remaining(),
+            'snapshot_coins': len(self.market_table),
+            'registry_coins': len(self.registry),
+            'alerts': self.alerts.get_stats() if self.alerts else None,
+            'history': self.history.get_stats() if self.history else None,
+            'snapshot_age_seconds': self.get_snapshot_age(),
             'popular_coins_count': len(self.popular_coins),
             'api_key_configured': bool(self.crypto_config.coingecko_api_key),
             'service_enabled': self.crypto_config.enabled
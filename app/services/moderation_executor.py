@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+🚦 MODERATION EXECUTOR v3.0
+⏱️ Очередь вызовов Bot API для модерации с ограничением частоты
+
+Во время рейда модерация порождает сотни вызовов (ограничить новичка,
+удалить сообщение, забанить), и если слать их сразу, Telegram начинает
+отвечать 429 самому боту. Вызовы кладутся в очередь без await, фоновая
+задача выполняет их пачками не чаще calls_per_second в секунду.
+
+У каждого чата своя очередь, пачка берет из чатов по кругу не больше
+одного вызова, поэтому действия в одном чате выполняются строго по
+порядку (удалить сообщение, потом ограничить), а шумный чат не
+задерживает остальные. Ответ 429 (исключение с retry_after) возвращает
+вызов в голову очереди его чата, и чат ждет указанное время.
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALLS_PER_SECOND = 20
+
+# Сколько вызовов запускать одной пачкой (параллельно)
+DEFAULT_MAX_BATCH = 10
+
+# Сколько раз повторять вызов после 429
+DEFAULT_MAX_RETRIES = 3
+
+
+@dataclass
+class QueuedCall:
+    """📨 Вызов в очереди чата"""
+    chat_id: int
+    call: Callable[[], Awaitable[Any]]
+    description: str = ''
+    attempts: int = 0
+
+
+class ModerationExecutor:
+    """🚦 Фоновое выполнение вызовов модерации с ограничением частоты"""
+
+    def __init__(self, calls_per_second: float = DEFAULT_CALLS_PER_SECOND, max_batch: int = DEFAULT_MAX_BATCH,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        self.calls_per_second = calls_per_second
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+
+        # чат -> его вызовы по порядку; порядок чатов - очередь обхода по кругу
+        self._queues: 'OrderedDict[int, deque]' = OrderedDict()
+        # чат -> момент (monotonic), до которого Telegram просил подождать
+        self._blocked: Dict[int, float] = {}
+        self._pending = 0
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.stats = {'submitted': 0, 'executed': 0, 'failed': 0, 'retried': 0, 'batches': 0}
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]], description: str = ''):
+        """➕ Вызов в очередь (без await); call - функция без аргументов, возвращающая корутину"""
+
+        if self._closed:
+            logger.warning(f"⚠️ Очередь модерации закрыта, вызов отброшен: {description}")
+            return
+
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(QueuedCall(chat_id, call, description))
+        self._pending += 1
+        self.stats['submitted'] += 1
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._closed or self._pending:
+            started = time.monotonic()
+            batch = self._next_batch(started)
+
+            if not batch:
+                # Пусто или все чаты ждут после 429 - спим до первого освобождения
+                timeout = min(self._blocked.values()) - started if self._pending and self._blocked else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            await self._execute(batch)
+
+            # Пачка из n вызовов "стоит" n / calls_per_second секунд
+            pause = len(batch) / self.calls_per_second - (time.monotonic() - started)
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+    def _next_batch(self, now: float) -> List[QueuedCall]:
+        """📦 По одному вызову из чатов по кругу (чаты после 429 пропускаются)"""
+
+        batch = []
+        for chat_id in list(self._queues):
+            if len(batch) >= self.max_batch:
+                break
+            blocked_until = self._blocked.get(chat_id)
+            if blocked_until is not None:
+                if blocked_until > now:
+                    continue
+                del self._blocked[chat_id]
+
+            queue = self._queues[chat_id]
+            batch.append(queue.popleft())
+            if queue:
+                self._queues.move_to_end(chat_id)
+            else:
+                del self._queues[chat_id]
+
+        self._pending -= len(batch)
+        return batch
+
+    async def _execute(self, batch: List[QueuedCall]):
+        results = await asyncio.gather(*(queued.call() for queued in batch), return_exceptions=True)
+        self.stats['batches'] += 1
+
+        for queued, result in zip(batch, results):
+            if not isinstance(result, Exception):
+                self.stats['executed'] += 1
+                continue
+
+            # TelegramRetryAfter: чат ждет, вызов возвращается первым в его очередь
+            retry_after = getattr(result, 'retry_after', None)
+            if retry_after is not None and queued.attempts < self.max_retries:
+                queued.attempts += 1
+                self._requeue(queued, retry_after)
+                self.stats['retried'] += 1
+                logger.warning(f"⚠️ 429 в {queued.chat_id} ({queued.description}), повтор через {retry_after} с")
+                continue
+
+            self.stats['failed'] += 1
+            logger.error(f"❌ Ошибка вызова модерации в {queued.chat_id} ({queued.description}): {result}")
+
+    def _requeue(self, queued: QueuedCall, retry_after: float):
+        chat_id = queued.chat_id
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.appendleft(queued)
+        self._pending += 1
+        self._blocked[chat_id] = max(self._blocked.get(chat_id, 0), time.monotonic() + retry_after)
+
+    async def close(self):
+        """🔒 Выполнение оставшихся вызовов и остановка"""
+
+        self._closed = True
+        self._wakeup.set()
+        if self._task:
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"❌ Ошибка остановки очереди модерации: {e}")
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика очереди"""
+
+        return {
+            **self.stats,
+            'pending': self._pending,
+            'chats_queued': len(self._queues),
+            'chats_waiting': len(self._blocked),
+            'calls_per_second': self.calls_per_second
+        }
+
+
+__all__ = ["ModerationExecutor", "QueuedCall"]
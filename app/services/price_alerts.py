@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+🔔 PRICE ALERTS v3.0
+📈 Движок ценовых алертов поверх crypto_alerts
+
+На каждую монету две кучи порогов: min-куча для "выше" и max-куча для
+"ниже". Проверка снимка снимает с вершин только сработавшие алерты,
+поэтому стоит O(сработавшие * log n), а монеты без алертов не
+просматриваются вовсе. Уведомления группируются по чату и уходят через
+отправителя с ограничением скорости.
+"""
+
+import heapq
+import logging
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable, Set
+
+logger = logging.getLogger(__name__)
+
+ALERT_ABOVE = 'above'
+ALERT_BELOW = 'below'
+
+
+@dataclass
+class PriceAlert:
+    """🔔 Активный алерт"""
+    id: int
+    user_id: int
+    chat_id: Optional[int]
+    coin_id: str
+    symbol: str
+    direction: str
+    threshold: float
+    created_price: Optional[float] = None
+
+
+class PriceAlertEngine:
+    """🔔 Хранение и проверка ценовых алертов"""
+
+    def __init__(self, db_service=None, max_per_user: int = 20,
+                 messages_per_second: float = 20.0, flush_interval: float = 1.0):
+        self.db = db_service
+        # crypto_alerts есть только у БД с fetchall (расширенная); иначе алерты живут в памяти
+        self.persistent = db_service is not None and hasattr(db_service, 'fetchall')
+        if db_service is not None and not self.persistent:
+            logger.warning("⚠️ БД без crypto_alerts: ценовые алерты не переживут перезапуск")
+        self.max_per_user = max_per_user
+        self.send_interval = 1.0 / max(0.1, messages_per_second)
+        self.flush_interval = flush_interval
+
+        self._alerts: Dict[int, PriceAlert] = {}
+        self._by_user: Dict[int, Set[int]] = {}
+        self._above: Dict[str, List[Tuple[float, int]]] = {}   # (порог, id)
+        self._below: Dict[str, List[Tuple[float, int]]] = {}   # (-порог, id)
+        self._local_ids = 0
+
+        # Очередь уведомлений: chat_id -> [строки]
+        self._outbox: Dict[int, List[str]] = {}
+        self._wakeup = asyncio.Event()
+        self._sender: Optional[Callable[[int, str], Awaitable[Any]]] = None
+        self._sender_task: Optional[asyncio.Task] = None
+
+        self.stats = {'triggered': 0, 'sent': 0, 'send_errors': 0}
+
+    # =================== ХРАНЕНИЕ ===================
+
+    async def load(self, symbol_lookup: Callable[[str], Optional[str]] = None):
+        """📤 Загрузка активных алертов из crypto_alerts"""
+
+        if not self.persistent:
+            return
+
+        rows = await self.db.fetchall("""
+            SELECT id, user_id, chat_id, coin_id, alert_type, trigger_price, current_price
+            FROM crypto_alerts WHERE is_active = 1
+        """)
+
+        for row in rows:
+            if row['alert_type'] not in (ALERT_ABOVE, ALERT_BELOW) or row['trigger_price'] is None:
+                continue
+
+            symbol = (symbol_lookup(row['coin_id']) if symbol_lookup else None) or row['coin_id']
+            self._index(PriceAlert(
+                id=row['id'],
+                user_id=row['user_id'],
+                chat_id=row['chat_id'],
+                coin_id=row['coin_id'],
+                symbol=symbol.upper(),
+                direction=row['alert_type'],
+                threshold=float(row['trigger_price']),
+                created_price=row['current_price']
+            ))
+
+        if rows:
+            logger.info(f"🔔 Загружено алертов: {len(self._alerts)}")
+
+    async def add_alert(self, user_id: int, chat_id: Optional[int], coin_id: str, symbol: str,
+                        direction: str, threshold: float,
+                        current_price: Optional[float] = None) -> Optional[PriceAlert]:
+        """➕ Новый алерт (None, если превышен лимит пользователя)"""
+
+        if direction not in (ALERT_ABOVE, ALERT_BELOW):
+            raise ValueError(f"Неизвестное направление алерта: {direction}")
+
+        if len(self._by_user.get(user_id, ())) >= self.max_per_user:
+            return None
+
+        if self.persistent:
+            cursor = await self.db.execute("""
+                INSERT INTO crypto_alerts
+                (user_id, chat_id, coin_id, alert_type, trigger_price, current_price, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, 1)
+            """, (user_id, chat_id, coin_id, direction, threshold, current_price))
+            alert_id = cursor.lastrowid
+        else:
+            self._local_ids -= 1
+            alert_id = self._local_ids
+
+        alert = PriceAlert(
+            id=alert_id,
+            user_id=user_id,
+            chat_id=chat_id,
+            coin_id=coin_id,
+            symbol=symbol.upper(),
+            direction=direction,
+            threshold=threshold,
+            created_price=current_price
+        )
+        self._index(alert)
+        return alert
+
+    def remove_alert(self, user_id: int, alert_id: int) -> bool:
+        """➖ Отмена алерта владельцем"""
+
+        alert = self._alerts.get(alert_id)
+        if not alert or alert.user_id != user_id:
+            return False
+
+        self._forget(alert)
+
+        # Удаление редкое: перестраиваем кучу одной монеты
+        index = self._above if alert.direction == ALERT_ABOVE else self._below
+        heap = [entry for entry in index.get(alert.coin_id, []) if entry[1] != alert_id]
+        if heap:
+            heapq.heapify(heap)
+            index[alert.coin_id] = heap
+        else:
+            index.pop(alert.coin_id, None)
+
+        self._write("UPDATE crypto_alerts SET is_active = 0 WHERE id = ?", (alert_id,))
+        return True
+
+    def _index(self, alert: PriceAlert):
+        self._alerts[alert.id] = alert
+        self._by_user.setdefault(alert.user_id, set()).add(alert.id)
+        if alert.direction == ALERT_ABOVE:
+            heapq.heappush(self._above.setdefault(alert.coin_id, []), (alert.threshold, alert.id))
+        else:
+            heapq.heappush(self._below.setdefault(alert.coin_id, []), (-alert.threshold, alert.id))
+
+    def _forget(self, alert: PriceAlert) -> PriceAlert:
+        self._alerts.pop(alert.id, None)
+        user_alerts = self._by_user.get(alert.user_id)
+        if user_alerts is not None:
+            user_alerts.discard(alert.id)
+            if not user_alerts:
+                del self._by_user[alert.user_id]
+        return alert
+
+    def _write(self, query: str, params: tuple):
+        writer = getattr(self.db, 'writer', None) if self.persistent else None
+        if writer:
+            writer.enqueue(query, params)
+
+    def get_user_alerts(self, user_id: int) -> List[PriceAlert]:
+        """📋 Активные алерты пользователя"""
+
+        return [self._alerts[alert_id] for alert_id in sorted(self._by_user.get(user_id, ()))]
+
+    def coins(self) -> Set[str]:
+        """₿ Монеты, по которым есть активные алерты"""
+
+        return self._above.keys() | self._below.keys()
+
+    # =================== ПРОВЕРКА ===================
+
+    def evaluate(self, prices: Dict[str, float]) -> List[PriceAlert]:
+        """⚡ Проверка алертов по новым ценам"""
+
+        triggered: List[Tuple[PriceAlert, float]] = []
+
+        for coin_id in list(self._above):
+            price = prices.get(coin_id)
+            if price is None:
+                continue
+            heap = self._above[coin_id]
+            while heap and heap[0][0] <= price:
+                _, alert_id = heapq.heappop(heap)
+                triggered.append((self._forget(self._alerts[alert_id]), price))
+            if not heap:
+                del self._above[coin_id]
+
+        for coin_id in list(self._below):
+            price = prices.get(coin_id)
+            if price is None:
+                continue
+            heap = self._below[coin_id]
+            while heap and -heap[0][0] >= price:
+                _, alert_id = heapq.heappop(heap)
+                triggered.append((self._forget(self._alerts[alert_id]), price))
+            if not heap:
+                del self._below[coin_id]
+
+        if not triggered:
+            return []
+
+        now = datetime.now()
+        for alert, price in triggered:
+            self._write("""
+                UPDATE crypto_alerts SET is_active = 0, triggered_at = ?, current_price = ?
+                WHERE id = ?
+            """, (now, price, alert.id))
+            self._queue_notification(alert, price)
+
+        self.stats['triggered'] += len(triggered)
+        self._wakeup.set()
+        return [alert for alert, _ in triggered]
+
+    # =================== УВЕДОМЛЕНИЯ ===================
+
+    def _queue_notification(self, alert: PriceAlert, price: float):
+        sign = '≥' if alert.direction == ALERT_ABOVE else '≤'
+        line = (
+            f'<a href="tg://user?id={alert.user_id}">🔔</a> <b>{alert.symbol}</b> '
+            f'{sign} ${alert.threshold:,.2f} — сейчас ${price:,.2f}'
+        )
+        target = alert.chat_id or alert.user_id
+        self._outbox.setdefault(target, []).append(line)
+
+    def set_sender(self, sender: Callable[[int, str], Awaitable[Any]]):
+        """📤 Корутина отправки: sender(chat_id, text)"""
+
+        self._sender = sender
+        self.start()
+
+    def start(self):
+        """🚀 Запуск фоновой отправки"""
+
+        if self._sender_task is None or self._sender_task.done():
+            self._sender_task = asyncio.create_task(self._sender_loop())
+
+    async def _sender_loop(self):
+        """🔄 Пакетная отправка с ограничением скорости"""
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if not self._sender or not self._outbox:
+                continue
+
+            outbox, self._outbox = self._outbox, {}
+            for chat_id, lines in outbox.items():
+                # Одно сообщение на чат, не длиннее лимита Telegram
+                for start in range(0, len(lines), 30):
+                    text = "<b>🔔 ЦЕНОВЫЕ АЛЕРТЫ</b>\n\n" + "\n".join(lines[start:start + 30])
+                    await self._send(chat_id, text)
+                    await asyncio.sleep(self.send_interval)
+
+    async def _send(self, chat_id: int, text: str):
+        for attempt in range(2):
+            try:
+                await self._sender(chat_id, text)
+                self.stats['sent'] += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # TelegramRetryAfter несет retry_after - ждем и пробуем еще раз
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after and attempt == 0:
+                    await asyncio.sleep(retry_after)
+                    continue
+                self.stats['send_errors'] += 1
+                logger.error(f"❌ Ошибка отправки алерта в {chat_id}: {e}")
+                return
+
+    async def close(self):
+        """🔒 Остановка отправки"""
+
+        if self._sender_task:
+            self._sender_task.cancel()
+            try:
+                await self._sender_task
+            except asyncio.CancelledError:
+                pass
+            self._sender_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика алертов"""
+
+        return {
+            **self.stats,
+            'active': len(self._alerts),
+            'coins': len(self.coins()),
+            'pending_chats': len(self._outbox)
+        }
+
+
+__all__ = ["PriceAlertEngine", "PriceAlert", "ALERT_ABOVE", "ALERT_BELOW"]
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+📈 PRICE HISTORY v3.0
+🕰️ Компактная история цен в памяти
+
+Для каждой монеты - кольцевые буферы array('d') с фиксированным шагом
+и тремя уровнями прореживания: 5 минут за сутки, час за неделю и день
+за год. Каждый слот хранит цену закрытия, максимум и минимум; монотонные
+очереди дают максимум/минимум окна уровня за O(1). Буферы сериализуются
+в BLOB и периодически сохраняются в price_history.
+"""
+
+import math
+import struct
+import logging
+from array import array
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (шаг в секундах, число слотов)
+PRICE_TIERS: Tuple[Tuple[int, int], ...] = (
+    (300, 288),      # 5 минут x 24 часа
+    (3600, 168),     # 1 час x 7 дней
+    (86400, 365),    # 1 день x 1 год
+)
+
+_NAN = float('nan')
+_HEADER = struct.Struct('<qII')
+
+
+class _Tier:
+    """🔁 Один уровень: кольцевые буферы close/high/low"""
+
+    __slots__ = ('resolution', 'capacity', 'close', 'high', 'low', 'last_slot', '_max', '_min')
+
+    def __init__(self, resolution: int, capacity: int):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.close = array('d', [_NAN]) * capacity
+        self.high = array('d', [_NAN]) * capacity
+        self.low = array('d', [_NAN]) * capacity
+        self.last_slot: Optional[int] = None
+
+        # Монотонные очереди (slot, value) для максимума и минимума окна
+        self._max: deque = deque()
+        self._min: deque = deque()
+
+    @property
+    def span(self) -> int:
+        return self.resolution * self.capacity
+
+    def add(self, ts: float, price: float):
+        slot = int(ts // self.resolution)
+
+        if self.last_slot is not None and slot < self.last_slot:
+            # Запоздавшие точки не переписывают историю
+            return
+
+        if self.last_slot is None or slot > self.last_slot:
+            first = slot - self.capacity + 1
+            if self.last_slot is not None:
+                first = max(first, self.last_slot + 1)
+            for skipped in range(first, slot + 1):
+                i = skipped % self.capacity
+                self.close[i] = self.high[i] = self.low[i] = _NAN
+            self.last_slot = slot
+            self._evict()
+
+        i = slot % self.capacity
+        self.close[i] = price
+
+        # Максимум слота только растет, минимум только падает -
+        # поэтому повторная запись в текущий слот сохраняет монотонность
+        if math.isnan(self.high[i]) or price > self.high[i]:
+            self.high[i] = price
+            while self._max and self._max[-1][1] <= price:
+                self._max.pop()
+            self._max.append((slot, price))
+
+        if math.isnan(self.low[i]) or price < self.low[i]:
+            self.low[i] = price
+            while self._min and self._min[-1][1] >= price:
+                self._min.pop()
+            self._min.append((slot, price))
+
+    def _evict(self):
+        oldest = self.last_slot - self.capacity
+        while self._max and self._max[0][0] <= oldest:
+            self._max.popleft()
+        while self._min and self._min[0][0] <= oldest:
+            self._min.popleft()
+
+    def covers(self, ts: float) -> bool:
+        if self.last_slot is None:
+            return False
+        slot = int(ts // self.resolution)
+        return self.last_slot - self.capacity < slot <= self.last_slot
+
+    def value_at(self, ts: float) -> Optional[float]:
+        """💰 Цена закрытия слота (или предыдущего, если слот пропущен)"""
+
+        slot = int(ts // self.resolution)
+        for candidate in (slot, slot - 1):
+            if self.last_slot - self.capacity < candidate <= self.last_slot:
+                value = self.close[candidate % self.capacity]
+                if not math.isnan(value):
+                    return value
+        return None
+
+    def window_range(self) -> Tuple[Optional[float], Optional[float]]:
+        if not self._max:
+            return None, None
+        return self._min[0][1], self._max[0][1]
+
+    def range_since(self, since: float) -> Tuple[Optional[float], Optional[float]]:
+        """📏 (мин, макс) слотов начиная с since (все окно - за O(1) из очередей)"""
+
+        if self.last_slot is None:
+            return None, None
+
+        first = int(since // self.resolution)
+        if first <= self.last_slot - self.capacity + 1:
+            return self.window_range()
+
+        lows = [self.low[slot % self.capacity] for slot in range(first, self.last_slot + 1)]
+        highs = [self.high[slot % self.capacity] for slot in range(first, self.last_slot + 1)]
+        lows = [value for value in lows if not math.isnan(value)]
+        highs = [value for value in highs if not math.isnan(value)]
+        if not lows:
+            return None, None
+        return min(lows), max(highs)
+
+    def points(self, since: float) -> List[Tuple[float, float]]:
+        """📊 (время слота, цена) начиная с since"""
+
+        if self.last_slot is None:
+            return []
+
+        first = max(self.last_slot - self.capacity + 1, int(since // self.resolution))
+        result = []
+        for slot in range(first, self.last_slot + 1):
+            value = self.close[slot % self.capacity]
+            if not math.isnan(value):
+                result.append((slot * self.resolution, value))
+        return result
+
+    def pack(self) -> bytes:
+        header = _HEADER.pack(self.last_slot if self.last_slot is not None else -1,
+                              self.resolution, self.capacity)
+        return header + self.close.tobytes() + self.high.tobytes() + self.low.tobytes()
+
+    @classmethod
+    def unpack(cls, data: memoryview) -> Tuple['_Tier', int]:
+        last_slot, resolution, capacity = _HEADER.unpack_from(data)
+        tier = cls(resolution, capacity)
+        offset = _HEADER.size
+        size = capacity * 8
+
+        for name in ('close', 'high', 'low'):
+            buffer = array('d')
+            buffer.frombytes(bytes(data[offset:offset + size]))
+            setattr(tier, name, buffer)
+            offset += size
+
+        if last_slot >= 0:
+            tier.last_slot = last_slot
+            # Восстанавливаем монотонные очереди проходом по окну
+            for slot in range(last_slot - capacity + 1, last_slot + 1):
+                i = slot % capacity
+                if not math.isnan(tier.high[i]):
+                    while tier._max and tier._max[-1][1] <= tier.high[i]:
+                        tier._max.pop()
+                    tier._max.append((slot, tier.high[i]))
+                if not math.isnan(tier.low[i]):
+                    while tier._min and tier._min[-1][1] >= tier.low[i]:
+                        tier._min.pop()
+                    tier._min.append((slot, tier.low[i]))
+
+        return tier, offset
+
+
+class PriceSeries:
+    """📈 История одной монеты на всех уровнях"""
+
+    __slots__ = ('tiers', 'last_price', 'last_ts')
+
+    def __init__(self, tiers: Tuple[Tuple[int, int], ...] = PRICE_TIERS):
+        self.tiers = [_Tier(resolution, capacity) for resolution, capacity in tiers]
+        self.last_price: Optional[float] = None
+        self.last_ts: Optional[float] = None
+
+    def add(self, ts: float, price: float):
+        for tier in self.tiers:
+            tier.add(ts, price)
+        if self.last_ts is None or ts >= self.last_ts:
+            self.last_price = price
+            self.last_ts = ts
+
+    def _tier_for(self, seconds: float) -> _Tier:
+        for tier in self.tiers:
+            if tier.span >= seconds:
+                return tier
+        return self.tiers[-1]
+
+    def price_ago(self, seconds: float, now: float) -> Optional[float]:
+        """🕰️ Цена seconds назад с самого подробного уровня, покрывающего момент"""
+
+        target = now - seconds
+        for tier in self.tiers:
+            if tier.covers(target):
+                value = tier.value_at(target)
+                if value is not None:
+                    return value
+        return None
+
+    def change_percent(self, seconds: float, now: float) -> Optional[float]:
+        past = self.price_ago(seconds, now)
+        if not past or self.last_price is None:
+            return None
+        return (self.last_price - past) / past * 100
+
+    def range(self, seconds: float, now: float) -> Tuple[Optional[float], Optional[float]]:
+        """📏 (мин, макс) за последние seconds на уровне, покрывающем период"""
+
+        return self._tier_for(seconds).range_since(now - seconds)
+
+    def points(self, seconds: float, now: float) -> List[Tuple[float, float]]:
+        return self._tier_for(seconds).points(now - seconds)
+
+    def pack(self) -> bytes:
+        return b''.join(tier.pack() for tier in self.tiers)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> 'PriceSeries':
+        series = cls.__new__(cls)
+        series.tiers = []
+        view = memoryview(data)
+        while len(view):
+            tier, size = _Tier.unpack(view)
+            series.tiers.append(tier)
+            view = view[size:]
+
+        series.last_price = None
+        series.last_ts = None
+        finest = series.tiers[0] if series.tiers else None
+        if finest and finest.last_slot is not None:
+            points = finest.points(0)
+            if points:
+                series.last_ts, series.last_price = points[-1]
+        return series
+
+
+class PriceHistoryStore:
+    """🗄️ История цен по монетам + периодическое сохранение"""
+
+    def __init__(self, db_service=None):
+        self.db = db_service
+        self.series: Dict[str, PriceSeries] = {}
+        self._dirty: set = set()
+
+    def record(self, coin_id: str, price: Optional[float], ts: float):
+        if price is None:
+            return
+        series = self.series.get(coin_id)
+        if series is None:
+            series = self.series[coin_id] = PriceSeries()
+        series.add(ts, float(price))
+        self._dirty.add(coin_id)
+
+    def record_snapshot(self, coins: Dict[str, Dict[str, Any]], ts: float):
+        """📥 Точка для каждой монеты рыночного снимка"""
+
+        for coin_id, coin in coins.items():
+            self.record(coin_id, coin.get('current_price'), ts)
+
+    def get(self, coin_id: str) -> Optional[PriceSeries]:
+        return self.series.get(coin_id)
+
+    def price_hours_ago(self, coin_id: str, hours: float, now: float) -> Optional[float]:
+        series = self.series.get(coin_id)
+        return series.price_ago(hours * 3600, now) if series else None
+
+    def change_percent(self, coin_id: str, hours: float, now: float) -> Optional[float]:
+        series = self.series.get(coin_id)
+        return series.change_percent(hours * 3600, now) if series else None
+
+    def get_range(self, coin_id: str, hours: float, now: float) -> Tuple[Optional[float], Optional[float]]:
+        series = self.series.get(coin_id)
+        return series.range(hours * 3600, now) if series else (None, None)
+
+    def get_points(self, coin_id: str, hours: float, now: float) -> List[Tuple[float, float]]:
+        series = self.series.get(coin_id)
+        return series.points(hours * 3600, now) if series else []
+
+    # =================== СОХРАНЕНИЕ ===================
+
+    def persist(self) -> int:
+        """💾 Измененные серии в price_history через пакетный писатель"""
+
+        writer = getattr(self.db, 'writer', None)
+        if not writer or not self._dirty:
+            return 0
+
+        now = datetime.now()
+        dirty, self._dirty = self._dirty, set()
+        for coin_id in dirty:
+            series = self.series.get(coin_id)
+            if series:
+                writer.enqueue(
+                    "INSERT OR REPLACE INTO price_history (coin_id, data, updated_at) VALUES (?, ?, ?)",
+                    (coin_id, series.pack(), now)
+                )
+        return len(dirty)
+
+    async def load(self):
+        """📤 Загрузка истории после рестарта"""
+
+        if not self.db or not hasattr(self.db, 'fetchall'):
+            return
+
+        rows = await self.db.fetchall("SELECT coin_id, data FROM price_history")
+        for row in rows:
+            try:
+                self.series[row['coin_id']] = PriceSeries.unpack(row['data'])
+            except (struct.error, ValueError) as e:
+                logger.debug(f"Пропущена история {row['coin_id']}: {e}")
+
+        if rows:
+            logger.info(f"📤 История цен загружена: {len(self.series)} монет")
+
+    def get_stats(self) -> Dict[str, Any]:
+        slots = sum(capacity for _, capacity in PRICE_TIERS)
+        return {
+            'coins': len(self.series),
+            'memory_bytes': len(self.series) * slots * 3 * 8,
+            'dirty': len(self._dirty)
+        }
+
+
+__all__ = ["PriceHistoryStore", "PriceSeries", "PRICE_TIERS"]
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+⏰ RESTRICTION SCHEDULER v3.0
+🔓 Снятие мутов и временных банов по истечении срока
+
+Все сроки (mutes.mute_until, bans.expires_at) лежат в одной min-куче.
+Фоновая задача спит ровно до ближайшего срока (или до пробуждения,
+если появился более ранний), снимает все истекшие ограничения через
+Bot API и помечает строки неактивными пакетом через BatchWriter.
+Опроса БД нет: куча загружается при старте и пополняется при каждом
+новом муте или бане, так что десятки тысяч сроков стоят O(log n) на
+операцию.
+
+Срок ведется на пару (вид, чат, пользователь), а не на строку: при
+повторном муте или бане (эскалация предупреждений, перемут админом)
+запись одна, со сроком позже из двух, и снимается она вместе со всеми
+своими строками. Иначе ранний срок снял бы ограничение, пока более
+позднее еще действует.
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+KIND_MUTE = 'mute'
+KIND_BAN = 'ban'
+
+# Дольше не спим, чтобы переживать переводы системных часов
+MAX_SLEEP_SECONDS = 3600
+
+# Сколько ограничений снимать за один заход цикла
+MAX_LIFT_BATCH = 100
+
+_DEACTIVATE_QUERIES = {
+    KIND_MUTE: "UPDATE mutes SET is_active = FALSE WHERE id = ?",
+    KIND_BAN: "UPDATE bans SET is_active = FALSE, unban_date = ? WHERE id = ?"
+}
+
+
+@dataclass
+class PendingRestriction:
+    """⏳ Ограничение, ожидающее снятия (все активные строки пользователя в чате)"""
+    kind: str
+    chat_id: Optional[int]
+    user_id: int
+    deadline: float
+    row_ids: List[int] = field(default_factory=list)
+    attempts: int = 0
+
+    @property
+    def key(self) -> Tuple[str, Optional[int], int]:
+        return self.kind, self.chat_id, self.user_id
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+class RestrictionScheduler:
+    """⏰ Куча сроков мутов и банов"""
+
+    def __init__(self, db_service=None, retry_seconds: float = 60.0, max_attempts: int = 3):
+        self.db = db_service
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+
+        # (срок, порядковый номер, ключ); устаревшие записи пропускаются при снятии с вершины
+        self._heap: List[Tuple[float, int, Tuple[str, Optional[int], int]]] = []
+        self._pending: Dict[Tuple[str, Optional[int], int], PendingRestriction] = {}
+        self._sequence = 0
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._lifter: Optional[Callable[[str, int, int], Awaitable[Any]]] = None
+
+        self.stats = {'scheduled': 0, 'lifted': 0, 'retries': 0, 'failed': 0}
+
+    def set_lifter(self, lifter: Callable[[str, int, int], Awaitable[Any]]):
+        """🔌 Снятие ограничения через Bot API: lifter(kind, chat_id, user_id)"""
+        self._lifter = lifter
+
+    # =================== ЗАГРУЗКА И ПЛАНИРОВАНИЕ ===================
+
+    async def load(self):
+        """📥 Активные ограничения со сроком из БД и запуск цикла"""
+
+        try:
+            mutes = await self.db.fetchall(
+                "SELECT id, chat_id, user_id, mute_until FROM mutes "
+                "WHERE is_active = TRUE AND mute_until IS NOT NULL"
+            )
+            bans = await self.db.fetchall(
+                "SELECT id, chat_id, user_id, expires_at FROM bans "
+                "WHERE is_active = TRUE AND expires_at IS NOT NULL"
+            )
+
+            for row in mutes:
+                self.schedule(KIND_MUTE, row['id'], row['chat_id'], row['user_id'], row['mute_until'])
+            for row in bans:
+                self.schedule(KIND_BAN, row['id'], row['chat_id'], row['user_id'], row['expires_at'])
+
+            logger.info(f"⏰ Запланировано снятие ограничений: {len(self._pending)}")
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки сроков ограничений: {e}")
+
+        self.start()
+
+    def schedule(self, kind: str, row_id: int, chat_id: Optional[int], user_id: int, until) -> bool:
+        """➕ Новый срок (при действующем ограничении того же вида остается более поздний)"""
+
+        until = _parse_datetime(until)
+        if until is None:
+            return False
+
+        key = (kind, chat_id, user_id)
+        deadline = until.timestamp()
+        restriction = self._pending.get(key)
+        if restriction is None:
+            restriction = self._pending[key] = PendingRestriction(kind, chat_id, user_id, deadline)
+        elif deadline > restriction.deadline:
+            restriction.deadline = deadline
+            restriction.attempts = 0
+        restriction.row_ids.append(row_id)
+        # Прежняя запись кучи с более ранним сроком отпадет сама
+        if restriction.deadline == deadline:
+            self._push(deadline, key)
+        self.stats['scheduled'] += 1
+        return True
+
+    def cancel(self, kind: str, chat_id: Optional[int], user_id: int) -> bool:
+        """➖ Отмена снятия (снято вручную или стало бессрочным); запись в куче отпадет сама"""
+
+        return self._pending.pop((kind, chat_id, user_id), None) is not None
+
+    def _push(self, deadline: float, key: Tuple[str, Optional[int], int]):
+        self._sequence += 1
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (deadline, self._sequence, key))
+        # Пробуждаем цикл, только если срок раньше того, до которого он спит
+        if earliest is None or deadline < earliest:
+            self._wakeup.set()
+
+    # =================== ЦИКЛ ===================
+
+    def start(self):
+        """🚀 Запуск фоновой задачи"""
+
+        if self._task is None and not self._closed:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                self._discard_stale()
+                delay = self._heap[0][0] - time.time() if self._heap else None
+
+                if delay is None or delay > 0:
+                    try:
+                        timeout = None if delay is None else min(delay, MAX_SLEEP_SECONDS)
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+
+                await self._lift_due()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка цикла снятия ограничений: {e}")
+                await asyncio.sleep(1)
+
+    def _discard_stale(self):
+        """🧹 Снятие с вершины отмененных и перенесенных записей"""
+
+        heap, pending = self._heap, self._pending
+        while heap:
+            deadline, _, key = heap[0]
+            restriction = pending.get(key)
+            if restriction is not None and restriction.deadline == deadline:
+                return
+            heapq.heappop(heap)
+
+    async def _lift_due(self):
+        """🔓 Снятие истекших ограничений и пакетное обновление строк"""
+
+        now = time.time()
+        due: List[PendingRestriction] = []
+        while self._heap and len(due) < MAX_LIFT_BATCH:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, _, key = heapq.heappop(self._heap)
+            due.append(self._pending.pop(key))
+
+        lifted = []
+        for restriction in due:
+            if self._lifter and restriction.chat_id:
+                try:
+                    await self._lifter(restriction.kind, restriction.chat_id, restriction.user_id)
+                except Exception as e:
+                    restriction.attempts += 1
+                    if restriction.attempts < self.max_attempts:
+                        logger.warning(f"⚠️ Не удалось снять {restriction.kind} с {restriction.user_id}, повтор: {e}")
+                        self.stats['retries'] += 1
+                        # Пока шел вызов, могло появиться новое ограничение - оно и главнее
+                        newer = self._pending.get(restriction.key)
+                        if newer is not None:
+                            newer.row_ids.extend(restriction.row_ids)
+                        else:
+                            restriction.deadline = now + self.retry_seconds
+                            self._pending[restriction.key] = restriction
+                            self._push(restriction.deadline, restriction.key)
+                        continue
+                    logger.error(f"❌ Не удалось снять {restriction.kind} с {restriction.user_id}: {e}")
+                    self.stats['failed'] += 1
+            lifted.append(restriction)
+
+        if lifted:
+            self._deactivate(lifted)
+            self.stats['lifted'] += len(lifted)
+            logger.info(f"🔓 Снято ограничений по сроку: {len(lifted)}")
+
+    def _deactivate(self, restrictions: List[PendingRestriction]):
+        """💾 Строки неактивны - одинаковые UPDATE уходят одним executemany"""
+
+        now = datetime.now()
+        writer = getattr(self.db, 'writer', None)
+        for restriction in sorted(restrictions, key=lambda item: item.kind):
+            for row_id in restriction.row_ids:
+                params = (row_id,) if restriction.kind == KIND_MUTE else (now, row_id)
+                if writer:
+                    writer.enqueue(_DEACTIVATE_QUERIES[restriction.kind], params)
+                else:
+                    asyncio.create_task(self.db.execute(_DEACTIVATE_QUERIES[restriction.kind], params))
+
+    # =================== ЗАКРЫТИЕ И СТАТИСТИКА ===================
+
+    async def close(self):
+        """🔒 Остановка цикла (несработавшие сроки останутся в БД до следующего запуска)"""
+
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика планировщика"""
+
+        self._discard_stale()
+        return {
+            **self.stats,
+            'pending': len(self._pending),
+            'heap_size': len(self._heap),
+            'next_deadline': datetime.fromtimestamp(self._heap[0][0]).isoformat() if self._heap else None
+        }
+
+
+__all__ = ["RestrictionScheduler", "PendingRestriction", "KIND_MUTE", "KIND_BAN"]
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+⚡ TRIGGER STORE v3.0
+🗄️ Единое хранилище триггеров поверх flexible_triggers
+
+Таблица читается один раз при старте, дальше все запросы обслуживает
+индекс в памяти: триггеры по чатам + глобальные. Создание и удаление
+пишут в БД сразу и обновляют индекс, срабатывания уходят в
+trigger_activations через пакетный писатель, а счетчики usage_count
+сбрасываются отложенно. На горячем пути сообщения - ни одного чтения из БД.
+"""
+
+import json
+import logging
+import asyncio
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+from app.modules.trigger_matcher import CompiledTriggerSet
+from app.modules.regex_guard import get_regex_sandbox, disabled_notice
+
+logger = logging.getLogger(__name__)
+
+# Счетчики usage_count сбрасываются в БД не чаще раза в N секунд
+USAGE_FLUSH_SECONDS = 5.0
+
+# Сколько текста сообщения сохранять в trigger_activations
+MAX_MATCHED_TEXT = 200
+
+GLOBAL_KEY = '__global__'
+
+# Короткие типы из /trigger_create -> типы матчера
+_TYPE_ALIASES = {
+    'starts': 'starts_with',
+    'ends': 'ends_with'
+}
+
+
+def _load_json(value, default):
+    if value is None or value == '':
+        return default
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _response_text(response_data) -> str:
+    """💬 Текст ответа из response_data (строка, {'response': ...} или список вариантов)"""
+
+    if isinstance(response_data, dict):
+        return str(response_data.get('response') or response_data.get('text') or '')
+    if isinstance(response_data, list):
+        return '|'.join(str(item) for item in response_data)
+    return '' if response_data is None else str(response_data)
+
+
+class TriggerStore:
+    """🗄️ flexible_triggers + индекс в памяти"""
+
+    def __init__(self, db_service):
+        self.db = db_service
+
+        # chat_id (строкой) -> {trigger_id: триггер}; порядок - порядок создания
+        self.chat_triggers: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.global_triggers: Dict[str, Dict[str, Any]] = {}
+
+        # Кэши, сбрасываемые при записи
+        self._compiled: Dict[str, CompiledTriggerSet] = {}
+        self._active: Dict[int, List[Dict[str, Any]]] = {}
+
+        # Несохраненные счетчики: trigger_id -> триггер
+        self._usage_dirty: Dict[str, Dict[str, Any]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._known_users: set = set()
+        self._notifier: Optional[Callable[[int, str], Awaitable[Any]]] = None
+
+        self.loaded = False
+        self.stats = {'activations': 0, 'usage_flushes': 0, 'disabled_slow_regex': 0}
+
+    # =================== ЗАГРУЗКА ===================
+
+    async def load(self):
+        """📤 Чтение flexible_triggers в индекс"""
+
+        rows = await self.db.fetchall("SELECT * FROM flexible_triggers ORDER BY id")
+
+        self.chat_triggers = {}
+        self.global_triggers = {}
+        for row in rows:
+            self._index(self._from_row(row))
+
+        self.invalidate()
+        self.loaded = True
+        logger.info(f"⚡ Триггеры загружены из БД: {len(rows)}")
+
+    @staticmethod
+    def _from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        """🔄 Строка таблицы -> триггер в формате TriggersModule"""
+
+        trigger_type = row.get('trigger_type') or 'contains'
+        response_data = _load_json(row.get('response_data'), row.get('response_data'))
+        is_global = bool(row.get('is_global'))
+
+        return {
+            'id': str(row['id']),
+            'name': row['name'],
+            'pattern': row['pattern'],
+            'response': _response_text(response_data),
+            'type': _TYPE_ALIASES.get(trigger_type, trigger_type),
+            'trigger_type': trigger_type,
+            'creator_id': row['user_id'],
+            'chat_id': 0 if is_global else row.get('chat_id'),
+            'conditions': _load_json(row.get('conditions'), {}),
+            'settings': _load_json(row.get('settings'), {}),
+            'usage_count': row.get('usage_count') or 0,
+            'last_used': row.get('last_used'),
+            'created_at': str(row.get('created_at') or ''),
+            'is_active': bool(row.get('is_active', True)),
+            'is_global': is_global
+        }
+
+    def _index(self, trigger: Dict[str, Any]):
+        if trigger['is_global']:
+            self.global_triggers[trigger['id']] = trigger
+        else:
+            self.chat_triggers.setdefault(str(trigger['chat_id']), {})[trigger['id']] = trigger
+
+    def _unindex(self, trigger: Dict[str, Any]):
+        if trigger['is_global']:
+            self.global_triggers.pop(trigger['id'], None)
+            return
+
+        chat_key = str(trigger['chat_id'])
+        chat = self.chat_triggers.get(chat_key)
+        if chat is not None:
+            chat.pop(trigger['id'], None)
+            if not chat:
+                del self.chat_triggers[chat_key]
+
+    def invalidate(self, chat_key: Optional[str] = None):
+        """♻️ Сброс кэшей чата (None - всех чатов и глобальных)"""
+
+        self._active.clear()
+        if chat_key is None:
+            self._compiled.clear()
+        else:
+            self._compiled.pop(chat_key, None)
+
+    # =================== ЗАПИСЬ ===================
+
+    async def add(self, trigger: Dict[str, Any]) -> Dict[str, Any]:
+        """➕ Новый триггер: запись в БД и в индекс"""
+
+        is_global = bool(trigger.get('is_global'))
+        chat_id = 0 if is_global else trigger.get('chat_id')
+        trigger_type = trigger.get('trigger_type') or trigger.get('type') or 'contains'
+        response_data = trigger.get('response_data', {'response': trigger.get('response', '')})
+
+        # UNIQUE(user_id, chat_id, name): REPLACE удалит прежнюю строку
+        for existing in self._scope(is_global, chat_id):
+            if existing['creator_id'] == trigger['creator_id'] and existing['name'] == trigger['name']:
+                self._unindex(existing)
+                self._usage_dirty.pop(existing['id'], None)
+                break
+
+        # flexible_triggers ссылается на users
+        await self.db.execute("INSERT OR IGNORE INTO users (id) VALUES (?)", (trigger['creator_id'],))
+        self._known_users.add(trigger['creator_id'])
+
+        now = datetime.now()
+        cursor = await self.db.execute("""
+            INSERT OR REPLACE INTO flexible_triggers
+            (user_id, chat_id, name, trigger_type, pattern, response_data,
+             conditions, settings, is_active, is_global, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            trigger['creator_id'],
+            chat_id,
+            trigger['name'],
+            trigger_type,
+            trigger['pattern'],
+            json.dumps(response_data, ensure_ascii=False),
+            json.dumps(trigger.get('conditions', {}), ensure_ascii=False),
+            json.dumps(trigger.get('settings', {}), ensure_ascii=False),
+            trigger.get('is_active', True),
+            is_global,
+            now,
+            now
+        ))
+
+        stored = self._from_row({
+            'id': cursor.lastrowid,
+            'user_id': trigger['creator_id'],
+            'chat_id': chat_id,
+            'name': trigger['name'],
+            'trigger_type': trigger_type,
+            'pattern': trigger['pattern'],
+            'response_data': json.dumps(response_data),
+            'conditions': json.dumps(trigger.get('conditions', {})),
+            'settings': json.dumps(trigger.get('settings', {})),
+            'is_active': trigger.get('is_active', True),
+            'is_global': is_global,
+            'usage_count': trigger.get('usage_count', 0),
+            'created_at': trigger.get('created_at') or now.isoformat()
+        })
+        self._index(stored)
+        self.invalidate(GLOBAL_KEY if is_global else str(chat_id))
+        return stored
+
+    async def delete(self, trigger: Dict[str, Any]) -> bool:
+        """🗑️ Удаление триггера вместе с историей срабатываний"""
+
+        await self.db.execute("DELETE FROM trigger_activations WHERE trigger_id = ?", (int(trigger['id']),))
+        await self.db.execute("DELETE FROM flexible_triggers WHERE id = ?", (int(trigger['id']),))
+
+        self._unindex(trigger)
+        self._usage_dirty.pop(trigger['id'], None)
+        self.invalidate(GLOBAL_KEY if trigger['is_global'] else str(trigger['chat_id']))
+        return True
+
+    def set_active(self, trigger: Dict[str, Any], is_active: bool):
+        """⏯️ Включение/выключение без удаления"""
+
+        trigger['is_active'] = is_active
+        self._enqueue(
+            "UPDATE flexible_triggers SET is_active = ?, updated_at = ? WHERE id = ?",
+            (is_active, datetime.now(), int(trigger['id']))
+        )
+        self.invalidate(GLOBAL_KEY if trigger['is_global'] else str(trigger['chat_id']))
+
+    def set_notifier(self, notifier: Callable[[int, str], Awaitable[Any]]):
+        """📨 Корутина уведомлений создателям: notifier(user_id, text)"""
+
+        self._notifier = notifier
+
+    def disable_slow_regex(self, trigger: Dict[str, Any], timeout: float):
+        """🛑 Отключение триггера, чья регулярка превысила бюджет, с уведомлением создателя"""
+
+        if not trigger['is_active']:
+            return
+
+        self.set_active(trigger, False)
+        self.stats['disabled_slow_regex'] += 1
+        logger.warning(f"🛑 Триггер {trigger['name']} ({trigger['id']}) отключен: регулярка превысила бюджет")
+
+        if self._notifier and trigger.get('creator_id'):
+            asyncio.create_task(self._notify(trigger['creator_id'], disabled_notice(trigger, timeout)))
+
+    async def _notify(self, user_id: int, text: str):
+        try:
+            await self._notifier(user_id, text)
+        except Exception as e:
+            logger.debug(f"Не удалось уведомить {user_id}: {e}")
+
+    def record_activation(self, trigger: Dict[str, Any], user_id: int, chat_id: int,
+                          matched_text: Optional[str] = None, response: Optional[str] = None,
+                          execution_time: Optional[float] = None):
+        """📈 Срабатывание: счетчик в памяти, строка - в очередь писателя"""
+
+        now = datetime.now()
+        trigger['usage_count'] = trigger.get('usage_count', 0) + 1
+        trigger['last_used'] = now.isoformat()
+
+        if user_id not in self._known_users:
+            self._known_users.add(user_id)
+            self._enqueue("INSERT OR IGNORE INTO users (id) VALUES (?)", (user_id,))
+
+        self._enqueue("""
+            INSERT INTO trigger_activations
+            (trigger_id, user_id, chat_id, matched_text, response_sent, execution_time, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            int(trigger['id']),
+            user_id,
+            chat_id,
+            (matched_text or '')[:MAX_MATCHED_TEXT],
+            response,
+            execution_time,
+            now
+        ))
+
+        self.stats['activations'] += 1
+        self._usage_dirty[trigger['id']] = trigger
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_usage_flush())
+
+    async def _delayed_usage_flush(self):
+        await asyncio.sleep(USAGE_FLUSH_SECONDS)
+        self.flush_usage()
+
+    def flush_usage(self) -> int:
+        """💾 Накопленные usage_count одной пачкой UPDATE в очередь писателя"""
+
+        if not self._usage_dirty:
+            return 0
+
+        dirty, self._usage_dirty = self._usage_dirty, {}
+        for trigger in dirty.values():
+            self._enqueue(
+                "UPDATE flexible_triggers SET usage_count = ?, last_used = ? WHERE id = ?",
+                (trigger['usage_count'], trigger['last_used'], int(trigger['id']))
+            )
+
+        self.stats['usage_flushes'] += 1
+        return len(dirty)
+
+    def _enqueue(self, query: str, params: tuple):
+        writer = getattr(self.db, 'writer', None)
+        if writer:
+            writer.enqueue(query, params)
+
+    async def close(self):
+        """🔒 Финальный сброс счетчиков (до закрытия писателя)"""
+
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self.flush_usage()
+
+    # =================== ЧТЕНИЕ ===================
+
+    def _scope(self, is_global: bool, chat_id) -> List[Dict[str, Any]]:
+        if is_global:
+            return list(self.global_triggers.values())
+        return list(self.chat_triggers.get(str(chat_id), {}).values())
+
+    def active_for_chat(self, chat_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """⚡ Активные триггеры чата и глобальные (None - все чаты)"""
+
+        key = chat_id if chat_id is not None else 0
+        cached = self._active.get(key)
+        if cached is not None:
+            return cached
+
+        if chat_id is None:
+            candidates = list(self.global_triggers.values())
+            for chat in self.chat_triggers.values():
+                candidates.extend(chat.values())
+        else:
+            candidates = list(self.global_triggers.values())
+            candidates.extend(self.chat_triggers.get(str(chat_id), {}).values())
+
+        active = [trigger for trigger in candidates if trigger['is_active']]
+        active.sort(key=lambda t: (not t['is_global'], -t.get('usage_count', 0)))
+        self._active[key] = active
+        return active
+
+    def compiled(self, chat_key: str) -> CompiledTriggerSet:
+        """⚙️ Скомпилированный набор чата или GLOBAL_KEY"""
+
+        compiled = self._compiled.get(chat_key)
+        if compiled is None:
+            source = self.global_triggers if chat_key == GLOBAL_KEY else self.chat_triggers.get(chat_key, {})
+            compiled = self._compiled[chat_key] = CompiledTriggerSet(source.values())
+        return compiled
+
+    async def match(self, chat_id: int, text: str, text_lower: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """🎯 Сработавший триггер: сначала чатовые, затем глобальные (регулярки - в песочнице)
+
+        text_lower - готовый lower() текста (MessageFeatures.lower), чтобы не считать его на каждый набор
+        """
+
+        if not text:
+            return None
+
+        if text_lower is None:
+            text_lower = text.lower()
+        sandbox = get_regex_sandbox()
+        for key in (str(chat_id), GLOBAL_KEY):
+            trigger, offenders = await self.compiled(key).match_guarded(text, sandbox, text_lower)
+            for offender in offenders:
+                self.disable_slow_regex(offender, sandbox.timeout)
+            if trigger:
+                return trigger
+        return None
+
+    @staticmethod
+    def as_row(trigger: Dict[str, Any]) -> Dict[str, Any]:
+        """🔄 Триггер в формате строки flexible_triggers (для старых обработчиков)"""
+
+        return {
+            'id': int(trigger['id']),
+            'user_id': trigger['creator_id'],
+            'chat_id': trigger['chat_id'],
+            'name': trigger['name'],
+            'trigger_type': trigger['trigger_type'],
+            'pattern': trigger['pattern'],
+            'response_data': {'response': trigger['response']},
+            'conditions': trigger['conditions'],
+            'settings': trigger['settings'],
+            'is_active': trigger['is_active'],
+            'is_global': trigger['is_global'],
+            'usage_count': trigger.get('usage_count', 0),
+            'last_used': trigger.get('last_used'),
+            'created_at': trigger.get('created_at', '')
+        }
+
+    def count(self) -> int:
+        """🔢 Число триггеров во всех чатах"""
+
+        return len(self.global_triggers) + sum(len(chat) for chat in self.chat_triggers.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика хранилища"""
+
+        return {
+            **self.stats,
+            'triggers': self.count(),
+            'chats': len(self.chat_triggers),
+            'compiled_sets': len(self._compiled),
+            'pending_usage': len(self._usage_dirty)
+        }
+
+
+__all__ = ["TriggerStore", "GLOBAL_KEY", "USAGE_FLUSH_SECONDS"]
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+⚠️ WARNING STORE v3.0
+🔢 Счетчики предупреждений по (чат, пользователь) без COUNT-запросов
+
+Активные предупреждения загружаются из таблицы warnings один раз при
+старте; дальше на каждую пару хранится короткий список отметок времени
+в порядке выдачи. Новое предупреждение пишется в память сразу, а в БД -
+через BatchWriter (write-through). Сгоревшие по сроку давности отметки
+снимаются с головы списка при обращении, поэтому и подсчет, и решение
+об эскалации (предупреждение -> мут -> бан) стоят O(1).
+"""
+
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ACTION_WARN = 'warn'
+ACTION_MUTE = 'mute'
+ACTION_BAN = 'ban'
+
+# admin_id автоматических предупреждений (строка в users создается при загрузке)
+AUTO_ADMIN_ID = 0
+
+# Больше отметок на пару не нужно: после бана счет уже не важен
+MAX_STAMPS = 16
+
+_INSERT_WARNING = (
+    "INSERT INTO warnings (user_id, chat_id, admin_id, reason, warn_date, severity_level, auto_generated) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+class WarningStore:
+    """⚠️ Кэш активных предупреждений с записью в БД"""
+
+    def __init__(self, db_service=None, max_warnings: int = 2, decay_hours: float = 72,
+                 ban_for_excessive_warnings: bool = True):
+        self.db = db_service
+        self.max_warnings = max_warnings
+        self.decay_seconds = decay_hours * 3600
+        self.ban_for_excessive_warnings = ban_for_excessive_warnings
+
+        # (чат, пользователь) -> отметки времени (epoch) по возрастанию
+        self._warnings: Dict[Tuple[int, int], List[float]] = {}
+
+        self.stats = {'loaded': 0, 'added': 0, 'decayed': 0, 'resets': 0}
+
+    def configure(self, max_warnings: Optional[int] = None, decay_hours: Optional[float] = None,
+                  ban_for_excessive_warnings: Optional[bool] = None):
+        """⚙️ Правила эскалации и срок давности (из ModerationConfig)"""
+
+        if max_warnings is not None:
+            self.max_warnings = max_warnings
+        if decay_hours is not None:
+            self.decay_seconds = decay_hours * 3600
+        if ban_for_excessive_warnings is not None:
+            self.ban_for_excessive_warnings = ban_for_excessive_warnings
+
+    # =================== ЗАГРУЗКА ===================
+
+    async def load(self):
+        """📥 Активные предупреждения из БД"""
+
+        try:
+            # Автоматические предупреждения ссылаются на служебного пользователя
+            await self.db.execute(
+                "INSERT OR IGNORE INTO users (id, first_name, is_bot) VALUES (?, ?, TRUE)",
+                (AUTO_ADMIN_ID, 'auto-moderation')
+            )
+
+            rows = await self.db.fetchall(
+                "SELECT chat_id, user_id, warn_date FROM warnings "
+                "WHERE is_active = TRUE ORDER BY warn_date"
+            )
+
+            for row in rows:
+                issued = _parse_datetime(row['warn_date'])
+                if issued is not None:
+                    self._append(row['chat_id'], row['user_id'], issued.timestamp())
+            self.stats['loaded'] = len(rows)
+
+            logger.info(f"⚠️ Загружено активных предупреждений: {len(rows)}")
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки предупреждений: {e}")
+
+    # =================== СЧЕТЧИКИ ===================
+
+    def _append(self, chat_id: int, user_id: int, stamp: float):
+        stamps = self._warnings.get((chat_id, user_id))
+        if stamps is None:
+            self._warnings[(chat_id, user_id)] = [stamp]
+            return
+        stamps.append(stamp)
+        if len(stamps) > MAX_STAMPS:
+            del stamps[0]
+
+    def count(self, chat_id: int, user_id: int, now: Optional[float] = None) -> int:
+        """🔢 Действующие предупреждения пользователя в чате"""
+
+        key = (chat_id, user_id)
+        stamps = self._warnings.get(key)
+        if not stamps:
+            return 0
+
+        if self.decay_seconds > 0:
+            expired_before = (time.time() if now is None else now) - self.decay_seconds
+            while stamps and stamps[0] <= expired_before:
+                del stamps[0]
+                self.stats['decayed'] += 1
+            if not stamps:
+                del self._warnings[key]
+                return 0
+
+        return len(stamps)
+
+    def escalation(self, count: int) -> str:
+        """📈 Действие для числа предупреждений: последнее допустимое - мут, сверх лимита - бан"""
+
+        if count > self.max_warnings:
+            return ACTION_BAN if self.ban_for_excessive_warnings else ACTION_MUTE
+        if count >= self.max_warnings:
+            return ACTION_MUTE
+        return ACTION_WARN
+
+    def add(self, chat_id: int, user_id: int, admin_id: int = AUTO_ADMIN_ID, reason: str = '',
+            severity_level: int = 1, persist: bool = True) -> Tuple[int, str]:
+        """➕ Новое предупреждение; возвращает (счетчик, действие эскалации)
+
+        persist=False - строка уже записана вызывающим (add_moderation_action)
+        """
+
+        issued = datetime.now()
+        stamp = issued.timestamp()
+        self._append(chat_id, user_id, stamp)
+        self.stats['added'] += 1
+
+        if persist:
+            params = (user_id, chat_id, admin_id, reason, issued, severity_level, admin_id == AUTO_ADMIN_ID)
+            writer = getattr(self.db, 'writer', None)
+            if writer:
+                writer.enqueue(_INSERT_WARNING, params)
+            elif self.db and hasattr(self.db, 'execute'):
+                asyncio.create_task(self.db.execute(_INSERT_WARNING, params))
+
+        count = self.count(chat_id, user_id, stamp)
+        return count, self.escalation(count)
+
+    def reset(self, chat_id: int, user_id: int) -> int:
+        """🔄 Снятие всех предупреждений пользователя в чате; возвращает их число"""
+
+        removed = len(self._warnings.pop((chat_id, user_id), ()))
+        self.stats['resets'] += 1
+
+        query = "UPDATE warnings SET is_active = FALSE WHERE chat_id = ? AND user_id = ? AND is_active = TRUE"
+        writer = getattr(self.db, 'writer', None)
+        if writer:
+            writer.enqueue(query, (chat_id, user_id))
+        elif self.db and hasattr(self.db, 'execute'):
+            asyncio.create_task(self.db.execute(query, (chat_id, user_id)))
+        return removed
+
+    # =================== СТАТИСТИКА ===================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """📊 Статистика кэша"""
+
+        return {
+            **self.stats,
+            'tracked_pairs': len(self._warnings),
+            'max_warnings': self.max_warnings,
+            'decay_hours': self.decay_seconds / 3600
+        }
+
+
+__all__ = ["WarningStore", "ACTION_WARN", "ACTION_MUTE", "ACTION_BAN", "AUTO_ADMIN_ID"]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+🏁 BENCHMARK: однопроходный сканер содержимого против прежних проверок
+
+Запуск из корня проекта:
+    python benchmarks/bench_content_scanner.py [--messages 20000] [--words 200] [--budget-us 50]
+
+Сравнивает ContentScanner.scan с прежними _check_spam/_check_banned_words/
+_check_toxicity (три регулярки и два прохода подстрокой по lower()).
+Проверяет, что обфускации из описания content_scanner нормализуются как
+заявлено. Возвращает 1, если среднее время сканирования выше --budget-us
+или обфускация не распознана.
+"""
+
+import re
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.modules.content_scanner import ContentScanner, DEFAULT_BANNED_WORDS, DEFAULT_TOXIC_WORDS, normalize  # noqa: E402
+
+CORPUS = (
+    "привет всем", "всем привет, как дела?", "кто сегодня вечером в игру?",
+    "биткоин опять падает, что делать", "эфир по 3к это дно или нет",
+    "скиньте курс доллара плиз", "ахахах ну ты даешь", "бот, ты тут?",
+    "ну ты и дурак конечно", "это обман, не ведитесь", "сп@м какой-то",
+    "кто смотрел вчера футбол? было очень круто, особенно второй тайм",
+    "ЗАРАБОТОК БЕЗ ВЛОЖЕНИЙ ПИШИТЕ В ЛС", "ааааааааааааааа", "лол",
+    "hello everyone", "gm frens", "wen moon?", "bitcoin to 100k this year",
+    "how are you doing today?", "this chat is crazy lol", "anyone here trading eth?",
+    "http://a.ru/http://b.ru/http://c.ru/ переходи", "ок", "+", "согласен",
+    "кто-нибудь знает, как вывести с биржи без комиссии? уже третий день пытаюсь",
+)
+
+LEGACY_SPAM = [r'(https?://\S+){3,}', r'(.)\1{10,}', r'[A-Z]{20,}']
+LEGACY_TOXIC = ['дурак', 'идиот', 'тупой', 'глупый']
+
+
+def legacy_scan(message: str, banned_words):
+    """Прежние проверки ModerationModule"""
+
+    is_spam = any(re.search(pattern, message) for pattern in LEGACY_SPAM)
+    message_lower = message.lower()
+    has_banned = any(word.rstrip('*') in message_lower for word in banned_words)
+    toxic = min(1.0, sum(1 for word in LEGACY_TOXIC if word in message.lower()) / 3)
+    return is_spam, has_banned, toxic
+
+
+# Обфускации из описания модуля: (как написано, как должно нормализоваться)
+OBFUSCATIONS = (
+    ('сп@м', 'спам'), ('cпaм', 'спам'), ('cп@m', 'спам'), ('спаааам', 'спам'),
+    ('СП\u200bАМ', 'спам'), ('4at', 'чат'), ('дyp@к', 'дурак'),
+)
+
+
+def check_obfuscations(scanner: ContentScanner) -> list:
+    """Обфускации, которые не свелись к словарному виду (запрещенные - и не нашлись сканером)"""
+
+    failed = []
+    for written, expected in OBFUSCATIONS:
+        if normalize(written) != expected:
+            failed.append(f"{written!r} -> {normalize(written)!r}, ожидалось {expected!r}")
+        elif expected == 'спам' and 'спам' not in scanner.scan(written).banned_words:
+            failed.append(f"{written!r} не найдено сканером")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--words', type=int, default=200, help='размер словаря запрещенных слов')
+    parser.add_argument('--budget-us', type=float, default=50.0)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    banned = list(DEFAULT_BANNED_WORDS) + [f"слово{i}" for i in range(max(0, args.words - len(DEFAULT_BANNED_WORDS)))]
+    messages = [rng.choice(CORPUS) for _ in range(args.messages)]
+
+    scanner = ContentScanner(banned, DEFAULT_TOXIC_WORDS)
+    scanner.set_chat_words(-1, 'banned', ['казино*', 'ставки'])
+
+    started = time.perf_counter()
+    flagged = sum(1 for message in messages if scanner.scan(message, -1).categories)
+    scanner_us = (time.perf_counter() - started) / len(messages) * 1e6
+
+    started = time.perf_counter()
+    for message in messages:
+        legacy_scan(message, banned)
+    legacy_us = (time.perf_counter() - started) / len(messages) * 1e6
+
+    print(f"словарь:             {len(banned)} слов")
+    print(f"scanner:             {scanner_us:.1f} µs/msg (с нарушениями: {flagged})")
+    print(f"legacy:              {legacy_us:.1f} µs/msg")
+    print(f"бюджет:              {args.budget_us:.0f} µs/msg - {'OK' if scanner_us <= args.budget_us else 'ПРЕВЫШЕН'}")
+
+    failed = check_obfuscations(ContentScanner())
+    print(f"обфускации:          {len(OBFUSCATIONS) - len(failed)}/{len(OBFUSCATIONS)}")
+    for failure in failed:
+        print(f"  ✗ {failure}")
+
+    return 0 if scanner_us <= args.budget_us and not failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+🏁 BENCHMARK: общий разбор сообщения (MessageFeatures) против отдельных проходов модулей
+
+Запуск из корня проекта:
+    python benchmarks/bench_message_features.py [--messages 20000] [--min-speedup 1.5]
+
+Прежний путь сообщения: BehaviorModule._analyze_message (настроение,
+стиль, ключевые слова, сложность - свои lower()/split()), MemoryModule
+(сущности, ключевые слова, нарастающий анализ диалога), ModerationModule
+(ContentScanner.scan с нормализацией) и проверка "отвечать ли боту" -
+каждый разбирает текст сам. Новый путь: один MessageFeatures на апдейт,
+модули читают из него. Сканер модерации есть в обоих путях.
+Возвращает 1, если ускорение меньше --min-speedup.
+"""
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.modules.message_features import MessageFeatures, LEXICON_SUMMON, LEXICON_QUESTION  # noqa: E402
+from app.modules.behavior_module import BehaviorModule  # noqa: E402
+from app.modules.conversation_memory import ConversationAnalysis, context_around  # noqa: E402
+from app.modules.content_scanner import ContentScanner  # noqa: E402
+
+CORPUS = (
+    "привет всем", "всем привет, как дела?", "кто сегодня вечером в игру?",
+    "биткоин опять падает, что делать", "эфир по 3к это дно или нет",
+    "скиньте курс доллара плиз", "ахахах ну ты даешь", "бот, ты тут?",
+    "ну ты и дурак конечно", "это обман, не ведитесь", "спасибо, все отлично работает 👍",
+    "кто смотрел вчера футбол? было очень круто, особенно второй тайм",
+    "бот, помоги пожалуйста: функция падает с ошибкой, код ниже, не работает уже час",
+    "мне не нравится новый дизайн, раньше было лучше", "люблю python и асинхронный код 😊",
+    "hello everyone", "gm frens", "wen moon?", "@admin посмотри #баг в чате https://example.com",
+    "how are you doing today?", "anyone here trading eth?", "ок", "+", "согласен",
+    "кто-нибудь знает, как вывести с биржи без комиссии? уже третий день пытаюсь, 100 раз писал в поддержку",
+)
+
+# =================== ПРЕЖНИЕ ПРОВЕРКИ ===================
+
+STOP_WORDS = {'и', 'в', 'на', 'с', 'по', 'для', 'от', 'до', 'из', 'к', 'о',
+              'что', 'это', 'как', 'но', 'а', 'да', 'нет', 'не', 'или', 'же'}
+BEHAVIOR_STOP_WORDS = {'и', 'в', 'на', 'с', 'по', 'для', 'от', 'до', 'из', 'к', 'о', 'что', 'это'}
+POSITIVE_MARKERS = ('нравится', 'люблю', 'хорошо', 'отлично', 'супер', 'класс')
+NEGATIVE_MARKERS = ('не нравится', 'плохо', 'ужасно', 'не люблю')
+PREFERENCE_EMOJIS = ('😊', '🙂', '👍')
+
+
+def legacy_keywords(text):
+    keywords, seen = [], set()
+    for word in text.lower().split():
+        clean_word = word if word.isalnum() else ''.join(c for c in word if c.isalnum())
+        if len(clean_word) > 2 and clean_word not in STOP_WORDS and clean_word.isalpha() and clean_word not in seen:
+            seen.add(clean_word)
+            keywords.append(clean_word)
+            if len(keywords) == 10:
+                break
+    return keywords
+
+
+def legacy_behavior(message):
+    """Прежний BehaviorModule._analyze_message"""
+
+    message_lower = message.lower()
+    positive = sum(1 for w in ('хорошо', 'отлично', 'супер', 'класс', 'спасибо', 'радуюсь') if w in message_lower)
+    negative = sum(1 for w in ('плохо', 'ужасно', 'проблема', 'ошибка', 'не работает') if w in message_lower)
+
+    message_lower = message.lower()
+    scores = {
+        'formal': sum(1 for m in ('пожалуйста', 'благодарю', 'извините', 'могли бы') if m in message_lower),
+        'casual': sum(1 for m in ('привет', 'пока', 'круто', 'ок') if m in message_lower),
+        'technical': sum(1 for m in ('функция', 'алгоритм', 'код', 'программа') if m in message_lower),
+        'emotional': sum(1 for m in ('чувствую', 'переживаю', 'волнуюсь', 'радуюсь') if m in message_lower),
+    }
+    style = max(scores, key=scores.get)
+
+    keywords = []
+    for word in message.lower().split():
+        clean_word = ''.join(c for c in word if c.isalnum())
+        if len(clean_word) > 2 and clean_word not in BEHAVIOR_STOP_WORDS and clean_word.isalpha():
+            keywords.append(clean_word)
+
+    word_count = len(message.split())
+    avg_word_length = sum(len(word) for word in message.split()) / max(word_count, 1)
+
+    return {
+        'length': len(message), 'word_count': len(message.split()), 'has_questions': '?' in message,
+        'has_exclamations': '!' in message, 'has_emojis': any(ord(char) > 127 for char in message),
+        'sentiment': 'positive' if positive > negative else 'negative' if negative > positive else 'neutral',
+        'communication_style': style if scores[style] else 'neutral',
+        'topic_keywords': list(set(keywords))[:10],
+        'complexity_level': ('complex' if word_count > 50 or avg_word_length > 6 else
+                             'medium' if word_count > 20 or avg_word_length > 4 else 'simple')
+    }
+
+
+def legacy_memory(message, analysis):
+    """Прежние MemoryModule._extract_entities/_extract_keywords и ConversationAnalysis.add"""
+
+    entities = {'urls': [], 'mentions': [], 'hashtags': [], 'numbers': [], 'dates': []}
+    for word in message.split():
+        if word.startswith(('http://', 'https://', 'www.')):
+            entities['urls'].append(word)
+        elif word.startswith('@'):
+            entities['mentions'].append(word)
+        elif word.startswith('#'):
+            entities['hashtags'].append(word)
+        elif word.isdigit():
+            entities['numbers'].append(word)
+    legacy_keywords(message)
+
+    analysis.messages += 1
+    analysis.total_length += len(message)
+    analysis.questions += '?' in message
+    analysis.exclamations += '!' in message
+    analysis.non_ascii += not message.isascii()
+    analysis.emoji_messages += any(emoji in message for emoji in PREFERENCE_EMOJIS)
+    for keyword in legacy_keywords(message):
+        analysis.keywords[keyword] += 1
+    lowered = message.lower()
+    for markers, target in ((POSITIVE_MARKERS, analysis.likes), (NEGATIVE_MARKERS, analysis.dislikes)):
+        for marker in markers:
+            if marker in lowered:
+                context = context_around(lowered, marker)
+                if context:
+                    target[context] = target.get(context, 0) + 1
+    return entities
+
+
+def legacy_should_respond(message, username='mybot'):
+    """Прежняя enhanced_should_respond_check (без триггеров и обучения)"""
+
+    text = message.lower()
+    if f'@{username}' in text:
+        return True
+    for keyword in ('бот', 'bot', 'робот', 'помощник', 'assistant'):
+        if keyword in text:
+            return True
+    question_markers = ['?', 'что', 'как', 'когда', 'где', 'почему', 'зачем', 'кто']
+    return ('?' in text or any(marker in text for marker in question_markers)) and len(text) > 10
+
+
+def legacy_pipeline(message, behavior, analysis, scanner):
+    legacy_behavior(message)
+    legacy_memory(message, analysis)
+    scanner.scan(message, -1)
+    legacy_should_respond(message)
+
+
+# =================== ОБЩИЙ РАЗБОР ===================
+
+def should_respond(features, username='mybot'):
+    if f'@{username}' in features.lower:
+        return True
+    if features.hits(LEXICON_SUMMON):
+        return True
+    return (features.has_question or bool(features.hits(LEXICON_QUESTION))) and len(features.lower) > 10
+
+
+def shared_pipeline(message, behavior, analysis, scanner):
+    features = MessageFeatures(message)
+    behavior._analyze_message(message, features)
+    # MemoryModule.add_interaction: сущности и ключевые слова - из признаков
+    features.entities, features.keywords
+    analysis.add(message, features)
+    scanner.scan(message, -1, features.normalized)
+    should_respond(features)
+
+
+def run(pipeline, messages, behavior, scanner) -> float:
+    analysis = ConversationAnalysis()
+    started = time.perf_counter()
+    for message in messages:
+        pipeline(message, behavior, analysis, scanner)
+    return (time.perf_counter() - started) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--min-speedup', type=float, default=1.5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    messages = [rng.choice(CORPUS) for _ in range(args.messages)]
+
+    behavior = BehaviorModule(None, None)
+    scanner = ContentScanner()
+
+    # Прогрев (кэши автоматов, интернирование строк)
+    run(shared_pipeline, messages[:500], behavior, scanner)
+    run(legacy_pipeline, messages[:500], behavior, scanner)
+
+    shared_us = min(run(shared_pipeline, messages, behavior, scanner) for _ in range(3))
+    legacy_us = min(run(legacy_pipeline, messages, behavior, scanner) for _ in range(3))
+
+    features_us = min(run(lambda message, *_: MessageFeatures(message), messages, behavior, scanner)
+                      for _ in range(3))
+
+    speedup = legacy_us / shared_us if shared_us else float('inf')
+    print(f"сообщений:           {len(messages)}")
+    print(f"MessageFeatures:     {features_us:.1f} µs/msg (только разбор)")
+    print(f"общий разбор:        {shared_us:.1f} µs/msg")
+    print(f"отдельные проходы:   {legacy_us:.1f} µs/msg")
+    print(f"ускорение:           x{speedup:.2f} - {'OK' if speedup >= args.min_speedup else 'НИЖЕ ПОРОГА'}")
+
+    return 0 if speedup >= args.min_speedup else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
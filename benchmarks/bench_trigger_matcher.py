@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+🏁 BENCHMARK: скомпилированный матчер триггеров против перебора
+
+Запуск из корня проекта:
+    python benchmarks/bench_trigger_matcher.py [--triggers 10000] [--messages 2000]
+
+Сравнивает прежний последовательный перебор (_match_trigger на каждый
+триггер) с CompiledTriggerSet и проверяет, что оба выбирают один и тот же
+триггер.
+"""
+
+import re
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.modules.trigger_matcher import CompiledTriggerSet  # noqa: E402
+
+WORDS = (
+    "привет как дела что нового бот крипта биткоин эфир курс цена рынок "
+    "hello how are you today bitcoin price moon pump dump meme chat bro "
+    "работа погода футбол музыка кино игра сегодня завтра вечером утром"
+).split()
+
+TYPES = ('contains', 'contains', 'contains', 'exact', 'starts_with', 'ends_with', 'regex')
+
+
+def make_triggers(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    triggers = []
+    for i in range(count):
+        trigger_type = TYPES[i % len(TYPES)]
+        # Большинство триггеров - редкие слова, как в живых чатах
+        word = f"{rng.choice(WORDS)}{i}"
+        if trigger_type == 'regex':
+            pattern = rf"\b{word}\d*\b"
+        else:
+            pattern = word
+        triggers.append({
+            'id': f"t{i}",
+            'name': f"t{i}",
+            'pattern': pattern,
+            'response': 'ok',
+            'type': trigger_type,
+            'is_active': True
+        })
+    return triggers
+
+
+def make_messages(count: int, trigger_count: int, seed: int = 2):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 12))]
+        # Каждое двадцатое сообщение задевает какой-нибудь триггер
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), f"{rng.choice(WORDS)}{rng.randrange(trigger_count)}")
+        messages.append(" ".join(words))
+    return messages
+
+
+def legacy_match(message_text: str, triggers):
+    """Прежняя логика TriggersModule._check_triggers/_match_trigger"""
+
+    for trigger in triggers:
+        pattern = trigger['pattern']
+        trigger_type = trigger.get('type', 'contains')
+        message_lower = message_text.lower()
+        pattern_lower = pattern.lower()
+
+        if trigger_type == 'exact':
+            matched = message_lower == pattern_lower
+        elif trigger_type == 'starts_with':
+            matched = message_lower.startswith(pattern_lower)
+        elif trigger_type == 'ends_with':
+            matched = message_lower.endswith(pattern_lower)
+        elif trigger_type == 'regex':
+            matched = bool(re.search(pattern, message_text, re.IGNORECASE))
+        else:
+            matched = pattern_lower in message_lower
+
+        if matched:
+            return trigger
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--triggers', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    triggers = make_triggers(args.triggers)
+    messages = make_messages(args.messages, args.triggers)
+
+    started = time.perf_counter()
+    compiled = CompiledTriggerSet(triggers)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    compiled_results = [compiled.match(message) for message in messages]
+    compiled_s = time.perf_counter() - started
+
+    legacy_messages = messages[:max(1, min(len(messages), 200))]
+    started = time.perf_counter()
+    legacy_results = [legacy_match(message, triggers) for message in legacy_messages]
+    legacy_s = time.perf_counter() - started
+
+    mismatches = sum(
+        1 for new, old in zip(compiled_results, legacy_results)
+        if (new and new['id']) != (old and old['id'])
+    )
+
+    print(f"triggers:            {args.triggers}")
+    print(f"build:               {build_ms:.1f} ms")
+    print(f"compiled:            {len(messages) / compiled_s:,.0f} msg/s "
+          f"({compiled_s / len(messages) * 1e6:.1f} µs/msg)")
+    print(f"legacy:              {len(legacy_messages) / legacy_s:,.0f} msg/s "
+          f"({legacy_s / len(legacy_messages) * 1e6:.1f} µs/msg)")
+    print(f"speedup:             x{(legacy_s / len(legacy_messages)) / (compiled_s / len(messages)):.0f}")
+    print(f"mismatches:          {mismatches} / {len(legacy_messages)}")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+🏁 BENCHMARK: TriggersModule.check_message_triggers целиком
+
+Запуск из корня проекта:
+    python benchmarks/bench_triggers_module.py [--sizes 10,1000,10000] [--messages 5000]
+        [--output results.json] [--compare baseline.json] [--max-regression 0.2]
+
+Для каждого размера создается синтетический чат с триггерами всех типов,
+через модуль прогоняется корпус русских и английских сообщений. Отчет -
+сообщения в секунду, задержка p50/p99 и память под триггеры и
+скомпилированный набор. Результат пишется в JSON; с --compare скрипт
+сравнивает его с прошлым прогоном и возвращает 1 при просадке больше
+--max-regression (по умолчанию 20%).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from config import Config  # noqa: E402
+from app.modules.triggers_module import TriggersModule  # noqa: E402
+
+CHAT_ID = -100123
+USERS = 500
+
+# Живые сообщения: короткие реплики, вопросы, крипта, смешанный язык
+CORPUS = (
+    "привет всем", "всем привет, как дела?", "кто сегодня вечером в игру?",
+    "биткоин опять падает, что делать", "эфир по 3к это дно или нет",
+    "скиньте курс доллара плиз", "ахахах ну ты даешь", "бот, ты тут?",
+    "кто смотрел вчера футбол?", "погода сегодня просто ужас",
+    "завтра на работу к восьми, жесть", "ну и что вы думаете про этот памп",
+    "я продал все на хаях", "посоветуйте музыку для работы",
+    "какой фильм посмотреть на выходных", "спокойной ночи, чат",
+    "доброе утро!", "опять этот мем", "го в дискорд", "лол",
+    "hello everyone", "gm frens", "wen moon?", "bitcoin to 100k this year",
+    "how are you doing today?", "this chat is crazy lol", "anyone here trading eth?",
+    "just bought the dip again", "what's the price of sol right now",
+    "good night guys", "bro that's a rug", "ngl this meme is fire",
+    "привет bro, how's it going", "сегодня pump или dump?", "ок",
+    "ну да", "+", "согласен", "не, ну это уже слишком",
+    "кто-нибудь знает, как вывести с биржи без комиссии?",
+)
+
+WORDS = (
+    "привет пока бот крипта биткоин эфир курс цена рынок работа погода "
+    "футбол музыка кино игра вечером утром hello moon pump dump meme bro"
+).split()
+
+TYPES = ('contains', 'contains', 'contains', 'exact', 'starts_with', 'ends_with', 'regex')
+
+RESPONSES = (
+    "Здарова, {first_name}!", "Ок", "{random:да|нет|может быть}",
+    "Сейчас {time}, {first_name}", "Принято: {message}"
+)
+
+
+def make_triggers(count: int, seed: int = 1):
+    """⚡ Триггеры всех типов в формате TriggersModule"""
+
+    rng = random.Random(seed)
+    triggers = {}
+    for i in range(count):
+        trigger_type = TYPES[i % len(TYPES)]
+        # Большинство триггеров - редкие слова, часть - на популярные
+        word = rng.choice(WORDS) if i < 5 else f"{rng.choice(WORDS)}{i}"
+        pattern = rf"\b{word}\d*\b" if trigger_type == 'regex' else word
+        trigger_id = f"{CHAT_ID}_t{i}"
+        triggers[trigger_id] = {
+            'id': trigger_id,
+            'name': f"t{i}",
+            'pattern': pattern,
+            'response': RESPONSES[i % len(RESPONSES)],
+            'type': trigger_type,
+            'creator_id': 1,
+            'chat_id': CHAT_ID,
+            'created_at': '2024-01-01T00:00:00',
+            'usage_count': 0,
+            'is_active': True,
+            'is_global': False
+        }
+    return triggers
+
+
+def make_messages(count: int, trigger_count: int, hit_rate: float, seed: int = 2):
+    """💬 Корпус: реплики из CORPUS, часть с вставленным словом триггера"""
+
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        text = rng.choice(CORPUS)
+        if rng.random() < hit_rate:
+            words = text.split()
+            words.insert(rng.randrange(len(words) + 1),
+                         f"{rng.choice(WORDS)}{rng.randrange(5, max(6, trigger_count))}")
+            text = " ".join(words)
+        messages.append((text, rng.randrange(USERS)))
+    return messages
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_size(size: int, args) -> dict:
+    """📏 Один размер: память, прогрев, замер"""
+
+    config = Config()
+    config.triggers.regex_timeout_ms = args.regex_timeout_ms
+    if not args.with_cooldowns:
+        # Иначе почти все сообщения отсекаются откатами до сопоставления
+        config.triggers.cooldown_seconds = 0
+        config.triggers.user_cooldown_seconds = 0
+        config.triggers.chat_triggers_per_minute = 0
+
+    module = TriggersModule(None, config)
+    messages = make_messages(args.messages, size, args.hit_rate)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    module.triggers[str(CHAT_ID)] = make_triggers(size)
+    module._get_compiled(str(CHAT_ID), module.triggers[str(CHAT_ID)])
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    try:
+        for text, user_id in messages[:args.warmup]:
+            await module.check_message_triggers(text, CHAT_ID, user_id, 'Bench')
+
+        latencies = []
+        hits = 0
+        clock = time.perf_counter_ns
+        started = clock()
+        for text, user_id in messages:
+            message_started = clock()
+            response = await module.check_message_triggers(text, CHAT_ID, user_id, 'Bench')
+            latencies.append(clock() - message_started)
+            if response:
+                hits += 1
+        elapsed = (clock() - started) / 1e9
+    finally:
+        if module._flush_task:
+            module._flush_task.cancel()
+        module.sandbox.close()
+
+    latencies.sort()
+    return {
+        'triggers': size,
+        'messages': len(messages),
+        'hits': hits,
+        'msgs_per_sec': round(len(messages) / elapsed, 1),
+        'mean_us': round(sum(latencies) / len(latencies) / 1000, 1),
+        'p50_us': round(percentile(latencies, 0.50) / 1000, 1),
+        'p99_us': round(percentile(latencies, 0.99) / 1000, 1),
+        'max_us': round(latencies[-1] / 1000, 1),
+        'memory_kb': round((after - before) / 1024, 1),
+        'memory_peak_kb': round((peak - before) / 1024, 1)
+    }
+
+
+def environment(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'regex_timeout_ms': args.regex_timeout_ms,
+        'with_cooldowns': args.with_cooldowns,
+        'hit_rate': args.hit_rate,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def compare(results: dict, baseline_path: str, max_regression: float) -> int:
+    """⚖️ Сравнение с прошлым прогоном: 1 при просадке сверх порога"""
+
+    baseline = json.loads(Path(baseline_path).read_text(encoding='utf-8'))
+    old_runs = {run['triggers']: run for run in baseline.get('runs', [])}
+    failed = 0
+
+    print(f"\nсравнение с {baseline_path} ({baseline.get('environment', {}).get('commit')}):")
+    for run in results['runs']:
+        old = old_runs.get(run['triggers'])
+        if not old:
+            continue
+        throughput = run['msgs_per_sec'] / old['msgs_per_sec'] - 1 if old['msgs_per_sec'] else 0.0
+        p99 = run['p99_us'] / old['p99_us'] - 1 if old['p99_us'] else 0.0
+        regressed = throughput < -max_regression or p99 > max_regression
+        failed += regressed
+        print(f"  {run['triggers']:>6} триггеров: msg/s {throughput:+.1%}, p99 {p99:+.1%}"
+              f"{'  ❌ РЕГРЕССИЯ' if regressed else ''}")
+
+    return 1 if failed else 0
+
+
+async def main_async(args) -> int:
+    results = {'environment': environment(args), 'runs': []}
+
+    for size in args.sizes:
+        run = await run_size(size, args)
+        results['runs'].append(run)
+        print(f"{run['triggers']:>6} триггеров: {run['msgs_per_sec']:>10,.0f} msg/s  "
+              f"p50 {run['p50_us']:>7.1f} µs  p99 {run['p99_us']:>7.1f} µs  "
+              f"память {run['memory_kb']:>9,.0f} KB  совпадений {run['hits']}")
+
+    results['environment']['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    payload = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(payload, encoding='utf-8')
+        print(f"\nрезультаты: {args.output}")
+    else:
+        print(payload)
+
+    if args.compare:
+        return compare(results, args.compare, args.max_regression)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=lambda value: [int(part) for part in value.split(',')],
+                        default=[10, 1000, 10000])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--hit-rate', type=float, default=0.05)
+    parser.add_argument('--regex-timeout-ms', type=int, default=100)
+    parser.add_argument('--with-cooldowns', action='store_true')
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # TriggersModule создает data/triggers в текущем каталоге
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        Path('data').mkdir()
+        return asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
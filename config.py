@@ -55,6 +55,11 @@ class AIConfig:
     max_tokens: int = 1024    # Короткие ответы
     context_memory: bool = True
     adaptive_responses: bool = True
+    memory_window_messages: int = 10  # Последних обменов в памяти диалога
+    memory_cache_mb: float = 16       # Бюджет LRU буферов диалогов
+    memory_summary_threshold: int = 20  # Свернутых сообщений между пересказами сводки
+    memory_cleanup_days: int = 30       # Молчащие дольше диалоги удаляются
+    memory_ai_summaries: bool = False   # Пересказывать сводки через AI (фоном)
 
 
 @dataclass
@@ -66,6 +71,15 @@ class CryptoConfig:
     default_vs_currency: str = "usd"
     trending_limit: int = 5
     price_alerts: bool = False
+    market_snapshot_enabled: bool = True
+    market_snapshot_size: int = 500  # Топ-N монет, обновляемых пакетно через /coins/markets
+    stale_ttl_seconds: int = 3600    # Сколько отдавать устаревший курс, пока идет обновление
+    negative_cache_ttl_seconds: int = 600  # Сколько помнить несуществующие ID монет
+    coin_registry_refresh_hours: int = 24  # Период обновления списка монет /coins/list (0 - не обновлять)
+    max_alerts_per_user: int = 20
+    alert_messages_per_second: float = 20.0  # Лимит отправки уведомлений об алертах
+    price_history_enabled: bool = True
+    price_history_persist_minutes: int = 15  # Как часто сохранять историю цен в БД
 
 
 @dataclass
@@ -75,7 +89,23 @@ class ModerationConfig:
     auto_moderation: bool = True
     toxicity_threshold: float = 0.7  # Строже
     flood_threshold: int = 3         # Строже
+    flood_window_seconds: int = 60   # Окно подсчета сообщений для флуда
+    flood_max_tracked: int = 50000   # Предел отслеживаемых пар (чат, пользователь)
+    flood_idle_seconds: int = 600    # Простой, после которого история забывается
+    spam_wave_chats: int = 3         # Волна: почти дубликаты больше чем в стольких чатах
+    spam_wave_users: int = 5         # ... или больше чем от стольких пользователей
+    spam_wave_window_minutes: int = 10
+    spam_wave_max_entries: int = 20000  # Предел отпечатков в окне (все чаты)
+    raid_protection: bool = True
+    raid_join_threshold: int = 10    # Рейд: больше стольких входов за окно...
+    raid_message_threshold: int = 10  # ...или первых сообщений новичков за окно
+    raid_window_seconds: int = 60
+    raid_lockdown_minutes: int = 15
+    raid_new_member_minutes: int = 10  # Сколько участник считается новичком
+    raid_ban_offenders: bool = True  # Банить новичков, писавших во время рейда
+    api_calls_per_second: int = 20   # Предел вызовов Bot API из очереди модерации
     max_warnings: int = 2            # Меньше предупреждений
+    warning_decay_hours: int = 72    # Срок давности предупреждения (0 - не сгорают)
     ban_duration_hours: int = 24
     log_actions: bool = True
     delete_spam: bool = True
@@ -104,8 +134,11 @@ class TriggersConfig:
     max_triggers_per_admin: int = 100
     allow_regex: bool = True
     allow_global_triggers: bool = False  # Отключено для жесткого контроля
-    cooldown_seconds: int = 2
+    cooldown_seconds: int = 2             # Откат одного триггера в чате
+    user_cooldown_seconds: int = 5        # Откат триггеров для одного пользователя в чате
+    chat_triggers_per_minute: int = 20    # Лимит срабатываний в чате (0 - без лимита)
     max_response_length: int = 500
+    regex_timeout_ms: int = 100          # Бюджет регулярок на сообщение (0 - без песочницы)
 
 
 @dataclass
@@ -213,17 +246,52 @@ def load_config() -> Config:
     config.ai.max_tokens = int(os.getenv("AI_MAX_TOKENS", "1024"))
     config.ai.context_memory = os.getenv("AI_CONTEXT_MEMORY", "true").lower() == "true"
     config.ai.adaptive_responses = os.getenv("AI_ADAPTIVE_RESPONSES", "true").lower() == "true"
+    config.ai.memory_window_messages = int(os.getenv("AI_MEMORY_WINDOW_MESSAGES", "10"))
+    config.ai.memory_cache_mb = float(os.getenv("AI_MEMORY_CACHE_MB", "16"))
+    config.ai.memory_summary_threshold = int(os.getenv("AI_MEMORY_SUMMARY_THRESHOLD", "20"))
+    config.ai.memory_cleanup_days = int(os.getenv("AI_MEMORY_CLEANUP_DAYS", "30"))
+    config.ai.memory_ai_summaries = os.getenv("AI_MEMORY_AI_SUMMARIES", "false").lower() == "true"
     
     # =================== ОСТАЛЬНЫЕ НАСТРОЙКИ ===================
     config.crypto.enabled = os.getenv("CRYPTO_ENABLED", "true").lower() == "true"
     config.crypto.coingecko_api_key = os.getenv("COINGECKO_API_KEY", "")
     config.crypto.cache_ttl_seconds = int(os.getenv("CRYPTO_CACHE_TTL", "300"))
+    config.crypto.market_snapshot_enabled = os.getenv("CRYPTO_SNAPSHOT_ENABLED", "true").lower() == "true"
+    config.crypto.market_snapshot_size = int(os.getenv("CRYPTO_SNAPSHOT_SIZE", "500"))
+    config.crypto.stale_ttl_seconds = int(os.getenv("CRYPTO_STALE_TTL", "3600"))
+    config.crypto.negative_cache_ttl_seconds = int(os.getenv("CRYPTO_NEGATIVE_TTL", "600"))
+    config.crypto.coin_registry_refresh_hours = int(os.getenv("CRYPTO_REGISTRY_REFRESH_HOURS", "24"))
+    config.crypto.price_alerts = os.getenv("CRYPTO_PRICE_ALERTS", "false").lower() == "true"
+    config.crypto.max_alerts_per_user = int(os.getenv("CRYPTO_MAX_ALERTS_PER_USER", "20"))
+    config.crypto.price_history_enabled = os.getenv("CRYPTO_PRICE_HISTORY", "true").lower() == "true"
+    config.crypto.price_history_persist_minutes = int(os.getenv("CRYPTO_PRICE_HISTORY_PERSIST_MINUTES", "15"))
+    
+    config.triggers.regex_timeout_ms = int(os.getenv("TRIGGERS_REGEX_TIMEOUT_MS", "100"))
+    config.triggers.cooldown_seconds = int(os.getenv("TRIGGERS_COOLDOWN_SECONDS", "2"))
+    config.triggers.user_cooldown_seconds = int(os.getenv("TRIGGERS_USER_COOLDOWN_SECONDS", "5"))
+    config.triggers.chat_triggers_per_minute = int(os.getenv("TRIGGERS_CHAT_PER_MINUTE", "20"))
     
     config.moderation.enabled = os.getenv("MODERATION_ENABLED", "true").lower() == "true"
     config.moderation.auto_moderation = os.getenv("AUTO_MODERATION", "true").lower() == "true"
     config.moderation.toxicity_threshold = float(os.getenv("TOXICITY_THRESHOLD", "0.7"))
     config.moderation.flood_threshold = int(os.getenv("FLOOD_THRESHOLD", "3"))
+    config.moderation.flood_window_seconds = int(os.getenv("FLOOD_WINDOW_SECONDS", "60"))
+    config.moderation.flood_max_tracked = int(os.getenv("FLOOD_MAX_TRACKED", "50000"))
+    config.moderation.flood_idle_seconds = int(os.getenv("FLOOD_IDLE_SECONDS", "600"))
+    config.moderation.spam_wave_chats = int(os.getenv("SPAM_WAVE_CHATS", "3"))
+    config.moderation.spam_wave_users = int(os.getenv("SPAM_WAVE_USERS", "5"))
+    config.moderation.spam_wave_window_minutes = int(os.getenv("SPAM_WAVE_WINDOW_MINUTES", "10"))
+    config.moderation.spam_wave_max_entries = int(os.getenv("SPAM_WAVE_MAX_ENTRIES", "20000"))
+    config.moderation.raid_protection = os.getenv("RAID_PROTECTION", "true").lower() == "true"
+    config.moderation.raid_join_threshold = int(os.getenv("RAID_JOIN_THRESHOLD", "10"))
+    config.moderation.raid_message_threshold = int(os.getenv("RAID_MESSAGE_THRESHOLD", "10"))
+    config.moderation.raid_window_seconds = int(os.getenv("RAID_WINDOW_SECONDS", "60"))
+    config.moderation.raid_lockdown_minutes = int(os.getenv("RAID_LOCKDOWN_MINUTES", "15"))
+    config.moderation.raid_ban_offenders = os.getenv("RAID_BAN_OFFENDERS", "true").lower() == "true"
+    config.moderation.api_calls_per_second = int(os.getenv("MODERATION_API_CALLS_PER_SECOND", "20"))
     config.moderation.max_warnings = int(os.getenv("MAX_WARNINGS", "2"))
+    config.moderation.warning_decay_hours = int(os.getenv("WARNING_DECAY_HOURS", "72"))
+    config.moderation.ban_for_excessive_warnings = os.getenv("BAN_FOR_EXCESSIVE_WARNINGS", "true").lower() == "true"
     
     config.permissions.enabled = os.getenv("PERMISSIONS_ENABLED", "true").lower() == "true"
     config.permissions.use_whitelist = os.getenv("USE_WHITELIST", "true").lower() == "true"
@@ -20,8 +20,13 @@ from typing import List, Dict, Any, Optional
 from pathlib import Path
 import json
 
+from app.services.batch_writer import BatchWriter
+
 logger = logging.getLogger(__name__)
 
+# Служебный пользователь для AI вызовов без user_id (сводки, фоновые задачи)
+TELEMETRY_USER_ID = 0
+
 
 class DatabaseService:
     """💾 Сервис работы с базой данных"""
@@ -30,6 +35,9 @@ class DatabaseService:
         self.config = config
         self.db_path = config.path
         self.connection = None
+        self.writer = None
+        # Пользователи, для которых строка в users уже обеспечена (FK ai_interactions)
+        self._telemetry_users = set()
         logger.info("💾 DatabaseService инициализирован")
     
     async def initialize(self):
@@ -55,8 +63,13 @@ class DatabaseService:
             
             # Создаем таблицы
             await self._create_tables()
+            await self._migrate_columns()
             await self._create_indexes()
             
+            # Пакетный писатель для телеметрии и счетчиков
+            self.writer = BatchWriter(self.db_path)
+            await self.writer.start()
+            
             logger.info("🚀 База данных инициализирована")
             
         except Exception as e:
@@ -66,6 +79,8 @@ class DatabaseService:
     async def close(self):
         """🔒 Закрытие соединения"""
         try:
+            if self.writer:
+                await self.writer.close()
             if self.connection:
                 await self.connection.close()
                 logger.info("🔒 База данных закрыта")
@@ -169,6 +184,14 @@ class DatabaseService:
                 model_used TEXT,
                 tokens_used INTEGER,
                 response_time REAL,
+                provider TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                ttfb REAL,
+                cache_hit BOOLEAN DEFAULT FALSE,
+                coalesced BOOLEAN DEFAULT FALSE,
+                cost_usd REAL DEFAULT 0,
+                success BOOLEAN DEFAULT TRUE,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id),
                 FOREIGN KEY (chat_id) REFERENCES chats (id)
@@ -268,6 +291,36 @@ class DatabaseService:
         await self.connection.commit()
         logger.info("📋 Все таблицы созданы")
     
+    async def _migrate_columns(self):
+        """🔧 Добавление новых колонок в существующие таблицы"""
+        new_columns = {
+            'ai_interactions': {
+                'provider': 'TEXT',
+                'prompt_tokens': 'INTEGER',
+                'completion_tokens': 'INTEGER',
+                'ttfb': 'REAL',
+                'cache_hit': 'BOOLEAN DEFAULT FALSE',
+                'coalesced': 'BOOLEAN DEFAULT FALSE',
+                'cost_usd': 'REAL DEFAULT 0',
+                'success': 'BOOLEAN DEFAULT TRUE'
+            }
+        }
+        
+        for table, columns in new_columns.items():
+            try:
+                cursor = await self.connection.execute(f"PRAGMA table_info({table})")
+                existing = {row[1] for row in await cursor.fetchall()}
+                
+                for column, column_type in columns.items():
+                    if column not in existing:
+                        await self.connection.execute(
+                            f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+                        )
+            except Exception as e:
+                logger.error(f"❌ Ошибка миграции таблицы {table}: {e}")
+        
+        await self.connection.commit()
+    
     async def _create_indexes(self):
         """🚀 Создание индексов"""
         indexes = [
@@ -280,6 +333,7 @@ class DatabaseService:
             "CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, timestamp)",
             "CREATE INDEX IF NOT EXISTS idx_user_actions_user ON user_actions(user_id, timestamp)",
             "CREATE INDEX IF NOT EXISTS idx_ai_interactions_user ON ai_interactions(user_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_ai_interactions_time ON ai_interactions(timestamp, model_used)",
             "CREATE INDEX IF NOT EXISTS idx_memory_contexts_user ON memory_contexts(user_id, chat_id)",
             "CREATE INDEX IF NOT EXISTS idx_triggers_active ON triggers(is_active, chat_id)",
             "CREATE INDEX IF NOT EXISTS idx_bans_active ON bans(is_active, user_id, chat_id)",
@@ -484,6 +538,57 @@ class DatabaseService:
             logger.error(f"❌ Ошибка сохранения AI взаимодействия: {e}")
             return False
     
+    def log_ai_telemetry(self, record: Dict[str, Any]):
+        """📡 Телеметрия AI вызова через пакетный писатель"""
+        if not self.writer:
+            return
+        
+        # Вызовы без пользователя (сводки и т.п.) пишутся на служебного пользователя;
+        # строка в users создается в той же очереди, иначе FK отбросит запись
+        user_id = record.get('user_id') or TELEMETRY_USER_ID
+        if user_id not in self._telemetry_users:
+            self.writer.enqueue(
+                "INSERT OR IGNORE INTO users (id, first_name, is_bot) VALUES (?, ?, ?)",
+                (user_id, 'ai-service' if user_id == TELEMETRY_USER_ID else None,
+                 user_id == TELEMETRY_USER_ID)
+            )
+            self._telemetry_users.add(user_id)
+        
+        self.writer.enqueue("""
+            INSERT INTO ai_interactions 
+            (user_id, chat_id, prompt, response, model_used, tokens_used, response_time,
+             provider, prompt_tokens, completion_tokens, ttfb, cache_hit, coalesced,
+             cost_usd, success, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            user_id,
+            record.get('chat_id'),
+            record.get('prompt', ''),
+            record.get('response'),
+            record.get('model'),
+            record.get('prompt_tokens', 0) + record.get('completion_tokens', 0),
+            record.get('response_time'),
+            record.get('provider'),
+            record.get('prompt_tokens', 0),
+            record.get('completion_tokens', 0),
+            record.get('ttfb'),
+            record.get('cache_hit', False),
+            record.get('coalesced', False),
+            record.get('cost_usd', 0.0),
+            record.get('success', True),
+            record.get('timestamp', datetime.now())
+        ))
+    
+    async def get_ai_telemetry(self, days: int = 7) -> List[Dict[str, Any]]:
+        """📡 Сырые записи телеметрии AI за период"""
+        return await self.fetch_all("""
+            SELECT DATE(timestamp) as day, provider, model_used, prompt_tokens, completion_tokens,
+                   response_time, ttfb, cache_hit, coalesced, cost_usd, success
+            FROM ai_interactions
+            WHERE timestamp >= ?
+            ORDER BY timestamp
+        """, (datetime.now() - timedelta(days=days),))
+    
     # =================== ПАМЯТЬ КОНТЕКСТОВ ===================
     
     async def save_memory_context(self, user_id: int, chat_id: int, context_key: str, 
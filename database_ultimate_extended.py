@@ -21,8 +21,16 @@ from typing import List, Dict, Any, Optional
 from pathlib import Path
 import json
 
+from app.services.batch_writer import BatchWriter
+from app.services.trigger_store import TriggerStore
+from app.services.restriction_scheduler import RestrictionScheduler, KIND_MUTE, KIND_BAN
+from app.services.warning_store import WarningStore
+
 logger = logging.getLogger(__name__)
 
+# Служебный пользователь для AI вызовов без user_id (сводки, фоновые задачи)
+TELEMETRY_USER_ID = 0
+
 
 class DatabaseService:
     """💾 Расширенный сервис базы данных"""
@@ -31,8 +39,17 @@ class DatabaseService:
         self.config = config
         self.db_path = Path(config.path)
         self.connection = None
+        self.writer = None
+        # Пользователи, для которых строка в users уже обеспечена (FK ai_interactions)
+        self._telemetry_users = set()
+        self.trigger_store = None
+        self.restrictions = None
+        self.warning_store = None
         self.initialized = False
         
+        # Последние выделенные id таблиц с пакетной вставкой
+        self._row_ids: Dict[str, int] = {}
+        
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
     
     async def initialize(self):
@@ -42,6 +59,7 @@ class DatabaseService:
                 self.db_path,
                 timeout=30.0
             )
+            self.connection.row_factory = aiosqlite.Row
             
             # Настраиваем производительность
             if self.config.wal_mode:
@@ -54,6 +72,22 @@ class DatabaseService:
             # Создаем все таблицы
             await self._create_extended_tables()
             
+            # Пакетный писатель для телеметрии и счетчиков
+            self.writer = BatchWriter(self.db_path, foreign_keys=bool(self.config.wal_mode))
+            await self.writer.start()
+            
+            # Индекс триггеров в памяти: сообщения не читают flexible_triggers
+            self.trigger_store = TriggerStore(self)
+            await self.trigger_store.load()
+            
+            # Сроки мутов и временных банов: куча в памяти вместо опроса таблиц
+            self.restrictions = RestrictionScheduler(self)
+            await self.restrictions.load()
+            
+            # Счетчики предупреждений в памяти: модерация не считает COUNT(*)
+            self.warning_store = WarningStore(self)
+            await self.warning_store.load()
+            
             self.initialized = True
             logger.info("💾 Расширенная база данных инициализирована")
             
@@ -386,6 +420,29 @@ class DatabaseService:
             )
             """,
             
+            # =================== AI ТЕЛЕМЕТРИЯ ===================
+            """
+            CREATE TABLE IF NOT EXISTS ai_interactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER,
+                prompt TEXT NOT NULL,
+                response TEXT,
+                model_used TEXT,
+                tokens_used INTEGER,
+                response_time REAL,
+                provider TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                ttfb REAL,
+                cache_hit BOOLEAN DEFAULT FALSE,
+                coalesced BOOLEAN DEFAULT FALSE,
+                cost_usd REAL DEFAULT 0,
+                success BOOLEAN DEFAULT TRUE,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            
             # =================== КРИПТОВАЛЮТЫ ===================
             """
             CREATE TABLE IF NOT EXISTS crypto_cache (
@@ -401,6 +458,23 @@ class DatabaseService:
             )
             """,
             
+            """
+            CREATE TABLE IF NOT EXISTS price_history (
+                coin_id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            
+            """
+            CREATE TABLE IF NOT EXISTS coin_registry (
+                coin_id TEXT PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                name TEXT,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            
             """
             CREATE TABLE IF NOT EXISTS crypto_requests (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -418,6 +492,7 @@ class DatabaseService:
             CREATE TABLE IF NOT EXISTS crypto_alerts (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
+                chat_id INTEGER,
                 coin_id TEXT NOT NULL,
                 alert_type TEXT NOT NULL,
                 trigger_price REAL,
@@ -532,6 +607,8 @@ class DatabaseService:
         
         await self.connection.commit()
         
+        await self._migrate_columns()
+        
         # Создаем индексы для производительности
         await self._create_indexes()
         
@@ -540,6 +617,30 @@ class DatabaseService:
         
         logger.info("📋 Расширенные таблицы созданы")
     
+    async def _migrate_columns(self):
+        """🔧 Добавление новых колонок в существующие таблицы"""
+        
+        new_columns = {
+            'crypto_alerts': {
+                'chat_id': 'INTEGER'
+            }
+        }
+        
+        for table, columns in new_columns.items():
+            try:
+                cursor = await self.connection.execute(f"PRAGMA table_info({table})")
+                existing = {row[1] for row in await cursor.fetchall()}
+                
+                for column, column_type in columns.items():
+                    if column not in existing:
+                        await self.connection.execute(
+                            f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+                        )
+            except Exception as e:
+                logger.error(f"❌ Ошибка миграции таблицы {table}: {e}")
+        
+        await self.connection.commit()
+    
     async def _create_indexes(self):
         """🚀 Создание индексов для производительности"""
         
@@ -559,6 +660,7 @@ class DatabaseService:
             "CREATE INDEX IF NOT EXISTS idx_triggers_active ON flexible_triggers (is_active)",
             "CREATE INDEX IF NOT EXISTS idx_triggers_global ON flexible_triggers (is_global)",
             "CREATE INDEX IF NOT EXISTS idx_triggers_type ON flexible_triggers (trigger_type)",
+            "CREATE INDEX IF NOT EXISTS idx_trigger_activations_trigger ON trigger_activations (trigger_id)",
             
             "CREATE INDEX IF NOT EXISTS idx_bans_user_id ON bans (user_id)",
             "CREATE INDEX IF NOT EXISTS idx_bans_active ON bans (is_active)",
@@ -570,8 +672,13 @@ class DatabaseService:
             "CREATE INDEX IF NOT EXISTS idx_warnings_user_id ON warnings (user_id)",
             "CREATE INDEX IF NOT EXISTS idx_warnings_date ON warnings (warn_date)",
             
+            "CREATE INDEX IF NOT EXISTS idx_context_memory_dialog ON context_memory (user_id, chat_id, context_type)",
+            
+            "CREATE INDEX IF NOT EXISTS idx_ai_interactions_time ON ai_interactions (timestamp, model_used)",
+            
             "CREATE INDEX IF NOT EXISTS idx_crypto_symbol ON crypto_cache (coin_symbol)",
             "CREATE INDEX IF NOT EXISTS idx_crypto_updated ON crypto_cache (last_updated)",
+            "CREATE INDEX IF NOT EXISTS idx_crypto_alerts_active ON crypto_alerts (is_active, coin_id)",
             
             "CREATE INDEX IF NOT EXISTS idx_daily_date ON daily_stats (date)",
             "CREATE INDEX IF NOT EXISTS idx_activity_date ON user_activity (date)",
@@ -789,29 +896,20 @@ class DatabaseService:
     # =================== ГИБКИЕ ТРИГГЕРЫ ===================
     
     async def save_flexible_trigger(self, trigger_data: Dict[str, Any]) -> bool:
-        """⚡ Сохранение гибкого триггера"""
+        """⚡ Сохранение гибкого триггера (через индекс триггеров)"""
         try:
-            await self.connection.execute("""
-                INSERT OR REPLACE INTO flexible_triggers
-                (user_id, chat_id, name, trigger_type, pattern, response_data, 
-                 conditions, settings, is_active, is_global, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                trigger_data['user_id'],
-                trigger_data.get('chat_id'),
-                trigger_data['name'],
-                trigger_data['trigger_type'],
-                trigger_data['pattern'],
-                json.dumps(trigger_data['response_data']),
-                json.dumps(trigger_data.get('conditions', {})),
-                json.dumps(trigger_data.get('settings', {})),
-                trigger_data.get('is_active', True),
-                trigger_data.get('is_global', False),
-                datetime.now(),
-                datetime.now()
-            ))
-            
-            await self.connection.commit()
+            await self.trigger_store.add({
+                'creator_id': trigger_data['user_id'],
+                'chat_id': trigger_data.get('chat_id'),
+                'name': trigger_data['name'],
+                'trigger_type': trigger_data['trigger_type'],
+                'pattern': trigger_data['pattern'],
+                'response_data': trigger_data['response_data'],
+                'conditions': trigger_data.get('conditions', {}),
+                'settings': trigger_data.get('settings', {}),
+                'is_active': trigger_data.get('is_active', True),
+                'is_global': trigger_data.get('is_global', False)
+            })
             return True
             
         except Exception as e:
@@ -819,28 +917,12 @@ class DatabaseService:
             return False
     
     async def get_active_triggers(self, chat_id: int = None) -> List[Dict[str, Any]]:
-        """⚡ Получение активных триггеров"""
+        """⚡ Получение активных триггеров (из индекса в памяти, без запроса к БД)"""
         try:
-            if chat_id:
-                triggers = await self.fetchall("""
-                    SELECT * FROM flexible_triggers 
-                    WHERE is_active = TRUE AND (chat_id = ? OR is_global = TRUE)
-                    ORDER BY is_global DESC, usage_count DESC
-                """, (chat_id,))
-            else:
-                triggers = await self.fetchall("""
-                    SELECT * FROM flexible_triggers 
-                    WHERE is_active = TRUE 
-                    ORDER BY is_global DESC, usage_count DESC
-                """)
-            
-            # Парсим JSON поля
-            for trigger in triggers:
-                trigger['response_data'] = json.loads(trigger['response_data'])
-                trigger['conditions'] = json.loads(trigger['conditions'])
-                trigger['settings'] = json.loads(trigger['settings'])
-            
-            return triggers
+            return [
+                TriggerStore.as_row(trigger)
+                for trigger in self.trigger_store.active_for_chat(chat_id or None)
+            ]
             
         except Exception as e:
             logger.error(f"❌ Ошибка получения триггеров: {e}")
@@ -935,84 +1017,205 @@ class DatabaseService:
     # =================== МОДЕРАЦИЯ ===================
     
     async def add_moderation_action(self, action_data: Dict[str, Any]) -> bool:
-        """🛡️ Добавление действия модерации"""
+        """🛡️ Добавление действия модерации (строки уходят в пакетный писатель)"""
         try:
             action_type = action_data['action']
+            user_id = action_data['user_id']
+            chat_id = action_data.get('chat_id')
+            admin_id = action_data['admin_id']
+            reason = action_data.get('reason', '')
+            now = datetime.now()
+            
+            row_id = None
             
             if action_type == 'ban':
-                await self.connection.execute("""
-                    INSERT INTO bans (user_id, chat_id, admin_id, reason, ban_type, expires_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
+                # id выделяется заранее: он нужен планировщику до записи строки
+                row_id = await self._next_row_id('bans')
+                self._enqueue_write("""
+                    INSERT INTO bans (id, user_id, chat_id, admin_id, reason, ban_type, ban_date, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
-                    action_data['user_id'],
-                    action_data.get('chat_id'),
-                    action_data['admin_id'],
-                    action_data.get('reason', ''),
-                    action_data.get('ban_type', 'permanent'),
-                    action_data.get('expires_at')
+                    row_id, user_id, chat_id, admin_id, reason,
+                    action_data.get('ban_type', 'permanent'), now, action_data.get('expires_at')
                 ))
             
             elif action_type == 'mute':
-                await self.connection.execute("""
-                    INSERT INTO mutes (user_id, chat_id, admin_id, reason, mute_until, mute_type)
-                    VALUES (?, ?, ?, ?, ?, ?)
+                row_id = await self._next_row_id('mutes')
+                self._enqueue_write("""
+                    INSERT INTO mutes (id, user_id, chat_id, admin_id, reason, mute_date, mute_until, mute_type)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
-                    action_data['user_id'],
-                    action_data['chat_id'],
-                    action_data['admin_id'],
-                    action_data.get('reason', ''),
-                    action_data['mute_until'],
-                    action_data.get('mute_type', 'full')
+                    row_id, user_id, chat_id, admin_id, reason, now,
+                    action_data['mute_until'], action_data.get('mute_type', 'full')
                 ))
             
             elif action_type == 'warn':
-                await self.connection.execute("""
-                    INSERT INTO warnings (user_id, chat_id, admin_id, reason, severity_level)
-                    VALUES (?, ?, ?, ?, ?)
+                self._enqueue_write("""
+                    INSERT INTO warnings (user_id, chat_id, admin_id, reason, warn_date, severity_level, auto_generated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
                 """, (
-                    action_data['user_id'],
-                    action_data['chat_id'],
-                    action_data['admin_id'],
-                    action_data.get('reason', ''),
-                    action_data.get('severity_level', 1)
+                    user_id, chat_id, admin_id, reason, now,
+                    action_data.get('severity_level', 1), bool(action_data.get('auto_generated'))
                 ))
             
             elif action_type == 'kick':
-                await self.connection.execute("""
-                    INSERT INTO kicks (user_id, chat_id, admin_id, reason)
-                    VALUES (?, ?, ?, ?)
-                """, (
-                    action_data['user_id'],
-                    action_data['chat_id'],
-                    action_data['admin_id'],
-                    action_data.get('reason', '')
-                ))
+                self._enqueue_write("""
+                    INSERT INTO kicks (user_id, chat_id, admin_id, reason, kick_date)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (user_id, chat_id, admin_id, reason, now))
+            
+            elif action_type == 'unban':
+                self._enqueue_write(
+                    "UPDATE bans SET is_active = FALSE, unban_date = ? WHERE user_id = ? AND chat_id = ? AND is_active = TRUE",
+                    (now, user_id, chat_id)
+                )
+                # Снят вручную: прежний срок не должен снимать бан, выданный позже
+                if self.restrictions:
+                    self.restrictions.cancel(KIND_BAN, chat_id, user_id)
+            
+            elif action_type == 'unmute':
+                self._enqueue_write(
+                    "UPDATE mutes SET is_active = FALSE WHERE user_id = ? AND chat_id = ? AND is_active = TRUE",
+                    (user_id, chat_id)
+                )
+                if self.restrictions:
+                    self.restrictions.cancel(KIND_MUTE, chat_id, user_id)
             
             # Логируем действие
-            await self.connection.execute("""
-                INSERT INTO moderation_log 
-                (user_id, chat_id, admin_id, action, reason, details)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                action_data['user_id'],
-                action_data.get('chat_id'),
-                action_data['admin_id'],
-                action_type,
-                action_data.get('reason', ''),
-                json.dumps(action_data.get('details', {}))
-            ))
+            self.log_moderation_action(
+                user_id, chat_id, admin_id, action_type, reason,
+                action_data.get('details', {}), bool(action_data.get('auto_generated'))
+            )
+            
+            # Временные ограничения снимет планировщик
+            if row_id is not None and self.restrictions:
+                if action_type == 'mute':
+                    self.restrictions.schedule(KIND_MUTE, row_id, chat_id, user_id, action_data['mute_until'])
+                elif action_data.get('expires_at'):
+                    self.restrictions.schedule(KIND_BAN, row_id, chat_id, user_id, action_data['expires_at'])
+                else:
+                    # Бессрочный бан: прежний временный не должен его снять
+                    self.restrictions.cancel(KIND_BAN, chat_id, user_id)
+            
+            # Счетчик предупреждений обновляется в памяти (строка уже в очереди)
+            if action_type == 'warn' and self.warning_store:
+                self.warning_store.add(chat_id, user_id, admin_id, reason, persist=False)
             
-            await self.connection.commit()
             return True
             
         except Exception as e:
             logger.error(f"❌ Ошибка добавления действия модерации: {e}")
             return False
     
+    def log_moderation_action(self, user_id: int, chat_id: Optional[int], admin_id: int, action: str,
+                              reason: str = '', details: Optional[Dict[str, Any]] = None,
+                              auto_generated: bool = False):
+        """📝 Строка moderation_log через пакетный писатель"""
+        self._enqueue_write("""
+            INSERT INTO moderation_log
+            (user_id, chat_id, admin_id, action, reason, details, auto_generated, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            user_id, chat_id, admin_id, action, reason,
+            json.dumps(details or {}, ensure_ascii=False), auto_generated, datetime.now()
+        ))
+    
+    async def _next_row_id(self, table: str) -> int:
+        """🔢 Следующий id таблицы (счетчик в памяти, один писатель на БД)"""
+        if table not in self._row_ids:
+            row = await self.fetchone(f"SELECT COALESCE(MAX(id), 0) AS max_id FROM {table}")
+            # Параллельный вызов мог уже засеять счетчик за время запроса
+            self._row_ids.setdefault(table, row['max_id'] if row else 0)
+        self._row_ids[table] += 1
+        return self._row_ids[table]
+    
+    def _enqueue_write(self, query: str, params: tuple):
+        """📦 Запись через пакетный писатель (до его запуска - напрямую)"""
+        if self.writer:
+            self.writer.enqueue(query, params)
+        else:
+            asyncio.create_task(self.execute(query, params))
+    
+    # =================== СОБЫТИЯ ===================
+    
+    async def track_event(self, user_id: int, chat_id: int, event_type: str,
+                          event_data: Optional[Dict[str, Any]] = None) -> bool:
+        """📋 Событие пользователя в user_actions (через пакетный писатель)"""
+        try:
+            self._enqueue_write(
+                "INSERT INTO user_actions (user_id, chat_id, action, action_data, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (user_id, chat_id, event_type, json.dumps(event_data or {}, ensure_ascii=False), datetime.now())
+            )
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи события: {e}")
+            return False
+    
+
+    # =================== AI ТЕЛЕМЕТРИЯ ===================
+    
+    def log_ai_telemetry(self, record: Dict[str, Any]):
+        """📡 Телеметрия AI вызова через пакетный писатель"""
+        if not self.writer:
+            return
+        
+        # Вызовы без пользователя (сводки и т.п.) пишутся на служебного пользователя;
+        # строка в users создается в той же очереди, иначе FK отбросит запись
+        user_id = record.get('user_id') or TELEMETRY_USER_ID
+        if user_id not in self._telemetry_users:
+            self.writer.enqueue(
+                "INSERT OR IGNORE INTO users (id, first_name, is_bot) VALUES (?, ?, ?)",
+                (user_id, 'ai-service' if user_id == TELEMETRY_USER_ID else None,
+                 user_id == TELEMETRY_USER_ID)
+            )
+            self._telemetry_users.add(user_id)
+        
+        self.writer.enqueue("""
+            INSERT INTO ai_interactions
+            (user_id, chat_id, prompt, response, model_used, tokens_used, response_time,
+             provider, prompt_tokens, completion_tokens, ttfb, cache_hit, coalesced,
+             cost_usd, success, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            user_id,
+            record.get('chat_id'),
+            record.get('prompt', ''),
+            record.get('response'),
+            record.get('model'),
+            record.get('prompt_tokens', 0) + record.get('completion_tokens', 0),
+            record.get('response_time'),
+            record.get('provider'),
+            record.get('prompt_tokens', 0),
+            record.get('completion_tokens', 0),
+            record.get('ttfb'),
+            record.get('cache_hit', False),
+            record.get('coalesced', False),
+            record.get('cost_usd', 0.0),
+            record.get('success', True),
+            record.get('timestamp', datetime.now())
+        ))
+    
+    async def get_ai_telemetry(self, days: int = 7) -> List[Dict[str, Any]]:
+        """📡 Сырые записи телеметрии AI за период"""
+        return await self.fetchall("""
+            SELECT DATE(timestamp) as day, provider, model_used, prompt_tokens, completion_tokens,
+                   response_time, ttfb, cache_hit, coalesced, cost_usd, success
+            FROM ai_interactions
+            WHERE timestamp >= ?
+            ORDER BY timestamp
+        """, (datetime.now() - timedelta(days=days),))
+    
     # =================== ЗАКРЫТИЕ ===================
     
     async def close(self):
         """🚪 Закрытие соединения"""
+        if self.restrictions:
+            await self.restrictions.close()
+        if self.trigger_store:
+            await self.trigger_store.close()
+        if self.writer:
+            await self.writer.close()
+            self.writer = None
         if self.connection:
             await self.connection.close()
             self.initialized = False